@@ -0,0 +1 @@
+"""Shared backend helpers used by the route modules (availability, locks, adapters)."""
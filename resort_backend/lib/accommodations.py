@@ -0,0 +1,78 @@
+"""Shared "accommodation with rooms" read path.
+
+One aggregation joins `rooms` onto `accommodations` by `rooms.accommodation_id`
+and normalises room capacity server-side, replacing the per-accommodation
+`rooms.find({"$or": [ObjectId, str]})` calls. It relies on
+`rooms.accommodation_id` holding the accommodation `_id` in its native type;
+run `scripts/migrate_room_accommodation_ids.py` once on older databases.
+"""
+from typing import Optional
+from resort_backend.utils import serialize_doc
+
+
+def _truthy_first(*fields: str, default=0):
+    """Aggregation equivalent of `r.get(a) or r.get(b) or ... or default` over `$$r`."""
+    expr = default
+    for f in reversed(fields):
+        expr = {"$cond": [{"$and": [f"$$r.{f}"]}, f"$$r.{f}", expr]}
+    return expr
+
+
+def _to_int(expr):
+    return {"$convert": {"input": expr, "to": "int", "onError": 0, "onNull": 0}}
+
+
+# Rooms that carry capacity_adults/capacity_children get both fields as ints and
+# `capacity` recomputed as their sum (same rule the endpoints applied in Python).
+_ROOM_MAP = {
+    "$map": {
+        "input": "$rooms",
+        "as": "r",
+        "in": {
+            "$mergeObjects": [
+                "$$r",
+                {"id": {"$toString": "$$r._id"}},
+                {
+                    "$cond": [
+                        {"$or": [{"$gt": ["$$r.capacity_adults", None]}, {"$gt": ["$$r.capacity_children", None]}]},
+                        {
+                            "capacity_adults": _to_int(_truthy_first("capacity_adults", "capacity", "sleeps")),
+                            "capacity_children": _to_int(_truthy_first("capacity_children")),
+                            "capacity": {"$add": [
+                                _to_int(_truthy_first("capacity_adults", "capacity", "sleeps")),
+                                _to_int(_truthy_first("capacity_children")),
+                            ]},
+                        },
+                        {},
+                    ]
+                },
+            ]
+        },
+    }
+}
+
+
+def accommodation_with_rooms_pipeline(match: Optional[dict] = None, limit: Optional[int] = None) -> list:
+    """Aggregation over `accommodations` returning each document with a normalised `rooms` array."""
+    pipeline = []
+    if match:
+        pipeline.append({"$match": match})
+    if limit:
+        pipeline.append({"$limit": limit})
+    pipeline += [
+        {"$lookup": {"from": "rooms", "localField": "_id", "foreignField": "accommodation_id", "as": "rooms"}},
+        {"$addFields": {"rooms": _ROOM_MAP}},
+        {"$project": {"rooms._id": 0}},
+    ]
+    return pipeline
+
+
+async def fetch_accommodations_with_rooms(db, match: Optional[dict] = None, limit: Optional[int] = None) -> list:
+    """Run the pipeline and return serialized accommodations (`id` plus `rooms`)."""
+    docs = await db["accommodations"].aggregate(accommodation_with_rooms_pipeline(match, limit)).to_list(length=None)
+    return [serialize_doc(d) for d in docs]
+
+
+async def fetch_accommodation_with_rooms(db, match: dict) -> Optional[dict]:
+    docs = await fetch_accommodations_with_rooms(db, match, limit=1)
+    return docs[0] if docs else None
@@ -0,0 +1,358 @@
+"""ARI (availability / rates / inventory) delta feed for OTAs.
+
+Rows are one per room type (accommodation) and date:
+
+    {room_type, date, total, available, rate}
+
+Nothing is recomputed on a timer. The availability calendar reports which
+unit-nights changed (lib/availability.py listeners) and `rooms.updated`
+events from the event bus mark a room type's whole horizon dirty (rate or
+inventory edits). Dirty (room type, nights) pairs are coalesced for
+ARI_DEBOUNCE_SECONDS, then recomputed from Mongo (`room_nights` and the
+legacy `bookings` holds; a worker's calendar may be minutes old) and compared
+with the last values stored in `ari_state`. Only rows whose values differ are
+written, each with a new feed `version`, so a booking touches only its own
+nights and a worker replaying another worker's change writes nothing.
+
+Versions are reserved before the rows are read, a block per flush, and the
+block is recorded as in flight until its rows are written. A row is only
+written over one with a lower version, so a flush that read older data never
+replaces a newer row. Readers see versions below the oldest block still in
+flight, so a consumer never moves past a row that is yet to be written; blocks
+of a worker that died mid-flush stop counting after INFLIGHT_TIMEOUT.
+
+Consumers either pull (`changes_since(version)`, exposed at GET /api/ota/ari)
+or receive pushes: when ARI_PUSH_URL is set a flush POSTs the rows not yet
+delivered, signed with ARI_PUSH_SECRET (X-ARI-Signature, hex HMAC-SHA256).
+Only the worker holding the `ari:push` lease (lib/locks.py) pushes; the others
+try again after the debounce. Undelivered rows are retried on the next flush.
+"""
+from datetime import date, datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import time
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError
+from resort_backend.lib.availability import ACTIVE_STATUSES, EPOCH, calendar as default_calendar, stay_mask, unit_id_variants, unit_key
+from resort_backend.lib.locks import lock_manager
+from resort_backend.lib.reservations import unit_masks
+
+logger = logging.getLogger("resort_backend.ari")
+
+STATE_COLLECTION = "ari_state"
+SEQ_ID = "__seq__"
+PUSH_ID = "__push__"
+HORIZON_DAYS = int(os.getenv("ARI_HORIZON_DAYS", "365"))
+DEBOUNCE_SECONDS = float(os.getenv("ARI_DEBOUNCE_SECONDS", "2"))
+INVENTORY_TTL_SECONDS = 300
+PUSH_BATCH = 1000
+PUSH_LOCK = "ari:push"
+PUSH_LEASE_SECONDS = 60
+INFLIGHT_TIMEOUT = timedelta(minutes=5)
+
+Sender = Callable[[dict], Awaitable[None]]
+
+
+def mask_dates(mask: int, start: date, days: int) -> list[date]:
+    """Dates in [start, start + days) whose calendar bit is set in `mask`."""
+    offset = start.toordinal() - EPOCH
+    window = (mask >> offset) & ((1 << days) - 1) if offset >= 0 else (mask << -offset) & ((1 << days) - 1)
+    out = []
+    while window:
+        low = window & -window
+        out.append(start + timedelta(days=low.bit_length() - 1))
+        window ^= low
+    return out
+
+
+def http_sender(url: str, secret: Optional[str] = None, timeout: float = 10.0) -> Sender:
+    async def send(payload: dict):
+        import httpx
+        body = json.dumps(payload, default=str).encode("utf-8")
+        headers = {"Content-Type": "application/json"}
+        if secret:
+            headers["X-ARI-Signature"] = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+        async with httpx.AsyncClient(timeout=timeout) as client:
+            r = await client.post(url, content=body, headers=headers)
+            r.raise_for_status()
+    return send
+
+
+def watermark(seq_doc: Optional[dict], now: datetime) -> int:
+    """Highest version readers may see: below the oldest live in-flight block."""
+    seq_doc = seq_doc or {}
+    live = [b["first"] for b in seq_doc.get("inflight") or [] if b["at"] > now - INFLIGHT_TIMEOUT]
+    return min(live) - 1 if live else int(seq_doc.get("seq") or 0)
+
+
+async def load_busy(db, units: list[str], start: date, days: int) -> dict[str, int]:
+    """Busy masks (calendar bits) of `units` over [start, start + days) from `room_nights` and `bookings`."""
+    end = start + timedelta(days=days)
+    busy = await unit_masks(db, units, start, end)
+    wanted = set(units)
+    q = {
+        "allocated_cottages": {"$in": unit_id_variants(units)},
+        "status": {"$in": ACTIVE_STATUSES},
+        "check_in": {"$lt": datetime(end.year, end.month, end.day)},
+        "check_out": {"$gt": datetime(start.year, start.month, start.day)},
+    }
+    async for b in db["bookings"].find(q, {"allocated_cottages": 1, "check_in": 1, "check_out": 1}):
+        mask = stay_mask(b.get("check_in"), b.get("check_out"))
+        for u in b.get("allocated_cottages") or []:
+            key = unit_key(u)
+            if key in wanted:
+                busy[key] = busy.get(key, 0) | mask
+    return busy
+
+
+class AriFeed:
+    def __init__(self, cal=None, horizon_days: int = HORIZON_DAYS, debounce: float = DEBOUNCE_SECONDS,
+                 sender: Optional[Sender] = None, locks=None):
+        self.calendar = cal or default_calendar
+        self.locks = locks or lock_manager
+        self.horizon_days = horizon_days
+        self.debounce = debounce
+        self.sender = sender
+        self.db = None
+        # room type -> {"units": [unit keys], "rate": float}
+        self.types: dict[str, dict] = {}
+        self.unit_type: dict[str, str] = {}
+        self.types_loaded_at: Optional[float] = None
+        # room type -> changed-night mask (calendar bits); -1 marks the whole horizon
+        self._dirty: dict[str, int] = {}
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self._flush_lock = asyncio.Lock()
+        self._bus_task: Optional[asyncio.Task] = None
+
+    # -- change tracking --------------------------------------------------
+
+    def on_calendar_change(self, unit: str, changed: int):
+        room_type = self.unit_type.get(unit)
+        if room_type is None:
+            if self.types_loaded_at is not None and unit not in self.types:
+                return
+            room_type = unit
+        self._mark(room_type, changed)
+
+    def mark_type(self, room_type: Any):
+        """Rate or inventory change: the whole horizon of `room_type` is dirty."""
+        self._mark(unit_key(room_type), -1)
+        self.types_loaded_at = None
+
+    def _mark(self, room_type: str, mask: int):
+        self._dirty[room_type] = -1 if mask == -1 or self._dirty.get(room_type) == -1 else self._dirty.get(room_type, 0) | mask
+        self._schedule()
+
+    def _schedule(self):
+        if self._flush_handle is not None or self.db is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        # first change opens the window; later ones ride along
+        self._flush_handle = loop.call_later(self.debounce, lambda: asyncio.ensure_future(self.flush()))
+
+    # -- lifecycle --------------------------------------------------------
+
+    async def start(self, db, bus=None):
+        self.db = db
+        if self.sender is None and os.getenv("ARI_PUSH_URL"):
+            self.sender = http_sender(os.environ["ARI_PUSH_URL"], os.getenv("ARI_PUSH_SECRET"))
+        await self.load_types()
+        self.calendar.add_listener(self.on_calendar_change)
+        # reconcile the whole horizon once; unchanged rows are not re-emitted
+        for room_type in self.types:
+            self._mark(room_type, -1)
+        if bus is not None:
+            self._bus_task = asyncio.create_task(self._follow_bus(bus))
+
+    async def stop(self):
+        self.calendar.remove_listener(self.on_calendar_change)
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._bus_task is not None:
+            self._bus_task.cancel()
+            self._bus_task = None
+
+    async def _follow_bus(self, bus):
+        sub = bus.subscribe(topics="rooms.updated")
+        try:
+            while True:
+                evt = await sub.get()
+                if evt is None:
+                    sub = bus.subscribe(topics="rooms.updated")
+                    continue
+                room_id = json.loads(evt.payload).get("room_id")
+                if room_id:
+                    self.mark_type(room_id)
+        finally:
+            bus.unsubscribe(sub)
+
+    async def load_types(self):
+        """Room types are accommodations; their units are the rooms pointing at them (or the type itself)."""
+        types: dict[str, dict] = {}
+        async for acc in self.db["accommodations"].find({}, {"price_per_night": 1, "price": 1}):
+            rate = acc.get("price_per_night", acc.get("price"))
+            types[unit_key(acc["_id"])] = {"units": [], "rate": rate}
+        async for room in self.db["rooms"].find({"accommodation_id": {"$ne": None}}, {"accommodation_id": 1}):
+            t = types.get(unit_key(room["accommodation_id"]))
+            if t is not None:
+                t["units"].append(unit_key(room["_id"]))
+        unit_type = {}
+        for type_id, t in types.items():
+            if not t["units"]:
+                t["units"] = [type_id]
+            for u in t["units"]:
+                unit_type[u] = type_id
+        self.types, self.unit_type = types, unit_type
+        self.types_loaded_at = time.monotonic()
+
+    # -- computation ------------------------------------------------------
+
+    def row(self, room_type: str, night: date, busy: dict[str, int]) -> dict:
+        """The row of one night from `busy` ({unit: calendar mask}, see `load_busy`)."""
+        t = self.types[room_type]
+        bit = 1 << (night.toordinal() - EPOCH)
+        free = sum(1 for u in t["units"] if not busy.get(u, 0) & bit)
+        if room_type not in t["units"] and busy.get(room_type, 0) & bit:
+            # a booking against the accommodation itself takes one of its rooms
+            free -= 1
+        return {"room_type": room_type, "date": night.isoformat(), "total": len(t["units"]), "available": max(free, 0), "rate": t["rate"]}
+
+    async def flush(self) -> list[dict]:
+        """Recompute dirty rows, store the ones that changed and push undelivered rows."""
+        async with self._flush_lock:
+            self._flush_handle = None
+            dirty, self._dirty = self._dirty, {}
+            if self.types_loaded_at is None or time.monotonic() - self.types_loaded_at > INVENTORY_TTL_SECONDS:
+                await self.load_types()
+            today = datetime.utcnow().date()
+            plan = []
+            for room_type, mask in dirty.items():
+                if room_type not in self.types:
+                    continue
+                nights = ([today + timedelta(days=i) for i in range(self.horizon_days)] if mask == -1
+                          else mask_dates(mask, today, self.horizon_days))
+                plan.append((room_type, nights))
+            changed = []
+            count = sum(len(nights) for _, nights in plan)
+            if count:
+                # reserved before reading, so a higher version always comes from a later read
+                first = await self._reserve(count)
+                try:
+                    units = sorted({u for room_type, _ in plan for u in self.types[room_type]["units"] + [room_type]})
+                    busy = await load_busy(self.db, units, today, self.horizon_days)
+                    rows = [self.row(room_type, n, busy) for room_type, nights in plan for n in nights]
+                    changed = await self._store(rows, first)
+                finally:
+                    await self.db[STATE_COLLECTION].update_one({"_id": SEQ_ID}, {"$pull": {"inflight": {"first": first}}})
+            if self.sender is not None:
+                await self.push_if_leader()
+            return changed
+
+    async def _reserve(self, count: int) -> int:
+        """Reserve `count` versions and record the block as in flight in one update; returns the first."""
+        seq = {"$ifNull": ["$seq", 0]}
+        doc = await self.db[STATE_COLLECTION].find_one_and_update(
+            {"_id": SEQ_ID},
+            # one $set stage: both fields see the counter as it was before this update
+            [{"$set": {"seq": {"$add": [seq, count]},
+                       "inflight": {"$concatArrays": [{"$ifNull": ["$inflight", []]},
+                                                      [{"first": {"$add": [seq, 1]}, "at": "$$NOW"}]]}}}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["seq"] - count + 1
+
+    async def _store(self, rows: list[dict], first: int) -> list[dict]:
+        """Write the rows that changed, row i with version `first + i`."""
+        if not rows:
+            return []
+        coll = self.db[STATE_COLLECTION]
+        ids = [f"{r['room_type']}:{r['date']}" for r in rows]
+        stored = {d["_id"]: d async for d in coll.find({"_id": {"$in": ids}}, {"available": 1, "total": 1, "rate": 1})}
+        changed = [
+            (n, i, r) for n, (i, r) in enumerate(zip(ids, rows))
+            if (stored.get(i) or {}).get("available") != r["available"]
+            or (stored.get(i) or {}).get("total") != r["total"]
+            or (stored.get(i) or {}).get("rate") != r["rate"]
+            or i not in stored
+        ]
+        if not changed:
+            return []
+        now = datetime.utcnow()
+        ops, out = [], []
+        for n, i, r in changed:
+            doc = dict(r, version=first + n, updated_at=now)
+            # a row written by a later flush wins: the upsert then collides with it and is dropped
+            ops.append(UpdateOne({"_id": i, "version": {"$not": {"$gt": doc["version"]}}}, {"$set": doc}, upsert=True))
+            out.append(doc)
+        superseded = set()
+        try:
+            await coll.bulk_write(ops, ordered=False)
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(err.get("code") != 11000 for err in errors):
+                raise
+            superseded = {err["index"] for err in errors}
+        out = [doc for n, doc in enumerate(out) if n not in superseded]
+        logger.info("ari: %d of %d recomputed rows changed", len(out), len(rows))
+        return out
+
+    async def published_version(self) -> int:
+        coll = self.db[STATE_COLLECTION]
+        now = datetime.utcnow()
+        seq_doc = await coll.find_one({"_id": SEQ_ID})
+        if any(b["at"] <= now - INFLIGHT_TIMEOUT for b in (seq_doc or {}).get("inflight") or []):
+            await coll.update_one({"_id": SEQ_ID}, {"$pull": {"inflight": {"at": {"$lte": now - INFLIGHT_TIMEOUT}}}})
+        return watermark(seq_doc, now)
+
+    async def changes_since(self, version: int = 0, limit: int = PUSH_BATCH) -> dict:
+        coll = self.db[STATE_COLLECTION]
+        upto = await self.published_version()
+        cursor = (coll.find({"version": {"$gt": version, "$lte": upto}}, {"_id": 0, "updated_at": 0})
+                  .sort("version", 1).limit(limit))
+        rows = await cursor.to_list(limit)
+        return {"since": version, "version": rows[-1]["version"] if rows else version, "more": len(rows) == limit, "updates": rows}
+
+    async def push_if_leader(self) -> bool:
+        """Push under the `ari:push` lease; without it, try again after the debounce."""
+        lease = await self.locks.acquire(self.db, PUSH_LOCK, ttl_seconds=PUSH_LEASE_SECONDS, timeout=0.1)
+        if lease is None:
+            self._schedule()
+            return False
+        try:
+            lease.start_auto_renew()
+            await self.push()
+        finally:
+            await self.locks.release(lease)
+        return True
+
+    async def push(self):
+        coll = self.db[STATE_COLLECTION]
+        state = await coll.find_one({"_id": PUSH_ID}) or {}
+        delivered = int(state.get("delivered") or 0)
+        while True:
+            page = await self.changes_since(delivered, PUSH_BATCH)
+            if not page["updates"]:
+                return
+            try:
+                await self.sender(page)
+            except Exception:
+                logger.exception("ari: push failed; %d rows will be retried", len(page["updates"]))
+                return
+            delivered = page["version"]
+            await coll.update_one({"_id": PUSH_ID}, {"$max": {"delivered": delivered}}, upsert=True)
+            if not page["more"]:
+                return
+
+
+# Process-wide feed; started from main.py once the database is available
+ari_feed = AriFeed()
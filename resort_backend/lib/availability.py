@@ -0,0 +1,305 @@
+"""In-memory availability calendar.
+
+Keeps one night-bitmap per bookable unit (room or accommodation id) so that
+"which units are free for [check_in, check_out)" is answered without a Mongo
+round-trip. Bit ``n`` of a unit's bitmap is the night starting ``EPOCH + n``
+days; a stay is free when its mask does not intersect the bitmap.
+
+The calendar is loaded from `bookings` (rooms in `allocated_cottages`) and
+the `room_nights` range reservations (lib/reservations.py) and is updated
+by the write paths via `reserve()`/`release()`. Each worker holds its own copy,
+so it is refreshed periodically and callers keep a single authoritative Mongo
+check before inserting. `booked_unit_ids()` is that check for listing
+endpoints: one typed, projected aggregation over `bookings` plus the units
+held in `room_nights` (bookings made through /api/bookings keep their dates
+as strings, which the typed aggregation does not match).
+
+Listeners registered with `add_listener(fn)` are called as ``fn(unit, mask)``
+with the nights whose busy state changed, whether through a write path or a
+reload (which reports only the difference from the previous bitmaps).
+"""
+from datetime import datetime, date, timedelta
+from typing import Any, Callable, Iterable, Optional
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger("resort_backend.availability")
+
+EPOCH = date(2020, 1, 1).toordinal()
+
+# Statuses that hold rooms listed in `allocated_cottages` (see api_compat.create_booking)
+ACTIVE_STATUSES = ["confirmed", "pending"]
+
+REFRESH_SECONDS = float(os.getenv("AVAILABILITY_REFRESH_SECONDS", "60"))
+
+
+def _to_date(v: Any) -> Optional[date]:
+    if v is None:
+        return None
+    if isinstance(v, datetime):
+        return v.date()
+    if isinstance(v, date):
+        return v
+    if isinstance(v, str):
+        try:
+            return date.fromisoformat(v[:10])
+        except ValueError:
+            return None
+    return None
+
+
+def unit_key(unit_id: Any) -> str:
+    """Normalise a room/accommodation id (ObjectId or str) to the calendar key."""
+    return str(unit_id)
+
+
+def stay_mask(check_in: Any, check_out: Any) -> int:
+    """Bitmask of the nights in [check_in, check_out). Nights before EPOCH are ignored."""
+    start = _to_date(check_in)
+    end = _to_date(check_out)
+    if start is None or end is None:
+        return 0
+    lo = max(start.toordinal() - EPOCH, 0)
+    hi = end.toordinal() - EPOCH
+    if hi <= lo:
+        return 0
+    return ((1 << (hi - lo)) - 1) << lo
+
+
+def night_bit(night: Any) -> int:
+    d = _to_date(night)
+    if d is None or d.toordinal() < EPOCH:
+        return 0
+    return 1 << (d.toordinal() - EPOCH)
+
+
+class AvailabilityCalendar:
+    """Per-unit night bitmaps with holder tracking so reservations can be released."""
+
+    def __init__(self):
+        # unit -> {holder -> mask}
+        self._holds: dict[str, dict[str, int]] = {}
+        # unit -> OR of all holder masks
+        self._busy: dict[str, int] = {}
+        # holder -> units it occupies
+        self._holders: dict[str, set[str]] = {}
+        self.loaded_at: Optional[float] = None
+        self._load_lock = asyncio.Lock()
+        self._listeners: list[Callable[[str, int], None]] = []
+
+    def add_listener(self, fn: Callable[[str, int], None]):
+        if fn not in self._listeners:
+            self._listeners.append(fn)
+
+    def remove_listener(self, fn: Callable[[str, int], None]):
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def _notify(self, unit: str, changed: int):
+        if not changed:
+            return
+        for fn in list(self._listeners):
+            try:
+                fn(unit, changed)
+            except Exception:
+                logger.exception("availability listener failed")
+
+    def clear(self):
+        self._holds.clear()
+        self._busy.clear()
+        self._holders.clear()
+        self.loaded_at = None
+
+    def invalidate(self):
+        """Force a reload from Mongo on the next `ensure_loaded`."""
+        self.loaded_at = None
+
+    def _add(self, holder: str, unit: str, mask: int, notify: bool = True):
+        if not mask:
+            return
+        holds = self._holds.setdefault(unit, {})
+        holds[holder] = holds.get(holder, 0) | mask
+        before = self._busy.get(unit, 0)
+        self._busy[unit] = before | mask
+        self._holders.setdefault(holder, set()).add(unit)
+        if notify:
+            self._notify(unit, mask & ~before)
+
+    def reserve(self, holder: Any, units: Iterable[Any], check_in: Any, check_out: Any):
+        """Mark `units` busy for [check_in, check_out) on behalf of `holder` (usually a booking id)."""
+        mask = stay_mask(check_in, check_out)
+        h = str(holder)
+        for u in units or []:
+            self._add(h, unit_key(u), mask)
+
+    def reserve_night(self, holder: Any, unit: Any, night: Any):
+        self._add(str(holder), unit_key(unit), night_bit(night))
+
+    def release(self, holder: Any):
+        """Drop every night held by `holder` and rebuild the affected unit bitmaps."""
+        h = str(holder)
+        for unit in self._holders.pop(h, set()):
+            holds = self._holds.get(unit)
+            if not holds:
+                continue
+            holds.pop(h, None)
+            busy = 0
+            for m in holds.values():
+                busy |= m
+            before = self._busy.get(unit, 0)
+            if busy:
+                self._busy[unit] = busy
+            else:
+                self._busy.pop(unit, None)
+                self._holds.pop(unit, None)
+            self._notify(unit, before ^ busy)
+
+    def is_free(self, unit: Any, check_in: Any, check_out: Any) -> bool:
+        return not (self._busy.get(unit_key(unit), 0) & stay_mask(check_in, check_out))
+
+    def all_free(self, units: Iterable[Any], check_in: Any, check_out: Any) -> bool:
+        mask = stay_mask(check_in, check_out)
+        return not any(self._busy.get(unit_key(u), 0) & mask for u in units or [])
+
+    def busy_units(self, check_in: Any, check_out: Any) -> set[str]:
+        """Keys of every unit with at least one busy night in [check_in, check_out)."""
+        mask = stay_mask(check_in, check_out)
+        if not mask:
+            return set()
+        return {u for u, busy in self._busy.items() if busy & mask}
+
+    def free_counts(self, units: Iterable[Any], start: Any, days: int, shared: Any = None) -> list[int]:
+        """Number of free `units` on each night of [start, start + days).
+
+        The window masks are summed bit-sliced (one ripple-carry add per unit
+        across all nights at once), so the cost grows with units, not nights.
+        A night held on `shared` (an accommodation booked as a whole rather than
+        by room) takes one more unit, as in lib/ari.py.
+        """
+        first = _to_date(start)
+        if first is None or days <= 0:
+            return []
+        full = (1 << days) - 1
+        offset = first.toordinal() - EPOCH
+        planes: list[int] = []
+        for u in units or []:
+            busy = self._busy.get(unit_key(u), 0)
+            window = busy >> offset if offset >= 0 else busy << -offset
+            carry = ~window & full
+            for i in range(len(planes)):
+                planes[i], carry = planes[i] ^ carry, planes[i] & carry
+                if not carry:
+                    break
+            if carry:
+                planes.append(carry)
+        counts = [sum(((p >> d) & 1) << i for i, p in enumerate(planes)) for d in range(days)]
+        if shared is not None:
+            busy = self._busy.get(unit_key(shared), 0)
+            held = busy >> offset if offset >= 0 else busy << -offset
+            counts = [max(c - ((held >> d) & 1), 0) for d, c in enumerate(counts)]
+        return counts
+
+    def free_units(self, units: Iterable[Any], check_in: Any, check_out: Any) -> list:
+        """Filter `units` (ids or docs with `_id`) down to the ones free for the stay, preserving order."""
+        mask = stay_mask(check_in, check_out)
+        out = []
+        for u in units or []:
+            uid = u.get("_id") if isinstance(u, dict) else u
+            if not (self._busy.get(unit_key(uid), 0) & mask):
+                out.append(u)
+        return out
+
+    async def load(self, db, horizon_days: int = 1):
+        """(Re)build the calendar from Mongo, ignoring stays that ended before `horizon_days` ago."""
+        since = datetime.utcnow() - timedelta(days=horizon_days)
+        holds: list[tuple[str, str, int]] = []
+        cursor = db["bookings"].find(
+            {
+                "allocated_cottages": {"$exists": True, "$ne": []},
+                "status": {"$in": ACTIVE_STATUSES},
+                "check_out": {"$gt": since},
+            },
+            {"allocated_cottages": 1, "check_in": 1, "check_out": 1},
+        )
+        async for b in cursor:
+            mask = stay_mask(b.get("check_in"), b.get("check_out"))
+            for room_id in b.get("allocated_cottages") or []:
+                holds.append((str(b["_id"]), unit_key(room_id), mask))
+        # imported here: lib.reservations builds on this module's night helpers
+        from resort_backend.lib.reservations import iter_holds
+        async for holder, unit, mask in iter_holds(db, since):
+            if unit is not None:
+                holds.append((str(holder), unit_key(unit), mask))
+        previous = dict(self._busy)
+        self.clear()
+        for holder, unit, mask in holds:
+            self._add(holder, unit, mask, notify=False)
+        if self._listeners:
+            for unit in set(previous) | set(self._busy):
+                self._notify(unit, previous.get(unit, 0) ^ self._busy.get(unit, 0))
+        self.loaded_at = time.monotonic()
+        logger.info("availability calendar loaded: %d units, %d holders", len(self._busy), len(self._holders))
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or (time.monotonic() - self.loaded_at) > REFRESH_SECONDS
+
+    async def ensure_loaded(self, db):
+        if not self.is_stale():
+            return self
+        async with self._load_lock:
+            if self.is_stale():
+                await self.load(db)
+        return self
+
+
+# Process-wide calendar shared by the booking routes
+calendar = AvailabilityCalendar()
+
+
+async def get_calendar(db) -> AvailabilityCalendar:
+    """Return the shared calendar, loading it from `db` when cold or stale."""
+    return await calendar.ensure_loaded(db)
+
+
+def booked_units_pipeline(check_in: datetime, check_out: datetime) -> list:
+    """Aggregation over `bookings`: one document with the units held by active bookings overlapping the stay.
+
+    Bounds must be datetimes (bookings store them typed); the $match is served by
+    the (status, check_in, check_out) index and only the unit fields are projected.
+    """
+    if not isinstance(check_in, datetime) or not isinstance(check_out, datetime):
+        raise TypeError("check_in/check_out must be datetimes")
+    return [
+        {"$match": {"status": {"$in": ACTIVE_STATUSES}, "check_in": {"$lt": check_out}, "check_out": {"$gt": check_in}}},
+        {"$project": {"_id": 0, "accommodation_id": 1, "allocated_cottages": 1}},
+        # accommodation_id is a scalar or a list; $unwind treats a scalar as one element
+        {"$unwind": {"path": "$accommodation_id", "preserveNullAndEmptyArrays": True}},
+        {"$unwind": {"path": "$allocated_cottages", "preserveNullAndEmptyArrays": True}},
+        {"$group": {"_id": None, "accommodations": {"$addToSet": "$accommodation_id"}, "rooms": {"$addToSet": "$allocated_cottages"}}},
+    ]
+
+
+def unit_id_variants(units: Iterable[Any]) -> list:
+    """Each id in both its str and ObjectId form, for `$in`/`$nin` against mixed-type `_id`s."""
+    from bson import ObjectId
+    out = set()
+    for u in units:
+        out.add(u)
+        s = str(u)
+        out.add(s)
+        if ObjectId.is_valid(s):
+            out.add(ObjectId(s))
+    return list(out)
+
+
+async def booked_unit_ids(db, check_in: datetime, check_out: datetime) -> list:
+    """Authoritative (Mongo) ids of units booked on any night of [check_in, check_out), str and ObjectId forms."""
+    # imported here: lib.reservations builds on this module's night helpers
+    from resort_backend.lib.reservations import held_units
+    docs = await db["bookings"].aggregate(booked_units_pipeline(check_in, check_out)).to_list(length=1)
+    units = set(await held_units(db, check_in, check_out))
+    if docs:
+        units.update(u for u in docs[0]["accommodations"] + docs[0]["rooms"] if u is not None)
+    return unit_id_variants(units)
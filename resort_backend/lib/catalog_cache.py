@@ -0,0 +1,130 @@
+"""Read-through cache for catalog endpoints (menu, navigation, gallery, ...).
+
+Entries are the final JSON body as bytes, so a hit skips both Mongo and
+serialize_doc. Each entry belongs to a namespace (usually the collection name)
+with its own TTL; the cache is bounded by entry count and total bytes and
+evicts least-recently-used entries first. Admin write endpoints call
+`catalog_cache.invalidate(<namespace>)`; the TTL bounds staleness for writes
+made by other workers or directly in the database.
+"""
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+from fastapi.responses import Response
+from resort_backend.utils import dumps_bson
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger("resort_backend.catalog_cache")
+
+# Seconds an entry stays fresh, per namespace; CATALOG_CACHE_TTL overrides the default
+DEFAULT_TTL = float(os.getenv("CATALOG_CACHE_TTL", "300"))
+NAMESPACE_TTLS = {
+    "site": 600,
+    "navigation": 600,
+    "reviews": 120,
+}
+
+
+def encode_json(data: Any) -> bytes:
+    return dumps_bson(data)
+
+
+class CatalogCache:
+    def __init__(self, max_entries: int = 512, max_bytes: int = 32 * 1024 * 1024, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._clock = clock
+        # (namespace, key) -> (expires_at, body)
+        self._entries: "OrderedDict[tuple[str, str], tuple[float, bytes]]" = OrderedDict()
+        self._bytes = 0
+        # single-flight: concurrent misses on one key share a single load
+        self._inflight: dict[tuple[str, str], asyncio.Future] = {}
+        # bumped on invalidate so loads that started before it are not stored
+        self._generation: dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def ttl_for(self, namespace: str) -> float:
+        return NAMESPACE_TTLS.get(namespace, DEFAULT_TTL)
+
+    def get(self, namespace: str, key: str) -> Optional[bytes]:
+        k = (namespace, key)
+        entry = self._entries.get(k)
+        if entry is None:
+            return None
+        expires_at, body = entry
+        if expires_at <= self._clock():
+            self._drop(k)
+            return None
+        self._entries.move_to_end(k)
+        return body
+
+    def set(self, namespace: str, key: str, body: bytes):
+        k = (namespace, key)
+        if k in self._entries:
+            self._drop(k)
+        if len(body) > self.max_bytes:
+            return
+        self._entries[k] = (self._clock() + self.ttl_for(namespace), body)
+        self._bytes += len(body)
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, k):
+        _, body = self._entries.pop(k)
+        self._bytes -= len(body)
+
+    def invalidate(self, *namespaces: str):
+        """Drop every entry of the given namespaces (all entries when none given)."""
+        for k in [k for k in self._entries if not namespaces or k[0] in namespaces]:
+            self._drop(k)
+        for ns in namespaces or list(self._generation):
+            self._generation[ns] = self._generation.get(ns, 0) + 1
+
+    async def get_or_load(self, namespace: str, key: str, loader: Callable[[], Awaitable[Any]]) -> bytes:
+        """Return the cached body or run `loader()` (JSON-able result) once and cache its encoding.
+
+        Exceptions from `loader` propagate and nothing is cached.
+        """
+        body = self.get(namespace, key)
+        if body is not None:
+            self.hits += 1
+            return body
+        k = (namespace, key)
+        pending = self._inflight.get(k)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        self.misses += 1
+        gen = self._generation.get(namespace, 0)
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[k] = fut
+        try:
+            body = encode_json(await loader())
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as exc:
+            fut.set_exception(exc)
+            # retrieve so an unawaited future does not log "exception never retrieved"
+            fut.exception()
+            raise
+        finally:
+            self._inflight.pop(k, None)
+        if self._generation.get(namespace, 0) == gen:
+            self.set(namespace, key, body)
+        fut.set_result(body)
+        return body
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+# Process-wide cache shared by the catalog routers
+catalog_cache = CatalogCache()
+
+
+async def cached_json_response(namespace: str, key: str, loader: Callable[[], Awaitable[Any]]) -> Response:
+    body = await catalog_cache.get_or_load(namespace, key, loader)
+    return Response(content=body, media_type="application/json")
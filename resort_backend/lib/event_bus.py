@@ -0,0 +1,293 @@
+"""Event bus behind the SSE stream in routes/events.py.
+
+Publishers call `event_bus.publish(evt)` (sync, never blocks). Each process
+keeps its own set of subscribers and fans events out to them locally; the
+backend decides how events travel between processes:
+
+- `LocalBackend`: in-process only (tests, single-worker dev server).
+- `MongoBackend`: events are appended to the capped `events` collection and
+  every worker tails it once with a tailable-await cursor, so a client
+  connected to any worker sees events published by all of them. A capped
+  collection is used rather than a change stream because change streams
+  need a replica set.
+
+Pick the backend with EVENT_BUS_BACKEND=local|mongo (default mongo once a
+database is available). Subscriber queues are bounded: a consumer that falls
+behind either loses its oldest queued events (`drop_oldest`, the default)
+or is disconnected (`disconnect`) so the client reconnects.
+
+Every event gets an ObjectId string as its SSE id when it is published.
+Ids from different workers are not ordered, but all workers read the shared
+log in the same (natural) order, so the last
+EVENT_LOG_SIZE events kept in each worker's ring buffer can be replayed
+after any id (`Last-Event-ID`) whichever worker the client reconnects to.
+Subscribers may pass topic patterns (`bookings.*`); events are matched on
+their "event" field before they are queued.
+"""
+from collections import deque
+from fnmatch import fnmatchcase
+from typing import Callable, NamedTuple, Optional
+import asyncio
+import json
+import logging
+import os
+import time
+from bson import ObjectId
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+
+logger = logging.getLogger("resort_backend.event_bus")
+
+EVENTS_COLLECTION = "events"
+CAPPED_SIZE_BYTES = int(os.getenv("EVENT_BUS_CAPPED_BYTES", str(16 * 1024 * 1024)))
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENT_BUS_QUEUE_SIZE", "256"))
+EVENT_LOG_SIZE = int(os.getenv("EVENT_LOG_SIZE", "1000"))
+DROP_OLDEST = "drop_oldest"
+DISCONNECT = "disconnect"
+
+
+class Event(NamedTuple):
+    id: str
+    topic: str
+    payload: str
+
+
+def topic_matcher(topics: Optional[str]) -> Optional[Callable[[str], bool]]:
+    """Matcher for a comma-separated list of exact topics and glob patterns; None matches all."""
+    if not topics:
+        return None
+    names = [t.strip() for t in topics.split(",") if t.strip()]
+    if not names or "*" in names:
+        return None
+    exact = {t for t in names if not any(c in t for c in "*?[")}
+    patterns = [t for t in names if t not in exact]
+
+    def match(topic: str) -> bool:
+        return topic in exact or any(fnmatchcase(topic, p) for p in patterns)
+    return match
+
+
+class Subscription:
+    """One SSE client: a bounded queue of events, optionally filtered by topic."""
+
+    def __init__(self, maxsize: int = SUBSCRIBER_QUEUE_SIZE, policy: str = DROP_OLDEST,
+                 matcher: Optional[Callable[[str], bool]] = None):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+        self.policy = policy
+        self.matcher = matcher
+        self.dropped = 0
+        self.closed = False
+        # events replayed from the ring buffer, sent before anything queued
+        self.backlog: list[Event] = []
+
+    def wants(self, evt: Event) -> bool:
+        return self.matcher is None or self.matcher(evt.topic)
+
+    def offer(self, evt: Event):
+        if self.closed or not self.wants(evt):
+            return
+        try:
+            self.queue.put_nowait(evt)
+            return
+        except asyncio.QueueFull:
+            pass
+        if self.policy == DISCONNECT:
+            self.close()
+            return
+        self.queue.get_nowait()
+        self.queue.put_nowait(evt)
+        self.dropped += 1
+
+    def close(self):
+        """Stop the subscriber; `get()` returns None once the queue is drained of the close marker."""
+        self.closed = True
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+    async def get(self) -> Optional[Event]:
+        if self.backlog:
+            return self.backlog.pop(0)
+        return await self.queue.get()
+
+
+class LocalBackend:
+    name = "local"
+
+    def __init__(self):
+        self.bus: Optional["EventBus"] = None
+
+    async def start(self, bus: "EventBus"):
+        self.bus = bus
+
+    async def stop(self):
+        pass
+
+    def publish(self, evt: Event):
+        self.bus.fanout(evt)
+
+
+class MongoBackend:
+    name = "mongo"
+
+    def __init__(self, db, collection: str = EVENTS_COLLECTION, capped_size: int = CAPPED_SIZE_BYTES):
+        self.db = db
+        self.collection = collection
+        self.capped_size = capped_size
+        self.bus: Optional["EventBus"] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_id = None
+
+    async def start(self, bus: "EventBus"):
+        self.bus = bus
+        try:
+            await self.db.create_collection(self.collection, capped=True, size=self.capped_size)
+        except CollectionInvalid:
+            pass
+        # seed the replay buffer with the newest events, then tail from there
+        recent = await self.db[self.collection].find({}).sort("$natural", -1).to_list(bus.log.maxlen)
+        for doc in reversed(recent):
+            bus.log.append(Event(str(doc["_id"]), doc.get("topic") or "", doc.get("payload")))
+        self._last_id = recent[0]["_id"] if recent else None
+        self._task = asyncio.create_task(self._tail())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    def publish(self, evt: Event):
+        asyncio.get_running_loop().create_task(self._insert(evt))
+
+    async def _insert(self, evt: Event):
+        try:
+            await self.db[self.collection].insert_one(
+                {"_id": ObjectId(evt.id), "topic": evt.topic, "payload": evt.payload, "created_at": time.time()}
+            )
+        except Exception:
+            # keep same-process subscribers informed even if the shared log is unavailable
+            logger.exception("event bus: failed to append event, delivering locally only")
+            self.bus.fanout(evt)
+
+    async def _tail(self):
+        # ObjectIds minted by different workers do not sort in append order, so the
+        # cursor is not filtered on _id: it reads the log in natural (append) order
+        # and, when reopened, skips up to the last event already delivered
+        coll = self.db[self.collection]
+        while True:
+            skipping = self._last_id is not None
+            cursor = coll.find({}, cursor_type=CursorType.TAILABLE_AWAIT)
+            try:
+                while cursor.alive:
+                    async for doc in cursor:
+                        if skipping:
+                            skipping = doc["_id"] != self._last_id
+                            continue
+                        self._last_id = doc["_id"]
+                        self.bus.fanout(Event(str(doc["_id"]), doc.get("topic") or "", doc.get("payload")))
+                    if skipping:
+                        break
+                    # no new events within the await window
+                    await asyncio.sleep(0.05)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("event bus: tail cursor failed, reopening")
+            if skipping:
+                # the last delivered event was overwritten, and with it everything
+                # appended before it: whatever is left is new
+                self._last_id = None
+                continue
+            # the cursor dies immediately on an empty capped collection
+            await asyncio.sleep(0.5)
+
+
+class EventBus:
+    def __init__(self, backend=None, log_size: int = EVENT_LOG_SIZE):
+        self.backend = backend or LocalBackend()
+        self.subscribers: set[Subscription] = set()
+        self.log: deque[Event] = deque(maxlen=log_size)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._started = False
+
+    async def start(self, backend=None):
+        if backend is not None:
+            await self.stop()
+            self.backend = backend
+        self._loop = asyncio.get_running_loop()
+        await self.backend.start(self)
+        self._started = True
+        logger.info("event bus started with %s backend", self.backend.name)
+
+    async def stop(self):
+        if self._started:
+            await self.backend.stop()
+            self._started = False
+
+    def subscribe(self, maxsize: int = SUBSCRIBER_QUEUE_SIZE, policy: str = DROP_OLDEST,
+                  topics: Optional[str] = None, last_event_id: Optional[str] = None) -> Subscription:
+        """Register a subscriber, replaying logged events published after `last_event_id`.
+
+        An id that has already left the ring buffer replays the whole buffer.
+        """
+        sub = Subscription(maxsize, policy, topic_matcher(topics))
+        if last_event_id:
+            ids = [e.id for e in self.log]
+            start = ids.index(last_event_id) + 1 if last_event_id in ids else 0
+            sub.backlog = [e for e in list(self.log)[start:] if sub.wants(e)]
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        self.subscribers.discard(sub)
+
+    def publish(self, evt: dict):
+        """Serialize `evt` (plus a wall-clock `ts`) and hand it to the backend. Never blocks.
+
+        Returns the event id.
+        """
+        data = evt.copy()
+        data["ts"] = time.time()
+        event = Event(str(ObjectId()), str(data.get("event") or ""), json.dumps(data, default=str))
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            # called from a worker thread: hop onto the bus loop
+            if self._loop is not None and not self._loop.is_closed():
+                self._loop.call_soon_threadsafe(self._dispatch, event)
+            return event.id
+        self._dispatch(event)
+        return event.id
+
+    def _dispatch(self, evt: Event):
+        if not self._started:
+            # before startup (or in tests without it) deliver in-process
+            self.fanout(evt)
+            return
+        self.backend.publish(evt)
+
+    def fanout(self, evt: Event):
+        self.log.append(evt)
+        for sub in list(self.subscribers):
+            try:
+                sub.offer(evt)
+            except Exception:
+                logger.exception("Failed to enqueue event for a subscriber")
+            if sub.closed:
+                self.subscribers.discard(sub)
+                logger.warning("event bus: disconnected slow subscriber (%d queued)", sub.queue.maxsize)
+
+
+def backend_from_env(db):
+    name = os.getenv("EVENT_BUS_BACKEND", "mongo" if db is not None else "local").lower()
+    if name == "mongo" and db is not None:
+        return MongoBackend(db)
+    return LocalBackend()
+
+
+# Process-wide bus shared by the routes
+event_bus = EventBus()
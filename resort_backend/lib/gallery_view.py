@@ -0,0 +1,170 @@
+"""Canonical gallery documents and the single gallery read path.
+
+Gallery items come from several writers (admin JSON, uploads, seeds, older
+data) and spell the same things differently: `url`/`imageUrl`/`image_url`/
+`image`/`images[0]`, `visible`/`isVisible`, `createdAt`/`created_at`. Every
+write now stores, next to the raw fields:
+
+    category, isVisible, createdAt   canonical filter/sort keys, indexed as
+                                     (category, isVisible, createdAt, _id)
+    public                           the finished response item, URLs already
+                                     prefixed with MEDIA_BASE_URL
+    public_v, public_base            PUBLIC_VERSION and MEDIA_BASE_URL the
+                                     projection was built with
+
+so a read is one aggregation: $match on the indexed keys, $sort by
+(createdAt, _id) descending, keyset paging, `$replaceRoot` to `public`, and
+optionally category counts from the same `$facet`. Items written before the
+projection existed, or built with an older PUBLIC_VERSION or another
+MEDIA_BASE_URL, are rebuilt at startup by `normalize_all`.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Optional
+import logging
+import os
+from bson import ObjectId
+from fastapi import HTTPException
+from resort_backend.lib.media import build_srcset
+
+logger = logging.getLogger("resort_backend.gallery")
+
+PUBLIC_VERSION = 1
+# prefix for relative media URLs in responses, e.g. https://api.example.com; empty keeps them relative
+MEDIA_BASE_URL = os.getenv("MEDIA_BASE_URL", "").rstrip("/")
+VIDEO_EXTS = (".mp4", ".webm", ".ogg", ".mov", ".avi", ".mkv")
+SORT = {"createdAt": -1, "_id": -1}
+EPOCH = datetime(1970, 1, 1)
+
+
+def _absolute(url: Any) -> Any:
+    if MEDIA_BASE_URL and isinstance(url, str) and url.startswith("/"):
+        return MEDIA_BASE_URL + url
+    return url
+
+
+def _first(v: Any) -> Optional[str]:
+    return v[0] if isinstance(v, list) and v and isinstance(v[0], str) else None
+
+
+def canonical_fields(doc: dict) -> dict:
+    """The fields `normalize` stores on a gallery document (`doc` must have its `_id`)."""
+    url = doc.get("url") or doc.get("imageUrl") or doc.get("image_url") or doc.get("image") or _first(doc.get("images")) or _first(doc.get("media"))
+    image = (doc.get("image_url") or doc.get("imageUrl") or doc.get("thumbnail") or doc.get("image")
+             or _first(doc.get("images")) or _first(doc.get("media")) or url)
+    visible = doc.get("isVisible")
+    if visible is None:
+        visible = doc.get("visible")
+    visible = visible is not False
+    created = doc.get("createdAt") or doc.get("created_at")
+    if not isinstance(created, datetime):
+        created = doc["_id"].generation_time.replace(tzinfo=None) if isinstance(doc["_id"], ObjectId) else datetime.utcnow()
+    category = doc.get("category") or doc.get("categoryName") or None
+    kind = doc.get("type")
+    if not kind and isinstance(url, str) and url.lower().split("?")[0].endswith(VIDEO_EXTS):
+        kind = "video"
+    variants = doc.get("variants")
+    if variants:
+        variants = {name: {**v, "webp": _absolute(v["webp"]), "jpeg": _absolute(v["jpeg"])} for name, v in variants.items()}
+    public = {
+        "id": str(doc["_id"]),
+        "title": doc.get("title"),
+        "caption": doc.get("caption") or doc.get("title") or doc.get("description") or "",
+        "description": doc.get("description") or "",
+        "type": kind,
+        "category": category,
+        "url": _absolute(url),
+        "imageUrl": _absolute(image),
+        "image_url": _absolute(image),
+        "isVisible": visible,
+        "visible": visible,
+        "variants": variants or None,
+        "srcset": build_srcset(variants) if variants else None,
+        "createdAt": created,
+    }
+    return {"category": category, "isVisible": visible, "createdAt": created, "public": public,
+            "public_v": PUBLIC_VERSION, "public_base": MEDIA_BASE_URL}
+
+
+async def normalize(db, item_id: Any) -> Optional[dict]:
+    """Rebuild the canonical fields of one gallery item after a write; returns the stored document."""
+    doc = await db["gallery"].find_one({"_id": item_id})
+    if doc is None:
+        return None
+    fields = canonical_fields(doc)
+    await db["gallery"].update_one({"_id": item_id}, {"$set": fields})
+    doc.update(fields)
+    return doc
+
+
+def stale_query() -> dict:
+    """Items whose projection was built by an older version or for another MEDIA_BASE_URL."""
+    return {"$or": [{"public_v": {"$ne": PUBLIC_VERSION}}, {"public_base": {"$ne": MEDIA_BASE_URL}}]}
+
+
+async def normalize_all(db, force: bool = False) -> int:
+    """Normalise items missing an up-to-date projection (all items with force=True)."""
+    query = {} if force else stale_query()
+    n = 0
+    async for doc in db["gallery"].find(query):
+        await db["gallery"].update_one({"_id": doc["_id"]}, {"$set": canonical_fields(doc)})
+        n += 1
+    if n:
+        logger.info("normalised %d gallery items", n)
+    return n
+
+
+def encode_cursor(item: dict) -> str:
+    # Mongo keeps datetimes to the millisecond, so this round-trips exactly
+    ms = (item["createdAt"] - EPOCH) // timedelta(milliseconds=1)
+    return f"{ms}_{item['id']}"
+
+
+def decode_cursor(cursor: str) -> dict:
+    """Keyset condition for the items after `cursor` in (createdAt, _id) descending order."""
+    try:
+        ms, oid = cursor.split("_", 1)
+        created = EPOCH + timedelta(milliseconds=int(ms))
+        oid = ObjectId(oid)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return {"$or": [{"createdAt": {"$lt": created}}, {"createdAt": created, "_id": {"$lt": oid}}]}
+
+
+def gallery_pipeline(category: Optional[str] = None, visible: Optional[bool] = None, after: Optional[str] = None,
+                     limit: Optional[int] = None, facets: bool = False) -> list:
+    """Aggregation for one gallery page; `limit` fetches one extra item to detect a next page."""
+    match: dict = {}
+    if category:
+        match["category"] = category
+    if visible is not None:
+        match["isVisible"] = visible
+    keyset = decode_cursor(after) if after else None
+    tail = ([{"$limit": limit + 1}] if limit is not None else []) + [{"$replaceRoot": {"newRoot": "$public"}}]
+    if not facets:
+        # the cursor joins the indexed $match so later pages start at the right index key
+        if keyset:
+            match = {"$and": [match, keyset]} if match else keyset
+        return [{"$match": match}, {"$sort": SORT}, *tail]
+    # counts cover every item matching the filter, not just this page
+    return [{"$match": match}, {"$sort": SORT}, {"$facet": {
+        "items": ([{"$match": keyset}] if keyset else []) + tail,
+        "categories": [{"$group": {"_id": "$category", "count": {"$sum": 1}}}, {"$sort": {"_id": 1}}],
+    }}]
+
+
+async def query_gallery(db, category: Optional[str] = None, visible: Optional[bool] = None, after: Optional[str] = None,
+                        limit: Optional[int] = None, facets: bool = False) -> dict:
+    """{"items", "next_cursor", "categories"} for one page; categories is None unless `facets`."""
+    pipeline = gallery_pipeline(category, visible, after, limit, facets)
+    rows = await db["gallery"].aggregate(pipeline).to_list(length=None)
+    categories = None
+    if facets:
+        items = rows[0]["items"] if rows else []
+        categories = [{"category": r["_id"], "count": r["count"]} for r in (rows[0]["categories"] if rows else [])]
+    else:
+        items = rows
+    next_cursor = None
+    if limit is not None and len(items) > limit:
+        items = items[:limit]
+        next_cursor = encode_cursor(items[-1])
+    return {"items": items, "next_cursor": next_cursor, "categories": categories}
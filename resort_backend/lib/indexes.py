@@ -0,0 +1,239 @@
+"""Declarative index registry.
+
+Every index the query paths rely on is listed once in `INDEXES`. The API
+applies the registry at startup (`ensure_indexes`, disabled with
+AUTO_CREATE_INDEXES=0) and `scripts/create_indexes.py` applies or checks it
+from the command line (`ensure_indexes_sync`). Applying is idempotent: only
+missing indexes are created. Differences from the registry are reported as
+drift instead of being changed silently:
+
+    changed    an index with the registry name but other keys/options
+    renamed    the registry keys exist under another name (treated as present)
+    unmanaged  indexes in the database the registry does not know about
+    failed     collections whose indexes could not be read or written (with the
+               error); the other collections are still applied
+
+`changed` indexes are only dropped and recreated with `fix=True` (the CLI's
+--fix). `HOT_QUERIES` are representative filters of the hot endpoints;
+tests/test_indexes.py runs explain() on each and asserts none is a COLLSCAN.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+import logging
+import pymongo
+from pymongo import IndexModel
+
+logger = logging.getLogger("resort_backend.indexes")
+
+ASC = pymongo.ASCENDING
+DESC = pymongo.DESCENDING
+# options that make two indexes with the same keys behave differently
+COMPARED_OPTIONS = ("unique", "sparse", "expireAfterSeconds", "partialFilterExpression")
+
+
+@dataclass
+class IndexSpec:
+    collection: str
+    keys: list
+    name: str
+    options: dict = field(default_factory=dict)
+
+    def model(self) -> IndexModel:
+        return IndexModel(self.keys, name=self.name, **self.options)
+
+    def matches(self, info: dict) -> bool:
+        """Same keys and options as an `index_information()` entry."""
+        if [tuple(k) for k in info.get("key", [])] != [tuple(k) for k in self.keys]:
+            return False
+        return all(info.get(opt) == self.options.get(opt) for opt in COMPARED_OPTIONS
+                   if opt in self.options or info.get(opt) not in (None, False))
+
+
+INDEXES = [
+    # bookings: overlap checks (api_compat.find_conflicting_rooms, availability.booked_unit_ids),
+    # guest lookups and payment joins (lib/reconciliation.py)
+    IndexSpec("bookings", [("accommodation_id", ASC), ("check_in", ASC), ("check_out", ASC)], "accom_checkin_checkout_idx"),
+    IndexSpec("bookings", [("allocated_cottages", ASC), ("status", ASC), ("check_in", ASC)], "bookings_rooms_status_checkin_idx"),
+    IndexSpec("bookings", [("status", ASC), ("check_in", ASC), ("check_out", ASC)], "bookings_status_checkin_checkout_idx"),
+    IndexSpec("bookings", [("guest_email", ASC)], "bookings_guest_email_idx"),
+    # one booking per paid order: reconciliation upserts on it while the webhook worker inserts
+    IndexSpec("bookings", [("payment.order_id", ASC)], "bookings_payment_order_unique",
+              {"unique": True, "partialFilterExpression": {"payment.order_id": {"$type": "string"}}}),
+    IndexSpec("bookings", [("payment.payment_id", ASC)], "bookings_payment_id_idx"),
+    # legacy per-night occupancy guard
+    IndexSpec("occupancies", [("accommodation_id", ASC), ("date", ASC)], "accom_date_unique_idx", {"unique": True}),
+    # range reservations (lib/reservations.py): release by holder, calendar loads recent months
+    IndexSpec("room_nights", [("holds.booking_id", ASC)], "room_nights_holder_idx"),
+    IndexSpec("room_nights", [("month", ASC)], "room_nights_month_idx"),
+    # catalog lookups
+    IndexSpec("rooms", [("accommodation_id", ASC)], "rooms_accommodation_idx"),
+    IndexSpec("rooms", [("slug", ASC)], "rooms_slug_idx"),
+    # gallery reads (lib/gallery_view.py): filter on the canonical keys, newest first with _id as tie-breaker
+    IndexSpec("gallery", [("category", ASC), ("isVisible", ASC), ("createdAt", DESC), ("_id", DESC)], "gallery_category_visible_created_idx"),
+    IndexSpec("gallery", [("isVisible", ASC), ("createdAt", DESC), ("_id", DESC)], "gallery_visible_created_idx"),
+    IndexSpec("navigation", [("is_visible", ASC), ("order", ASC)], "navigation_visible_order_idx"),
+    # programs read model (lib/programs_view.py): ?tag= filters on kinds, lists in (rank, source_id) order
+    IndexSpec("programs_view", [("kinds", ASC), ("rank", ASC), ("source_id", ASC)], "programs_view_kinds_idx"),
+    IndexSpec("programs_view", [("rank", ASC), ("source_id", ASC)], "programs_view_order_idx"),
+    IndexSpec("programs_view", [("source_id", ASC), ("rank", ASC)], "programs_view_source_idx"),
+    # OTA mappings: one internal booking per (source, external_id); batch ingestion relies on it
+    IndexSpec("ota_bookings", [("source", ASC), ("external_id", ASC)], "ota_source_external_unique", {"unique": True}),
+    # payment reconciliation scans transactions in created_at order
+    IndexSpec("transactions", [("status", ASC), ("created_at", ASC), ("_id", ASC)], "transactions_status_created_idx"),
+    IndexSpec("transactions", [("razorpay_order_id", ASC)], "transactions_order_idx"),
+    # webhook inbox (lib/webhooks.py): _id is the provider event id; the worker polls due events
+    IndexSpec("webhook_inbox", [("status", ASC), ("next_attempt_at", ASC)], "webhook_inbox_due_idx"),
+    IndexSpec("webhook_inbox", [("claim", ASC)], "webhook_inbox_claim_idx", {"sparse": True}),
+    # ARI feed (lib/ari.py): consumers page through changes by version
+    IndexSpec("ari_state", [("version", ASC)], "ari_state_version_idx", {"sparse": True}),
+    # locks: unique key, expiry via TTL on expire_at
+    IndexSpec("locks", [("key", ASC)], "locks_key_unique", {"unique": True}),
+    IndexSpec("locks", [("expire_at", ASC)], "locks_expire_ttl", {"expireAfterSeconds": 0}),
+    IndexSpec("users", [("email", ASC)], "users_email_idx", {"unique": True}),
+    IndexSpec("guests", [("email", ASC)], "guests_email_idx"),
+]
+
+_SAMPLE_DAY = datetime(2030, 1, 1)
+
+# (description, collection, filter, sort) for the hot endpoints
+HOT_QUERIES = [
+    ("booking conflict check", "bookings", {"allocated_cottages": {"$in": ["r1"]}, "status": {"$in": ["confirmed", "pending"]},
+                                            "check_in": {"$lt": _SAMPLE_DAY}, "check_out": {"$gt": _SAMPLE_DAY}}, None),
+    ("cottage listing overlap", "bookings", {"status": {"$in": ["confirmed", "pending"]}, "check_in": {"$lt": _SAMPLE_DAY},
+                                             "check_out": {"$gt": _SAMPLE_DAY}}, None),
+    ("bookings by guest", "bookings", {"guest_email": "guest@example.com"}, None),
+    ("booking by payment order", "bookings", {"payment.order_id": "order_1"}, None),
+    ("transaction by order", "transactions", {"razorpay_order_id": "order_1"}, None),
+    ("ota mapping", "ota_bookings", {"source": "yatra", "external_id": "Y1"}, None),
+    ("rooms of accommodation", "rooms", {"accommodation_id": "a1"}, None),
+    ("room by slug", "rooms", {"slug": "garden"}, None),
+    ("gallery by category", "gallery", {"category": "rooms", "isVisible": True}, [("createdAt", DESC), ("_id", DESC)]),
+    ("public gallery", "gallery", {"isVisible": True}, [("createdAt", DESC), ("_id", DESC)]),
+    ("public navigation", "navigation", {"is_visible": True}, [("order", ASC)]),
+    ("programs by kind", "programs_view", {"kinds": "wellness"}, [("rank", ASC), ("source_id", ASC)]),
+    ("program by id", "programs_view", {"source_id": "p1"}, [("rank", ASC), ("source_id", ASC)]),
+    ("due webhook events", "webhook_inbox", {"status": "pending", "next_attempt_at": {"$lte": _SAMPLE_DAY}}, None),
+    ("room nights of booking", "room_nights", {"holds.booking_id": "b1"}, None),
+    ("user by email", "users", {"email": "guest@example.com"}, None),
+]
+
+
+def plan(specs: list, existing: dict) -> dict:
+    """Compare `specs` of one collection with its `index_information()`.
+
+    Returns {"create": [specs], "changed": [specs], "renamed": [(spec, name)], "unmanaged": [names]}.
+    """
+    out = {"create": [], "changed": [], "renamed": [], "unmanaged": []}
+    claimed = {"_id_"} | {spec.name for spec in specs if spec.name in existing}
+    for spec in specs:
+        info = existing.get(spec.name)
+        if info is not None:
+            if not spec.matches(info):
+                out["changed"].append(spec)
+            continue
+        other = next((n for n, i in existing.items() if n not in claimed and spec.matches(i)), None)
+        if other is not None:
+            claimed.add(other)
+            out["renamed"].append((spec, other))
+        else:
+            out["create"].append(spec)
+    out["unmanaged"] = sorted(n for n in existing if n not in claimed)
+    return out
+
+
+def by_collection(specs: Optional[list] = None) -> dict:
+    grouped: dict[str, list] = {}
+    for spec in specs or INDEXES:
+        grouped.setdefault(spec.collection, []).append(spec)
+    return grouped
+
+
+def _summarise(report: dict) -> dict:
+    return {
+        "created": [f"{s.collection}.{s.name}" for s in report["create"]] if report["applied"] else [],
+        "missing": [] if report["applied"] else [f"{s.collection}.{s.name}" for s in report["create"]],
+        "changed": [f"{s.collection}.{s.name}" for s in report["changed"]],
+        "renamed": [f"{s.collection}.{s.name} (exists as {n})" for s, n in report["renamed"]],
+        "unmanaged": report["unmanaged"],
+        "failed": report["failed"],
+    }
+
+
+def _log_drift(summary: dict):
+    for kind in ("changed", "renamed", "unmanaged", "missing", "failed"):
+        if summary[kind]:
+            logger.warning("index drift (%s): %s", kind, ", ".join(summary[kind]))
+
+
+def _merge(report: dict, coll_name: str, p: dict):
+    report["create"] += p["create"]
+    report["changed"] += p["changed"]
+    report["renamed"] += p["renamed"]
+    report["unmanaged"] += [f"{coll_name}.{n}" for n in p["unmanaged"]]
+
+
+def _rebuild_changed(p: dict) -> list:
+    """With fix=True changed indexes are dropped and created again; returns the names to drop."""
+    drop = [s.name for s in p["changed"]]
+    p["create"] += p["changed"]
+    p["changed"] = []
+    return drop
+
+
+async def ensure_indexes(db, apply: bool = True, fix: bool = False, specs: Optional[list] = None) -> dict:
+    """Create missing registry indexes on a motor database and report drift."""
+    report = {"create": [], "changed": [], "renamed": [], "unmanaged": [], "failed": [], "applied": apply}
+    for coll_name, coll_specs in by_collection(specs).items():
+        coll = db[coll_name]
+        try:
+            p = plan(coll_specs, await coll.index_information())
+            if apply and fix:
+                for name in _rebuild_changed(p):
+                    await coll.drop_index(name)
+            if apply and p["create"]:
+                await coll.create_indexes([s.model() for s in p["create"]])
+        except pymongo.errors.PyMongoError as exc:
+            report["failed"].append(f"{coll_name}: {exc}")
+            continue
+        _merge(report, coll_name, p)
+    summary = _summarise(report)
+    _log_drift(summary)
+    return summary
+
+
+def ensure_indexes_sync(db, apply: bool = True, fix: bool = False, specs: Optional[list] = None) -> dict:
+    """`ensure_indexes` for a pymongo (blocking) database, used by the CLI and tests."""
+    report = {"create": [], "changed": [], "renamed": [], "unmanaged": [], "failed": [], "applied": apply}
+    for coll_name, coll_specs in by_collection(specs).items():
+        coll = db[coll_name]
+        try:
+            p = plan(coll_specs, coll.index_information())
+            if apply and fix:
+                for name in _rebuild_changed(p):
+                    coll.drop_index(name)
+            if apply and p["create"]:
+                coll.create_indexes([s.model() for s in p["create"]])
+        except pymongo.errors.PyMongoError as exc:
+            report["failed"].append(f"{coll_name}: {exc}")
+            continue
+        _merge(report, coll_name, p)
+    summary = _summarise(report)
+    _log_drift(summary)
+    return summary
+
+
+def plan_stages(plan_doc: dict) -> list:
+    """Stage names of an explain() winning plan, outermost first."""
+    stages = []
+    todo = [plan_doc]
+    while todo:
+        node = todo.pop()
+        if not isinstance(node, dict):
+            continue
+        if "stage" in node:
+            stages.append(node["stage"])
+        # classic plans nest inputStage(s); SBE plans wrap the tree in queryPlan
+        todo.extend(node.get(k) for k in ("queryPlan", "inputStage") if k in node)
+        todo.extend(node.get("inputStages") or [])
+    return stages
@@ -0,0 +1,241 @@
+"""Lease-based distributed locks stored in the `locks` collection.
+
+One document per lock key:
+
+    {key, owner, token, lease_until, expire_at, acquired_at, created_at}
+
+Acquisition is a single `find_one_and_update(..., upsert=True)` that only
+matches a free lease (released or past `lease_until`); when the lease is held
+the upsert collides with the unique `key` index and the caller backs off
+(exponential, full jitter) until its timeout. Every successful acquisition
+increments `token`, a fencing token that only grows for a key, so writers
+can reject work from a holder whose lease already passed to someone else.
+Released/expired documents are kept for FENCE_RETENTION (the TTL index on
+`expire_at` purges them afterwards) so tokens stay monotonic.
+
+Waiters for the same key inside one process first queue on a local
+asyncio.Lock, so only one of them polls Mongo at a time.
+
+The booking routes no longer take these locks: their range claims in
+`room_nights` (lib/reservations.py) are atomic on their own. The ARI push in
+lib/ari.py holds the `ari:push` lease so only one worker talks to the channel
+managers. `acquire_lock`/`release_lock` keep their original call signatures;
+`lease()` is the context-manager form with auto-renewal for long critical
+sections.
+"""
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Optional
+from uuid import uuid4
+import asyncio
+import logging
+import random
+import pymongo
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger("resort_backend.locks")
+
+LOCKS_COLLECTION = "locks"
+FENCE_RETENTION = timedelta(days=1)
+BACKOFF_BASE = 0.01
+BACKOFF_CAP = 0.5
+
+
+class LockLost(Exception):
+    """Raised when a lease can no longer be renewed because another owner took it over."""
+
+
+class Lease:
+    def __init__(self, manager: "LockManager", db, key: str, owner: str, token: int, ttl_seconds: float):
+        self.manager = manager
+        self.db = db
+        self.key = key
+        self.owner = owner
+        self.token = token
+        self.ttl_seconds = ttl_seconds
+        self.released = False
+        self._renew_task: Optional[asyncio.Task] = None
+
+    async def renew(self, ttl_seconds: Optional[float] = None):
+        """Extend the lease; raises LockLost if it was taken over in the meantime."""
+        if ttl_seconds is not None:
+            self.ttl_seconds = ttl_seconds
+        if not await self.manager._renew_remote(self.db, self.key, self.owner, self.token, self.ttl_seconds):
+            raise LockLost(self.key)
+
+    def start_auto_renew(self, interval: Optional[float] = None):
+        """Renew in the background every `interval` seconds (default a third of the TTL)."""
+        if self._renew_task is None:
+            self._renew_task = asyncio.create_task(self._auto_renew(interval or self.ttl_seconds / 3))
+
+    async def _auto_renew(self, interval: float):
+        while not self.released:
+            await asyncio.sleep(interval)
+            if self.released:
+                return
+            try:
+                await self.renew()
+            except LockLost:
+                logger.warning("lock %s lost by %s (token %s)", self.key, self.owner, self.token)
+                return
+            except Exception:
+                logger.exception("lock %s: renewal failed, retrying", self.key)
+
+    async def release(self):
+        await self.manager.release(self)
+
+
+class LockManager:
+    def __init__(self, coalesce: bool = True, backoff_base: float = BACKOFF_BASE, backoff_cap: float = BACKOFF_CAP):
+        self.coalesce = coalesce
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        # key -> [asyncio.Lock, users]; entries are dropped when the last user leaves
+        self._local: dict[str, list] = {}
+        self._leases: dict[tuple[str, str], Lease] = {}
+        self._indexed: set[int] = set()
+
+    # -- Mongo operations (overridable, see tests and scripts/bench_locks.py) --
+
+    async def _ensure_index(self, db):
+        # the unique key index is what makes a held lease reject the upsert
+        if id(db) in self._indexed:
+            return
+        await db[LOCKS_COLLECTION].create_index([("key", pymongo.ASCENDING)], name="locks_key_unique", unique=True)
+        self._indexed.add(id(db))
+
+    async def _try_acquire(self, db, key: str, owner: str, ttl_seconds: float) -> Optional[int]:
+        now = datetime.utcnow()
+        lease_until = now + timedelta(seconds=ttl_seconds)
+        try:
+            doc = await db[LOCKS_COLLECTION].find_one_and_update(
+                {"key": key, "$or": [
+                    {"owner": None},
+                    {"lease_until": {"$lte": now}},
+                    {"lease_until": {"$exists": False}},
+                ]},
+                {
+                    "$set": {"owner": owner, "lease_until": lease_until, "expire_at": lease_until + FENCE_RETENTION, "acquired_at": now},
+                    "$inc": {"token": 1},
+                    "$setOnInsert": {"created_at": now},
+                },
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            return None
+        return doc.get("token") if doc else None
+
+    async def _renew_remote(self, db, key: str, owner: str, token: int, ttl_seconds: float) -> bool:
+        lease_until = datetime.utcnow() + timedelta(seconds=ttl_seconds)
+        res = await db[LOCKS_COLLECTION].update_one(
+            {"key": key, "owner": owner, "token": token},
+            {"$set": {"lease_until": lease_until, "expire_at": lease_until + FENCE_RETENTION}},
+        )
+        return res.matched_count == 1
+
+    async def _release_remote(self, db, key: str, owner: str, token: Optional[int]):
+        q = {"key": key, "owner": owner}
+        if token is not None:
+            q["token"] = token
+        now = datetime.utcnow()
+        # keep the document (and its token) so fencing tokens stay monotonic
+        await db[LOCKS_COLLECTION].update_one(q, {"$set": {"owner": None, "lease_until": now, "expire_at": now + FENCE_RETENTION}})
+
+    # -- public API --
+
+    def backoff_delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    async def acquire(self, db, key: str, owner: Optional[str] = None, ttl_seconds: float = 30, timeout: float = 5.0) -> Optional[Lease]:
+        """Wait up to `timeout` seconds for the lease on `key`; returns None on timeout."""
+        owner = owner or uuid4().hex
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        local = None
+        if self.coalesce:
+            local = self._local.setdefault(key, [asyncio.Lock(), 0])
+            local[1] += 1
+            try:
+                await asyncio.wait_for(local[0].acquire(), timeout)
+            except asyncio.TimeoutError:
+                self._leave_local(key, local, locked=False)
+                return None
+        try:
+            await self._ensure_index(db)
+            attempt = 0
+            while True:
+                token = await self._try_acquire(db, key, owner, ttl_seconds)
+                if token is not None:
+                    lease = Lease(self, db, key, owner, token, ttl_seconds)
+                    self._leases[(key, owner)] = lease
+                    return lease
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(min(remaining, self.backoff_delay(attempt)))
+                attempt += 1
+        except BaseException:
+            if local is not None:
+                self._leave_local(key, local, locked=True)
+            raise
+        if local is not None:
+            self._leave_local(key, local, locked=True)
+        return None
+
+    async def release(self, lease: Lease):
+        if lease.released:
+            return
+        lease.released = True
+        if lease._renew_task is not None:
+            lease._renew_task.cancel()
+        self._leases.pop((lease.key, lease.owner), None)
+        try:
+            await self._release_remote(lease.db, lease.key, lease.owner, lease.token)
+        finally:
+            local = self._local.get(lease.key)
+            if local is not None and self.coalesce:
+                self._leave_local(lease.key, local, locked=True)
+
+    def _leave_local(self, key: str, local: list, locked: bool):
+        if locked:
+            local[0].release()
+        local[1] -= 1
+        if local[1] == 0 and self._local.get(key) is local:
+            del self._local[key]
+
+    def lease_for(self, key: str, owner: str) -> Optional[Lease]:
+        return self._leases.get((key, owner))
+
+    @asynccontextmanager
+    async def lease(self, db, key: str, ttl_seconds: float = 30, timeout: float = 5.0, auto_renew: bool = True):
+        """`async with lock_manager.lease(db, key) as lease:`; raises TimeoutError if not acquired."""
+        lease = await self.acquire(db, key, ttl_seconds=ttl_seconds, timeout=timeout)
+        if lease is None:
+            raise TimeoutError(f"lock {key} not acquired within {timeout}s")
+        if auto_renew:
+            lease.start_auto_renew()
+        try:
+            yield lease
+        finally:
+            await self.release(lease)
+
+
+# Process-wide manager shared by the routes
+lock_manager = LockManager()
+
+
+async def acquire_lock(db, key: str, owner: Optional[str] = None, ttl_seconds: float = 30, timeout: float = 5.0) -> Optional[str]:
+    """Acquire the lease on `key`; returns the owner id to pass to `release_lock`, or None on timeout."""
+    lease = await lock_manager.acquire(db, key, owner=owner, ttl_seconds=ttl_seconds, timeout=timeout)
+    return lease.owner if lease else None
+
+
+async def release_lock(db, key: str, owner: Optional[str] = None):
+    lease = lock_manager.lease_for(key, owner) if owner else None
+    if lease is not None:
+        await lock_manager.release(lease)
+    elif owner:
+        # lease from another process (or already forgotten here): release by owner only
+        await lock_manager._release_remote(db, key, owner, None)
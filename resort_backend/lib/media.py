@@ -0,0 +1,222 @@
+"""Gallery image derivatives (fixed-width WebP + JPEG variants).
+
+When a gallery item is created or its image URL changes, `media_pipeline.submit`
+schedules a background job: the original is read (a local `/uploads/...` file,
+or an http(s) URL on one of the MEDIA_SOURCE_HOSTS; other URLs get no
+variants), resized in a process pool, and the variants are written under
+`uploads/derived/<item id>/<key>/`, where the key is a hash of the source
+bytes. A new image, even one stored under the same URL, therefore gets new
+variant URLs, which lets the `/uploads`
+mount serve them as immutable (lib/media_files.py); variants of the item's
+previous images are removed once the new ones are stored. The gallery
+document then gets:
+
+    variants   {name: {width, height, webp, jpeg}} for thumbnail/medium/large
+    srcset     {"webp": "<url> 320w, ...", "jpeg": "..."} ready for <img srcset>
+    variants_source  the URL the variants were made from
+
+Variants are never upscaled; sizes the original cannot fill are skipped.
+Pillow is optional: without it the pipeline logs once and does nothing, and
+items keep serving their original URL.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Any, Optional
+import asyncio
+import hashlib
+import io
+import logging
+import os
+import shutil
+from urllib.parse import urlsplit
+from resort_backend.lib.catalog_cache import catalog_cache
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # derivatives are skipped; originals are still served
+    Image = ImageOps = None
+
+logger = logging.getLogger("resort_backend.media")
+
+# name -> target width in pixels
+VARIANT_WIDTHS = {"thumbnail": 320, "medium": 800, "large": 1600}
+WEBP_QUALITY = 80
+JPEG_QUALITY = 82
+MEDIA_ROOT = os.path.join(os.path.dirname(os.path.dirname(__file__)), "uploads")
+DERIVED_DIR = "derived"
+URL_PREFIX = "/uploads"
+MAX_SOURCE_BYTES = int(os.getenv("MEDIA_MAX_SOURCE_BYTES", str(25 * 1024 * 1024)))
+WORKERS = int(os.getenv("MEDIA_WORKERS", str(min(4, os.cpu_count() or 1))))
+VIDEO_EXTS = (".mp4", ".webm", ".ogg", ".mov", ".avi", ".mkv")
+# remote hosts variants may be fetched from, e.g. "cdn.example.com,images.example.com";
+# the gallery write endpoints are open, so any other URL is never fetched
+SOURCE_HOSTS = {h.strip().lower() for h in os.getenv("MEDIA_SOURCE_HOSTS", "").split(",") if h.strip()}
+
+
+def fetchable(url: str) -> bool:
+    """True for local uploads and http(s) URLs on an allow-listed host."""
+    if url.startswith(URL_PREFIX + "/"):
+        return True
+    parts = urlsplit(url)
+    return parts.scheme in ("http", "https") and (parts.hostname or "").lower() in SOURCE_HOSTS
+
+
+def source_url(doc: dict) -> Optional[str]:
+    url = doc.get("url") or doc.get("imageUrl") or doc.get("image_url") or doc.get("image")
+    if not isinstance(url, str) or not url:
+        return None
+    if doc.get("type") == "video" or url.lower().split("?")[0].endswith(VIDEO_EXTS):
+        return None
+    return url if fetchable(url) else None
+
+
+def variant_key(data: bytes) -> str:
+    """Directory name for the variants of one source image (its content hash)."""
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def plan_sizes(width: int, height: int) -> list[tuple[str, int, int]]:
+    """(name, width, height) per variant, keeping the aspect ratio and never upscaling."""
+    out = []
+    for name, target in sorted(VARIANT_WIDTHS.items(), key=lambda kv: kv[1]):
+        if target > width and out:
+            break
+        w = min(target, width)
+        out.append((name, w, max(1, round(height * w / width))))
+        if w == width:
+            break
+    return out
+
+
+def build_srcset(variants: dict) -> dict:
+    ordered = sorted(variants.values(), key=lambda v: v["width"])
+    return {fmt: ", ".join(f"{v[fmt]} {v['width']}w" for v in ordered) for fmt in ("webp", "jpeg")}
+
+
+def render_variants(data: bytes, out_dir: str, url_base: str) -> dict:
+    """Resize `data` into every planned variant (runs in a worker process)."""
+    img = Image.open(io.BytesIO(data))
+    img = ImageOps.exif_transpose(img)
+    if img.mode not in ("RGB", "RGBA"):
+        img = img.convert("RGBA" if "transparency" in img.info or img.mode in ("LA", "PA") else "RGB")
+    os.makedirs(out_dir, exist_ok=True)
+    variants = {}
+    for name, w, h in plan_sizes(*img.size):
+        resized = img if (w, h) == img.size else img.resize((w, h), Image.LANCZOS)
+        resized.save(os.path.join(out_dir, f"{name}.webp"), "WEBP", quality=WEBP_QUALITY, method=4)
+        flat = resized
+        if resized.mode == "RGBA":
+            flat = Image.new("RGB", resized.size, (255, 255, 255))
+            flat.paste(resized, mask=resized.split()[3])
+        flat.save(os.path.join(out_dir, f"{name}.jpg"), "JPEG", quality=JPEG_QUALITY, optimize=True, progressive=True)
+        variants[name] = {"width": w, "height": h, "webp": f"{url_base}/{name}.webp", "jpeg": f"{url_base}/{name}.jpg"}
+    return variants
+
+
+async def read_source(url: str) -> bytes:
+    if url.startswith(URL_PREFIX + "/"):
+        path = os.path.normpath(os.path.join(MEDIA_ROOT, url[len(URL_PREFIX) + 1:].split("?")[0]))
+        if not path.startswith(os.path.normpath(MEDIA_ROOT) + os.sep):
+            raise ValueError(f"path outside uploads: {url}")
+        if os.path.getsize(path) > MAX_SOURCE_BYTES:
+            raise ValueError(f"source too large: {url}")
+        return await asyncio.to_thread(lambda: open(path, "rb").read())
+    if fetchable(url):
+        import httpx
+        # redirects are not followed: they could leave the allow-listed hosts
+        async with httpx.AsyncClient(timeout=30, follow_redirects=False) as client:
+            async with client.stream("GET", url) as r:
+                r.raise_for_status()
+                buf = bytearray()
+                async for chunk in r.aiter_bytes():
+                    buf += chunk
+                    if len(buf) > MAX_SOURCE_BYTES:
+                        raise ValueError(f"source too large: {url}")
+                return bytes(buf)
+    raise ValueError(f"unsupported source: {url}")
+
+
+class MediaPipeline:
+    def __init__(self, workers: int = WORKERS, media_root: str = MEDIA_ROOT):
+        self.workers = workers
+        self.media_root = media_root
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._tasks: set[asyncio.Task] = set()
+        self._warned = False
+
+    @property
+    def available(self) -> bool:
+        if Image is None and not self._warned:
+            logger.warning("Pillow not installed; gallery variants are disabled")
+            self._warned = True
+        return Image is not None
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        return self._pool
+
+    def submit(self, db, item_id: Any):
+        """Regenerate an item's variants in the background; the request does not wait."""
+        if not self.available:
+            return
+        task = asyncio.create_task(self._run(db, item_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, db, item_id: Any):
+        try:
+            doc = await db["gallery"].find_one({"_id": item_id})
+            if doc is not None:
+                await self.process(db, doc)
+        except Exception:
+            logger.exception("gallery variants failed for %s", item_id)
+
+    async def process(self, db, doc: dict) -> Optional[dict]:
+        """Render and store the variants of one gallery document; None when it has no image."""
+        url = source_url(doc)
+        if url is None or not self.available:
+            return None
+        data = await read_source(url)
+        item = str(doc["_id"])
+        key = variant_key(data)
+        out_dir = os.path.join(self.media_root, DERIVED_DIR, item, key)
+        url_base = f"{URL_PREFIX}/{DERIVED_DIR}/{item}/{key}"
+        loop = asyncio.get_running_loop()
+        variants = await loop.run_in_executor(self._executor(), render_variants, data, out_dir, url_base)
+        # only store if the image was not replaced while we were rendering
+        current = {k: doc.get(k) for k in ("url", "imageUrl", "image_url", "image") if k in doc}
+        res = await db["gallery"].update_one(
+            {"_id": doc["_id"], **current},
+            {"$set": {"variants": variants, "srcset": build_srcset(variants), "variants_source": url,
+                      "variants_updated_at": datetime.utcnow()}},
+        )
+        if res.matched_count:
+            # imported here: gallery_view builds srcsets with this module's helpers
+            from resort_backend.lib.gallery_view import normalize
+            await normalize(db, doc["_id"])
+            await asyncio.to_thread(self._remove_stale, os.path.dirname(out_dir), key)
+        catalog_cache.invalidate("gallery")
+        return variants
+
+    @staticmethod
+    def _remove_stale(item_dir: str, keep: str):
+        for name in os.listdir(item_dir):
+            path = os.path.join(item_dir, name)
+            if name == keep:
+                continue
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.unlink(path)
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Process-wide pipeline used by the gallery routes
+media_pipeline = MediaPipeline()
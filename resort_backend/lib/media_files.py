@@ -0,0 +1,282 @@
+"""Static serving for `/uploads` with validators, ranges and long-lived caching.
+
+`MediaFiles` is a drop-in `StaticFiles` that answers regular files itself:
+
+- strong ETags from the content: the hash in the name for content-addressed
+  uploads (lib/uploads.py), otherwise a SHA-256 computed once per
+  (path, size, mtime) in a worker thread and kept in a bounded cache
+- `Cache-Control: public, max-age=31536000, immutable` for hashed paths
+  (`cas/...` uploads and `derived/<item>/<key>/...` variants, whose URL changes
+  with the content); other files get MEDIA_MAX_AGE and revalidate by ETag
+- conditional GET/HEAD: If-None-Match, If-Modified-Since, and If-Range
+- byte ranges: 206 for one range, `multipart/byteranges` for several, 416
+  when none is satisfiable; overlapping ranges are coalesced and requests for
+  more than MAX_RANGES pieces get the whole file instead
+- precompressed siblings (`<file>.br`, `<file>.gz`) when the client accepts
+  them and is not asking for a range
+- the body is handed to the server with the ASGI `http.response.zerocopysend`
+  or `http.response.pathsend` extensions when the server offers them, and is
+  otherwise read in chunks off the event loop
+"""
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+import asyncio
+import hashlib
+import mimetypes
+import os
+import re
+import secrets
+import stat
+from starlette.datastructures import Headers
+from starlette.responses import Response
+from starlette.staticfiles import StaticFiles
+from starlette.types import Receive, Scope, Send
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+MAX_AGE = int(os.getenv("MEDIA_MAX_AGE", "3600"))
+MAX_RANGES = 16
+CHUNK_SIZE = 256 * 1024
+ETAG_CACHE_SIZE = 4096
+# above this, files are tagged by size and mtime instead of being hashed
+HASH_MAX_BYTES = int(os.getenv("MEDIA_ETAG_HASH_MAX_BYTES", str(256 * 1024 * 1024)))
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+# content-addressed paths: the URL changes whenever the bytes do
+_HASHED = re.compile(r"^(?:cas/[0-9a-f]{2}/(?P<sha>[0-9a-f]{64})\.[a-z0-9]+|derived/[^/]+/[0-9a-f]{16}/[^/]+)$")
+
+
+def parse_ranges(header: Optional[str], size: int) -> Optional[list[tuple[int, int]]]:
+    """Inclusive (start, end) byte ranges of a Range header, sorted and coalesced.
+
+    None means "ignore the header and send the whole file" (absent, malformed,
+    not bytes, or too many pieces); an empty list means none is satisfiable.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(","):
+        first, sep, last = part.strip().partition("-")
+        # each bound is empty or all digits, and not both empty
+        if not sep or not (first or last) or not all(b.isdigit() for b in (first, last) if b):
+            return None
+        if not first:
+            # suffix range: the last N bytes
+            if int(last) == 0:
+                continue
+            ranges.append((max(size - int(last), 0), size - 1))
+            continue
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    merged: list[tuple[int, int]] = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged if len(merged) <= MAX_RANGES else None
+
+
+def accepted_encodings(header: Optional[str]) -> set[str]:
+    out = set()
+    for item in (header or "").split(","):
+        name, _, params = item.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            out.add(name.strip().lower())
+    return out
+
+
+def _hash_file(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ETagCache:
+    def __init__(self, size: int = ETAG_CACHE_SIZE):
+        self.size = size
+        self._tags: OrderedDict[tuple, str] = OrderedDict()
+
+    async def get(self, path: str, st: os.stat_result, rel: str) -> str:
+        m = _HASHED.match(rel)
+        if m and m.group("sha"):
+            return f'"{m.group("sha")}"'
+        key = (path, st.st_size, st.st_mtime_ns)
+        tag = self._tags.get(key)
+        if tag is None:
+            if st.st_size > HASH_MAX_BYTES:
+                tag = f'"{st.st_size:x}-{st.st_mtime_ns:x}"'
+            else:
+                tag = f'"{(await asyncio.to_thread(_hash_file, path))[:32]}"'
+            self._tags[key] = tag
+            while len(self._tags) > self.size:
+                self._tags.popitem(last=False)
+        else:
+            self._tags.move_to_end(key)
+        return tag
+
+
+etag_cache = ETagCache()
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # If-None-Match uses the weak comparison
+    return etag in (t.strip().removeprefix("W/") for t in header.split(","))
+
+
+def _not_modified(req: Headers, etag: str, mtime: float) -> bool:
+    if "if-none-match" in req:
+        return _etag_matches(req["if-none-match"], etag)
+    since = req.get("if-modified-since")
+    if since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _if_range_ok(req: Headers, etag: str, last_modified: str) -> bool:
+    cond = req.get("if-range")
+    if not cond:
+        return True
+    cond = cond.strip()
+    if cond.startswith(('"', "W/")):
+        # strong comparison only
+        return cond == etag
+    return cond == last_modified
+
+
+class MediaFileResponse(Response):
+    """Sends `segments` of (prefix bytes, file offset, byte count) from `path`."""
+
+    def __init__(self, path: str, status_code: int, headers: dict, segments: list, trailer: bytes = b"",
+                 head: bool = False):
+        super().__init__(status_code=status_code, headers=headers)
+        self.path = path
+        self.segments = segments
+        self.trailer = trailer
+        self.head = head
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        extensions = scope.get("extensions") or {}
+        if self.head or not self.segments:
+            await send({"type": "http.response.body", "body": b""})
+        elif ("http.response.pathsend" in extensions and len(self.segments) == 1 and not self.segments[0][0]
+              and self.segments[0][1] == 0 and not self.trailer and self.status_code == 200):
+            await send({"type": "http.response.pathsend", "path": self.path})
+        elif "http.response.zerocopysend" in extensions:
+            with open(self.path, "rb") as f:
+                for prefix, offset, count in self.segments:
+                    if prefix:
+                        await send({"type": "http.response.body", "body": prefix, "more_body": True})
+                    await send({"type": "http.response.zerocopysend", "file": f, "offset": offset, "count": count,
+                                "more_body": True})
+            await send({"type": "http.response.body", "body": self.trailer})
+        else:
+            f = await asyncio.to_thread(open, self.path, "rb")
+            try:
+                for prefix, offset, count in self.segments:
+                    if prefix:
+                        await send({"type": "http.response.body", "body": prefix, "more_body": True})
+                    while count > 0:
+                        chunk = await asyncio.to_thread(os.pread, f.fileno(), min(CHUNK_SIZE, count), offset)
+                        if not chunk:
+                            break
+                        offset += len(chunk)
+                        count -= len(chunk)
+                        await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            finally:
+                f.close()
+            await send({"type": "http.response.body", "body": self.trailer})
+        if self.background is not None:
+            await self.background()
+
+
+class MediaFiles(StaticFiles):
+    async def get_response(self, path: str, scope: Scope) -> Response:
+        if scope["method"] in ("GET", "HEAD"):
+            try:
+                full_path, st = await asyncio.to_thread(self.lookup_path, path)
+            except OSError:
+                full_path, st = None, None
+            if st is not None and stat.S_ISREG(st.st_mode):
+                return await self.media_response(str(full_path), st, path.replace(os.sep, "/"), scope)
+        # directories, missing files and other methods keep the StaticFiles behaviour
+        return await super().get_response(path, scope)
+
+    async def media_response(self, full_path: str, st: os.stat_result, rel: str, scope: Scope) -> Response:
+        req = Headers(scope=scope)
+        media_type = mimetypes.guess_type(full_path)[0] or "application/octet-stream"
+        headers = {"cache-control": IMMUTABLE if _HASHED.match(rel) else f"public, max-age={MAX_AGE}"}
+        ranges_header = req.get("range")
+
+        # a precompressed sibling replaces the file for clients that accept it (never for ranges)
+        encoding = None
+        for name, suffix in ENCODINGS:
+            sibling = full_path + suffix
+            try:
+                sib_st = await asyncio.to_thread(os.stat, sibling)
+            except OSError:
+                continue
+            headers["vary"] = "Accept-Encoding"
+            if encoding is None and not ranges_header and name in accepted_encodings(req.get("accept-encoding")):
+                encoding, full_path, st, rel = name, sibling, sib_st, rel + suffix
+        if encoding:
+            headers["content-encoding"] = encoding
+
+        etag = await etag_cache.get(full_path, st, rel)
+        last_modified = formatdate(st.st_mtime, usegmt=True)
+        headers.update({"etag": etag, "last-modified": last_modified})
+        if encoding is None:
+            headers["accept-ranges"] = "bytes"
+        if _not_modified(req, etag, st.st_mtime):
+            return Response(status_code=304, headers=headers)
+
+        head = scope["method"] == "HEAD"
+        size = st.st_size
+        ranges = None
+        if ranges_header and encoding is None and _if_range_ok(req, etag, last_modified):
+            ranges = parse_ranges(ranges_header, size)
+        if ranges == []:
+            headers["content-range"] = f"bytes */{size}"
+            return Response(status_code=416, headers=headers)
+        if not ranges:
+            headers.update({"content-type": media_type, "content-length": str(size)})
+            return MediaFileResponse(full_path, 200, headers, [(b"", 0, size)], head=head)
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            headers.update({"content-type": media_type, "content-length": str(end - start + 1),
+                            "content-range": f"bytes {start}-{end}/{size}"})
+            return MediaFileResponse(full_path, 206, headers, [(b"", start, end - start + 1)], head=head)
+        boundary = secrets.token_hex(12)
+        segments = []
+        length = 0
+        for i, (start, end) in enumerate(ranges):
+            # every part after the first starts by closing the previous one's data
+            prefix = (("\r\n" if i else "") + f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+                      f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode()
+            segments.append((prefix, start, end - start + 1))
+            length += len(prefix) + end - start + 1
+        trailer = f"\r\n--{boundary}--\r\n".encode()
+        headers.update({"content-type": f"multipart/byteranges; boundary={boundary}",
+                        "content-length": str(length + len(trailer))})
+        return MediaFileResponse(full_path, 206, headers, segments, trailer, head=head)
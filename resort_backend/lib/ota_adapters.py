@@ -0,0 +1,142 @@
+"""OTA provider adapters: signature settings and payload mapping per channel.
+
+Each provider is registered once with the names it may appear under in the
+`source` field. `resolve(source)` is a dict lookup (with the result cached
+per distinct source string), so a batch of thousands of events does not
+re-run string matching per item. Every mapper returns the generic shape
+used by routes/ota.py:
+
+    {source, external_id, guest_name, guest_email, guest_phone,
+     accommodation_id, check_in, check_out, total_price, status}
+
+Provider-specific field names are tried first and fall back to the generic
+names, so a channel manager that already sends the generic shape works with
+any adapter. Secrets come from `<PROVIDER>_WEBHOOK_SECRET`.
+"""
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+import os
+import re
+
+GENERIC = "generic"
+CANCELLED_WORDS = {"cancelled", "canceled", "cancel", "cancellation"}
+
+
+def _first(payload: dict, *keys: str, default: Any = None) -> Any:
+    """First present value among dotted `keys`."""
+    for key in keys:
+        cur: Any = payload
+        for part in key.split("."):
+            cur = cur.get(part) if isinstance(cur, dict) else None
+        if cur not in (None, ""):
+            return cur
+    return default
+
+
+def _status(value: Any) -> str:
+    s = str(value or "confirmed").strip().lower()
+    if s in CANCELLED_WORDS:
+        return "cancelled"
+    if s in ("modified", "amended", "modification", "updated"):
+        return "modified"
+    return "confirmed"
+
+
+def map_generic(payload: dict, source: Optional[str] = None) -> dict:
+    return {
+        "source": source or payload.get("source"),
+        "external_id": payload.get("external_id"),
+        "guest_name": payload.get("guest_name"),
+        "guest_email": payload.get("guest_email"),
+        "guest_phone": payload.get("guest_phone"),
+        "accommodation_id": payload.get("accommodation_id"),
+        "check_in": payload.get("check_in"),
+        "check_out": payload.get("check_out"),
+        "total_price": payload.get("total_price", 0),
+        "status": _status(payload.get("status")),
+    }
+
+
+def map_yatra(payload: dict, source: Optional[str] = None) -> dict:
+    return {
+        "source": source or payload.get("source"),
+        "external_id": _first(payload, "external_id", "booking_id", "bookingId"),
+        "guest_name": _first(payload, "guest_name", "guest.name", "customer.name"),
+        "guest_email": _first(payload, "guest_email", "guest.email", "customer.email"),
+        "guest_phone": _first(payload, "guest_phone", "guest.phone", "customer.mobile"),
+        "accommodation_id": _first(payload, "accommodation_id", "room_code", "room.code"),
+        "check_in": _first(payload, "check_in", "checkin", "stay.checkin"),
+        "check_out": _first(payload, "check_out", "checkout", "stay.checkout"),
+        "total_price": _first(payload, "total_price", "amount", "price.total", default=0),
+        "status": _status(_first(payload, "status", "booking_status")),
+    }
+
+
+def map_mmt(payload: dict, source: Optional[str] = None) -> dict:
+    return {
+        "source": source or payload.get("source"),
+        "external_id": _first(payload, "external_id", "bookingId", "booking_id"),
+        "guest_name": _first(payload, "guest_name", "guestDetails.name", "primaryGuest.name"),
+        "guest_email": _first(payload, "guest_email", "guestDetails.email", "primaryGuest.email"),
+        "guest_phone": _first(payload, "guest_phone", "guestDetails.phone", "primaryGuest.phone"),
+        "accommodation_id": _first(payload, "accommodation_id", "roomTypeCode", "room.roomTypeCode"),
+        "check_in": _first(payload, "check_in", "checkInDate", "checkin"),
+        "check_out": _first(payload, "check_out", "checkOutDate", "checkout"),
+        "total_price": _first(payload, "total_price", "totalAmount", "amount", default=0),
+        "status": _status(_first(payload, "status", "bookingStatus")),
+    }
+
+
+@dataclass
+class Adapter:
+    name: str
+    mapper: Callable[..., dict]
+    signature_header: str = "X-Signature"
+    aliases: tuple = ()
+
+    @property
+    def secret(self) -> Optional[str]:
+        return os.getenv(f"{self.name.upper()}_WEBHOOK_SECRET")
+
+    def map(self, payload: dict, source: Optional[str] = None) -> dict:
+        return self.mapper(payload, source)
+
+
+_adapters: dict[str, Adapter] = {}
+_by_alias: dict[str, Adapter] = {}
+_resolved: dict[str, Adapter] = {}
+# `source` comes from request bodies; keep the memo from growing without bound
+RESOLVE_CACHE_SIZE = 1024
+
+
+def register(name: str, mapper: Callable[..., dict], signature_header: str = "X-Signature", aliases: tuple = ()) -> Adapter:
+    adapter = Adapter(name, mapper, signature_header, tuple(aliases))
+    _adapters[name] = adapter
+    for alias in (name, *aliases):
+        _by_alias[alias.lower()] = adapter
+    _resolved.clear()
+    return adapter
+
+
+def resolve(source: Optional[str]) -> Adapter:
+    """Adapter for a `source` value: exact alias, else any alias among its word tokens, else generic."""
+    key = (source or "").strip().lower()
+    adapter = _resolved.get(key)
+    if adapter is None:
+        adapter = _by_alias.get(key)
+        if adapter is None:
+            tokens = [t for t in re.split(r"[^a-z0-9]+", key) if t]
+            adapter = next((_by_alias[t] for t in tokens if t in _by_alias), _adapters[GENERIC])
+        if len(_resolved) < RESOLVE_CACHE_SIZE:
+            _resolved[key] = adapter
+    return adapter
+
+
+def get_provider_config(source: Optional[str]) -> dict:
+    adapter = resolve(source)
+    return {"name": adapter.name, "secret": adapter.secret, "signature_header": adapter.signature_header}
+
+
+register(GENERIC, map_generic)
+register("yatra", map_yatra, signature_header="X-Yatra-Signature")
+register("mmt", map_mmt, signature_header="X-MMT-Signature", aliases=("makemytrip",))
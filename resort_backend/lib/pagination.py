@@ -0,0 +1,107 @@
+"""Keyset pagination and NDJSON export for list endpoints.
+
+List endpoints accept `?after=<_id>&limit=N` and return one page sorted by
+`_id`, still as a JSON array so existing clients keep working. The cursor for
+the following page is sent in `X-Next-Cursor` and a `Link: <...>; rel="next"`
+header and is absent on the last page. `?format=ndjson` streams the whole
+result one document per line straight off the Motor cursor, so memory stays
+flat regardless of collection size (admin exports).
+
+Requests without any of these parameters get the endpoint's unpaginated
+response as before.
+"""
+from typing import Any, Callable, Dict, Optional
+from bson import ObjectId
+from fastapi import HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+from resort_backend.utils import dumps_bson, encode_docs, with_id
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+STREAM_BATCH_SIZE = 500
+
+
+def parse_after(after: Optional[str]) -> Optional[ObjectId]:
+    if not after:
+        return None
+    try:
+        return ObjectId(after)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def clamp_limit(limit: Optional[int]) -> int:
+    if limit is None:
+        return DEFAULT_LIMIT
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    return min(limit, MAX_LIMIT)
+
+
+def keyset_query(query: Optional[dict], after: Optional[ObjectId]) -> dict:
+    query = query or {}
+    if after is None:
+        return query
+    # $and keeps any _id condition the caller already has
+    return {"$and": [query, {"_id": {"$gt": after}}]} if query else {"_id": {"$gt": after}}
+
+
+async def fetch_page(coll, query: Optional[dict], after: Optional[str], limit: Optional[int], projection: Optional[dict] = None):
+    """Return `(docs, next_cursor)` for the page after `after`; next_cursor is None on the last page."""
+    n = clamp_limit(limit)
+    cursor = coll.find(keyset_query(query, parse_after(after)), projection).sort("_id", 1).limit(n + 1)
+    docs = await cursor.to_list(length=n + 1)
+    if len(docs) > n:
+        docs = docs[:n]
+        return docs, str(docs[-1]["_id"])
+    return docs, None
+
+
+def page_response(request: Request, docs: list, next_cursor: Optional[str], limit: Optional[int]) -> Response:
+    headers = {}
+    if next_cursor:
+        url = request.url.include_query_params(after=next_cursor, limit=clamp_limit(limit))
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{url}>; rel="next"'
+    return Response(content=encode_docs(docs), media_type="application/json", headers=headers)
+
+
+def ndjson_response(cursor, transform: Optional[Callable[[Dict[str, Any]], Any]] = None, filename: Optional[str] = None) -> StreamingResponse:
+    """Stream a Motor cursor as newline-delimited JSON, one document per line."""
+    async def lines():
+        async for doc in cursor:
+            if transform is not None:
+                doc = transform(doc)
+            yield dumps_bson(with_id(doc)) + b"\n"
+
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'} if filename else None
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers=headers)
+
+
+async def paged_response(
+    request: Request,
+    coll,
+    query: Optional[dict] = None,
+    *,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    format: Optional[str] = None,
+    transform: Optional[Callable[[Dict[str, Any]], Any]] = None,
+    filename: Optional[str] = None,
+) -> Optional[Response]:
+    """Serve a keyset page or an NDJSON export when the request asks for one.
+
+    Returns None when no paging/format parameter was given so the endpoint can
+    fall back to its unpaginated response.
+    """
+    if format not in (None, "json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    if format == "ndjson":
+        cursor = coll.find(keyset_query(query, parse_after(after))).sort("_id", 1).batch_size(STREAM_BATCH_SIZE)
+        return ndjson_response(cursor, transform, filename)
+    if after is None and limit is None:
+        return None
+    docs, next_cursor = await fetch_page(coll, query, after, limit)
+    if transform is not None:
+        docs = [transform(d) for d in docs]
+    return page_response(request, docs, next_cursor, limit)
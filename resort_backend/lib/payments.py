@@ -0,0 +1,187 @@
+"""Payment gateway adapter for routes/razorpay.py.
+
+The Razorpay SDK is synchronous (requests under the hood). Calling it from
+an `async def` stalls the whole worker for the HTTP round-trip, so every
+network call goes through a small, bounded thread pool shared by the
+process and is wrapped in a per-call timeout. One SDK client (and its
+pooled HTTP session) is built per process instead of per request.
+
+`get_gateway()` returns the process-wide gateway, selected by
+PAYMENT_GATEWAY=razorpay|stub (default razorpay). The stub never leaves the
+process: it fakes orders and signs/verifies with a local secret, and can
+simulate a slow blocking SDK (PAYMENT_STUB_LATENCY_MS) for load tests.
+"""
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import time
+
+logger = logging.getLogger("resort_backend")
+
+MAX_WORKERS = int(os.getenv("PAYMENT_GATEWAY_WORKERS", "8"))
+CALL_TIMEOUT = float(os.getenv("PAYMENT_GATEWAY_TIMEOUT", "15"))
+STUB_SECRET = "stub_secret"
+
+
+class GatewayError(Exception):
+    pass
+
+
+class GatewayTimeout(GatewayError):
+    pass
+
+
+class SignatureError(GatewayError):
+    pass
+
+
+class PaymentGateway(ABC):
+    """Runs blocking gateway calls on a bounded executor with a timeout."""
+    name = "base"
+
+    def __init__(self, key_id: str, max_workers: int = MAX_WORKERS, timeout: float = CALL_TIMEOUT):
+        self.key_id = key_id
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"pay-{self.name}")
+
+    async def _call(self, fn, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self._executor, partial(fn, *args, **kwargs))
+        try:
+            return await asyncio.wait_for(fut, self.timeout)
+        except asyncio.TimeoutError:
+            raise GatewayTimeout(f"{self.name} call timed out after {self.timeout:g}s")
+
+    @abstractmethod
+    async def create_order(self, payload: dict) -> dict:
+        ...
+
+    @abstractmethod
+    def verify_payment_signature(self, data: dict):
+        """Raise SignatureError unless the checkout signature matches. Local HMAC, no I/O."""
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class RazorpayGateway(PaymentGateway):
+    name = "razorpay"
+
+    def __init__(self, key_id: str, key_secret: str, **kw):
+        super().__init__(key_id, **kw)
+        import razorpay
+        import requests
+        from requests.adapters import HTTPAdapter
+        session = requests.Session()
+        # one pooled connection per executor thread
+        session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers))
+        self.client = razorpay.Client(session=session, auth=(key_id, key_secret))
+
+    async def create_order(self, payload: dict) -> dict:
+        # the HTTP timeout frees the thread; wait_for bounds the caller
+        return await self._call(self.client.order.create, data=payload, timeout=self.timeout)
+
+    def verify_payment_signature(self, data: dict):
+        try:
+            self.client.utility.verify_payment_signature(data)
+        except Exception as e:
+            raise SignatureError(str(e)) from e
+
+    def close(self):
+        super().close()
+        self.client.session.close()
+
+
+class StubGateway(PaymentGateway):
+    """Offline gateway for local development and load tests."""
+    name = "stub"
+
+    def __init__(self, key_id: str = "rzp_test_stub", secret: str = STUB_SECRET, latency: float = 0.0, **kw):
+        super().__init__(key_id, **kw)
+        self.secret = secret
+        self.latency = latency
+        self.orders_created = 0
+
+    def _create_order_blocking(self, payload: dict) -> dict:
+        # stands in for the SDK's blocking HTTP round-trip
+        if self.latency:
+            time.sleep(self.latency)
+        self.orders_created += 1
+        return {
+            "id": "order_" + os.urandom(7).hex(),
+            "entity": "order",
+            "amount": payload.get("amount"),
+            "currency": payload.get("currency"),
+            "receipt": payload.get("receipt"),
+            "status": "created",
+            "created_at": int(time.time()),
+        }
+
+    async def create_order(self, payload: dict) -> dict:
+        return await self._call(self._create_order_blocking, payload)
+
+    def sign(self, order_id: str, payment_id: str) -> str:
+        msg = f"{order_id}|{payment_id}".encode("utf-8")
+        return hmac.new(self.secret.encode("utf-8"), msg, hashlib.sha256).hexdigest()
+
+    def verify_payment_signature(self, data: dict):
+        expected = self.sign(data.get("razorpay_order_id", ""), data.get("razorpay_payment_id", ""))
+        if not hmac.compare_digest(expected, data.get("razorpay_signature") or ""):
+            raise SignatureError("Razorpay Signature Verification Failed")
+
+
+def _razorpay_keys() -> tuple[str, str]:
+    key_id = os.getenv("RAZORPAY_KEY_ID") or os.getenv("RAZORPAY_KEY")
+    key_secret = os.getenv("RAZORPAY_KEY_SECRET")
+    # also support older env names from application.properties style
+    if not key_id:
+        key_id = os.getenv("razorpay.key_id")
+    if not key_secret:
+        key_secret = os.getenv("razorpay.key_secret")
+    # If keys are missing, allow an explicit, opt-in test fallback for local development.
+    if not key_id or not key_secret:
+        allow_fallback = (os.getenv("ALLOW_RAZORPAY_TEST_FALLBACK") == "1") or (os.getenv("DEBUG") in ("1", "true", "True"))
+        if allow_fallback:
+            logger.warning("Razorpay keys not configured — using test fallback because ALLOW_RAZORPAY_TEST_FALLBACK is enabled. Do NOT use this in production.")
+            key_id = key_id or "rzp_test_RpZR4dDpG2dPnv"
+            key_secret = key_secret or "CcN59mt21z556BN4ryhiI7Ks"
+        else:
+            logger.error("Razorpay keys not configured. Set RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET in environment.")
+            raise RuntimeError("Razorpay keys not configured. Set RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET.")
+    return key_id, key_secret
+
+
+_gateway: Optional[PaymentGateway] = None
+
+
+def get_gateway() -> PaymentGateway:
+    """Process-wide gateway, built on first use."""
+    global _gateway
+    if _gateway is None:
+        if os.getenv("PAYMENT_GATEWAY", "razorpay").lower() == "stub":
+            _gateway = StubGateway(latency=float(os.getenv("PAYMENT_STUB_LATENCY_MS", "0")) / 1000)
+        else:
+            key_id, key_secret = _razorpay_keys()
+            _gateway = RazorpayGateway(key_id, key_secret)
+        # Log which key id is being used (do not log secrets)
+        logger.info(f"Payment gateway {_gateway.name} using key_id={_gateway.key_id}")
+    return _gateway
+
+
+def set_gateway(gateway: Optional[PaymentGateway]):
+    """Swap the process-wide gateway (tests, load tests); closes the previous one."""
+    global _gateway
+    if _gateway is not None and _gateway is not gateway:
+        _gateway.close()
+    _gateway = gateway
+
+
+def close_gateway():
+    set_gateway(None)
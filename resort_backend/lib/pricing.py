@@ -0,0 +1,273 @@
+"""In-memory rate table and stay quotes.
+
+Everything a price depends on is loaded once into a `RateTable`:
+
+- rooms: base nightly price (`price_per_night`/`pricePerNight`/`price`) and the
+  extra bed price of their accommodation (`extra_bedding_price`)
+- programs from `wellnessPrograms` then `programs`, keyed by `_id` and `id`
+- rules from the `pricing_rules` collection, by `kind`:
+
+    season          {start, end, price_per_night | multiplier, accommodation_id?}
+                    date range [start, end); a later-starting season overrides
+                    an earlier one, and a scoped season overrides a global one
+    length_of_stay  {min_nights, discount_pct, accommodation_id?}
+                    the largest `min_nights` not above the stay applies
+    occupancy       {base_guests, extra_guest_price, accommodation_id?}
+                    per guest per night above the rooms' combined base guests
+    tax             {min_rate, rate}
+                    room nights are taxed by the first slab whose `min_rate`
+                    the nightly rate reaches (highest first); programs, extra
+                    beds and rooms with no matching slab use DEFAULT_TAX_RATE
+
+`accommodation_id` scopes a rule to an accommodation or a single room id.
+Seasons are flattened at load time into non-overlapping segments per scope, so
+pricing a night is a bisect. `quote()` prices a whole stay without touching
+the database. The table reloads after PRICING_REFRESH_SECONDS and admin writes
+to rooms, accommodations, programs or rules call `rate_table.invalidate()`.
+"""
+from bisect import bisect_right
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Any, Iterable, Optional
+import asyncio
+import logging
+import os
+import time
+from resort_backend.lib.availability import _to_date, unit_key
+
+logger = logging.getLogger("resort_backend.pricing")
+
+RULES_COLLECTION = "pricing_rules"
+PROGRAM_COLLECTIONS = ("wellnessPrograms", "programs")
+DEFAULT_TAX_RATE = float(os.getenv("PRICING_DEFAULT_TAX_RATE", "0.18"))
+REFRESH_SECONDS = float(os.getenv("PRICING_REFRESH_SECONDS", "300"))
+
+
+def _num(v: Any, default: float = 0.0) -> float:
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        return default
+
+
+@dataclass
+class Season:
+    start: int
+    end: int
+    price: Optional[float] = None
+    multiplier: float = 1.0
+
+    def apply(self, base: float) -> float:
+        return self.price if self.price is not None else base * self.multiplier
+
+
+def flatten_seasons(seasons: list[Season]) -> tuple[list[int], list[Optional[Season]]]:
+    """Non-overlapping segments: `starts[i]` begins segment `segs[i]` (None where no season applies)."""
+    bounds = sorted({s.start for s in seasons} | {s.end for s in seasons})
+    # later start wins; on a tie the shorter (more specific) range wins
+    ranked = sorted(seasons, key=lambda s: (s.start, -(s.end - s.start)))
+    starts, segs = [], []
+    for lo in bounds:
+        winner = None
+        for s in ranked:
+            if s.start <= lo < s.end:
+                winner = s
+        if segs and segs[-1] is winner:
+            continue
+        starts.append(lo)
+        segs.append(winner)
+    return starts, segs
+
+
+class RateTable:
+    def __init__(self):
+        self.rooms: dict[str, dict] = {}
+        self.programs: dict[str, dict] = {}
+        # scope (None = all rooms) -> flattened seasons
+        self.seasons: dict[Optional[str], tuple[list[int], list[Optional[Season]]]] = {}
+        # scope -> [(min_nights, discount_pct)] sorted by min_nights descending
+        self.stay_discounts: dict[Optional[str], list[tuple[int, float]]] = {}
+        # scope -> (base_guests, extra_guest_price)
+        self.occupancy: dict[Optional[str], tuple[int, float]] = {}
+        # [(min_rate, rate)] sorted by min_rate descending
+        self.tax_slabs: list[tuple[float, float]] = []
+        self.loaded_at: Optional[float] = None
+        self._load_lock = asyncio.Lock()
+
+    # -- loading ----------------------------------------------------------
+
+    def invalidate(self):
+        """Force a reload on the next `ensure_loaded`."""
+        self.loaded_at = None
+
+    def is_stale(self) -> bool:
+        return self.loaded_at is None or (time.monotonic() - self.loaded_at) > REFRESH_SECONDS
+
+    async def ensure_loaded(self, db, room_ids: Iterable[Any] = ()):
+        """Reload when stale, or when a room being priced was added after the last load."""
+        if not self.is_stale() and all(unit_key(r) in self.rooms for r in room_ids):
+            return self
+        async with self._load_lock:
+            if self.is_stale() or not all(unit_key(r) in self.rooms for r in room_ids):
+                await self.load(db)
+        return self
+
+    async def load(self, db):
+        extra_bed = {}
+        async for acc in db["accommodations"].find({}, {"extra_bedding_price": 1}):
+            extra_bed[unit_key(acc["_id"])] = _num(acc.get("extra_bedding_price"))
+        rooms = {}
+        async for r in db["rooms"].find({}, {"price_per_night": 1, "pricePerNight": 1, "price": 1, "accommodation_id": 1}):
+            acc_id = unit_key(r["accommodation_id"]) if r.get("accommodation_id") is not None else None
+            rooms[unit_key(r["_id"])] = {
+                "base": _num(r.get("price_per_night") or r.get("pricePerNight") or r.get("price") or 0),
+                "accommodation_id": acc_id,
+                "extra_bed_price": extra_bed.get(acc_id, 0.0),
+            }
+        programs = {}
+        for coll in reversed(PROGRAM_COLLECTIONS):
+            # earlier collections take precedence, so load them last
+            async for p in db[coll].find({}, {"price": 1, "price_inr": 1, "cost": 1, "title": 1, "name": 1, "id": 1}):
+                item = {
+                    "program_id": str(p.get("id") or p["_id"]),
+                    "title": p.get("title") or p.get("name"),
+                    "price": int(_num(p.get("price") or p.get("price_inr") or p.get("cost") or 0)),
+                }
+                programs[unit_key(p["_id"])] = item
+                if p.get("id"):
+                    programs[str(p["id"])] = item
+        rules = await db[RULES_COLLECTION].find({"active": {"$ne": False}}).to_list(length=None)
+        self.compile(rooms, programs, rules)
+        self.loaded_at = time.monotonic()
+        logger.info("rate table loaded: %d rooms, %d programs, %d rules", len(rooms), len(programs), len(rules))
+
+    def compile(self, rooms: dict, programs: dict, rules: list[dict]):
+        seasons: dict[Optional[str], list[Season]] = {}
+        discounts: dict[Optional[str], list[tuple[int, float]]] = {}
+        occupancy: dict[Optional[str], tuple[int, float]] = {}
+        slabs = []
+        for rule in rules:
+            kind = rule.get("kind")
+            scope = unit_key(rule["accommodation_id"]) if rule.get("accommodation_id") is not None else None
+            if kind == "season":
+                start, end = _to_date(rule.get("start")), _to_date(rule.get("end"))
+                if start is None or end is None or end <= start:
+                    logger.warning("pricing rule %s: invalid season range", rule.get("_id"))
+                    continue
+                price = rule.get("price_per_night")
+                seasons.setdefault(scope, []).append(Season(
+                    start.toordinal(), end.toordinal(),
+                    _num(price) if price is not None else None,
+                    _num(rule.get("multiplier"), 1.0),
+                ))
+            elif kind == "length_of_stay":
+                discounts.setdefault(scope, []).append((int(_num(rule.get("min_nights"))), _num(rule.get("discount_pct"))))
+            elif kind == "occupancy":
+                occupancy[scope] = (int(_num(rule.get("base_guests"), 2)), _num(rule.get("extra_guest_price")))
+            elif kind == "tax":
+                slabs.append((_num(rule.get("min_rate")), _num(rule.get("rate"), DEFAULT_TAX_RATE)))
+        self.rooms = rooms
+        self.programs = programs
+        self.seasons = {scope: flatten_seasons(s) for scope, s in seasons.items()}
+        self.stay_discounts = {scope: sorted(d, reverse=True) for scope, d in discounts.items()}
+        self.occupancy = occupancy
+        self.tax_slabs = sorted(slabs, reverse=True)
+
+    # -- pricing ----------------------------------------------------------
+
+    def _scoped(self, table: dict, room_id: str, room: dict):
+        for scope in (room_id, room.get("accommodation_id"), None):
+            if scope in table:
+                return table[scope]
+        return None
+
+    def _season(self, scope: Optional[str], night: int) -> Optional[Season]:
+        flat = self.seasons.get(scope)
+        if not flat:
+            return None
+        i = bisect_right(flat[0], night) - 1
+        return flat[1][i] if i >= 0 else None
+
+    def nightly_rate(self, room_id: str, night: date) -> float:
+        room = self.rooms[room_id]
+        n = night.toordinal()
+        for scope in (room_id, room.get("accommodation_id"), None):
+            season = self._season(scope, n)
+            if season is not None:
+                return season.apply(room["base"])
+        return room["base"]
+
+    def tax_rate(self, nightly: float) -> float:
+        for min_rate, rate in self.tax_slabs:
+            if nightly >= min_rate:
+                return rate
+        return DEFAULT_TAX_RATE
+
+    def quote(self, room_ids: Iterable[Any], check_in: Any, check_out: Any, guests: int = 1,
+              programs: Iterable[Any] = (), extra_beds: int = 0) -> dict:
+        """Price breakdown for a stay; unknown programs are skipped, unknown rooms raise KeyError."""
+        start, end = _to_date(check_in), _to_date(check_out)
+        nights = max((end - start).days, 1)
+        dates = [start + timedelta(days=i) for i in range(nights)]
+        room_ids = [unit_key(r) for r in room_ids]
+
+        rooms_subtotal = 0.0
+        tax = 0.0
+        per_room = []
+        base_guests = 0
+        extra_guest_price = 0.0
+        for rid in room_ids:
+            room = self.rooms[rid]
+            rates = [self.nightly_rate(rid, d) for d in dates]
+            discount_pct = next((pct for min_n, pct in self._scoped(self.stay_discounts, rid, room) or [] if nights >= min_n), 0.0)
+            factor = 1 - discount_pct / 100
+            subtotal = sum(rates) * factor
+            rooms_subtotal += subtotal
+            tax += sum(r * factor * self.tax_rate(r) for r in rates)
+            occ = self._scoped(self.occupancy, rid, room)
+            if occ is not None:
+                base_guests += occ[0]
+                extra_guest_price = max(extra_guest_price, occ[1])
+            per_room.append({
+                "room_id": rid,
+                "price_per_night": room["base"],
+                "nightly_rates": rates,
+                "discount_pct": discount_pct,
+                "subtotal": round(subtotal, 2),
+            })
+
+        extra_guests = max(int(guests or 0) - base_guests, 0) if extra_guest_price else 0
+        occupancy_subtotal = extra_guests * extra_guest_price * nights
+        bed_price = max((self.rooms[rid]["extra_bed_price"] for rid in room_ids), default=0.0)
+        extra_beds_subtotal = max(int(extra_beds or 0), 0) * bed_price * nights
+
+        program_items = []
+        for pid in programs or ():
+            p = self.programs.get(str(pid))
+            if p is not None:
+                program_items.append(dict(p))
+        programs_subtotal = float(sum(p["price"] for p in program_items))
+
+        tax += (occupancy_subtotal + extra_beds_subtotal + programs_subtotal) * DEFAULT_TAX_RATE
+        tax = round(tax, 2)
+        subtotal = rooms_subtotal + occupancy_subtotal + extra_beds_subtotal + programs_subtotal
+        return {
+            "nights": nights,
+            "rooms_subtotal": round(rooms_subtotal, 2),
+            "occupancy_subtotal": round(occupancy_subtotal, 2),
+            "extra_beds_subtotal": round(extra_beds_subtotal, 2),
+            "programs_subtotal": round(programs_subtotal, 2),
+            "tax": tax,
+            "total": round(subtotal + tax, 2),
+            "per_room": per_room,
+            "programs": program_items,
+        }
+
+
+# Process-wide rate table shared by the booking and quote routes
+rate_table = RateTable()
+
+
+async def get_rate_table(db, room_ids: Iterable[Any] = ()) -> RateTable:
+    """Return the shared rate table, loading it from `db` when cold, stale or missing a room."""
+    return await rate_table.ensure_loaded(db, room_ids)
@@ -0,0 +1,243 @@
+"""Materialised `programs_view`: one read model over every program collection.
+
+Programs live in `programs`, `wellnessPrograms` and `activities`, with
+different field names. `programs_view` holds one document per source
+document, built in Mongo by `$unionWith` + `$merge`:
+
+    _id          "<source>:<source _id>"
+    source       source collection; rank orders programs before wellness/activities
+    source_id    the source document's _id (GET /api/programs/{id})
+    kinds        lowercased tags plus "wellness"/"activities" from the source
+                 collection or a matching type/tag; the ?tag= filters use it
+    doc          the source document as stored (endpoints returning raw documents)
+    id, title, description, duration, price, image, tags, schedule, location
+                 the public schema the compat endpoints used to map per request
+    built_at     server time ($$NOW) of the aggregation that wrote the document
+
+Reads are a single query on the indexed (kinds, rank, source_id) or
+(rank, source_id) keys. The view is rebuilt at startup. It is then kept
+current per document: the program routes call `refresh` after their writes, and
+where the server supports change streams (replica sets, Atlas) `start`
+follows writes made to any source collection by anything else. On a standalone
+server, writes made outside the API show up at the next rebuild.
+
+Every worker rebuilds at startup, concurrently with each other and with
+refreshes. `$merge` therefore keeps whichever copy of a document has the later
+`built_at`, so an older rebuild cannot overwrite what a newer rebuild or a
+refresh wrote. Documents whose source is gone are found by an anti-join
+against the source collections, never by age.
+"""
+from typing import Any, Optional
+import asyncio
+import logging
+import os
+from pymongo.errors import OperationFailure
+from resort_backend.lib.catalog_cache import catalog_cache
+from resort_backend.lib.pricing import rate_table
+
+logger = logging.getLogger("resort_backend.programs_view")
+
+VIEW = "programs_view"
+# source collection -> (rank, kind implied by the collection)
+SOURCES = {"programs": (0, None), "wellnessPrograms": (1, "wellness"), "activities": (2, "activities")}
+KIND_PATTERNS = {"wellness": "wellness", "activities": "activit"}
+TAG_ALIASES = {"resort-activities": "activities"}
+MEDIA_BASE_URL = os.getenv("MEDIA_BASE_URL", "").rstrip("/")
+PUBLIC_FIELDS = {"_id": 0, "id": 1, "title": 1, "description": 1, "duration": 1, "price": 1, "image": 1, "tags": 1, "source": 1}
+ORDER = [("rank", 1), ("source_id", 1)]
+RETRY_SECONDS = 30
+
+
+def _first_of(*exprs: Any) -> Any:
+    """Nested $ifNull: the first expression that is not null/missing."""
+    out = exprs[-1]
+    for expr in reversed(exprs[:-1]):
+        out = {"$ifNull": [expr, out]}
+    return out
+
+
+def _str(expr: Any) -> dict:
+    # a stray non-string tag or type must not fail the whole build
+    return {"$convert": {"input": expr, "to": "string", "onError": "", "onNull": ""}}
+
+
+def _matches(pattern: str) -> dict:
+    """True when `type` or any tag matches `pattern` (case-insensitive)."""
+    return {"$or": [
+        {"$regexMatch": {"input": _str("$type"), "regex": pattern, "options": "i"}},
+        {"$anyElementTrue": [{"$map": {"input": {"$ifNull": ["$tags", []]}, "as": "t",
+                                       "in": {"$regexMatch": {"input": _str("$$t"), "regex": pattern, "options": "i"}}}}]},
+    ]}
+
+
+def normalize_stages(source: str) -> list:
+    """Stages mapping documents of `source` to view documents."""
+    rank, implied = SOURCES[source]
+    image = _first_of("$image", "$image_url", "$imageUrl", {"$arrayElemAt": [_first_of("$images", "$media", []), 0]}, None)
+    if MEDIA_BASE_URL:
+        image = {"$let": {"vars": {"img": image}, "in": {"$cond": [
+            {"$eq": [{"$substrCP": [{"$ifNull": ["$$img", ""]}, 0, 1]}, "/"]},
+            {"$concat": [MEDIA_BASE_URL, "$$img"]}, "$$img"]}}}
+    kinds = [{"$map": {"input": {"$ifNull": ["$tags", []]}, "as": "t", "in": {"$toLower": _str("$$t")}}}]
+    for kind, pattern in KIND_PATTERNS.items():
+        kinds.append([kind] if kind == implied else {"$cond": [_matches(pattern), [kind], []]})
+    return [
+        {"$project": {
+            "_id": {"$concat": [source + ":", {"$toString": "$_id"}]},
+            "source": {"$literal": source},
+            "rank": {"$literal": rank},
+            "source_id": "$_id",
+            "kinds": {"$setUnion": [{"$concatArrays": kinds}]},
+            "doc": "$$ROOT",
+            "id": {"$toString": _first_of("$id", "$_id")},
+            "title": _first_of("$title", "$name", "$programName", ""),
+            "description": _first_of("$description", "$summary", "$details", ""),
+            "duration": _first_of("$duration", {"$cond": [
+                {"$gt": [{"$ifNull": ["$duration_days", 0]}, 0]},
+                {"$concat": [{"$toString": "$duration_days"}, " days"]},
+                _first_of("$length", ""),
+            ]}),
+            "price": {"$toLong": {"$convert": {"input": _first_of("$price", "$price_inr", "$cost", "$amount", 0),
+                                               "to": "double", "onError": 0, "onNull": 0}}},
+            "image": image,
+            "tags": _first_of("$tags", []),
+            "schedule": _first_of("$schedule", "$time", ""),
+            "location": _first_of("$location", ""),
+            "built_at": "$$NOW",
+        }},
+    ]
+
+
+# a stored document written by a later aggregation (`$$new` is the incoming one) wins
+MERGE = {"$merge": {"into": VIEW, "on": "_id", "whenNotMatched": "insert", "whenMatched": [
+    {"$replaceWith": {"$cond": [{"$gt": ["$built_at", "$$new.built_at"]}, "$$ROOT", "$$new"]}},
+]}}
+
+
+def rebuild_pipeline() -> list:
+    """Aggregation (run on `programs`) that writes every source document into the view."""
+    first, *others = SOURCES
+    pipeline = normalize_stages(first)
+    for source in others:
+        pipeline.append({"$unionWith": {"coll": source, "pipeline": normalize_stages(source)}})
+    pipeline.append(MERGE)
+    return pipeline
+
+
+def orphans_pipeline(source: str) -> list:
+    """Aggregation (run on the view) listing the _ids of `source` documents whose source is gone."""
+    return [
+        {"$match": {"rank": SOURCES[source][0]}},
+        {"$lookup": {"from": source, "localField": "source_id", "foreignField": "_id", "as": "src"}},
+        {"$match": {"src": {"$size": 0}}},
+        {"$project": {"_id": 1}},
+    ]
+
+
+def kind_filter(tag: Optional[str]) -> dict:
+    if not tag:
+        return {}
+    tag = tag.lower()
+    return {"kinds": TAG_ALIASES.get(tag, tag)}
+
+
+class ProgramsView:
+    def __init__(self):
+        self.db = None
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _changed():
+        catalog_cache.invalidate("programs")
+        rate_table.invalidate()
+
+    # -- maintenance ------------------------------------------------------
+
+    async def rebuild(self, db) -> int:
+        """Rebuild the whole view; documents whose source is gone are removed."""
+        await db["programs"].aggregate(rebuild_pipeline()).to_list(length=None)
+        removed = 0
+        for source in SOURCES:
+            orphans = [d["_id"] for d in await db[VIEW].aggregate(orphans_pipeline(source)).to_list(length=None)]
+            if orphans:
+                removed += (await db[VIEW].delete_many({"_id": {"$in": orphans}})).deleted_count
+        self._changed()
+        count = await db[VIEW].count_documents({})
+        logger.info("programs_view rebuilt: %d programs (%d removed)", count, removed)
+        return count
+
+    async def refresh(self, db, source: str, source_id: Any):
+        """Re-derive the view document of one source document (or drop it when deleted)."""
+        if source not in SOURCES:
+            return
+        await db[source].aggregate([{"$match": {"_id": source_id}}, *normalize_stages(source), MERGE]).to_list(length=None)
+        if await db[source].find_one({"_id": source_id}, {"_id": 1}) is None:
+            await db[VIEW].delete_one({"source": source, "source_id": source_id})
+        self._changed()
+
+    # -- change stream ----------------------------------------------------
+
+    async def start(self, db):
+        self.db = db
+        await self.rebuild(db)
+        self._task = asyncio.create_task(self._follow())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    async def _follow(self):
+        pipeline = [{"$match": {"ns.coll": {"$in": list(SOURCES)}}}]
+        while True:
+            try:
+                async with self.db.watch(pipeline) as stream:
+                    async for change in stream:
+                        op = change.get("operationType")
+                        if op in ("insert", "update", "replace", "delete"):
+                            await self.refresh(self.db, change["ns"]["coll"], change["documentKey"]["_id"])
+                        elif op in ("drop", "rename", "dropDatabase", "invalidate"):
+                            await self.rebuild(self.db)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as exc:
+                if exc.code in (40573, 40324):  # standalone server: no change streams
+                    logger.info("programs_view: change streams unavailable; refreshed on API writes and at startup")
+                    return
+                logger.warning("programs_view: change stream failed (%s); rebuilding", exc)
+            except Exception:
+                logger.exception("programs_view: change stream failed; rebuilding")
+            await asyncio.sleep(RETRY_SECONDS)
+            try:
+                # changes made while the stream was down are picked up by a full rebuild
+                await self.rebuild(self.db)
+            except Exception:
+                logger.exception("programs_view rebuild failed")
+
+    # -- reads ------------------------------------------------------------
+
+    async def raw(self, db, tag: Optional[str] = None, source: Optional[str] = None) -> list:
+        """Source documents, programs first; `source` keeps one source collection."""
+        match = kind_filter(tag)
+        if source is not None:
+            match["rank"] = SOURCES[source][0]
+        pipeline = [{"$match": match}, {"$sort": dict(ORDER)}, {"$replaceRoot": {"newRoot": "$doc"}}]
+        return await db[VIEW].aggregate(pipeline).to_list(length=None)
+
+    async def public(self, db, tag: Optional[str] = None, projection: Optional[dict] = None) -> list:
+        """Programs in the public schema (or `projection`), programs first."""
+        pipeline = [{"$match": kind_filter(tag)}, {"$sort": dict(ORDER)}, {"$project": projection or PUBLIC_FIELDS}]
+        return await db[VIEW].aggregate(pipeline).to_list(length=None)
+
+    async def get(self, db, source_id: Any) -> Optional[dict]:
+        """The source document with this _id, looking in programs, then wellnessPrograms, then activities."""
+        found = await db[VIEW].find({"source_id": source_id}, {"doc": 1}).sort(ORDER).limit(1).to_list(length=1)
+        return found[0]["doc"] if found else None
+
+
+# Process-wide view maintained by the API process
+programs_view = ProgramsView()
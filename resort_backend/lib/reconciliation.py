@@ -0,0 +1,282 @@
+"""Batched reconciliation between Razorpay `transactions` and `bookings`.
+
+Transactions are read in (created_at, _id) order, BATCH_SIZE at a time, with
+one aggregation per batch that `$lookup`s the linked booking by
+`payment.order_id` and by `payment.payment_id`. For each transaction:
+
+- paid, no booking, `booking_payload` stored at order creation
+    -> booking built from the payload; it is confirmed once its rooms are
+       claimed in `room_nights` (lib/reservations.py) and otherwise stays
+       `pending` with a `review` reason for the front desk
+- paid, no booking, no payload
+    -> placeholder booking recording the payment (as the webhook does),
+       unless placeholders are disabled
+- paid, booking still `pending` (and not held for review)
+    -> booking confirmed and its payment ids filled in
+- `created`, but a booking already carries the payment id
+    -> transaction marked paid
+
+All writes of a batch go out in one `bulk_write` per collection, built from
+the (filter, update) specs of `batch_specs`, and the rooms of the bookings it
+inserted are claimed with one `reserve_many`. Bookings are upserted on
+`payment.order_id`, so re-running a batch never creates a second booking. After each batch the run's position is saved in
+`reconciliation_checkpoints`: an interrupted run resumes from there, a
+completed one makes the next call start a fresh scan.
+"""
+from datetime import datetime
+from typing import Any, Optional
+import logging
+import random
+import string
+from bson import ObjectId
+from pymongo import UpdateMany, UpdateOne
+from resort_backend.lib.availability import _to_date
+from resort_backend.lib.reservations import reserve_many
+
+logger = logging.getLogger("resort_backend.reconciliation")
+
+CHECKPOINTS = "reconciliation_checkpoints"
+BATCH_SIZE = 1000
+# transaction states worth looking at; failed/refunded ones need no booking
+SCANNED_STATUSES = ["paid", "created"]
+CONFIRMABLE_BOOKING_STATUSES = ["pending"]
+# `review` reasons of payload bookings that are not confirmed
+AWAITING_CLAIM = "paid; rooms not claimed yet"
+NOTHING_TO_CLAIM = "paid; payload has no rooms or valid dates"
+ROOMS_TAKEN = "paid; rooms already booked for these dates"
+
+
+def _reference() -> str:
+    return "RB-WEB-" + datetime.utcnow().strftime("%Y%m%d%H%M%S") + "-" + ''.join(random.choices(string.digits, k=4))
+
+
+def _stay_bound(v: Any) -> Optional[datetime]:
+    d = _to_date(v)
+    return datetime(d.year, d.month, d.day) if d else None
+
+
+def booking_from_transaction(tx: dict) -> dict:
+    """Booking document for a paid transaction (same shape the webhook creates).
+
+    Payload bookings get typed dates and are written `pending` for review:
+    `reconcile` confirms them once their rooms are claimed.
+    """
+    order_id, payment_id = tx.get("razorpay_order_id"), tx.get("razorpay_payment_id")
+    now = datetime.utcnow()
+    bp = tx.get("booking_payload")
+    if bp:
+        check_in, check_out = _stay_bound(bp.get("check_in")), _stay_bound(bp.get("check_out"))
+        rooms = bp.get("allocated_cottages") or []
+        claimable = rooms and check_in and check_out and check_in < check_out
+        return {
+            "_id": ObjectId(),
+            "reference": _reference(),
+            "guest_name": bp.get("guest_name") or bp.get("guest_email") or "Auto-created",
+            "guest_email": bp.get("guest_email"),
+            "guest_phone": bp.get("guest_phone"),
+            "guests": bp.get("guests") or 1,
+            "selected_cottages": bp.get("selected_cottages") or [],
+            "allocated_cottages": rooms,
+            "payment": {"provider": "razorpay", "order_id": order_id, "payment_id": payment_id},
+            "check_in": check_in,
+            "check_out": check_out,
+            "nights": bp.get("nights") or 0,
+            "price_breakdown": bp.get("price_breakdown") or {},
+            "status": "pending",
+            "review": AWAITING_CLAIM if claimable else NOTHING_TO_CLAIM,
+            "created_at": now,
+            "updated_at": now,
+            "auto_created_by_reconciliation": True,
+        }
+    amount = tx.get("amount")
+    return {
+        "reference": _reference(),
+        "guest_name": tx.get("receipt") or "Unknown",
+        "guest_email": None,
+        "guest_phone": None,
+        "guests": 1,
+        "selected_cottages": [],
+        "allocated_cottages": [],
+        "payment": {"provider": "razorpay", "order_id": order_id, "payment_id": payment_id},
+        "check_in": None,
+        "check_out": None,
+        "nights": 0,
+        "price_breakdown": {"total": amount / 100 if amount else None},
+        "status": "paid",
+        "created_at": now,
+        "updated_at": now,
+        "auto_created_by_reconciliation": True,
+        "note": "Auto-created booking placeholder from payment reconciliation — enrich manually.",
+    }
+
+
+def _lookup(local: str, foreign: str, as_: str) -> dict:
+    # $expr equality with a null guard: a transaction without a payment id must not
+    # match every booking that lacks one
+    return {"$lookup": {
+        "from": "bookings",
+        "let": {"v": f"${local}"},
+        "pipeline": [
+            {"$match": {"$expr": {"$and": [{"$ne": ["$$v", None]}, {"$eq": [f"${foreign}", "$$v"]}]}}},
+            {"$project": {"status": 1, "payment": 1, "review": 1}},
+            {"$limit": 1},
+        ],
+        "as": as_,
+    }}
+
+
+def batch_pipeline(after: Optional[dict], batch_size: int, until: datetime, since: Optional[datetime] = None) -> list[dict]:
+    created: dict[str, Any] = {"$lte": until}
+    if since is not None:
+        created["$gte"] = since
+    match: dict[str, Any] = {"status": {"$in": SCANNED_STATUSES}, "created_at": created}
+    if after:
+        match["$or"] = [
+            {"created_at": {"$gt": after["created_at"]}},
+            {"created_at": after["created_at"], "_id": {"$gt": after["_id"]}},
+        ]
+    return [
+        {"$match": match},
+        {"$sort": {"created_at": 1, "_id": 1}},
+        {"$limit": batch_size},
+        {"$project": {"raw_order": 0, "raw": 0}},
+        _lookup("razorpay_order_id", "payment.order_id", "by_order"),
+        _lookup("razorpay_payment_id", "payment.payment_id", "by_payment"),
+    ]
+
+
+def batch_specs(txs: list[dict], placeholders: bool = True) -> tuple[list, list, dict, list]:
+    """Writes for one batch as specs, plus counts and the stays to claim.
+
+    Returns (booking_specs, tx_specs, counts, claims): booking specs are
+    (filter, update, upsert) tuples, transaction specs (filter, update), and
+    claims (booking_id, rooms, check_in, check_out) for new payload bookings.
+    """
+    booking_specs, tx_specs, claims = [], [], []
+    counts = {"scanned": len(txs), "bookings_created": 0, "placeholders_created": 0, "bookings_confirmed": 0, "transactions_marked_paid": 0,
+              "bookings_for_review": 0}
+    seen_orders = set()
+    for tx in txs:
+        booking = (tx.get("by_order") or tx.get("by_payment") or [None])[0]
+        order_id = tx.get("razorpay_order_id")
+        payment_id = tx.get("razorpay_payment_id")
+        if tx.get("status") == "paid":
+            if booking is None:
+                if not order_id or order_id in seen_orders:
+                    continue
+                if not tx.get("booking_payload") and not placeholders:
+                    continue
+                seen_orders.add(order_id)
+                doc = booking_from_transaction(tx)
+                booking_specs.append(({"payment.order_id": order_id}, {"$setOnInsert": doc}, True))
+                if doc.get("review") == AWAITING_CLAIM:
+                    claims.append((doc["_id"], doc["allocated_cottages"], doc["check_in"], doc["check_out"]))
+                elif doc.get("review"):
+                    counts["bookings_for_review"] += 1
+                counts["bookings_created" if tx.get("booking_payload") else "placeholders_created"] += 1
+            elif booking.get("status") in CONFIRMABLE_BOOKING_STATUSES and not booking.get("review"):
+                fix = {"status": "confirmed", "payment.provider": "razorpay", "updated_at": datetime.utcnow()}
+                if order_id:
+                    fix["payment.order_id"] = order_id
+                if payment_id:
+                    fix["payment.payment_id"] = payment_id
+                booking_specs.append((
+                    {"_id": booking["_id"], "status": {"$in": CONFIRMABLE_BOOKING_STATUSES}, "review": {"$exists": False}},
+                    {"$set": fix},
+                    False,
+                ))
+                counts["bookings_confirmed"] += 1
+        elif booking is not None and (booking.get("payment") or {}).get("payment_id"):
+            tx_specs.append((
+                {"_id": tx["_id"], "status": "created"},
+                {"$set": {"status": "paid", "razorpay_payment_id": booking["payment"]["payment_id"], "reconciled_at": datetime.utcnow()}},
+            ))
+            counts["transactions_marked_paid"] += 1
+    return booking_specs, tx_specs, counts, claims
+
+
+async def claim_new_bookings(db, claims: list, inserted: set) -> int:
+    """Claim the rooms of the payload bookings this batch inserted and confirm them.
+
+    Bookings whose rooms are taken keep `pending` with the ROOMS_TAKEN review
+    reason. Returns how many were left for review.
+    """
+    stays = [(booking_id, rooms, booking_id, ci, co) for booking_id, rooms, ci, co in claims if booking_id in inserted]
+    if not stays:
+        return 0
+    failed = await reserve_many(db, stays)
+    now = datetime.utcnow()
+    ok = [s[0] for s in stays if s[0] not in failed]
+    ops = []
+    if ok:
+        ops.append(UpdateMany({"_id": {"$in": ok}, "review": AWAITING_CLAIM},
+                              {"$set": {"status": "confirmed", "updated_at": now}, "$unset": {"review": ""}}))
+    if failed:
+        ops.append(UpdateMany({"_id": {"$in": list(failed)}, "review": AWAITING_CLAIM},
+                              {"$set": {"review": ROOMS_TAKEN, "updated_at": now}}))
+    await db.bookings.bulk_write(ops, ordered=False)
+    return len(failed)
+
+
+async def reconcile(
+    db,
+    checkpoint: str = "payments",
+    batch_size: int = BATCH_SIZE,
+    max_batches: Optional[int] = None,
+    placeholders: bool = True,
+    dry_run: bool = False,
+    restart: bool = False,
+    since: Optional[datetime] = None,
+) -> dict:
+    """Continue (or start) a reconciliation run; returns totals for this call.
+
+    `max_batches` bounds the work of one call (the admin endpoint uses it);
+    the following call picks up where this one stopped. A new run covers
+    transactions created between `since` (default: the oldest) and the
+    moment it starts. `restart` abandons an unfinished run. A dry run
+    writes nothing, not even the checkpoint.
+    """
+    state = await db[CHECKPOINTS].find_one({"_id": checkpoint})
+    if restart or not state or state.get("complete"):
+        # stop at the transactions that existed when the run began
+        state = {"until": datetime.utcnow(), "since": since, "created_at": None, "last_id": None}
+    until, since = state["until"], state.get("since")
+    after = {"created_at": state["created_at"], "_id": state["last_id"]} if state.get("last_id") is not None else None
+    totals = {"scanned": 0, "bookings_created": 0, "placeholders_created": 0, "bookings_confirmed": 0, "transactions_marked_paid": 0,
+              "bookings_for_review": 0, "batches": 0}
+    done = False
+    while max_batches is None or totals["batches"] < max_batches:
+        txs = await db.transactions.aggregate(batch_pipeline(after, batch_size, until, since)).to_list(batch_size)
+        if not txs:
+            done = True
+            if not dry_run:
+                await db[CHECKPOINTS].update_one({"_id": checkpoint}, {"$set": {"complete": True, "updated_at": datetime.utcnow()}})
+            break
+        booking_specs, tx_specs, counts, claims = batch_specs(txs, placeholders)
+        if not dry_run:
+            if booking_specs:
+                res = await db.bookings.bulk_write([UpdateOne(f, u, upsert=up) for f, u, up in booking_specs], ordered=False)
+                totals["bookings_for_review"] += await claim_new_bookings(db, claims, set(res.upserted_ids.values()))
+            if tx_specs:
+                await db.transactions.bulk_write([UpdateOne(f, u) for f, u in tx_specs], ordered=False)
+        last = txs[-1]
+        after = {"created_at": last["created_at"], "_id": last["_id"]}
+        done = len(txs) < batch_size
+        if not dry_run:
+            await db[CHECKPOINTS].update_one(
+                {"_id": checkpoint},
+                {"$set": {
+                    "until": until, "since": since, "created_at": last["created_at"], "last_id": last["_id"],
+                    "complete": done, "updated_at": datetime.utcnow(),
+                }},
+                upsert=True,
+            )
+        for k, v in counts.items():
+            totals[k] += v
+        totals["batches"] += 1
+        if done:
+            break
+    totals["complete"] = done
+    totals["checkpoint"] = {"created_at": after["created_at"], "last_id": str(after["_id"])} if after else None
+    logger.info("reconciliation %s: %s", checkpoint, totals)
+    return totals
@@ -0,0 +1,343 @@
+"""Range reservations stored as one night-bitmask document per unit and month.
+
+`room_nights` documents:
+
+    {_id: "<unit>:<YYYY-MM>", unit, month, mask, holds: [{booking_id, bits}]}
+
+Bit ``d - 1`` of `mask` is the night starting on day ``d`` of the month. A
+stay is claimed with one conditional upsert per (unit, month) it touches:
+
+    update_one({"_id": ..., "mask": {"$bitsAllClear": bits}},
+               {"$bit": {"mask": {"or": bits}}, "$push": {"holds": ...}}, upsert=True)
+
+When any requested night is already taken the filter does not match and the
+upsert collides with the existing `_id` (DuplicateKeyError). The same error
+comes back when two first claims on a (unit, month) race to insert it, so a
+DuplicateKeyError is retried once as a plain conditional update against the
+now existing document; only a claim that still matches nothing conflicts.
+Inside a transaction the error aborts it, so it is raised to the caller,
+which retries without a transaction.
+Two stays therefore conflict exactly when they share a night. A stay of
+any length inside one month is a single write (two across a month boundary),
+replacing the per-night `occupancies` documents. Claims made without a
+transaction are rolled back when a later (unit, month) conflicts. A booking
+whose dates change is moved with `move_many`/`move_booking`, which claim the
+new nights before releasing the old ones.
+
+Run `scripts/migrate_occupancies.py` once to carry existing per-night
+occupancies over.
+"""
+from datetime import date, datetime
+from typing import Any, Iterable, Optional
+import logging
+from pymongo import UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from resort_backend.lib.availability import EPOCH, _to_date, unit_key
+
+logger = logging.getLogger("resort_backend.reservations")
+
+COLLECTION = "room_nights"
+# all 31 day bits; used to clear bits with $bit "and"
+FULL_MONTH = (1 << 31) - 1
+
+
+def _next_month(d: date) -> date:
+    return date(d.year + (d.month == 12), d.month % 12 + 1, 1)
+
+
+def month_masks(check_in: Any, check_out: Any) -> list[tuple[str, int]]:
+    """[("YYYY-MM", bits)] covering the nights in [check_in, check_out)."""
+    start, end = _to_date(check_in), _to_date(check_out)
+    out = []
+    if start is None or end is None:
+        return out
+    d = start
+    while d < end:
+        stop = min(end, _next_month(d))
+        out.append((f"{d.year:04d}-{d.month:02d}", ((1 << (stop - d).days) - 1) << (d.day - 1)))
+        d = stop
+    return out
+
+
+def doc_id(unit: Any, month: str) -> str:
+    return f"{unit_key(unit)}:{month}"
+
+
+def epoch_mask(month: str, bits: int) -> int:
+    """Convert month-relative bits to the availability calendar's EPOCH-relative mask."""
+    y, m = (int(p) for p in month.split("-"))
+    offset = date(y, m, 1).toordinal() - EPOCH
+    return bits << offset if offset >= 0 else bits >> -offset
+
+
+def _claim_spec(unit: Any, month: str, bits: int, holder: str) -> tuple[dict, dict]:
+    return (
+        {"_id": doc_id(unit, month), "mask": {"$bitsAllClear": bits}},
+        {
+            "$bit": {"mask": {"or": bits}},
+            "$push": {"holds": {"booking_id": holder, "bits": bits}},
+            "$setOnInsert": {"unit": unit_key(unit), "month": month},
+            "$currentDate": {"updated_at": True},
+        },
+    )
+
+
+def _unclaim_spec(_id: str, bits: int, holder: str) -> tuple[dict, dict]:
+    # matching on the hold makes this idempotent: bits are cleared at most once
+    return (
+        {"_id": _id, "holds.booking_id": holder},
+        {"$bit": {"mask": {"and": FULL_MONTH ^ bits}}, "$pull": {"holds": {"booking_id": holder}}, "$currentDate": {"updated_at": True}},
+    )
+
+
+async def _claim(db, unit: str, month: str, bits: int, holder: str, session=None) -> bool:
+    q, update = _claim_spec(unit, month, bits, holder)
+    try:
+        await db[COLLECTION].update_one(q, update, upsert=True, session=session)
+    except DuplicateKeyError:
+        if session is not None:
+            # the error aborted the transaction, so nothing can be retried in it;
+            # the caller starts over without one
+            raise
+        # either a night is taken or a concurrent first claim inserted the document
+        # first; Mongo does not retry upserts whose filter is more than the _id
+        res = await db[COLLECTION].update_one(q, update)
+        return res.matched_count == 1
+    return True
+
+
+async def _unclaim(db, _id: str, bits: int, holder: str, session=None) -> bool:
+    q, update = _unclaim_spec(_id, bits, holder)
+    res = await db[COLLECTION].update_one(q, update, session=session)
+    return res.modified_count == 1
+
+
+async def reserve_units(db, units: Iterable[Any], booking_id: Any, check_in: Any, check_out: Any, session=None) -> bool:
+    """Claim [check_in, check_out) on every unit for `booking_id`; all or nothing.
+
+    Returns False when any night is already held. Inside a transaction the
+    caller aborts; otherwise the claims made so far are rolled back here.
+    With a session a DuplicateKeyError is raised instead of retried (it aborts
+    the transaction): callers fall back to claiming without one.
+    """
+    holder = str(booking_id)
+    spans = month_masks(check_in, check_out)
+    done = []
+    for unit in units:
+        for month, bits in spans:
+            if not await _claim(db, unit, month, bits, holder, session=session):
+                if session is None:
+                    for _id, b in done:
+                        await _unclaim(db, _id, b, holder)
+                return False
+            done.append((doc_id(unit, month), bits))
+    return True
+
+
+async def release_booking(db, booking_id: Any, session=None) -> int:
+    """Free every night held by `booking_id`; returns the number of unit-nights released."""
+    holder = str(booking_id)
+    released = 0
+    cursor = db[COLLECTION].find({"holds.booking_id": holder}, {"holds": 1}, session=session)
+    async for doc in cursor:
+        bits = 0
+        for h in doc.get("holds") or []:
+            if h.get("booking_id") == holder:
+                bits |= int(h.get("bits") or 0)
+        if await _unclaim(db, doc["_id"], bits, holder, session=session):
+            released += bin(bits).count("1")
+    return released
+
+
+async def reserve_many(db, stays: Iterable[tuple[Any, Iterable[Any], Any, Any, Any]]) -> dict:
+    """Claim many stays with one unordered bulk_write (batch ingestion).
+
+    `stays` holds (key, units, booking_id, check_in, check_out) tuples. Each
+    stay is all or nothing: returns {key: "conflict" | "error"} for the stays
+    that could not be claimed, after rolling back their other claims with a
+    second bulk_write. Stays in the same batch conflict with each other the
+    same way they conflict with stored ones; claims that failed with a
+    DuplicateKeyError are retried without upsert, as in `_claim`.
+    """
+    claims = []
+    for key, units, booking_id, check_in, check_out in stays:
+        spans = month_masks(check_in, check_out)
+        claims.extend((key, unit, month, bits, str(booking_id)) for unit in units for month, bits in spans)
+    return await _claim_many(db, claims)
+
+
+async def _claim_many(db, claims: list[tuple[Any, Any, str, int, str]]) -> dict:
+    """Bulk form of `_claim` for (key, unit, month, bits, holder) claims; all or nothing per key."""
+    ops = [UpdateOne(*_claim_spec(unit, month, bits, holder), upsert=True) for _, unit, month, bits, holder in claims]
+    failed: dict = {}
+    if not ops:
+        return failed
+    duplicates = []
+    try:
+        await db[COLLECTION].bulk_write(ops, ordered=False)
+    except BulkWriteError as e:
+        for err in e.details.get("writeErrors", []):
+            if err.get("code") == 11000:
+                duplicates.append(err["index"])
+            else:
+                failed[claims[err["index"]][0]] = "error"
+    for i in duplicates:
+        key, unit, month, bits, holder = claims[i]
+        if key in failed:
+            continue
+        res = await db[COLLECTION].update_one(*_claim_spec(unit, month, bits, holder))
+        if res.matched_count != 1:
+            failed[key] = "conflict"
+    rollback = [UpdateOne(*_unclaim_spec(doc_id(unit, month), bits, holder))
+                for key, unit, month, bits, holder in claims if key in failed]
+    if rollback:
+        await db[COLLECTION].bulk_write(rollback, ordered=False)
+    return failed
+
+
+def _move_holder(holder: str) -> str:
+    return f"{holder}:move"
+
+
+def move_plan(held: dict[str, int], want: dict[str, tuple[Any, str, int]]) -> tuple[list, list]:
+    """What moving one booking takes: (claims, trims).
+
+    `held` is {room_nights _id: bits} the booking holds now, `want` is
+    {_id: (unit, month, bits)} it should hold. Claims are the (unit, month, bits)
+    not held yet; trims are the (_id, held bits, bits to keep) of held documents
+    with nights the booking no longer needs.
+    """
+    claims = [(unit, month, bits & ~held.get(_id, 0)) for _id, (unit, month, bits) in want.items() if bits & ~held.get(_id, 0)]
+    trims = []
+    for _id, bits in held.items():
+        keep = bits & (want[_id][2] if _id in want else 0)
+        if keep != bits:
+            trims.append((_id, bits, keep))
+    return claims, trims
+
+
+async def move_many(db, moves: Iterable[tuple[Any, Iterable[Any], Any, Any, Any]]) -> dict:
+    """Move booked stays to new (units, check_in, check_out) without letting go of their nights first.
+
+    `moves` holds (key, units, booking_id, check_in, check_out). The nights a
+    booking does not hold yet are claimed first, under a temporary
+    "<booking_id>:move" holder; a move that conflicts rolls those back and
+    leaves the booking's reservation as it was. Only then are the nights it no
+    longer needs released and the new claims handed over to the booking.
+    Returns {key: "conflict" | "error"} like `reserve_many`.
+    """
+    moves = list(moves)
+    held: dict[str, dict[str, int]] = {str(booking_id): {} for _, _, booking_id, _, _ in moves}
+    if not held:
+        return {}
+    async for doc in db[COLLECTION].find({"holds.booking_id": {"$in": list(held)}}, {"holds": 1}):
+        for h in doc.get("holds") or []:
+            holder = h.get("booking_id")
+            if holder in held:
+                held[holder][doc["_id"]] = held[holder].get(doc["_id"], 0) | int(h.get("bits") or 0)
+    claims, plans = [], {}
+    for key, units, booking_id, check_in, check_out in moves:
+        holder = str(booking_id)
+        want = {doc_id(unit, month): (unit, month, bits) for unit in units for month, bits in month_masks(check_in, check_out)}
+        extra, trim = move_plan(held[holder], want)
+        plans[key] = (holder, trim)
+        claims.extend((key, unit, month, bits, _move_holder(holder)) for unit, month, bits in extra)
+    failed = await _claim_many(db, claims)
+    # ordered: trim the booking's own holds before the temporary ones take its name
+    trims, renames = [], []
+    for key, (holder, trim) in plans.items():
+        if key in failed:
+            continue
+        for _id, bits, keep in trim:
+            update = {"$bit": {"mask": {"and": FULL_MONTH ^ (bits & ~keep)}}, "$currentDate": {"updated_at": True}}
+            if keep:
+                trims.append(UpdateOne({"_id": _id}, {**update, "$set": {"holds.$[h].bits": keep}}, array_filters=[{"h.booking_id": holder}]))
+            else:
+                trims.append(UpdateOne({"_id": _id}, {**update, "$pull": {"holds": {"booking_id": holder}}}))
+        renames.append(UpdateMany({"holds.booking_id": _move_holder(holder)}, {"$set": {"holds.$[h].booking_id": holder}},
+                                  array_filters=[{"h.booking_id": _move_holder(holder)}]))
+    if trims or renames:
+        await db[COLLECTION].bulk_write(trims + renames, ordered=True)
+    return failed
+
+
+async def move_booking(db, units: Iterable[Any], booking_id: Any, check_in: Any, check_out: Any) -> bool:
+    """Move one booking's reservation (see `move_many`); False when a new night is taken."""
+    return not await move_many(db, [(None, list(units), booking_id, check_in, check_out)])
+
+
+async def release_many(db, booking_ids: Iterable[Any]) -> dict:
+    """Free every night held by each booking with one find and one bulk_write; {booking_id: nights}."""
+    released = {str(b): 0 for b in booking_ids}
+    ops = []
+    if not released:
+        return released
+    async for doc in db[COLLECTION].find({"holds.booking_id": {"$in": list(released)}}, {"holds": 1}):
+        per_holder: dict[str, int] = {}
+        for h in doc.get("holds") or []:
+            holder = h.get("booking_id")
+            if holder in released:
+                per_holder[holder] = per_holder.get(holder, 0) | int(h.get("bits") or 0)
+        for holder, bits in per_holder.items():
+            ops.append(UpdateOne(*_unclaim_spec(doc["_id"], bits, holder)))
+            released[holder] += bin(bits).count("1")
+    if ops:
+        await db[COLLECTION].bulk_write(ops, ordered=False)
+    return released
+
+
+async def busy_units(db, units: Iterable[Any], check_in: Any, check_out: Any) -> set[str]:
+    """Units (as calendar keys) with at least one night of [check_in, check_out) held; one query."""
+    spans = dict(month_masks(check_in, check_out))
+    keys = [unit_key(u) for u in units]
+    ids = [doc_id(u, m) for u in keys for m in spans]
+    busy = set()
+    if not ids:
+        return busy
+    async for doc in db[COLLECTION].find({"_id": {"$in": ids}}, {"unit": 1, "month": 1, "mask": 1}):
+        if int(doc.get("mask") or 0) & spans.get(doc.get("month"), 0):
+            busy.add(doc.get("unit"))
+    return busy
+
+
+async def held_units(db, check_in: Any, check_out: Any) -> set[str]:
+    """Every unit (as calendar key) with a night of [check_in, check_out) held; one query on the month index.
+
+    Unlike `busy_units` the units need not be known: listing endpoints use it to
+    exclude whatever is reserved, whatever the booking stored as its dates.
+    """
+    spans = dict(month_masks(check_in, check_out))
+    held = set()
+    if not spans:
+        return held
+    async for doc in db[COLLECTION].find({"month": {"$in": list(spans)}}, {"unit": 1, "month": 1, "mask": 1}):
+        if int(doc.get("mask") or 0) & spans.get(doc.get("month"), 0):
+            held.add(doc.get("unit"))
+    return held
+
+
+async def unit_masks(db, units: Iterable[Any], start: date, end: date) -> dict[str, int]:
+    """{unit key: EPOCH-relative busy mask} for the months overlapping [start, end); one query."""
+    months = []
+    d = date(start.year, start.month, 1)
+    while d < end:
+        months.append(f"{d.year:04d}-{d.month:02d}")
+        d = _next_month(d)
+    ids = [doc_id(u, m) for u in units for m in months]
+    busy: dict[str, int] = {}
+    if not ids:
+        return busy
+    async for doc in db[COLLECTION].find({"_id": {"$in": ids}}, {"unit": 1, "month": 1, "mask": 1}):
+        unit = doc.get("unit")
+        busy[unit] = busy.get(unit, 0) | epoch_mask(doc["month"], int(doc.get("mask") or 0))
+    return busy
+
+
+async def iter_holds(db, since: Optional[datetime] = None):
+    """Yield (booking_id, unit, epoch_mask) for the calendar loader."""
+    q = {}
+    if since is not None:
+        q["month"] = {"$gte": f"{since.year:04d}-{since.month:02d}"}
+    async for doc in db[COLLECTION].find(q, {"unit": 1, "month": 1, "holds": 1}):
+        for h in doc.get("holds") or []:
+            yield h.get("booking_id"), doc.get("unit"), epoch_mask(doc["month"], int(h.get("bits") or 0))
@@ -0,0 +1,273 @@
+"""Streaming, content-addressed image uploads.
+
+`receive_upload` parses a multipart request body as it arrives: the file part
+is written to a temp file chunk by chunk (the body is never held in memory)
+while a SHA-256 is computed. The stored name is the hash, so the same image
+uploaded twice is one file:
+
+    uploads/cas/<sha[:2]>/<sha>.<ext>   served as /uploads/cas/<sha[:2]>/<sha>.<ext>
+
+The type is taken from the file's magic bytes, not the client's Content-Type
+or filename, and only images in `IMAGE_TYPES` are accepted (415 otherwise).
+Requests over MAX_UPLOAD_BYTES are refused from their Content-Length before
+reading, and streamed bodies are cut off with 413 as soon as they pass it.
+
+Each blob has a `media_blobs` document {_id: sha, url, size, content_type,
+refs}. `refs` counts the documents (gallery items, menu items, cottages)
+holding the URL: an upload takes one reference for the document it is attached
+to, `sync_refs` adjusts the counts when a document's image URLs change, and the
+file is deleted only when the last reference is released.
+"""
+from datetime import datetime
+from typing import Iterable, Optional
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import tempfile
+from uuid import uuid4
+from fastapi import HTTPException, Request
+from multipart.multipart import MultipartParser, parse_options_header
+from resort_backend.lib.media import MEDIA_ROOT, URL_PREFIX
+
+logger = logging.getLogger("resort_backend.uploads")
+
+BLOBS_COLLECTION = "media_blobs"
+CAS_DIR = "cas"
+MAX_UPLOAD_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(15 * 1024 * 1024)))
+# total size of the non-file form fields (title, caption, ...)
+MAX_FIELD_BYTES = 64 * 1024
+# content type -> extension
+IMAGE_TYPES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/gif": ".gif",
+    "image/webp": ".webp",
+    "image/avif": ".avif",
+}
+SNIFF_BYTES = 16
+_CAS_URL = re.compile(re.escape(f"{URL_PREFIX}/{CAS_DIR}/") + r"[0-9a-f]{2}/([0-9a-f]{64})\.[a-z0-9]+$")
+
+
+def sniff_type(head: bytes) -> Optional[str]:
+    """Image content type from the first bytes of a file, None when not a supported image."""
+    if head.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    if head[4:12] in (b"ftypavif", b"ftypavis"):
+        return "image/avif"
+    return None
+
+
+def blob_path(sha: str, content_type: str, media_root: str = MEDIA_ROOT) -> str:
+    return os.path.join(media_root, CAS_DIR, sha[:2], sha + IMAGE_TYPES[content_type])
+
+
+def blob_url(sha: str, content_type: str) -> str:
+    return f"{URL_PREFIX}/{CAS_DIR}/{sha[:2]}/{sha}{IMAGE_TYPES[content_type]}"
+
+
+def blob_id(url) -> Optional[str]:
+    """The hash of a content-addressed upload URL (absolute or relative); None for other URLs."""
+    if not isinstance(url, str):
+        return None
+    m = _CAS_URL.search(url.split("?")[0])
+    return m.group(1) if m else None
+
+
+def image_urls(doc: Optional[dict], fields: Iterable[str]) -> list:
+    """Every URL in `fields` of a document; list fields (e.g. `images`) are flattened."""
+    out = []
+    for f in fields:
+        v = (doc or {}).get(f)
+        out.extend(v if isinstance(v, list) else [v])
+    return [u for u in out if isinstance(u, str) and u]
+
+
+class _Receiver:
+    """Multipart callbacks; file bytes are queued and written by `receive_upload` between reads."""
+
+    def __init__(self, field: str, max_bytes: int):
+        self.field = field
+        self.max_bytes = max_bytes
+        self.fields: dict[str, str] = {}
+        self.field_bytes = 0
+        self.size = 0
+        self.sha = hashlib.sha256()
+        self.head = b""
+        self.content_type: Optional[str] = None
+        self.pending: list[bytes] = []
+        self.seen_file = False
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: dict[bytes, bytes] = {}
+        self._name: Optional[str] = None
+        self._is_file = False
+        self._value = bytearray()
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._name = None
+        self._is_file = False
+        self._value = bytearray()
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name")
+        self._name = name.decode("utf-8", "replace") if name is not None else None
+        if b"filename" in options:
+            if self._name != self.field or self.seen_file:
+                raise HTTPException(status_code=400, detail=f"expected a single file in field '{self.field}'")
+            self._is_file = True
+            self.seen_file = True
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        chunk = data[start:end]
+        if not self._is_file:
+            self.field_bytes += len(chunk)
+            if self.field_bytes > MAX_FIELD_BYTES:
+                raise HTTPException(status_code=413, detail="form fields too large")
+            self._value += chunk
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise HTTPException(status_code=413, detail=f"file larger than {self.max_bytes} bytes")
+        if self.content_type is None:
+            self.head += chunk[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) >= SNIFF_BYTES:
+                self._check_type()
+        self.sha.update(chunk)
+        self.pending.append(chunk)
+
+    def on_part_end(self):
+        if self._is_file:
+            if self.content_type is None:
+                self._check_type()
+        elif self._name is not None:
+            self.fields[self._name] = self._value.decode("utf-8", "replace")
+
+    def _check_type(self):
+        self.content_type = sniff_type(self.head)
+        if self.content_type is None:
+            raise HTTPException(status_code=415, detail=f"unsupported image type; allowed: {', '.join(IMAGE_TYPES)}")
+
+
+def _write(f, chunks: list[bytes]):
+    f.write(b"".join(chunks))
+
+
+async def receive_upload(request: Request, db, field: str = "file", max_bytes: int = MAX_UPLOAD_BYTES,
+                         media_root: str = MEDIA_ROOT) -> tuple[dict, dict]:
+    """Store the image in multipart field `field` and take one reference on its blob.
+
+    Returns (blob, form fields). The caller attaches `blob["url"]` to its
+    document and must `release` it if that fails.
+    """
+    ctype, params = parse_options_header(request.headers.get("content-type", ""))
+    if ctype != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="expected multipart/form-data")
+    limit = max_bytes + MAX_FIELD_BYTES
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > limit:
+        raise HTTPException(status_code=413, detail=f"file larger than {max_bytes} bytes")
+
+    rx = _Receiver(field, max_bytes)
+    parser = MultipartParser(params[b"boundary"], {
+        name: getattr(rx, name) for name in ("on_part_begin", "on_part_data", "on_part_end", "on_header_field",
+                                             "on_header_value", "on_header_end", "on_headers_finished")
+    })
+    tmp_dir = os.path.join(media_root, CAS_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            received = 0
+            async for chunk in request.stream():
+                received += len(chunk)
+                if received > limit:
+                    raise HTTPException(status_code=413, detail=f"file larger than {max_bytes} bytes")
+                parser.write(chunk)
+                if rx.pending:
+                    # one thread hop per network read keeps disk writes off the event loop
+                    await asyncio.to_thread(_write, f, rx.pending)
+                    rx.pending = []
+            parser.finalize()
+        if not rx.seen_file or rx.size == 0:
+            raise HTTPException(status_code=400, detail=f"missing file field '{field}'")
+        blob = await _commit(db, tmp_path, rx.sha.hexdigest(), rx.size, rx.content_type, media_root)
+        tmp_path = None
+        return blob, rx.fields
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+async def _commit(db, tmp_path: str, sha: str, size: int, content_type: str, media_root: str) -> dict:
+    # reference first, file second, and the file is always put in place (same
+    # bytes, atomic rename): a concurrent release of the last reference has
+    # either seen our reference and kept the file, or moved it aside before we
+    # put ours back (see `release`)
+    blob = await db[BLOBS_COLLECTION].find_one_and_update(
+        {"_id": sha},
+        {"$inc": {"refs": 1},
+         "$setOnInsert": {"url": blob_url(sha, content_type), "size": size, "content_type": content_type,
+                          "created_at": datetime.utcnow()}},
+        upsert=True, return_document=True,
+    )
+    path = blob_path(sha, content_type, media_root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.replace(tmp_path, path)
+    return blob
+
+
+async def retain(db, urls: Iterable[str]):
+    """Take a reference on every content-addressed blob in `urls` (other URLs are ignored)."""
+    for sha in filter(None, map(blob_id, urls)):
+        await db[BLOBS_COLLECTION].update_one({"_id": sha}, {"$inc": {"refs": 1}})
+
+
+async def release(db, urls: Iterable[str], media_root: str = MEDIA_ROOT):
+    """Drop a reference per URL and delete blobs nothing refers to any more."""
+    for sha in filter(None, map(blob_id, urls)):
+        await db[BLOBS_COLLECTION].update_one({"_id": sha, "refs": {"$gt": 0}}, {"$inc": {"refs": -1}})
+        gone = await db[BLOBS_COLLECTION].find_one_and_delete({"_id": sha, "refs": {"$lte": 0}})
+        if gone is None:
+            continue
+        # move the file aside before checking for a new upload of the same bytes:
+        # an upload that commits after the check writes the file back itself
+        path = blob_path(sha, gone["content_type"], media_root)
+        doomed = f"{path}.{uuid4().hex}.del"
+        try:
+            os.replace(path, doomed)
+        except FileNotFoundError:
+            continue
+        if await db[BLOBS_COLLECTION].find_one({"_id": sha}) is not None:
+            # uploaded again meanwhile: keep the bytes (identical to any the upload wrote)
+            os.replace(doomed, path)
+            continue
+        os.unlink(doomed)
+        logger.info("deleted unreferenced upload %s", sha)
+
+
+async def sync_refs(db, before: Iterable[str], after: Iterable[str], media_root: str = MEDIA_ROOT):
+    """Move references from a document's old image URLs to its new ones (create: before=[], delete: after=[])."""
+    before, after = set(before), set(after)
+    await retain(db, after - before)
+    await release(db, before - after, media_root)
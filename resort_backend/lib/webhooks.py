@@ -0,0 +1,179 @@
+"""Webhook signature checks and a Mongo-backed inbox with an async worker.
+
+Intake does the minimum before acknowledging: verify the HMAC, then insert
+the raw event into `webhook_inbox` keyed by the provider's event id. The
+`_id` unique index deduplicates redeliveries, so a retried webhook costs one
+failed insert and is never processed twice.
+
+`InboxWorker` drains the inbox in batches: it claims up to BATCH_SIZE due
+events with one update_many, runs the registered handler for each, and
+writes the outcomes back with one bulk_write. Failed events are retried
+with exponential backoff until MAX_ATTEMPTS, then left as `failed` for an
+operator. A claim is a lease: events held by a worker that died become due
+again after CLAIM_SECONDS.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Optional
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import random
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger("resort_backend.webhooks")
+
+INBOX_COLLECTION = "webhook_inbox"
+BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", "2"))
+CLAIM_SECONDS = 300
+RETRY_BASE_SECONDS = 5
+RETRY_CAP_SECONDS = 3600
+
+PENDING, PROCESSING, DONE, FAILED = "pending", "processing", "done", "failed"
+
+Handler = Callable[[Any, dict], Awaitable[None]]
+
+
+def verify_hmac_sha256(signature: Optional[str], body: bytes, secret: str) -> bool:
+    """Constant-time check of a hex HMAC-SHA256 of `body`; accepts an optional `sha256=` prefix."""
+    if not signature or not secret:
+        return False
+    if signature.startswith("sha256="):
+        signature = signature[len("sha256="):]
+    computed = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(computed, signature.strip().lower())
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter for the attempt that just failed (1-based)."""
+    ceiling = min(RETRY_CAP_SECONDS, RETRY_BASE_SECONDS * (2 ** (attempts - 1)))
+    return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+async def enqueue(db, provider: str, event_id: Optional[str], body: bytes, event: Optional[str] = None) -> bool:
+    """Store a verified webhook body; returns False when `event_id` was already received.
+
+    Without a provider event id the body hash is used, so byte-identical
+    redeliveries still collapse.
+    """
+    key = f"{provider}:{event_id or hashlib.sha256(body).hexdigest()}"
+    now = datetime.utcnow()
+    try:
+        await db[INBOX_COLLECTION].insert_one({
+            "_id": key,
+            "provider": provider,
+            "event": event,
+            "body": body.decode("utf-8", errors="replace"),
+            "status": PENDING,
+            "attempts": 0,
+            "received_at": now,
+            "next_attempt_at": now,
+        })
+    except DuplicateKeyError:
+        return False
+    return True
+
+
+class InboxWorker:
+    """Processes `webhook_inbox` in the background; one per process is enough."""
+
+    def __init__(self, batch_size: int = BATCH_SIZE, poll_seconds: float = POLL_SECONDS):
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.handlers: dict[str, Handler] = {}
+        self.db = None
+        self._task: Optional[asyncio.Task] = None
+        self._wake = asyncio.Event()
+
+    def register(self, provider: str, handler: Handler):
+        self.handlers[provider] = handler
+
+    def notify(self):
+        """Wake the worker right away (called after intake)."""
+        self._wake.set()
+
+    async def start(self, db):
+        self.db = db
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                n = await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("webhook inbox: batch failed")
+                n = 0
+            if n >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.poll_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _claim(self, now: datetime) -> list[dict]:
+        coll = self.db[INBOX_COLLECTION]
+        due = {
+            "provider": {"$in": list(self.handlers)},
+            "$or": [
+                {"status": PENDING, "next_attempt_at": {"$lte": now}},
+                {"status": PROCESSING, "claimed_until": {"$lt": now}},
+            ],
+        }
+        ids = [d["_id"] async for d in coll.find(due, {"_id": 1}).sort("next_attempt_at", 1).limit(self.batch_size)]
+        if not ids:
+            return []
+        claim = str(ObjectId())
+        # re-check the due filter so two workers never claim the same event
+        await coll.update_many(
+            {"_id": {"$in": ids}, **due},
+            {"$set": {"status": PROCESSING, "claim": claim, "claimed_until": now + timedelta(seconds=CLAIM_SECONDS)}},
+        )
+        return await coll.find({"claim": claim}).to_list(self.batch_size)
+
+    async def run_once(self) -> int:
+        """Claim and process one batch; returns the number of events handled."""
+        now = datetime.utcnow()
+        batch = await self._claim(now)
+        ops = []
+        for doc in batch:
+            handler = self.handlers[doc["provider"]]
+            attempts = int(doc.get("attempts") or 0) + 1
+            try:
+                await handler(self.db, doc)
+            except Exception as e:
+                logger.exception("webhook inbox: %s failed (attempt %d)", doc["_id"], attempts)
+                status = FAILED if attempts >= MAX_ATTEMPTS else PENDING
+                update = {
+                    "status": status,
+                    "attempts": attempts,
+                    "last_error": str(e)[:500],
+                    "next_attempt_at": now + timedelta(seconds=retry_delay(attempts)),
+                }
+            else:
+                update = {"status": DONE, "attempts": attempts, "processed_at": datetime.utcnow()}
+            ops.append(UpdateOne({"_id": doc["_id"], "claim": doc["claim"]}, {"$set": update, "$unset": {"claim": "", "claimed_until": ""}}))
+        if ops:
+            await self.db[INBOX_COLLECTION].bulk_write(ops, ordered=False)
+        return len(batch)
+
+
+# Process-wide worker; routes register their handlers at import time
+inbox_worker = InboxWorker()
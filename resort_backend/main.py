@@ -27,6 +27,15 @@ import resort_backend.database as database
 from resort_backend.database import connect_db, close_db, get_db
 from resort_backend.routes import accommodations, packages, experiences, wellness, bookings, home, gallery, api_compat, internal_status, navigation, api_site
 from resort_backend.routes import events, extra_beds, programs
+from resort_backend.lib.event_bus import event_bus, backend_from_env
+from resort_backend.lib.payments import close_gateway
+from resort_backend.lib.webhooks import inbox_worker
+from resort_backend.lib.ari import ari_feed
+from resort_backend.lib.indexes import ensure_indexes
+from resort_backend.lib.media import media_pipeline
+from resort_backend.lib.media_files import MediaFiles
+from resort_backend.lib.gallery_view import normalize_all
+from resort_backend.lib.programs_view import programs_view
 from resort_backend.routes import razorpay
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import Response
@@ -110,6 +119,77 @@ async def shutdown_db_client():
     if client:
         client.close()
 
+# --- Index registry (lib/indexes.py): create missing indexes, log drift ---
+@app.on_event("startup")
+async def bootstrap_indexes():
+    if getattr(app.state, "db", None) is None or os.getenv("AUTO_CREATE_INDEXES", "1") == "0":
+        return
+    try:
+        await ensure_indexes(app.state.db)
+    except Exception:
+        logging.getLogger("resort_backend.indexes").exception("index bootstrap failed; run scripts/create_indexes.py")
+
+# --- Gallery: build the stored public projection for items written without it ---
+@app.on_event("startup")
+async def normalize_gallery():
+    if getattr(app.state, "db", None) is None:
+        return
+    try:
+        await normalize_all(app.state.db)
+    except Exception:
+        logging.getLogger("resort_backend.gallery").exception("gallery normalisation failed")
+
+# --- Programs read model (lib/programs_view.py): rebuild, then follow source writes ---
+@app.on_event("startup")
+async def start_programs_view():
+    if getattr(app.state, "db", None) is None:
+        return
+    try:
+        await programs_view.start(app.state.db)
+    except Exception:
+        logging.getLogger("resort_backend.programs_view").exception("programs_view rebuild failed")
+
+@app.on_event("shutdown")
+async def stop_programs_view():
+    await programs_view.stop()
+
+# --- SSE event bus: each worker tails the shared event log once ---
+@app.on_event("startup")
+async def start_event_bus():
+    await event_bus.start(backend_from_env(getattr(app.state, "db", None)))
+
+@app.on_event("shutdown")
+async def stop_event_bus():
+    await event_bus.stop()
+
+# --- Webhook inbox worker (lib/webhooks.py) ---
+@app.on_event("startup")
+async def start_webhook_worker():
+    if getattr(app.state, "db", None) is not None:
+        await inbox_worker.start(app.state.db)
+
+@app.on_event("shutdown")
+async def stop_webhook_worker():
+    await inbox_worker.stop()
+
+# --- OTA ARI delta feed (lib/ari.py) ---
+@app.on_event("startup")
+async def start_ari_feed():
+    if getattr(app.state, "db", None) is not None:
+        await ari_feed.start(app.state.db, event_bus)
+
+@app.on_event("shutdown")
+async def stop_ari_feed():
+    await ari_feed.stop()
+
+@app.on_event("shutdown")
+async def stop_media_pipeline():
+    await media_pipeline.close()
+
+@app.on_event("shutdown")
+async def close_payment_gateway():
+    close_gateway()
+
 # Include routers
 # Also include navigation router under /api for backwards compatibility with some clients
 # Include gallery under /api for compatibility with clients expecting /api/gallery
@@ -142,11 +222,18 @@ from resort_backend.routes.dining import router as dining_router
 app.include_router(dining_router, prefix="/api/dining")
 from resort_backend.routes.contact import router as contact_router
 app.include_router(contact_router, prefix="/api/contact")
+# OTA / channel-manager webhooks
+from resort_backend.routes import ota
+app.include_router(ota.router, prefix="/api/ota")
+# Pricing rules admin (quotes are served by api_compat /quote)
+from resort_backend.routes import pricing
+app.include_router(pricing.router, prefix="/api/pricing")
 
 # Serve uploaded files from /uploads
 uploads_path = os.path.join(os.path.dirname(__file__), "uploads")
 os.makedirs(uploads_path, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=uploads_path), name="uploads")
+# ETags, ranges, precompressed siblings and immutable caching for hashed paths (lib/media_files.py)
+app.mount("/uploads", MediaFiles(directory=uploads_path), name="uploads")
 
 @app.get("/")
 async def root():
@@ -1,68 +1,91 @@
 from fastapi import APIRouter, HTTPException, Request
 from resort_backend.models import Accommodation
 from bson import ObjectId
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Optional
+import math
 from resort_backend.utils import get_db_or_503, serialize_doc
 from resort_backend.routes.events import publish_event
+from resort_backend.lib.pricing import rate_table, get_rate_table
+from resort_backend.lib.availability import get_calendar
+from resort_backend.lib.accommodations import fetch_accommodations_with_rooms, fetch_accommodation_with_rooms
 
 router = APIRouter(tags=["accommodations"])
 
+# longest window one /search request may cover
+MAX_SEARCH_DAYS = 366
+
 @router.get("/")
 async def get_all_accommodations(request: Request):
-    """Get all accommodations"""
+    """Get all accommodations with their rooms (single $lookup aggregation)"""
     db = get_db_or_503(request)
     try:
-        accommodations = await db["accommodations"].find().to_list(None)
-        out = []
-        for acc in accommodations:
-            acc_doc = serialize_doc(acc)
-            # attach related rooms if any (rooms may store accommodation_id as ObjectId or string)
-            try:
-                rooms_cursor = db["rooms"].find({"$or": [{"accommodation_id": acc.get("_id")}, {"accommodation_id": str(acc.get("_id"))}]})
-                rooms = await rooms_cursor.to_list(length=None)
-                acc_doc["rooms"] = [serialize_doc(r) for r in rooms]
-                # expose adult/child capacity fields for rooms
-                for r in acc_doc["rooms"]:
-                    try:
-                        if r.get("capacity_adults") is not None or r.get("capacity_children") is not None:
-                            r["capacity_adults"] = int(r.get("capacity_adults") or r.get("capacity") or r.get("sleeps") or 0)
-                            r["capacity_children"] = int(r.get("capacity_children") or 0)
-                            r["capacity"] = r["capacity_adults"] + r["capacity_children"]
-                    except Exception:
-                        pass
-            except Exception:
-                acc_doc["rooms"] = []
-            out.append(acc_doc)
-        return out
+        return await fetch_accommodations_with_rooms(db)
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to fetch accommodations")
 
+@router.get("/search")
+async def search_availability(request: Request, start: str, days: int = 30, guests: int = 1):
+    """Nightly availability and price for every accommodation over [start, start + days).
+
+    Vectors are indexed by night (`start` + i). `available[i]` is the number of
+    free rooms and `price[i]` the lowest nightly rate among the accommodation's
+    rooms; a stay fits when every night in it has `available >= rooms_needed`.
+    """
+    db = get_db_or_503(request)
+    try:
+        first = datetime.strptime(start, "%Y-%m-%d").date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid start; use YYYY-MM-DD")
+    if not 1 <= days <= MAX_SEARCH_DAYS:
+        raise HTTPException(status_code=400, detail=f"days must be between 1 and {MAX_SEARCH_DAYS}")
+    guests = max(guests, 1)
+    try:
+        accommodations = await fetch_accommodations_with_rooms(db)
+    except Exception:
+        raise HTTPException(status_code=500, detail="Failed to fetch accommodations")
+    cal = await get_calendar(db)
+    rates = await get_rate_table(db)
+    nights = [first + timedelta(days=i) for i in range(days)]
+
+    types = []
+    for acc in accommodations:
+        rooms = acc.get("rooms") or []
+        # an accommodation without room documents is booked as a single unit
+        units = [r["id"] for r in rooms] or [acc["id"]]
+        capacity = max([int(r.get("capacity") or 0) for r in rooms] + [int(acc.get("capacity") or 0)]) or 2
+        rooms_needed = math.ceil(guests / capacity)
+        if rooms_needed > len(units):
+            continue
+        priced = [u for u in units if u in rates.rooms]
+        if priced:
+            price = [min(rates.nightly_rate(u, n) for u in priced) for n in nights]
+        else:
+            base = acc.get("price_per_night") or acc.get("price")
+            price = [base] * days
+        types.append({
+            "id": acc["id"],
+            "name": acc.get("name") or acc.get("title"),
+            "capacity": capacity,
+            "rooms": len(units),
+            "rooms_needed": rooms_needed,
+            # /api/bookings reserves the accommodation id itself; such a hold takes one room
+            "available": cal.free_counts(units, first, days, shared=acc["id"] if rooms else None),
+            "price": price,
+        })
+    return {"start": first.isoformat(), "days": days, "guests": guests, "types": types}
+
 @router.get("/{accommodation_id}")
 async def get_accommodation(request: Request, accommodation_id: str):
     """Get a specific accommodation by ID"""
     db = get_db_or_503(request)
     try:
-        accommodation = await db["accommodations"].find_one({"_id": ObjectId(accommodation_id)})
+        match = {"_id": ObjectId(accommodation_id)}
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid accommodation id")
-    if not accommodation:
+    out = await fetch_accommodation_with_rooms(db, match)
+    if not out:
         raise HTTPException(status_code=404, detail="Accommodation not found")
-    out = serialize_doc(accommodation)
-    # attach related rooms for this accommodation
-    try:
-        rooms_cursor = db["rooms"].find({"$or": [{"accommodation_id": accommodation.get("_id")}, {"accommodation_id": str(accommodation.get("_id"))}]})
-        rooms = await rooms_cursor.to_list(length=None)
-        out["rooms"] = [serialize_doc(r) for r in rooms]
-        for r in out["rooms"]:
-            try:
-                if r.get("capacity_adults") is not None or r.get("capacity_children") is not None:
-                    r["capacity_adults"] = int(r.get("capacity_adults") or r.get("capacity") or r.get("sleeps") or 0)
-                    r["capacity_children"] = int(r.get("capacity_children") or 0)
-                    r["capacity"] = r["capacity_adults"] + r["capacity_children"]
-            except Exception:
-                pass
-    except Exception:
-        out["rooms"] = []
     return out
 
 @router.post("/")
@@ -74,6 +97,7 @@ async def create_accommodation(request: Request, accommodation: Accommodation):
     result = await db["accommodations"].insert_one(acc_dict)
     created = await db["accommodations"].find_one({"_id": result.inserted_id})
     out = serialize_doc(created)
+    rate_table.invalidate()
     # Notify subscribers that rooms/accommodations were updated
     try:
         publish_event({"event": "rooms.updated", "room_id": out.get("id")})
@@ -96,6 +120,7 @@ async def update_accommodation(request: Request, accommodation_id: str, accommod
         raise HTTPException(status_code=404, detail="Accommodation not found")
     updated = await db["accommodations"].find_one({"_id": ObjectId(accommodation_id)})
     out = serialize_doc(updated)
+    rate_table.invalidate()
     try:
         publish_event({"event": "rooms.updated", "room_id": out.get("id")})
     except Exception:
@@ -112,6 +137,7 @@ async def delete_accommodation(request: Request, accommodation_id: str):
         raise HTTPException(status_code=400, detail="Invalid accommodation id")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Accommodation not found")
+    rate_table.invalidate()
     try:
         publish_event({"event": "rooms.updated", "room_id": accommodation_id})
     except Exception:
@@ -7,9 +7,15 @@ from typing import Optional, List
 from collections import Counter
 from datetime import datetime
 from resort_backend.utils import get_db_or_503, serialize_doc
+from resort_backend.lib.availability import get_calendar, ACTIVE_STATUSES
+from resort_backend.lib.accommodations import fetch_accommodation_with_rooms
+from resort_backend.lib.reservations import reserve_units, release_booking
+from resort_backend.lib.catalog_cache import catalog_cache, cached_json_response
+from resort_backend.lib.pagination import paged_response
+from resort_backend.lib.pricing import get_rate_table
+from resort_backend.lib.programs_view import programs_view
 from bson import ObjectId
 from pydantic import BaseModel
-import itertools
 import random
 import string
 import re
@@ -19,6 +25,9 @@ import logging
 router = APIRouter(tags=["api_compat"])
 logger = logging.getLogger(__name__)
 
+# activity cards returned by /programs?tag=activities
+ACTIVITY_FIELDS = {"_id": 0, "id": 1, "title": 1, "description": 1, "schedule": 1, "location": 1, "price": 1, "imageUrl": "$image"}
+
 
 class BookingRequest(BaseModel):
     guest_name: str
@@ -40,6 +49,18 @@ class BookingRequest(BaseModel):
     extraBedId: Optional[str] = None
     extraBedQuantity: Optional[int] = 0
 
+class QuoteRequest(BaseModel):
+    check_in: str
+    check_out: str
+    guests: Optional[int] = None
+    allow_extra_beds: Optional[bool] = False
+    preferred_room_types: Optional[List[str]] = None
+    selected_cottages: Optional[List[str]] = None
+    selected_programs: Optional[List[str]] = None
+    extra_beds_qty: Optional[int] = 0
+    extraBedQuantity: Optional[int] = 0
+
+
 def gen_reference():
     return "RB-" + datetime.utcnow().strftime("%Y%m%d%H%M%S") + "-" + ''.join(random.choices(string.digits, k=4))
 
@@ -82,7 +103,13 @@ def _room_capacity(room: dict, allow_extra_beds: bool) -> int:
     return cap
 
 
-def allocate_rooms(candidates, guests: int, allow_extra_beds: bool = False, preferred_room_types=None, max_k: int = 4):
+def allocate_rooms(candidates, guests: int, allow_extra_beds: bool = False, preferred_room_types=None, max_k: Optional[int] = None):
+    """Pick rooms covering `guests`: fewest rooms first, then lowest nightly price.
+
+    0/1 knapsack over capacity capped at `guests` (states 0..guests), so it runs in
+    O(len(candidates) * guests) and has no fixed limit on the number of rooms.
+    `max_k`, when given, caps the number of rooms; returns [] if no allocation fits.
+    """
     if guests <= 0:
         return []
     filtered = []
@@ -101,46 +128,153 @@ def allocate_rooms(candidates, guests: int, allow_extra_beds: bool = False, pref
     annotated = []
     for r in filtered:
         cap = _room_capacity(r, allow_extra_beds)
+        if cap <= 0:
+            continue
         price = r.get("price_per_night") or r.get("pricePerNight") or r.get("price") or 0
-        annotated.append({"room": r, "cap": cap, "price": price})
-
-    singles = [a for a in annotated if a["cap"] >= guests]
-    if singles:
-        pick = min(singles, key=lambda a: a["price"])
-        return [pick["room"]["_id"]]
-
-    n = len(annotated)
-    max_k = min(max_k, n)
-    best_combo = None
-    best_k = None
-    best_price = None
-    for k in range(2, max_k + 1):
-        for combo in itertools.combinations(annotated, k):
-            cap = sum(c["cap"] for c in combo)
-            if cap >= guests:
-                price = sum(c["price"] for c in combo)
-                if best_combo is None or k < best_k or (k == best_k and price < best_price):
-                    best_combo = combo
-                    best_k = k
-                    best_price = price
-        if best_combo is not None:
-            break
-    if best_combo is not None:
-        return [c["room"]["_id"] for c in best_combo]
-
-    sorted_cand = sorted(annotated, key=lambda a: (-a["cap"], a["price"]))
+        try:
+            price = float(price)
+        except (TypeError, ValueError):
+            price = 0.0
+        annotated.append((r, cap, price))
+
+    # best[c] = (rooms, price) for the cheapest fewest-room set reaching capacity c (capped at guests)
+    best = [None] * (guests + 1)
+    best[0] = (0, 0.0)
+    # choices[i][c] = state before room i was added, when room i improved state c
+    choices = []
+    for _, cap, price in annotated:
+        nxt = list(best)
+        took = {}
+        for c in range(guests, -1, -1):
+            cur = best[c]
+            if cur is None:
+                continue
+            t = min(guests, c + cap)
+            cand = (cur[0] + 1, cur[1] + price)
+            if nxt[t] is None or cand < nxt[t]:
+                nxt[t] = cand
+                took[t] = c
+        best = nxt
+        choices.append(took)
+
+    final = best[guests]
+    if final is None or (max_k is not None and final[0] > max_k):
+        return []
     picked = []
-    total = 0
-    for a in sorted_cand:
-        if total >= guests:
+    state = guests
+    for i in range(len(annotated) - 1, -1, -1):
+        if state == 0:
             break
-        picked.append(a["room"]["_id"])
-        total += a["cap"]
-    if total < guests:
-        return []
+        prev = choices[i].get(state)
+        if prev is not None:
+            picked.append(annotated[i][0]["_id"])
+            state = prev
+    picked.reverse()
     return picked
 
 
+def _as_object_id(v):
+    if isinstance(v, ObjectId):
+        return v
+    try:
+        return ObjectId(str(v))
+    except Exception:
+        return v
+
+
+async def resolve_selected_cottages(db, selected: List[str], check_in: datetime, check_out: datetime, cal) -> dict:
+    """Resolve `selected_cottages` entries to room documents in a fixed number of queries.
+
+    Each distinct id is either a room (`_id`/`id`, quantity must be 1) or an
+    accommodation (`_id`/`id`/`slug`, or the `accommodation_id` stored on rooms)
+    that expands to as many free rooms as it was selected, in `_id` order.
+    Returns `{selected_id: [room_doc, ...]}`; raises HTTPException(400) when an id
+    is unknown, a room is busy or an accommodation has too few free rooms.
+    """
+    counts = Counter(selected)
+    ids = list(counts)
+    oids = [ObjectId(i) for i in ids if ObjectId.is_valid(i)]
+
+    rooms = await db["rooms"].find({"$or": [
+        {"_id": {"$in": oids + ids}},
+        {"id": {"$in": ids}},
+        {"accommodation_id": {"$in": oids + ids}},
+    ]}).sort([("_id", 1)]).to_list(length=None)
+    wanted = set(ids)
+    room_by_key = {}
+    pool_by_acc = {}
+    for r in rooms:
+        room_by_key.setdefault(str(r.get("_id")), r)
+        if r.get("id") is not None:
+            room_by_key.setdefault(str(r.get("id")), r)
+        # complete pools only: rooms matched through their own accommodation_id
+        if str(r.get("accommodation_id")) in wanted:
+            pool_by_acc.setdefault(str(r.get("accommodation_id")), []).append(r)
+
+    # Ids that are neither a room nor a known accommodation_id on rooms: try accommodations by id/slug
+    pending = [i for i in ids if i not in room_by_key and i not in pool_by_acc]
+    acc_key = {}
+    if pending:
+        p_oids = [ObjectId(i) for i in pending if ObjectId.is_valid(i)]
+        accs = await db["accommodations"].find(
+            {"$or": [{"_id": {"$in": p_oids + pending}}, {"id": {"$in": pending}}, {"slug": {"$in": pending}}]},
+            {"_id": 1, "id": 1, "slug": 1},
+        ).to_list(length=None)
+        for acc in accs:
+            for k in (acc.get("_id"), acc.get("id"), acc.get("slug")):
+                if k is not None and str(k) in pending:
+                    acc_key[str(k)] = str(acc["_id"])
+        missing_pools = [a for a in set(acc_key.values()) if a not in pool_by_acc]
+        if missing_pools:
+            acc_ids = [ObjectId(a) for a in missing_pools if ObjectId.is_valid(a)] + missing_pools
+            more = await db["rooms"].find({"accommodation_id": {"$in": acc_ids}}).sort([("_id", 1)]).to_list(length=None)
+            for r in more:
+                pool_by_acc.setdefault(str(r.get("accommodation_id")), []).append(r)
+
+    resolution = {}
+    taken = set()
+    for sid, qty in counts.items():
+        room = room_by_key.get(sid)
+        if room is not None:
+            if qty > 1:
+                raise HTTPException(status_code=400, detail=f"Requested {qty} rooms but {sid} is a single room id")
+            if not cal.is_free(room.get("_id"), check_in, check_out) or str(room.get("_id")) in taken:
+                logger.warning(f"create_booking: selected cottage {sid} (resolved {room.get('_id')}) is overlapping")
+                raise HTTPException(status_code=400, detail=f"Cottage {sid} not available for selected dates")
+            resolution[sid] = [room]
+            taken.add(str(room.get("_id")))
+            continue
+        pool = pool_by_acc.get(acc_key.get(sid, sid))
+        if pool is None:
+            logger.warning(f"create_booking: couldn't resolve selected id {sid}")
+            raise HTTPException(status_code=400, detail=f"Cottage {sid} not found")
+        available = [r for r in cal.free_units(pool, check_in, check_out) if str(r.get("_id")) not in taken]
+        if len(available) < qty:
+            raise HTTPException(status_code=400, detail=f"Not enough available rooms in accommodation {sid} for requested quantity")
+        resolution[sid] = available[:qty]
+        taken.update(str(r.get("_id")) for r in resolution[sid])
+    return resolution
+
+
+async def find_conflicting_rooms(db, room_ids: list, check_in: datetime, check_out: datetime) -> set:
+    """Return the ids (as str) of `room_ids` held by an active booking overlapping the stay, in one aggregation."""
+    if not room_ids:
+        return set()
+    pipeline = [
+        {"$match": {
+            "allocated_cottages": {"$in": room_ids},
+            "status": {"$in": ACTIVE_STATUSES},
+            "check_in": {"$lt": check_out},
+            "check_out": {"$gt": check_in},
+        }},
+        {"$project": {"allocated_cottages": 1}},
+        {"$unwind": "$allocated_cottages"},
+        {"$match": {"allocated_cottages": {"$in": room_ids}}},
+        {"$group": {"_id": "$allocated_cottages"}},
+    ]
+    return {str(d["_id"]) async for d in db["bookings"].aggregate(pipeline)}
+
+
 @router.get("/site/site-config.js")
 async def site_config_js():
     config = {"apiBase": "/api", "siteName": "Resort"}
@@ -153,10 +287,17 @@ async def site_config_js():
 
 
 @router.get("/dining")
-async def dining_menu(request: Request):
+async def dining_menu(request: Request, after: Optional[str] = None, limit: Optional[int] = None, format: Optional[str] = None):
     db = get_db_or_503(request)
-    docs = await db["menu"].find().to_list(None)
-    return [serialize_doc(d) for d in docs]
+    paged = await paged_response(request, db["menu"], after=after, limit=limit, format=format)
+    if paged is not None:
+        return paged
+
+    async def load():
+        docs = await db["menu"].find().to_list(None)
+        return [serialize_doc(d) for d in docs]
+
+    return await cached_json_response("menu", "compat", load)
 
 
 @router.post("/dining/ensure")
@@ -170,106 +311,26 @@ async def dining_ensure(request: Request):
             for it in items:
                 it.pop("_id", None)
             await db["menu"].insert_many(items)
+            catalog_cache.invalidate("menu")
     return {"ok": True}
 
 
 @router.get("/programs")
-async def programs_list(request: Request):
-    db = get_db_or_503(request)
-    # If a tag query param is provided and equals 'wellness', return a wrapped
-    # { value: [...], Count: N } payload sourced from `wellnessPrograms` when available.
-    tag = request.query_params.get('tag') if request.query_params else None
-    if tag:
-        t = tag.lower()
-        if t == 'wellness':
-            try:
-                names = await db.list_collection_names()
-            except Exception:
-                raise HTTPException(status_code=500, detail="Failed to list collections")
-
-        async def map_doc_local(d: dict):
-            try:
-                doc = serialize_doc(d)
-            except Exception:
-                doc = dict(d)
-            title = doc.get("title") or doc.get("name") or doc.get("programName") or ""
-            description = doc.get("description") or doc.get("summary") or doc.get("details") or ""
-            duration = doc.get("duration") or (str(doc.get("duration_days")) + " days" if doc.get("duration_days") else doc.get("length") or "")
-            price = doc.get("price") or doc.get("price_inr") or doc.get("cost") or doc.get("amount") or 0
-            try:
-                if isinstance(price, (float, int)):
-                    price_val = int(price)
-                else:
-                    price_val = int(float(str(price)))
-            except Exception:
-                price_val = 0
-            image = doc.get("image")
-            if not image:
-                imgs = doc.get("images") or doc.get("media") or []
-                if isinstance(imgs, list) and len(imgs) > 0:
-                    image = imgs[0]
-            return {
-                "title": title,
-                "description": description,
-                "duration": duration,
-                "price": price_val,
-                "image": image,
-            }
-
-        if "wellnessPrograms" in (await db.list_collection_names()):
-            try:
-                docs = await db["wellnessPrograms"].find().to_list(None)
-            except Exception:
-                raise HTTPException(status_code=500, detail="Failed to query wellnessPrograms")
-            out = [await map_doc_local(d) for d in docs]
-            return {"value": out, "Count": len(out)}
-            # Fallback: continue to normal behavior below if wellnessPrograms not present
-        if t in ('activities', 'resort-activities'):
-            # Return activities collection in a simplified public form
-            async def map_activity(d: dict):
-                try:
-                    doc = serialize_doc(d)
-                except Exception:
-                    doc = dict(d)
-                return {
-                    "title": doc.get("title") or doc.get("name") or "",
-                    "description": doc.get("description") or doc.get("summary") or "",
-                    "schedule": doc.get("schedule") or doc.get("time") or "",
-                    "location": doc.get("location") or "",
-                    "price": doc.get("price") or 0,
-                    "imageUrl": doc.get("imageUrl") or doc.get("image") or (doc.get("images") or (doc.get("media") or []) ) and ( (doc.get("images") or (doc.get("media") or []) )[0] if isinstance((doc.get("images") or (doc.get("media") or [])), list) and len((doc.get("images") or (doc.get("media") or [])))>0 else None),
-                    "id": doc.get("id") or doc.get("_id")
-                }
-
-            if "activities" in (await db.list_collection_names()):
-                try:
-                    docs = await db["activities"].find().to_list(None)
-                except Exception:
-                    raise HTTPException(status_code=500, detail="Failed to query activities")
-                out = [await map_activity(d) for d in docs]
-                return out
-            # else fallthrough to normal behavior
-
-    # Try to return from `programs` if present; else combine wellnessPrograms + activities
-    try:
-        names = await db.list_collection_names()
-    except Exception:
-        raise HTTPException(status_code=500, detail="Failed to list collections")
-
-    async def fetch(name: str):
-        if name in names:
-            docs = await db[name].find().to_list(None)
-            return [serialize_doc(d) for d in docs]
-        return []
-
-    res = await fetch("programs")
-    if res:
-        return res
-    combined = []
-    combined += await fetch("wellnessPrograms")
-    combined += await fetch("activities")
-    return combined
+async def programs_list(request: Request, tag: Optional[str] = None):
+    """Programs from `programs_view` (lib/programs_view.py).
 
+    `tag=wellness` returns `{value, Count}` in the public schema,
+    `tag=activities`/`resort-activities` a list of activity cards, and anything
+    else the stored documents.
+    """
+    db = get_db_or_503(request)
+    t = (tag or "").lower()
+    if t == "wellness":
+        out = await programs_view.public(db, "wellness")
+        return {"value": out, "Count": len(out)}
+    if t in ("activities", "resort-activities"):
+        return await programs_view.public(db, "activities", ACTIVITY_FIELDS)
+    return [serialize_doc(d) for d in await programs_view.raw(db, tag)]
 
 
 @router.get('/sitemap.xml')
@@ -317,76 +378,11 @@ async def sitemap_xml(request: Request):
 
 @router.get("/programs/wellness")
 async def programs_wellness(request: Request):
-    db = get_db_or_503(request)
-    try:
-        names = await db.list_collection_names()
-    except Exception:
-        raise HTTPException(status_code=500, detail="Failed to list collections")
-
-    # Optional API key protection: if enabled via env, require X-API-KEY header.
-    # For developer convenience, do not enforce the API key when running in
-    # a non-production environment (ENVIRONMENT != 'production'). This allows
-    # local frontend dev servers to call `/api/programs/wellness` without
-    # injecting secrets into the client.
-    import os
     # This compatibility endpoint intentionally does not enforce the API key.
     # API key enforcement is available on stricter endpoints; keep this route
     # open for development clients to avoid embedding secrets in the frontend.
-
-    async def map_doc(d: dict):
-        # Map document fields to expected public schema
-        try:
-            doc = serialize_doc(d)
-        except Exception:
-            doc = dict(d)
-        title = doc.get("title") or doc.get("name") or doc.get("programName") or ""
-        description = doc.get("description") or doc.get("summary") or doc.get("details") or ""
-        duration = doc.get("duration") or (str(doc.get("duration_days")) + " days" if doc.get("duration_days") else doc.get("length") or "")
-        price = doc.get("price") or doc.get("price_inr") or doc.get("cost") or doc.get("amount") or 0
-        # normalize numeric
-        try:
-            if isinstance(price, (float, int)):
-                price_val = int(price)
-            else:
-                price_val = int(float(str(price)))
-        except Exception:
-            price_val = 0
-        image = doc.get("image")
-        if not image:
-            imgs = doc.get("images") or doc.get("media") or []
-            if isinstance(imgs, list) and len(imgs) > 0:
-                image = imgs[0]
-        return {
-            "title": title,
-            "description": description,
-            "duration": duration,
-            "price": price_val,
-            "image": image,
-        }
-
-    # Prefer wellnessPrograms collection if it exists
-    if "wellnessPrograms" in names:
-        try:
-            docs = await db["wellnessPrograms"].find().to_list(None)
-        except Exception:
-            raise HTTPException(status_code=500, detail="Failed to query wellnessPrograms")
-        out = []
-        for d in docs:
-            out.append(await map_doc(d))
-        return {"value": out, "Count": len(out)}
-
-    # Fallback: match documents in `programs` with wellness type/tags
-    q = {
-        "$or": [
-            {"type": {"$regex": "wellness", "$options": "i"}},
-            {"tags": {"$elemMatch": {"$regex": "wellness", "$options": "i"}}}
-        ]
-    }
-    try:
-        docs = await db["programs"].find(q).to_list(None)
-    except Exception:
-        raise HTTPException(status_code=500, detail="Failed to query programs collection")
-    out = [await map_doc(d) for d in docs]
+    db = get_db_or_503(request)
+    out = await programs_view.public(db, "wellness")
     return {"value": out, "Count": len(out)}
 
 
@@ -410,17 +406,10 @@ async def rooms_get_by_name(request: Request, room_name: str):
     if not doc:
         # try accommodations fallback where an accommodation matches the slug/id/name
         try:
-            acc = await db["accommodations"].find_one({"$or": [{"slug": room_name}, {"id": room_name}, {"name": {"$regex": f"^{re.escape(room_name)}$", "$options": "i"}}]})
+            a = await fetch_accommodation_with_rooms(db, {"$or": [{"slug": room_name}, {"id": room_name}, {"name": {"$regex": f"^{re.escape(room_name)}$", "$options": "i"}}]})
         except Exception:
-            acc = None
-        if acc:
-            a = serialize_doc(acc)
-            try:
-                rooms_cursor = db["rooms"].find({"$or": [{"accommodation_id": acc.get("_id")}, {"accommodation_id": str(acc.get("_id"))}]})
-                rooms = await rooms_cursor.to_list(length=None)
-                a["rooms"] = [serialize_doc(r) for r in rooms] if rooms else []
-            except Exception:
-                a.setdefault("rooms", [])
+            a = None
+        if a:
             return a
         raise HTTPException(status_code=404, detail="Not found")
 
@@ -439,33 +428,6 @@ async def rooms_get_by_name(request: Request, room_name: str):
     out["allowedExtraBedIds"] = out.get("allowedExtraBedIds") or out.get("allowed_extra_bed_ids") or out.get("allowedExtraBeds") or None
     return out
 
-    # If not found in rooms, try accommodations collection (some datasets store items there)
-    try:
-        acc = await db["accommodations"].find_one({"$or": [
-            {"slug": room_name},
-            {"id": room_name},
-            {"name": {"$regex": f"^{room_name}$", "$options": "i"}}
-        ]})
-    except Exception:
-        acc = None
-
-    if acc:
-        # normalize accommodation document to a room-like response the frontend expects
-        a = serialize_doc(acc)
-        # attach any per-accommodation rooms
-        try:
-            rooms_cursor = db["rooms"].find({"$or": [{"accommodation_id": acc.get("_id")}, {"accommodation_id": str(acc.get("_id"))}]})
-            rooms = await rooms_cursor.to_list(length=None)
-            if rooms:
-                a["rooms"] = [serialize_doc(r) for r in rooms]
-            else:
-                a.setdefault("rooms", [])
-        except Exception:
-            a.setdefault("rooms", [])
-        return a
-
-    raise HTTPException(status_code=404, detail="Not found")
-
 
 @router.get("/dining")
 async def dining_menu(request: Request):
@@ -488,98 +450,71 @@ async def dining_ensure(request: Request):
     return {"ok": True}
 
 
-@router.get("/programs")
-async def programs_list(request: Request):
+@router.get("/programs/activities")
+async def programs_activities(request: Request):
     db = get_db_or_503(request)
-    # Try to return from `programs` if present; else combine wellnessPrograms + activities
+    out = await programs_view.public(db, "activities")
+    return {"value": out, "Count": len(out)}
+
+
+def _parse_stay(data: dict):
+    """Validated (check_in, check_out, guests) from a booking or quote payload."""
     try:
-        names = await db.list_collection_names()
+        s = datetime.strptime(data.get("check_in"), "%Y-%m-%d")
+        e = datetime.strptime(data.get("check_out"), "%Y-%m-%d")
     except Exception:
-        raise HTTPException(status_code=500, detail="Failed to list collections")
+        raise HTTPException(status_code=400, detail="Invalid dates; use YYYY-MM-DD")
+    if e <= s:
+        raise HTTPException(status_code=400, detail="check_out must be after check_in")
 
-    async def fetch(name: str):
-        if name in names:
-            docs = await db[name].find().to_list(None)
-            return [serialize_doc(d) for d in docs]
-        return []
+    try:
+        guests = int(data.get("guests"))
+        if guests <= 0:
+            raise ValueError()
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid guests count")
+    return s, e, guests
 
-    res = await fetch("programs")
-    if res:
-        return res
-    combined = []
-    combined += await fetch("wellnessPrograms")
-    combined += await fetch("activities")
-    return combined
 
+def _extra_beds_qty(data: dict) -> int:
+    try:
+        return max(int(data.get("extra_beds_qty") or data.get("extraBedQuantity") or 0), 0)
+    except (TypeError, ValueError):
+        return 0
 
 
+async def _allocate_stay(db, cal, data: dict, s: datetime, e: datetime, guests: int) -> list:
+    """Rooms for a stay: the free rooms of `selected_cottages`, else an automatic allocation."""
+    allocated = []
+    selected = data.get("selected_cottages") or []
+    if selected:
+        resolution = await resolve_selected_cottages(db, selected, s, e, cal)
+        for rdocs in resolution.values():
+            allocated.extend(_as_object_id(r.get("_id")) for r in rdocs)
 
+    if not allocated:
+        rooms = await db["rooms"].find({"available": True}).to_list(length=None)
+        candidates = cal.free_units(rooms, s, e)
+        allow_extra = bool(data.get("allow_extra_beds", False) or data.get("extra_bedding", False))
+        prefs = data.get("preferred_room_types", None)
+        allocated = allocate_rooms(candidates, guests, allow_extra_beds=allow_extra, preferred_room_types=prefs)
+        if not allocated:
+            raise HTTPException(status_code=400, detail="Not enough cottages available for requested guests/dates")
+    return allocated
 
-@router.get("/programs/activities")
-async def programs_activities(request: Request):
-    db = get_db_or_503(request)
-    try:
-        names = await db.list_collection_names()
-    except Exception:
-        raise HTTPException(status_code=500, detail="Failed to list collections")
-    async def map_doc(d: dict):
-        try:
-            doc = serialize_doc(d)
-        except Exception:
-            doc = dict(d)
-        title = doc.get("title") or doc.get("name") or doc.get("programName") or ""
-        description = doc.get("description") or doc.get("summary") or doc.get("details") or ""
-        duration = doc.get("duration") or (str(doc.get("duration_days")) + " days" if doc.get("duration_days") else doc.get("length") or "")
-        price = doc.get("price") or doc.get("price_inr") or doc.get("cost") or doc.get("amount") or 0
-        try:
-            if isinstance(price, (float, int)):
-                price_val = int(price)
-            else:
-                price_val = int(float(str(price)))
-        except Exception:
-            price_val = 0
-        image = doc.get("image")
-        if not image:
-            imgs = doc.get("images") or doc.get("media") or []
-            if isinstance(imgs, list) and len(imgs) > 0:
-                image = imgs[0]
-        # If image is a relative path, prefix with backend base URL so frontend loads from backend
-        try:
-            if image and isinstance(image, str) and image.startswith("/"):
-                base = str(request.base_url).rstrip("/")
-                image = base + image
-        except Exception:
-            pass
-        return {
-            "title": title,
-            "description": description,
-            "duration": duration,
-            "price": price_val,
-            "image": image,
-        }
-
-    # Prefer activities collection if it exists
-    if "activities" in names:
-        try:
-            docs = await db["activities"].find().to_list(None)
-        except Exception:
-            raise HTTPException(status_code=500, detail="Failed to query activities")
-        out = [await map_doc(d) for d in docs]
-        return {"value": out, "Count": len(out)}
 
-    # Fallback: match documents in `programs` with activity type/tags
-    q = {
-        "$or": [
-            {"type": {"$regex": "activity|activities", "$options": "i"}},
-            {"tags": {"$elemMatch": {"$regex": "activity|activities", "$options": "i"}}}
-        ]
-    }
-    try:
-        docs = await db["programs"].find(q).to_list(None)
-    except Exception:
-        raise HTTPException(status_code=500, detail="Failed to query programs for activities")
-    out = [await map_doc(d) for d in docs]
-    return {"value": out, "Count": len(out)}
+@router.post("/quote")
+async def quote_stay(request: Request, payload: QuoteRequest = Body(...)):
+    """Price a stay exactly as `POST /bookings` would, without creating a booking."""
+    db = get_db_or_503(request)
+    data = payload.dict()
+    s, e, guests = _parse_stay(data)
+    cal = await get_calendar(db)
+    allocated = await _allocate_stay(db, cal, data, s, e, guests)
+    rates = await get_rate_table(db, allocated)
+    breakdown = rates.quote(allocated, s, e, guests, data.get("selected_programs") or [], _extra_beds_qty(data))
+    return {"check_in": data["check_in"], "check_out": data["check_out"], "guests": guests,
+            "allocated_cottages": [str(r) for r in allocated], "price_breakdown": breakdown}
 
 
 @router.post("/bookings", status_code=201)
@@ -602,20 +537,7 @@ async def create_booking(request: Request, payload: BookingRequest = Body(...),
         if len(digits) < 6:
             raise HTTPException(status_code=400, detail="Invalid guest_phone")
 
-    try:
-        s = datetime.strptime(data.get("check_in"), "%Y-%m-%d")
-        e = datetime.strptime(data.get("check_out"), "%Y-%m-%d")
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid dates; use YYYY-MM-DD")
-    if e <= s:
-        raise HTTPException(status_code=400, detail="check_out must be after check_in")
-
-    try:
-        guests = int(data.get("guests"))
-        if guests <= 0:
-            raise ValueError()
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid guests count")
+    s, e, guests = _parse_stay(data)
 
     email = data.get("guest_email")
     if not email:
@@ -644,95 +566,60 @@ async def create_booking(request: Request, payload: BookingRequest = Body(...),
 
     selected = data.get("selected_cottages") or []
 
-    busy_ids = await db["bookings"].distinct("allocated_cottages", {
-        "status": {"$in": ["confirmed", "pending"]},
-        "check_in": {"$lt": e},
-        "check_out": {"$gt": s}
-    })
-    busy_ids = [b for b in busy_ids if b]
+    # Busy rooms come from the in-memory calendar instead of a distinct() + per-room find_one
+    cal = await get_calendar(db)
+    allocated = await _allocate_stay(db, cal, data, s, e, guests)
 
-    allocated = []
-    if selected:
-        # deterministic expansion: treat each unique selected id and a count of requested rooms
-        counts = Counter(selected)
-        busy_ids_str = [str(b) for b in busy_ids]
-        # keep track of room ids we've allocated in this request to avoid duplicates
-        allocated_strs = set()
+    doc = {
+        "reference": gen_reference(),
+        "guest_name": data.get("guest_name"),
+        "guest_email": email,
+        "guest_phone": data.get("guest_phone"),
+        "guests": guests,
+        "selected_cottages": selected,
+        "allocated_cottages": allocated,
+        "payment": data.get("payment"),
+        "extra_bedding": bool(data.get("allow_extra_beds", False) or data.get("extra_bedding", False)),
+        "check_in": s,
+        "check_out": e,
+        "nights": (e - s).days,
+        "price_breakdown": {},
+        "status": "pending",
+        "created_at": datetime.utcnow(),
+        "updated_at": datetime.utcnow(),
+    }
+
+    rates = await get_rate_table(db, allocated)
+    doc["price_breakdown"] = rates.quote(allocated, s, e, guests, data.get("selected_programs") or [], _extra_beds_qty(data))
+
+    # Single authoritative overlap check: other workers may have booked since our calendar loaded
+    conflicts = await find_conflicting_rooms(db, allocated, s, e)
+    if conflicts:
+        cal.invalidate()
+        logger.warning(f"create_booking: rooms {sorted(conflicts)} overlap an existing booking")
+        raise HTTPException(status_code=400, detail="Selected cottages are no longer available for selected dates")
+
+    # Claim the rooms' nights atomically; closes the race between the check above and the insert
+    doc["_id"] = ObjectId()
+    if not await reserve_units(db, allocated, doc["_id"], s, e):
+        cal.invalidate()
+        raise HTTPException(status_code=400, detail="Selected cottages are no longer available for selected dates")
+    try:
+        res = await db["bookings"].insert_one(doc)
+    except Exception:
+        await release_booking(db, doc["_id"])
+        raise
+    cal.reserve(res.inserted_id, allocated, s, e)
+    created = await db["bookings"].find_one({"_id": res.inserted_id})
 
-        for sid, qty in counts.items():
-            # Attempt to resolve sid as a room id first
-            resolved_rooms = []
+    out = serialize_doc(created)
+    try:
+        from resort_backend.routes.events import publish_event
+        publish_event({"event": "bookings.created", "payload": {"id": out.get("id"), "reference": out.get("reference"), "status": out.get("status")}})
+    except Exception:
+        pass
 
-            # Try ObjectId conversion -> room
-            try:
-                oid_try = ObjectId(sid)
-                room_doc = await db["rooms"].find_one({"_id": oid_try})
-                if room_doc:
-                    # if qty >1 but only one physical room id provided, it's invalid
-                    if qty > 1:
-                        raise HTTPException(status_code=400, detail=f"Requested {qty} rooms but {sid} is a single room id")
-                    resolved_rooms = [room_doc]
-            except Exception:
-                # ignore conversion errors
-                resolved_rooms = []
-
-            # If not a room, try matching by room fields (accommodation_id/id/_id string)
-            if not resolved_rooms:
-                try:
-                    r = await db["rooms"].find_one({"$or": [{"accommodation_id": sid}, {"id": sid}, {"_id": sid}]})
-                    if r:
-                        if qty > 1:
-                            raise HTTPException(status_code=400, detail=f"Requested {qty} rooms but {sid} resolves to a single room")
-                        resolved_rooms = [r]
-                except Exception:
-                    resolved_rooms = []
-
-            # If still not a specific room, treat sid as an accommodation id/slug and expand to `qty` room docs
-            if not resolved_rooms:
-                try:
-                    acc = await db["accommodations"].find_one({"$or": [{"id": sid}, {"_id": sid}, {"slug": sid}]})
-                except Exception:
-                    acc = None
-                if not acc:
-                    logger.warning(f"create_booking: couldn't resolve selected id {sid}")
-                    raise HTTPException(status_code=400, detail=f"Cottage {sid} not found")
-
-                # Query rooms for this accommodation deterministically by _id (stable ordering)
-                try:
-                    rooms_cursor = db["rooms"].find({"$or": [{"accommodation_id": acc.get("_id")}, {"accommodation_id": str(acc.get("_id"))}] }).sort([("_id", 1)])
-                    rooms = await rooms_cursor.to_list(length=None)
-                except Exception:
-                    rooms = []
-
-                # Filter out busy rooms and already allocated ones
-                available = [r for r in rooms if str(r.get("_id")) not in busy_ids_str and str(r.get("_id")) not in allocated_strs]
-                if len(available) < qty:
-                    raise HTTPException(status_code=400, detail=f"Not enough available rooms in accommodation {sid} for requested quantity")
-                resolved_rooms = available[:qty]
-
-            # Now convert resolved_rooms to ObjectIds and check overlaps, append to allocated
-            for rdoc in resolved_rooms:
-                oid_final = rdoc.get("_id")
-                try:
-                    if not isinstance(oid_final, ObjectId):
-                        oid_final = ObjectId(str(oid_final))
-                except Exception:
-                    pass
-
-                # check overlapping bookings again for safety
-                overlapping = await db["bookings"].find_one({
-                    "allocated_cottages": oid_final,
-                    "status": {"$in": ["confirmed", "pending"]},
-                    "check_in": {"$lt": e},
-                    "check_out": {"$gt": s}
-                })
-                if overlapping:
-                    resolved_id = str(oid_final) if oid_final is not None else sid
-                    logger.warning(f"create_booking: selected cottage {sid} (resolved {resolved_id}) is overlapping")
-                    raise HTTPException(status_code=400, detail=f"Cottage {sid} not available for selected dates")
-
-                allocated.append(oid_final)
-                allocated_strs.add(str(oid_final))
+    return {"id": out.get("id"), "reference": out.get("reference"), "status": out.get("status"), "allocated_cottages": out.get("allocated_cottages"), "price_breakdown": out.get("price_breakdown")}
 
 
 @router.get("/_debug/room/{room_id}")
@@ -754,8 +641,9 @@ async def debug_room(request: Request, room_id: str):
     except Exception:
         tried.append({"as_object_id": None})
 
-    # try exact string match on accommodation_id or id fields
-    doc = await db["rooms"].find_one({"$or": [{"accommodation_id": room_id}, {"id": room_id}, {"_id": room_id}]})
+    # try exact match on accommodation_id (stored as the accommodation's native _id) or id fields
+    aid = ObjectId(room_id) if ObjectId.is_valid(room_id) else room_id
+    doc = await db["rooms"].find_one({"$or": [{"accommodation_id": aid}, {"id": room_id}, {"_id": room_id}]})
     if doc:
         return {"found": True, "method": "string_match", "doc": serialize_doc(doc)}
 
@@ -791,15 +679,12 @@ async def rooms_name_debug(request: Request, room_name: str):
         pass
     # try accommodation lookup
     try:
-        acc = await db["accommodations"].find_one({"$or": [{"slug": room_name}, {"id": room_name}, {"name": {"$regex": f"^{re.escape(room_name)}$", "$options": "i"}}]})
+        acc = await fetch_accommodation_with_rooms(db, {"$or": [{"slug": room_name}, {"id": room_name}, {"name": {"$regex": f"^{re.escape(room_name)}$", "$options": "i"}}]})
     except Exception:
         acc = None
     if acc:
-        try:
-            rooms = await db["rooms"].find({"$or": [{"accommodation_id": acc.get("_id")}, {"accommodation_id": str(acc.get("_id"))}]}).to_list(length=None)
-            return {"found": True, "method": "accommodation", "acc": serialize_doc(acc), "rooms": [serialize_doc(r) for r in rooms]}
-        except Exception:
-            pass
+        rooms = acc.pop("rooms", [])
+        return {"found": True, "method": "accommodation", "acc": acc, "rooms": rooms}
     return {"found": False}
 
 
@@ -815,100 +700,6 @@ async def debug_counts(request: Request):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-    if not allocated:
-        q = {"available": True}
-        if busy_ids:
-            q["_id"] = {"$nin": busy_ids}
-        candidates = await db["rooms"].find(q).to_list(length=None)
-        allow_extra = bool(data.get("allow_extra_beds", False) or data.get("extra_bedding", False))
-        prefs = data.get("preferred_room_types", None)
-        allocated = allocate_rooms(candidates, guests, allow_extra_beds=allow_extra, preferred_room_types=prefs, max_k=4)
-        if not allocated:
-            raise HTTPException(status_code=400, detail="Not enough cottages available for requested guests/dates")
-
-    doc = {
-        "reference": gen_reference(),
-        "guest_name": data.get("guest_name"),
-        "guest_email": email,
-        "guest_phone": data.get("guest_phone"),
-        "guests": guests,
-        "selected_cottages": selected,
-        "allocated_cottages": allocated,
-        "payment": data.get("payment"),
-        "extra_bedding": bool(data.get("allow_extra_beds", False) or data.get("extra_bedding", False)),
-        "check_in": s,
-        "check_out": e,
-        "nights": (e - s).days,
-        "price_breakdown": {},
-        "status": "pending",
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow(),
-    }
-
-    nights = doc.get("nights", 0) or 0
-    room_docs = []
-    if allocated:
-        room_docs = await db["rooms"].find({"_id": {"$in": allocated}}).to_list(length=None)
-    rooms_subtotal = 0.0
-    per_room = []
-    for r in room_docs:
-        price = r.get("price_per_night") or r.get("pricePerNight") or r.get("price") or 0
-        rooms_subtotal += float(price) * max(int(nights), 1)
-        per_room.append({"room_id": str(r.get("_id")), "price_per_night": price})
-
-    # Handle selected wellness programs (optional) and include in pricing
-    programs_subtotal = 0.0
-    program_items = []
-    sel_programs = data.get("selected_programs") or []
-    if sel_programs:
-        for pid in sel_programs:
-            prog_doc = None
-            try:
-                oid = ObjectId(pid)
-                prog_doc = await db["wellnessPrograms"].find_one({"_id": oid})
-            except Exception:
-                prog_doc = None
-            if not prog_doc:
-                # try string match fields in wellnessPrograms
-                prog_doc = await db["wellnessPrograms"].find_one({"$or": [{"id": pid}, {"_id": pid}]})
-            if not prog_doc:
-                prog_doc = await db["programs"].find_one({"$or": [{"_id": pid}, {"id": pid}]})
-            if not prog_doc:
-                # not found; skip silently to avoid blocking booking creation
-                continue
-            p = serialize_doc(prog_doc)
-            p_price = p.get("price") or p.get("price_inr") or p.get("cost") or 0
-            try:
-                p_price_val = int(float(p_price))
-            except Exception:
-                p_price_val = 0
-            programs_subtotal += p_price_val
-            program_items.append({"program_id": str(p.get("id") or p.get("_id") or pid), "title": p.get("title") or p.get("name"), "price": p_price_val})
-
-    combined_subtotal = rooms_subtotal + programs_subtotal
-    tax = round(combined_subtotal * 0.18, 2)
-    total = round(combined_subtotal + tax, 2)
-    doc["price_breakdown"] = {
-        "rooms_subtotal": round(rooms_subtotal, 2),
-        "programs_subtotal": round(programs_subtotal, 2),
-        "tax": tax,
-        "total": total,
-        "per_room": per_room,
-        "programs": program_items,
-    }
-
-    res = await db["bookings"].insert_one(doc)
-    created = await db["bookings"].find_one({"_id": res.inserted_id})
-
-    out = serialize_doc(created)
-    try:
-        from resort_backend.routes.events import publish_event
-        publish_event({"event": "bookings.created", "payload": {"id": out.get("id"), "reference": out.get("reference"), "status": out.get("status")}})
-    except Exception:
-        pass
-
-    return {"id": out.get("id"), "reference": out.get("reference"), "status": out.get("status"), "allocated_cottages": out.get("allocated_cottages"), "price_breakdown": out.get("price_breakdown")}
-
 
 @router.get("/debug/db-info")
 async def debug_db_info(request: Request, sample_col: Optional[str] = None, limit: int = 5):
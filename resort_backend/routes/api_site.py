@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Request, HTTPException
 from resort_backend.utils import get_db_or_503, serialize_doc
+from resort_backend.lib.catalog_cache import cached_json_response
 
 router = APIRouter(tags=["site"])
 
@@ -7,7 +8,11 @@ router = APIRouter(tags=["site"])
 @router.get("/site")
 async def get_site(request: Request):
     db = get_db_or_503(request)
-    site = await db["site"].find_one(sort=[("createdAt", -1)])
-    if not site:
-        raise HTTPException(status_code=404, detail="Site config not found")
-    return serialize_doc(site)
+
+    async def load():
+        site = await db["site"].find_one(sort=[("createdAt", -1)])
+        if not site:
+            raise HTTPException(status_code=404, detail="Site config not found")
+        return serialize_doc(site)
+
+    return await cached_json_response("site", "latest", load)
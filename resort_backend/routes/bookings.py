@@ -2,12 +2,13 @@
 from fastapi import APIRouter, HTTPException, Request
 from pydantic import BaseModel, Field
 from bson import ObjectId
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import List, Union, Optional
 import pymongo
-from uuid import uuid4
-from resort_backend.utils import get_db_or_503, serialize_doc
-from resort_backend.lib.locks import acquire_lock, release_lock
+from resort_backend.utils import get_db_or_503, serialize_doc, docs_response
+from resort_backend.lib.reservations import reserve_units, release_booking
+from resort_backend.lib.availability import get_calendar, calendar
+from resort_backend.lib.pagination import paged_response
 from resort_backend.routes.events import publish_event
 
 
@@ -62,14 +63,24 @@ class MenuItem(BaseModel):
 
 
 @router.get("/", response_model=List[dict], summary="Get all bookings")
-async def get_all_bookings(request: Request):
-    """Return all bookings with extraBeds and cottage fields for frontend compatibility."""
+async def get_all_bookings(request: Request, after: Optional[str] = None, limit: Optional[int] = None, format: Optional[str] = None):
+    """Return all bookings with extraBeds and cottage fields for frontend compatibility.
+
+    Supports keyset paging (`?after=<id>&limit=N`) and `?format=ndjson` exports.
+    """
     db = get_db_or_503(request)
+    paged = await paged_response(request, db["bookings"], after=after, limit=limit, format=format,
+                                 transform=_with_booking_defaults, filename="bookings.ndjson")
+    if paged is not None:
+        return paged
     bookings = await db["bookings"].find().to_list(None)
-    for b in bookings:
-        b.setdefault("extraBeds", 0)
-        b.setdefault("cottage", "")
-    return [serialize_doc(b) for b in bookings]
+    return docs_response([_with_booking_defaults(b) for b in bookings])
+
+
+def _with_booking_defaults(b: dict) -> dict:
+    b.setdefault("extraBeds", 0)
+    b.setdefault("cottage", "")
+    return b
 
 
 @router.get("/{booking_id}")
@@ -97,6 +108,19 @@ async def get_booking(request: Request, booking_id: str):
 ## Removed duplicate get_booking_by_query endpoint. Use /bookings/{booking_id} instead.
 
 
+async def _legacy_overlap(db, accommodation_id, check_in: datetime, check_out: datetime, exclude=None, session=None):
+    """An active booking of `accommodation_id` overlapping the stay (other than `exclude`), or None."""
+    q = {
+        "accommodation_id": accommodation_id,
+        "status": {"$ne": "cancelled"},
+        "check_in": {"$lt": check_out},
+        "check_out": {"$gt": check_in},
+    }
+    if exclude is not None:
+        q["_id"] = {"$ne": exclude}
+    return await db["bookings"].find_one(q, session=session)
+
+
 @router.post("/")
 async def create_booking(request: Request, booking: BookingCreateRequest):
     db = get_db_or_503(request)
@@ -163,7 +187,7 @@ async def create_booking(request: Request, booking: BookingCreateRequest):
                 total_cap = int(acc.get("capacity") or acc.get("sleeps") or 0)
                 # if accommodation has rooms, sum their capacity
                 try:
-                    rooms = await db["rooms"].find({"$or": [{"accommodation_id": acc.get("_id")}, {"accommodation_id": str(acc.get("_id"))}]}).to_list(None)
+                    rooms = await db["rooms"].find({"accommodation_id": acc.get("_id")}).to_list(None)
                     if rooms:
                         total_cap = sum(int(r.get("capacity") or r.get("sleeps") or 0) for r in rooms)
                         extra_available = sum(int(r.get("extra_beds") or r.get("extra_bedding") or 0) for r in rooms)
@@ -194,19 +218,13 @@ async def create_booking(request: Request, booking: BookingCreateRequest):
     if check_in_dt >= check_out_dt:
         raise HTTPException(status_code=400, detail="check_in must be before check_out")
 
-    # Build list of nights (dates) the booking will occupy (check_in date .. check_out date - 1)
-    start_date = check_in_dt
-    end_date = check_out_dt
-    nights = []
-    d = start_date
-    while d < end_date:
-        nights.append(datetime(d.year, d.month, d.day))
-        d += timedelta(days=1)
+    # Cheap in-memory rejection before opening a transaction
+    cal = await get_calendar(db)
+    if not cal.all_free(booking_dict["accommodation_id"], check_in_dt, check_out_dt):
+        raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
 
     client = getattr(request.app.state, "db_client", None)
-
-    lock_owner = None
-    lock_key = f"accom:{booking_dict['accommodation_id']}:{start_date.isoformat()}:{end_date.isoformat()}"
+    created = None
 
     # If we have a MongoDB client that supports transactions (replica set), prefer a transaction
     if client is not None and hasattr(client, "start_session"):
@@ -215,74 +233,46 @@ async def create_booking(request: Request, booking: BookingCreateRequest):
                 async with session.start_transaction():
                     result = await db["bookings"].insert_one(booking_dict, session=session)
                     booking_id = result.inserted_id
-                    # create per-night occupancy documents to enforce uniqueness
-                    occ_docs = []
-                    for nd in nights:
-                        occ_docs.append({
-                            "accommodation_id": booking_dict["accommodation_id"],
-                            "date": nd,
-                            "booking_id": booking_id,
-                            "created_at": datetime.utcnow(),
-                        })
-                    if occ_docs:
-                        await db["occupancies"].insert_many(occ_docs, ordered=True, session=session)
+                    # claim the stay range; conflicts with any stay sharing a night
+                    if not await reserve_units(db, booking_dict["accommodation_id"], booking_id, check_in_dt, check_out_dt, session=session):
+                        raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
+                    # same legacy check as below: bookings made before range reservations existed
+                    if await _legacy_overlap(db, booking_dict["accommodation_id"], check_in_dt, check_out_dt, exclude=booking_id, session=session):
+                        raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
                     created = await db["bookings"].find_one({"_id": booking_id}, session=session)
+        except HTTPException:
+            raise
         except pymongo.errors.DuplicateKeyError:
-            raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
+            # two first claims on a (unit, month) raced; the aborted transaction cannot
+            # retry, so the claim is made again below without one
+            created = None
         except pymongo.errors.PyMongoError:
             # If transactions aren't supported or another error occurred, fall back
-            # to using a distributed lock, implemented below.
+            # to claiming the range first and inserting afterwards, below.
             created = None
         except Exception:
             created = None
-    else:
-        # No client/session available — fall back to using distributed lock
-        created = None
-
-    # If transactional path did not create the booking, attempt lock-based fallback
-    if "created" not in locals() or created is None:
-        # FIX: Remove unsupported retry_delay argument
-        lock_owner = await acquire_lock(
-            db,
-            lock_key,
-            owner=uuid4().hex,
-            ttl_seconds=30,
-            timeout=5.0
-        )
-        if not lock_owner:
-            raise HTTPException(status_code=409, detail="Accommodation is busy; try again")
+
+    # No transaction: the range claim is atomic on its own, so take it before inserting
+    # and give it back if the booking cannot be written.
+    if created is None:
+        booking_id = ObjectId()
+        if not await reserve_units(db, booking_dict["accommodation_id"], booking_id, check_in_dt, check_out_dt):
+            raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
         try:
-            overlap = await db["bookings"].find_one({
-                "accommodation_id": booking_dict["accommodation_id"],
-                "status": {"$ne": "cancelled"},
-                "check_in": {"$lt": check_out_dt},
-                "check_out": {"$gt": check_in_dt},
-            })
-            if overlap:
+            # bookings made before range reservations existed are not in room_nights
+            if await _legacy_overlap(db, booking_dict["accommodation_id"], check_in_dt, check_out_dt):
                 raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
-            # insert booking and create occupancy docs (best-effort)
-            result = await db["bookings"].insert_one(booking_dict)
-            booking_id = result.inserted_id
-            occ_docs = []
-            for nd in nights:
-                occ_docs.append({
-                    "accommodation_id": booking_dict["accommodation_id"],
-                    "date": nd,
-                    "booking_id": booking_id,
-                    "created_at": datetime.utcnow(),
-                })
-            if occ_docs:
-                try:
-                    await db["occupancies"].insert_many(occ_docs, ordered=True)
-                except Exception:
-                    await db["bookings"].delete_one({"_id": booking_id})
-                    raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
+            booking_dict["_id"] = booking_id
+            await db["bookings"].insert_one(booking_dict)
             created = await db["bookings"].find_one({"_id": booking_id})
-        finally:
+        except BaseException:
             try:
-                await release_lock(db, lock_key, owner=lock_owner)
+                await release_booking(db, booking_id)
             except Exception:
                 pass
+            raise
+    cal.reserve(created["_id"], booking_dict["accommodation_id"], check_in_dt, check_out_dt)
     out = serialize_doc(created)
     # Notify subscribers that a booking was created
     try:
@@ -331,24 +321,28 @@ async def delete_booking(request: Request, booking_id: str):
     booking = await db["bookings"].find_one({"_id": b_id})
     if not booking:
         raise HTTPException(status_code=404, detail="Booking not found")
-    # Remove occupancies associated with this booking (best-effort)
+    # Free the booking's reserved range (best-effort)
     try:
-        await db["occupancies"].delete_many({"booking_id": b_id})
+        await release_booking(db, b_id)
     except Exception:
-        # booking deletion should proceed even if occupancy cleanup fails
+        # booking deletion should proceed even if reservation cleanup fails
         pass
     result = await db["bookings"].delete_one({"_id": b_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Booking not found")
+    calendar.release(b_id)
     return {"message": "Booking deleted successfully"}
 
 
 @router.get("/guest/{guest_email}")
-async def get_guest_bookings(request: Request, guest_email: str):
+async def get_guest_bookings(request: Request, guest_email: str, after: Optional[str] = None, limit: Optional[int] = None, format: Optional[str] = None):
     """Get all bookings for a specific guest"""
     db = get_db_or_503(request)
+    paged = await paged_response(request, db["bookings"], {"guest_email": guest_email}, after=after, limit=limit, format=format)
+    if paged is not None:
+        return paged
     bookings = await db["bookings"].find({"guest_email": guest_email}).to_list(None)
-    return [serialize_doc(b) for b in bookings]
+    return docs_response(bookings)
 
 
 @router.get('/me')
@@ -361,19 +355,20 @@ async def my_bookings(request: Request):
     # match by user id or user email
     q = {"$or": [{"user_id": user.get('id')}, {"guest_email": user.get('email')}]} if user else {}
     bookings = await db['bookings'].find(q).to_list(None)
-    return [serialize_doc(b) for b in bookings]
+    return docs_response(bookings)
 
 
 @router.post("/{booking_id}/release")
 async def release_occupancies_endpoint(request: Request, booking_id: str):
-    """Admin-safe endpoint: release occupancies associated with a booking id."""
+    """Admin-safe endpoint: release the nights reserved for a booking id."""
     db = get_db_or_503(request)
     try:
         b_id = ObjectId(booking_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid booking id")
-    res = await db["occupancies"].delete_many({"booking_id": b_id})
-    return {"released": int(res.deleted_count)}
+    released = await release_booking(db, b_id)
+    calendar.release(b_id)
+    return {"released": released}
 
 
     # ...existing code...
@@ -389,6 +384,8 @@ async def cancel_booking(request: Request, booking_id: str):
         result = await db["bookings"].update_one({"_id": ObjectId(booking_id)}, {"$set": {"status": "cancelled"}})
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Booking not found.")
+        await release_booking(db, booking_id)
+        calendar.release(booking_id)
         return {"success": True}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
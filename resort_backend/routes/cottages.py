@@ -1,12 +1,18 @@
-from fastapi import APIRouter, HTTPException, Request, Query
+from fastapi import APIRouter, HTTPException, Request, Query, Depends
 from pydantic import BaseModel
 from bson import ObjectId
 from datetime import datetime
 from resort_backend.utils import get_db_or_503, serialize_doc
+from resort_backend.lib.availability import booked_unit_ids
+from resort_backend.lib.pagination import paged_response
+from resort_backend.lib.uploads import receive_upload, release, sync_refs, image_urls
+from resort_backend.routes.gallery import admin_key_dep
 from typing import Optional
 
 router = APIRouter(tags=["cottages"])
 
+IMAGE_FIELDS = ("images",)
+
 # Pydantic model for cottage
 class CottageModel(BaseModel):
     name: str
@@ -33,8 +39,11 @@ class CottageUpdateModel(BaseModel):
     maintenance: Optional[bool] = None
 
 @router.get("/all")
-async def get_all_cottages_admin(request: Request):
+async def get_all_cottages_admin(request: Request, after: Optional[str] = None, limit: Optional[int] = None, format: Optional[str] = None):
     db = get_db_or_503(request)
+    paged = await paged_response(request, db["cottages"], after=after, limit=limit, format=format, filename="cottages.ndjson")
+    if paged is not None:
+        return paged
     try:
         cottages = await db["cottages"].find().to_list(None)
         return [serialize_doc(c) for c in cottages]
@@ -46,6 +55,7 @@ async def create_cottage(request: Request, cottage: CottageModel):
     db = get_db_or_503(request)
     try:
         result = await db["cottages"].insert_one(cottage.dict())
+        await sync_refs(db, [], image_urls(cottage.dict(), IMAGE_FIELDS))
         new_cottage = await db["cottages"].find_one({"_id": result.inserted_id})
         return serialize_doc(new_cottage)
     except Exception as e:
@@ -56,10 +66,11 @@ async def update_cottage(request: Request, cottage_id: str, cottage: CottageUpda
     db = get_db_or_503(request)
     try:
         update_data = {k: v for k, v in cottage.dict().items() if v is not None}
-        result = await db["cottages"].update_one({"_id": ObjectId(cottage_id)}, {"$set": update_data})
-        if result.matched_count == 0:
+        before = await db["cottages"].find_one_and_update({"_id": ObjectId(cottage_id)}, {"$set": update_data})
+        if before is None:
             raise HTTPException(status_code=404, detail="Cottage not found.")
         updated_cottage = await db["cottages"].find_one({"_id": ObjectId(cottage_id)})
+        await sync_refs(db, image_urls(before, IMAGE_FIELDS), image_urls(updated_cottage, IMAGE_FIELDS))
         return serialize_doc(updated_cottage)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -68,13 +79,37 @@ async def update_cottage(request: Request, cottage_id: str, cottage: CottageUpda
 async def delete_cottage(request: Request, cottage_id: str):
     db = get_db_or_503(request)
     try:
-        result = await db["cottages"].delete_one({"_id": ObjectId(cottage_id)})
-        if result.deleted_count == 0:
+        deleted = await db["cottages"].find_one_and_delete({"_id": ObjectId(cottage_id)})
+        if deleted is None:
             raise HTTPException(status_code=404, detail="Cottage not found.")
+        await release(db, set(image_urls(deleted, IMAGE_FIELDS)))
         return
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
 
+@router.post("/{cottage_id}/images", status_code=201, dependencies=[Depends(admin_key_dep)])
+async def upload_cottage_image(request: Request, cottage_id: str):
+    """Add an uploaded image (multipart field `file`) to a cottage's `images`."""
+    db = get_db_or_503(request)
+    try:
+        oid = ObjectId(cottage_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cottage id")
+    if await db["cottages"].find_one({"_id": oid}, {"_id": 1}) is None:
+        raise HTTPException(status_code=404, detail="Cottage not found.")
+    blob, _ = await receive_upload(request, db)
+    url = blob["url"]
+    # items created without images store images: null, which $addToSet rejects
+    await db["cottages"].update_one({"_id": oid, "images": None}, {"$set": {"images": []}})
+    before = await db["cottages"].find_one_and_update({"_id": oid}, {"$addToSet": {"images": url}})
+    if before is None or url in image_urls(before, IMAGE_FIELDS):
+        # cottage deleted meanwhile, or it already holds (a reference to) this image
+        await release(db, [url])
+        if before is None:
+            raise HTTPException(status_code=404, detail="Cottage not found.")
+    updated_cottage = await db["cottages"].find_one({"_id": oid})
+    return serialize_doc(updated_cottage)
+
 @router.get("/")
 async def get_all_cottages(
     request: Request,
@@ -83,47 +118,27 @@ async def get_all_cottages(
 ):
     """Get all cottages (alias for accommodations), optionally filter by availability"""
     db = get_db_or_503(request)
-    try:
-        cottages = await db["cottages"].find().to_list(None)
-        out = [serialize_doc(c) for c in cottages]
-
-        # If no date filter, return all cottages
-        if not availableStart or not availableEnd:
-            return out
-
-        # Parse dates
+    query = {}
+    if availableStart and availableEnd:
         try:
             start_date = datetime.strptime(availableStart, "%Y-%m-%d")
             end_date = datetime.strptime(availableEnd, "%Y-%m-%d")
         except Exception:
             raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD.")
-
-        # Get all bookings that overlap with the requested range
-        bookings = await db["bookings"].find({
-            "$or": [
-                {
-                    "check_in": {"$lt": availableEnd},
-                    "check_out": {"$gt": availableStart}
-                }
-            ]
-        }).to_list(None)
-        booked_ids = set()
-        for b in bookings:
-            # booking may be for one or multiple cottages
-            acc_ids = b.get("accommodation_id")
-            if isinstance(acc_ids, list):
-                booked_ids.update(str(aid) for aid in acc_ids)
-            elif acc_ids:
-                booked_ids.add(str(acc_ids))
-
-        # Only return cottages that are NOT booked in the given range
-        available_cottages = [c for c in out if str(c.get("_id") or c.get("id")) not in booked_ids]
-        # Optionally, add 'available' property for frontend
-        for c in available_cottages:
-            c['available'] = True
-        return available_cottages
+        # Booked units come from one typed overlap aggregation; the exclusion runs in Mongo
+        booked_ids = await booked_unit_ids(db, start_date, end_date)
+        if booked_ids:
+            query["_id"] = {"$nin": booked_ids}
+    try:
+        cottages = await db["cottages"].find(query).to_list(None)
     except Exception:
         raise HTTPException(status_code=500, detail="Failed to fetch cottages")
+    out = [serialize_doc(c) for c in cottages]
+    if availableStart and availableEnd:
+        # Optionally, add 'available' property for frontend
+        for c in out:
+            c['available'] = True
+    return out
 
 @router.get("/{cottage_id}")
 async def get_cottage(request: Request, cottage_id: str):
@@ -1,12 +1,17 @@
 
-from fastapi import APIRouter, HTTPException, Request
+from fastapi import APIRouter, HTTPException, Request, Depends
 from resort_backend.utils import get_db_or_503, serialize_doc
+from resort_backend.lib.catalog_cache import catalog_cache, cached_json_response
+from resort_backend.lib.uploads import receive_upload, release, sync_refs, image_urls
+from resort_backend.routes.gallery import admin_key_dep
 from pydantic import BaseModel
 from typing import Optional
 from bson import ObjectId
 
 router = APIRouter(tags=["dining"])
 
+IMAGE_FIELDS = ("image", "images")
+
 
 # Pydantic model for menu item
 class MenuItem(BaseModel):
@@ -37,19 +42,25 @@ async def get_dining(request: Request):
     Returns all menu items from the 'menu' collection in MongoDB.
     """
     db = get_db_or_503(request)
-    try:
-        items = await db["menu"].find().to_list(None)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
-    if not items:
-        raise HTTPException(status_code=404, detail="No menu items found in 'menu' collection.")
-    return [serialize_doc(i) for i in items]
+
+    async def load():
+        try:
+            items = await db["menu"].find().to_list(None)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+        if not items:
+            raise HTTPException(status_code=404, detail="No menu items found in 'menu' collection.")
+        return [serialize_doc(i) for i in items]
+
+    return await cached_json_response("menu", "all", load)
 
 @router.post("/dining", status_code=201)
 async def create_menu_item(request: Request, item: MenuItem):
     db = get_db_or_503(request)
     try:
         result = await db["menu"].insert_one(item.dict())
+        catalog_cache.invalidate("menu")
+        await sync_refs(db, [], image_urls(item.dict(), IMAGE_FIELDS))
         new_item = await db["menu"].find_one({"_id": result.inserted_id})
         return serialize_doc(new_item)
     except Exception as e:
@@ -60,10 +71,12 @@ async def update_menu_item(request: Request, item_id: str, item: MenuItemUpdate)
     db = get_db_or_503(request)
     try:
         update_data = {k: v for k, v in item.dict().items() if v is not None}
-        result = await db["menu"].update_one({"_id": ObjectId(item_id)}, {"$set": update_data})
-        if result.matched_count == 0:
+        before = await db["menu"].find_one_and_update({"_id": ObjectId(item_id)}, {"$set": update_data})
+        if before is None:
             raise HTTPException(status_code=404, detail="Menu item not found.")
+        catalog_cache.invalidate("menu")
         updated_item = await db["menu"].find_one({"_id": ObjectId(item_id)})
+        await sync_refs(db, image_urls(before, IMAGE_FIELDS), image_urls(updated_item, IMAGE_FIELDS))
         return serialize_doc(updated_item)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
@@ -72,9 +85,40 @@ async def update_menu_item(request: Request, item_id: str, item: MenuItemUpdate)
 async def delete_menu_item(request: Request, item_id: str):
     db = get_db_or_503(request)
     try:
-        result = await db["menu"].delete_one({"_id": ObjectId(item_id)})
-        if result.deleted_count == 0:
+        deleted = await db["menu"].find_one_and_delete({"_id": ObjectId(item_id)})
+        if deleted is None:
             raise HTTPException(status_code=404, detail="Menu item not found.")
+        catalog_cache.invalidate("menu")
+        await release(db, set(image_urls(deleted, IMAGE_FIELDS)))
         return
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
+
+@router.post("/dining/{item_id}/images", status_code=201, dependencies=[Depends(admin_key_dep)])
+async def upload_menu_item_image(request: Request, item_id: str):
+    """Add an uploaded image (multipart field `file`) to a menu item's `images`.
+
+    The first image also becomes the item's main `image`.
+    """
+    db = get_db_or_503(request)
+    try:
+        oid = ObjectId(item_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid menu item id")
+    if await db["menu"].find_one({"_id": oid}, {"_id": 1}) is None:
+        raise HTTPException(status_code=404, detail="Menu item not found.")
+    blob, _ = await receive_upload(request, db)
+    url = blob["url"]
+    # items created without images store images: null, which $addToSet rejects
+    await db["menu"].update_one({"_id": oid, "images": None}, {"$set": {"images": []}})
+    before = await db["menu"].find_one_and_update({"_id": oid}, {"$addToSet": {"images": url}})
+    if before is None or url in image_urls(before, IMAGE_FIELDS):
+        # item deleted meanwhile, or it already holds (a reference to) this image
+        await release(db, [url])
+        if before is None:
+            raise HTTPException(status_code=404, detail="Menu item not found.")
+    if before is not None and not before.get("image"):
+        await db["menu"].update_one({"_id": oid, "image": before.get("image")}, {"$set": {"image": url}})
+    catalog_cache.invalidate("menu")
+    updated_item = await db["menu"].find_one({"_id": oid})
+    return serialize_doc(updated_item)
@@ -1,63 +1,66 @@
 from fastapi import APIRouter, Request
 from fastapi.responses import StreamingResponse
+from typing import Optional
 import asyncio
-import json
 import logging
+import os
+from resort_backend.lib.event_bus import event_bus, Subscription
 
 router = APIRouter(tags=["events"])
 
 logger = logging.getLogger("resort_backend.events")
 
-# In-memory broadcaster: list of asyncio.Queue objects, one per subscriber
-_subscribers: list[asyncio.Queue] = []
+# keep idle proxies from closing quiet streams
+HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# EventSource reconnect delay suggested to clients
+RETRY_MS = 3000
+
 
 def publish_event(evt: dict):
-    """Publish an event to all subscribers. Non-blocking."""
-    data = evt.copy()
-    data["ts"] = asyncio.get_event_loop().time()
-    payload = json.dumps(data)
-    for q in list(_subscribers):
-        try:
-            # use put_nowait to avoid blocking
-            q.put_nowait(payload)
-        except Exception:
-            logger.exception("Failed to enqueue event for a subscriber")
+    """Publish an event to all subscribers in every worker. Non-blocking."""
+    return event_bus.publish(evt)
+
 
-async def _event_generator(q: asyncio.Queue):
+async def _event_generator(sub: Subscription, heartbeat: float = HEARTBEAT_SECONDS):
     try:
+        yield f"retry: {RETRY_MS}\n\n"
         while True:
-            payload = await q.get()
-            yield f"data: {payload}\n\n"
+            try:
+                evt = await asyncio.wait_for(sub.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if evt is None:
+                # slow consumer was cut off; the client reconnects with Last-Event-ID
+                return
+            yield f"id: {evt.id}\ndata: {evt.payload}\n\n"
     except asyncio.CancelledError:
         return
 
 
 @router.get("/events/stream")
-async def events_stream(request: Request):
-    """SSE endpoint that streams JSON events as `data: ...` lines.
+async def events_stream(request: Request, topics: Optional[str] = None, last_event_id: Optional[str] = None):
+    """SSE endpoint that streams JSON events as `id: ...` / `data: ...` frames.
 
-    Note: this broadcaster is in-memory and only works for a single process.
+    Events come from lib/event_bus, so clients connected to any worker see
+    events published by all of them. `topics` takes a comma-separated list of
+    event names or patterns (`bookings.*,rooms.updated`). On reconnect the
+    `Last-Event-ID` header (or `last_event_id` query parameter) replays the
+    events missed since that id while they are still in the ring buffer.
+    A `: keepalive` comment is sent every SSE_HEARTBEAT_SECONDS when idle.
     """
-    q: asyncio.Queue = asyncio.Queue()
-    _subscribers.append(q)
-
-    async def cleanup():
-        try:
-            _subscribers.remove(q)
-        except ValueError:
-            pass
-
-    generator = _event_generator(q)
-    # StreamingResponse will iterate the async generator
-    resp = StreamingResponse(generator, media_type="text/event-stream")
+    resume = request.headers.get("last-event-id") or last_event_id
+    sub = event_bus.subscribe(topics=topics, last_event_id=resume)
 
-    # When client disconnects, StreamingResponse won't call cleanup automatically;
-    # rely on background task when generator completes. Wrap generator to ensure cleanup.
     async def wrapper_gen():
         try:
-            async for chunk in generator:
+            async for chunk in _event_generator(sub):
                 yield chunk
         finally:
-            await cleanup()
+            event_bus.unsubscribe(sub)
 
-    return StreamingResponse(wrapper_gen(), media_type="text/event-stream")
+    return StreamingResponse(
+        wrapper_gen(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
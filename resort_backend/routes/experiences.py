@@ -3,6 +3,7 @@ from resort_backend.models import Experience
 from bson import ObjectId
 from datetime import datetime
 from resort_backend.utils import get_db_or_503, serialize_doc
+from resort_backend.lib.catalog_cache import catalog_cache, cached_json_response
 
 router = APIRouter(tags=["experiences"])
 
@@ -10,8 +11,12 @@ router = APIRouter(tags=["experiences"])
 async def get_all_experiences(request: Request):
     """Get all experiences"""
     db = get_db_or_503(request)
-    experiences = await db["experiences"].find().to_list(None)
-    return [serialize_doc(exp) for exp in experiences]
+
+    async def load():
+        experiences = await db["experiences"].find().to_list(None)
+        return [serialize_doc(exp) for exp in experiences]
+
+    return await cached_json_response("experiences", "all", load)
 
 @router.get("/{experience_id}")
 async def get_experience(request: Request, experience_id: str):
@@ -32,6 +37,7 @@ async def create_experience(request: Request, experience: Experience):
     exp_dict = experience.dict()
     exp_dict["created_at"] = datetime.utcnow()
     result = await db["experiences"].insert_one(exp_dict)
+    catalog_cache.invalidate("experiences")
     created = await db["experiences"].find_one({"_id": result.inserted_id})
     return serialize_doc(created)
 
@@ -48,6 +54,7 @@ async def update_experience(request: Request, experience_id: str, experience: Ex
         raise HTTPException(status_code=400, detail="Invalid experience id")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Experience not found")
+    catalog_cache.invalidate("experiences")
     updated = await db["experiences"].find_one({"_id": ObjectId(experience_id)})
     return serialize_doc(updated)
 
@@ -61,4 +68,5 @@ async def delete_experience(request: Request, experience_id: str):
         raise HTTPException(status_code=400, detail="Invalid experience id")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Experience not found")
+    catalog_cache.invalidate("experiences")
     return {"message": "Experience deleted successfully"}
@@ -1,7 +1,10 @@
 from fastapi import APIRouter, HTTPException, Request
+from typing import Optional
 from bson import ObjectId
 from datetime import datetime
 from resort_backend.utils import get_db_or_503, serialize_doc
+from resort_backend.lib.pagination import paged_response
+from resort_backend.lib.catalog_cache import cached_json_response
 from resort_backend.models import ExtraBedRequest
 from resort_backend.routes.events import publish_event
 
@@ -9,10 +12,17 @@ router = APIRouter(tags=["extra-beds"])
 
 
 @router.get("/")
-async def list_extra_beds(request: Request):
+async def list_extra_beds(request: Request, after: Optional[str] = None, limit: Optional[int] = None, format: Optional[str] = None):
     db = get_db_or_503(request)
-    items = await db["extra_bed"].find().to_list(None)
-    return [serialize_doc(i) for i in items]
+    paged = await paged_response(request, db["extra_bed"], after=after, limit=limit, format=format)
+    if paged is not None:
+        return paged
+
+    async def load():
+        items = await db["extra_bed"].find().to_list(None)
+        return [serialize_doc(i) for i in items]
+
+    return await cached_json_response("extra_bed", "all", load)
 
 
 @router.get("/{item_id}")
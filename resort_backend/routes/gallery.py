@@ -1,10 +1,14 @@
 
-from fastapi import APIRouter, HTTPException, Request, Depends, Form, File, UploadFile
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, HTTPException, Request, Depends, Header
 
 from pydantic import BaseModel
 from typing import Optional
-from resort_backend.utils import get_db_or_503, serialize_doc
+from resort_backend.utils import get_db_or_503, serialize_doc, BSONResponse
+from resort_backend.lib.catalog_cache import catalog_cache, cached_json_response
+from resort_backend.lib.gallery_view import normalize, query_gallery
+from resort_backend.lib.media import media_pipeline
+from resort_backend.lib.pagination import clamp_limit, page_response
+from resort_backend.lib.uploads import receive_upload, release, sync_refs, image_urls
 from datetime import datetime
 import os
 from bson import ObjectId
@@ -13,6 +17,17 @@ from bson import ObjectId
 router = APIRouter(tags=["gallery"])
 
 
+def admin_key_dep(x_admin_key: Optional[str] = Header(None)):
+    """Require X-Admin-Key to match ADMIN_API_KEY; admin endpoints are closed when it is unset."""
+    admin_key = os.getenv("ADMIN_API_KEY")
+    if not admin_key or x_admin_key != admin_key:
+        raise HTTPException(status_code=403, detail="forbidden")
+
+
+# fields that may hold the item's image URL (uploads are reference counted through them)
+IMAGE_FIELDS = ("url", "imageUrl", "image_url", "image")
+
+
 class GalleryCreateRequest(BaseModel):
     title: Optional[str] = None
     caption: Optional[str] = None
@@ -32,93 +47,33 @@ class GalleryItemResponse(BaseModel):
     category: Optional[str] = None
     visible: Optional[bool] = None
     image_url: Optional[str] = None
+    # resized WebP/JPEG derivatives (lib/media.py), filled in after upload
+    variants: Optional[dict] = None
+    srcset: Optional[dict] = None
     created_at: Optional[str] = None
 
-# FIX: Register the route as "/gallery" (no trailing slash)
-@router.get("/", response_model=list[GalleryItemResponse])
-async def get_gallery(request: Request, category: str = None, visible: Optional[bool] = None):
+@router.get("/")
+async def get_gallery(request: Request, category: Optional[str] = None, visible: Optional[bool] = None,
+                      after: Optional[str] = None, limit: Optional[int] = None, facets: bool = False):
     """
-    Returns all gallery items (images and videos) in a consistent format.
-    Supports filtering by category and visible flag.
+    Gallery items, newest first, in the public shape stored at write time
+    (lib/gallery_view.py); one indexed aggregation per uncached read.
+
+    Without paging parameters the whole list is returned (cached). `limit`/`after`
+    page by keyset with the next cursor in X-Next-Cursor and Link, like the other
+    list endpoints. `facets=true` returns {items, next_cursor, categories} with the
+    per-category counts of every item matching the filter.
     """
     db = get_db_or_503(request)
-    query = {}
-    if category:
-        query["category"] = category
-    if visible is not None:
-        query["visible"] = {"$ne": False} if visible else False
-    items = await db["gallery"].find(query).to_list(None)
-
-    def norm(item):
-        doc = serialize_doc(item)
-        doc["id"] = str(doc.get("_id"))
-        doc["title"] = doc.get("title")
-        doc["caption"] = doc.get("caption")
-        doc["description"] = doc.get("description")
-        # Prefer explicit url field, fallback to imageUrl if present
-        doc["url"] = doc.get("url") or doc.get("imageUrl") or doc.get("image_url")
-        doc["type"] = doc.get("type")
-        doc["category"] = doc.get("category")
-        doc["visible"] = doc.get("visible", True)
-        doc["image_url"] = (
-            doc.get("image_url")
-            or doc.get("imageUrl")
-            or doc.get("thumbnail")
-            or doc.get("image")
-            or (doc.get("images")[0] if isinstance(doc.get("images"), list) and doc.get("images") else None)
-        )
-        doc["created_at"] = doc.get("created_at")
-        doc = {k: doc[k] for k in GalleryItemResponse.__fields__.keys()}
-        return doc
-
-    return [norm(i) for i in items]
-
-
-@router.get("/", response_class=JSONResponse)
-async def list_gallery(request: Request, category: Optional[str] = None, visible: Optional[bool] = None, limit: int = 50, skip: int = 0):
-    db = get_db_or_503(request)
-    query = {}
-    if category:
-        query["category"] = category
-    # Treat missing `isVisible` as visible in legacy data: when visible=True,
-    # include documents that either have isVisible=True or have no isVisible field.
-    if visible is not None:
-        if visible:
-            query["$or"] = [{"isVisible": True}, {"isVisible": {"$exists": False}}]
-        else:
-            # explicit false: only return documents with isVisible set to False
-            query["isVisible"] = False
+    if after is None and limit is None and not facets:
+        async def load():
+            return (await query_gallery(db, category, visible))["items"]
 
-    try:
-        cursor = db.gallery.find(query).skip(skip).limit(limit)
-        items = await cursor.to_list(length=limit)
-    except Exception:
-        raise HTTPException(status_code=500, detail="Failed to query gallery collection")
-
-    serialized = [serialize_doc(d) for d in items]
-    # Map to public shape expected by frontend
-    out = []
-    for doc in serialized:
-        caption = doc.get("caption") or doc.get("title") or doc.get("description") or ""
-        description = doc.get("description") or ""
-        imageUrl = doc.get("imageUrl") or doc.get("image") or (doc.get("media") and doc.get("media")[0] if isinstance(doc.get("media"), list) and len(doc.get("media"))>0 else None)
-        category_val = doc.get("category") or doc.get("categoryName") or ""
-        # If imageUrl is a relative path (e.g. /uploads/...), prefix with request.base_url so
-        # browser loads the image from the backend origin rather than the frontend origin.
-        if imageUrl and isinstance(imageUrl, str) and imageUrl.startswith('/'):
-            imageUrl = str(request.base_url).rstrip('/') + imageUrl
-
-        out.append({
-            "id": doc.get("id"),
-            "caption": caption,
-            "description": description,
-            "imageUrl": imageUrl,
-            "category": category_val,
-            "isVisible": doc.get("isVisible", True),
-            "createdAt": doc.get("createdAt"),
-        })
-
-    return out
+        return await cached_json_response("gallery", f"category={category or ''}&visible={visible}", load)
+    page = await query_gallery(db, category, visible, after, clamp_limit(limit), facets)
+    if facets:
+        return BSONResponse(page)
+    return page_response(request, page["items"], page["next_cursor"], limit)
 
 
 @router.get("/{item_id}")
@@ -143,14 +98,27 @@ async def update_gallery_item(request: Request, item_id: str, payload: dict):
     payload.pop("id", None)
     payload.pop("_id", None)
     # Allow updating the url field
-    update_fields = {k: v for k, v in payload.items() if k in ["title", "caption", "description", "type", "category", "visible", "url", "image_url", "imageUrl"]}
+    update_fields = {k: v for k, v in payload.items() if k in ["title", "caption", "description", "type", "category", "visible", "isVisible", "url", "image_url", "imageUrl"]}
+    # both visibility spellings stay in step; the canonical isVisible is derived from them
+    for src, dst in (("visible", "isVisible"), ("isVisible", "visible")):
+        if src in update_fields and dst not in update_fields:
+            update_fields[dst] = update_fields[src]
+    update = {"$set": update_fields}
+    image_changed = any(k in update_fields for k in ("url", "image_url", "imageUrl"))
+    if image_changed:
+        # old derivatives show the previous image; drop them until the new ones are rendered
+        update["$unset"] = {"variants": "", "srcset": "", "variants_source": ""}
     try:
-        res = await db.gallery.update_one({"_id": ObjectId(item_id)}, {"$set": update_fields})
+        before = await db.gallery.find_one_and_update({"_id": ObjectId(item_id)}, update)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid id")
-    if res.matched_count == 0:
+    if before is None:
         raise HTTPException(status_code=404, detail="Not found")
-    doc = await db.gallery.find_one({"_id": ObjectId(item_id)})
+    doc = await normalize(db, ObjectId(item_id))
+    catalog_cache.invalidate("gallery")
+    if image_changed:
+        await sync_refs(db, image_urls(before, IMAGE_FIELDS), image_urls(doc, IMAGE_FIELDS))
+        media_pipeline.submit(db, ObjectId(item_id))
     return serialize_doc(doc)
 
 
@@ -158,15 +126,51 @@ async def update_gallery_item(request: Request, item_id: str, payload: dict):
 async def delete_gallery_item(request: Request, item_id: str):
     db = get_db_or_503(request)
     try:
-        res = await db.gallery.delete_one({"_id": ObjectId(item_id)})
+        doc = await db.gallery.find_one_and_delete({"_id": ObjectId(item_id)})
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid id")
-    if res.deleted_count == 0:
+    if doc is None:
         raise HTTPException(status_code=404, detail="Not found")
+    catalog_cache.invalidate("gallery")
+    await release(db, set(image_urls(doc, IMAGE_FIELDS)))
     return {"deleted": True}
 
-UPLOAD_DIR = os.path.join(os.path.dirname(__file__), '../../uploads/gallery')
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+
+@router.post("/upload", dependencies=[Depends(admin_key_dep)])
+async def upload_gallery_item(request: Request):
+    """Create a gallery item from a multipart upload: `file` plus optional
+    title/caption/description/category/isVisible form fields.
+
+    The image is streamed to content-addressed storage (lib/uploads.py), so
+    uploading the same file again reuses the stored copy.
+    """
+    db = get_db_or_503(request)
+    blob, fields = await receive_upload(request, db)
+    now = datetime.utcnow()
+    visible = str(fields.get("isVisible", fields.get("visible", "true"))).lower() not in ("false", "0", "no")
+    doc = {
+        "title": fields.get("title"),
+        "caption": fields.get("caption"),
+        "description": fields.get("description"),
+        "category": fields.get("category"),
+        "type": "image",
+        "url": blob["url"],
+        "imageUrl": blob["url"],
+        "image_url": blob["url"],
+        "visible": visible,
+        "isVisible": visible,
+        "createdAt": now,
+        "updatedAt": now,
+    }
+    try:
+        res = await db.gallery.insert_one(doc)
+    except Exception:
+        await release(db, [blob["url"]])
+        raise HTTPException(status_code=500, detail="Failed to create gallery item")
+    doc = await normalize(db, res.inserted_id)
+    catalog_cache.invalidate("gallery")
+    media_pipeline.submit(db, res.inserted_id)
+    return serialize_doc(doc)
 
 
 
@@ -186,5 +190,8 @@ async def create_gallery_item_json(data: GalleryCreateRequest, request: Request)
         if not doc.get("type") and any(url_lower.endswith(ext) for ext in video_exts):
             doc["type"] = "video"
     res = await db.gallery.insert_one(doc)
-    doc["_id"] = res.inserted_id
+    doc = await normalize(db, res.inserted_id)
+    catalog_cache.invalidate("gallery")
+    await sync_refs(db, [], image_urls(doc, IMAGE_FIELDS))
+    media_pipeline.submit(db, res.inserted_id)
     return serialize_doc(doc)
\ No newline at end of file
@@ -1,5 +1,7 @@
 from fastapi import APIRouter, Request, HTTPException
 from resort_backend.utils import get_db_or_503, serialize_doc
+from resort_backend.lib.catalog_cache import catalog_cache, encode_json
+from fastapi.responses import Response
 from bson import ObjectId
 from datetime import datetime
 import logging
@@ -28,9 +30,13 @@ async def list_navigation(request: Request, public: bool = True):
         # If we don't have a db handle, raise to trigger fallback below
         if db is None:
             raise RuntimeError("db not available")
-        # sort by `order` if present to provide consistent navigation ordering
-        cursor = db["navigation"].find(q).sort([("order", 1)])
-        items = await cursor.to_list(length=None)
+
+        async def load():
+            # sort by `order` if present to provide consistent navigation ordering
+            cursor = db["navigation"].find(q).sort([("order", 1)])
+            return [serialize_doc(i) for i in await cursor.to_list(length=None)]
+
+        body = await catalog_cache.get_or_load("navigation", f"public={public}", load)
     except Exception:
         # DB error: for public requests return a small fallback nav so frontend header stays usable
         if public:
@@ -45,8 +51,7 @@ async def list_navigation(request: Request, public: bool = True):
             ]
         raise HTTPException(status_code=500, detail="Failed to fetch navigation items")
 
-    out = [serialize_doc(i) for i in items]
-    if public and not out:
+    if public and body == encode_json([]):
         client_host = None
         try:
             client_host = request.client.host
@@ -61,7 +66,7 @@ async def list_navigation(request: Request, public: bool = True):
             {"id": "fallback-packages", "name": "packages", "label": "Packages", "href": "/packages", "type": "link", "is_visible": True, "order": 50},
             {"id": "fallback-contact", "name": "contact", "label": "Contact", "href": "/contact", "type": "link", "is_visible": True, "order": 60},
         ]
-    return out
+    return Response(content=body, media_type="application/json")
 
 
 @router.post("/")
@@ -69,6 +74,7 @@ async def create_navigation(request: Request, payload: dict):
     db = get_db_or_503(request)
     payload["created_at"] = datetime.utcnow()
     res = await db["navigation"].insert_one(payload)
+    catalog_cache.invalidate("navigation")
     created = await db["navigation"].find_one({"_id": res.inserted_id})
     return serialize_doc(created)
 
@@ -82,6 +88,7 @@ async def update_navigation(request: Request, item_id: str, payload: dict):
         raise HTTPException(status_code=400, detail="Invalid id")
     if res.matched_count == 0:
         raise HTTPException(status_code=404, detail="Navigation item not found")
+    catalog_cache.invalidate("navigation")
     updated = await db["navigation"].find_one({"_id": ObjectId(item_id)})
     return serialize_doc(updated)
 
@@ -95,4 +102,5 @@ async def delete_navigation(request: Request, item_id: str):
         raise HTTPException(status_code=400, detail="Invalid id")
     if res.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Navigation item not found")
+    catalog_cache.invalidate("navigation")
     return {"message": "Deleted"}
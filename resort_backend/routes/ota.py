@@ -1,16 +1,24 @@
 from fastapi import APIRouter, Request, HTTPException, Depends
-from datetime import datetime, timedelta
-from resort_backend.lib.locks import acquire_lock, release_lock
+from collections import Counter
+from datetime import datetime
+from resort_backend.lib.reservations import reserve_units, release_booking, reserve_many, release_many, move_many, move_booking
+from resort_backend.lib.availability import get_calendar
 from bson import ObjectId
 from resort_backend.utils import get_db_or_503, serialize_doc
+from pymongo import InsertOne, UpdateOne
+import json
 import pymongo
 import os
-from lib import ota_adapters
+from resort_backend.lib import ota_adapters
 from resort_backend.lib.webhooks import verify_hmac_sha256
+from resort_backend.lib.ari import ari_feed
 from resort_backend.routes.gallery import admin_key_dep
 
 router = APIRouter(tags=["ota"])
 
+# events accepted by one /webhook/batch request
+MAX_BATCH_ITEMS = int(os.getenv("OTA_MAX_BATCH_ITEMS", "5000"))
+
 
 @router.post("/webhook")
 async def ota_webhook(request: Request):
@@ -34,43 +42,25 @@ async def ota_webhook(request: Request):
     """
     db = get_db_or_503(request)
     body_bytes = await request.body()
-    payload = await request.json()
+    try:
+        payload = json.loads(body_bytes)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON body")
     source = payload.get("source")
-    external_id = payload.get("external_id")
-    if not source or not external_id:
-        raise HTTPException(status_code=400, detail="source and external_id required")
+    adapter = ota_adapters.resolve(source)
 
     # Verify signature if provider secret is configured
-    cfg = ota_adapters.get_provider_config(source)
-    secret = cfg.get("secret")
-    sig_header = cfg.get("signature_header") or "X-Signature"
-    header_val = request.headers.get(sig_header)
+    secret = adapter.secret
     if secret:
-        ok = verify_hmac_sha256(header_val, body_bytes, secret)
+        ok = verify_hmac_sha256(request.headers.get(adapter.signature_header), body_bytes, secret)
         if not ok:
             raise HTTPException(status_code=403, detail="Invalid webhook signature")
 
     # Allow provider-specific mapping via adapters
-    mapped = None
-    lower_source = source.lower()
-    if "yatra" in lower_source:
-        mapped = ota_adapters.map_yatra(payload)
-    elif "mmt" in lower_source or "makemytrip" in lower_source:
-        mapped = ota_adapters.map_mmt(payload)
-    else:
-        # Fallback: assume generic shape
-        mapped = {
-            "source": source,
-            "external_id": external_id,
-            "guest_name": payload.get("guest_name"),
-            "guest_email": payload.get("guest_email"),
-            "guest_phone": payload.get("guest_phone"),
-            "accommodation_id": payload.get("accommodation_id"),
-            "check_in": payload.get("check_in"),
-            "check_out": payload.get("check_out"),
-            "total_price": payload.get("total_price", 0),
-            "status": payload.get("status", "confirmed"),
-        }
+    mapped = adapter.map(payload, source)
+    external_id = mapped.get("external_id")
+    if not source or not external_id:
+        raise HTTPException(status_code=400, detail="source and external_id required")
 
     guest_name = mapped.get("guest_name")
     guest_email = mapped.get("guest_email")
@@ -90,14 +80,16 @@ async def ota_webhook(request: Request):
     # Idempotency: check if we already mapped this external booking
     existing = await db["ota_bookings"].find_one({"source": source, "external_id": external_id})
     client = getattr(request.app.state, "db_client", None)
+    cal = await get_calendar(db)
 
-    # If OTA reports cancellation, attempt to cancel internal booking and free occupancies
+    # If OTA reports cancellation, attempt to cancel internal booking and free its reserved nights
     if existing and status == "cancelled":
         try:
             b_id = existing.get("booking_id")
             if b_id:
-                await db["occupancies"].delete_many({"booking_id": b_id})
+                await release_booking(db, b_id)
                 await db["bookings"].update_one({"_id": b_id}, {"$set": {"status": "cancelled"}})
+                cal.release(b_id)
             await db["ota_bookings"].update_one({"_id": existing["_id"]}, {"$set": {"status": "cancelled"}})
         except Exception:
             raise HTTPException(status_code=500, detail="Failed to cancel booking")
@@ -118,9 +110,9 @@ async def ota_webhook(request: Request):
 
     # Try transactional path first
     if existing is None:
-        # create new mapping + booking
-        lock_key = f"accom:{accommodation_id}:{ci.date().isoformat()}:{co.date().isoformat()}"
-        lock_owner = None
+        if not cal.is_free(accommodation_id, ci, co):
+            raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
+        created = None
         # prefer transactions when available
         if client is not None and hasattr(client, "start_session"):
             try:
@@ -128,68 +120,302 @@ async def ota_webhook(request: Request):
                     async with session.start_transaction():
                         res = await db["bookings"].insert_one(booking_doc, session=session)
                         booking_id = res.inserted_id
-                        # per-night occupancies
-                        occs = []
-                        d = ci.date()
-                        while d < co.date():
-                            occs.append({"accommodation_id": accommodation_id, "date": datetime(d.year, d.month, d.day), "booking_id": booking_id, "created_at": datetime.utcnow()})
-                            d = d + timedelta(days=1)
-                        if occs:
-                            await db["occupancies"].insert_many(occs, ordered=True, session=session)
+                        if not await reserve_units(db, [accommodation_id], booking_id, ci, co, session=session):
+                            raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
                         await db["ota_bookings"].insert_one({"source": source, "external_id": external_id, "booking_id": booking_id, "status": booking_doc["status"], "created_at": datetime.utcnow()}, session=session)
                         created = await db["bookings"].find_one({"_id": booking_id}, session=session)
-                        return serialize_doc(created)
-            except pymongo.errors.DuplicateKeyError:
-                raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
+                    cal.reserve(booking_id, [accommodation_id], ci, co)
+                    return serialize_doc(created)
+            except HTTPException:
+                raise
             except Exception:
-                # fall through to lock-based fallback
+                # fall through to the non-transactional path; this includes a DuplicateKeyError
+                # from racing first claims, which aborted the transaction
                 pass
 
-        # lock-based fallback when transactions not possible
-        lock_owner = await acquire_lock(db, lock_key, ttl_seconds=30, timeout=5.0)
-        if not lock_owner:
-            raise HTTPException(status_code=409, detail="Accommodation busy; try again")
+        # no transaction: claim the range first (atomic on its own), release it if the insert fails
+        booking_id = ObjectId()
+        if not await reserve_units(db, [accommodation_id], booking_id, ci, co):
+            raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
         try:
-            # re-check overlap
+            # bookings made before range reservations existed are not in room_nights
             overlap = await db["bookings"].find_one({"accommodation_id": accommodation_id, "status": {"$ne": "cancelled"}, "check_in": {"$lt": co}, "check_out": {"$gt": ci}})
             if overlap:
                 raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
-            res = await db["bookings"].insert_one(booking_doc)
-            booking_id = res.inserted_id
-            occs = []
-            d = ci.date()
-            while d < co.date():
-                occs.append({"accommodation_id": accommodation_id, "date": datetime(d.year, d.month, d.day), "booking_id": booking_id, "created_at": datetime.utcnow()})
-                d = d + timedelta(days=1)
-            if occs:
-                try:
-                    await db["occupancies"].insert_many(occs, ordered=True)
-                except pymongo.errors.DuplicateKeyError:
-                    await db["bookings"].delete_one({"_id": booking_id})
-                    raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
+            booking_doc["_id"] = booking_id
+            await db["bookings"].insert_one(booking_doc)
             await db["ota_bookings"].insert_one({"source": source, "external_id": external_id, "booking_id": booking_id, "status": booking_doc["status"], "created_at": datetime.utcnow()})
-            created = await db["bookings"].find_one({"_id": booking_id})
-            return serialize_doc(created)
-        finally:
+        except BaseException as exc:
             try:
-                await release_lock(db, lock_key, owner=lock_owner)
+                await release_booking(db, booking_id)
+                await db["bookings"].delete_one({"_id": booking_id})
             except Exception:
                 pass
+            if isinstance(exc, pymongo.errors.DuplicateKeyError):
+                # the same (source, external_id) was recorded concurrently
+                raise HTTPException(status_code=409, detail="Booking already recorded for this external id")
+            raise
+        cal.reserve(booking_id, [accommodation_id], ci, co)
+        created = await db["bookings"].find_one({"_id": booking_id})
+        return serialize_doc(created)
     else:
         # Update path: map incoming changes to internal booking
         b_id = existing.get("booking_id")
         if not b_id:
             raise HTTPException(status_code=500, detail="Mapped booking not found")
+        # move the reserved range: the new nights are claimed before the old ones are let go
+        if not await move_booking(db, [accommodation_id], b_id, ci, co):
+            raise HTTPException(status_code=409, detail="Accommodation already booked for the selected dates")
         # For simplicity, support modified -> update dates/price and cancelled handled earlier
         try:
             await db["bookings"].update_one({"_id": b_id}, {"$set": {"check_in": ci, "check_out": co, "total_price": total_price, "guest_name": guest_name, "guest_email": guest_email}})
             await db["ota_bookings"].update_one({"_id": existing["_id"]}, {"$set": {"updated_at": datetime.utcnow(), "status": status}})
+            cal.release(b_id)
+            cal.reserve(b_id, [accommodation_id], ci, co)
             updated = await db["bookings"].find_one({"_id": b_id})
             return serialize_doc(updated)
         except Exception:
             raise HTTPException(status_code=500, detail="Failed to update mapped booking")
 
 
+def _parse_batch(body: bytes) -> list:
+    """A JSON array of events, or NDJSON (one event per line)."""
+    text = body.strip()
+    if not text:
+        return []
+    if text[:1] == b"[":
+        items = json.loads(text)
+        if not isinstance(items, list):
+            raise ValueError("expected a JSON array")
+        return items
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def _booking_doc(m: dict, ci: datetime, co: datetime) -> dict:
+    return {
+        "guest_name": m.get("guest_name") or "",
+        "guest_email": m.get("guest_email") or "",
+        "guest_phone": m.get("guest_phone") or "",
+        "accommodation_id": m.get("accommodation_id"),
+        "check_in": ci,
+        "check_out": co,
+        "total_price": m.get("total_price", 0),
+        "status": "confirmed",
+        "created_at": datetime.utcnow(),
+    }
+
+
+async def _apply_cancels(db, cal, entries, results):
+    if not entries:
+        return
+    booking_ids = [e["existing"].get("booking_id") for e in entries if e["existing"].get("booking_id")]
+    await release_many(db, booking_ids)
+    if booking_ids:
+        await db["bookings"].bulk_write([UpdateOne({"_id": b}, {"$set": {"status": "cancelled"}}) for b in booking_ids], ordered=False)
+    now = datetime.utcnow()
+    await db["ota_bookings"].bulk_write(
+        [UpdateOne({"_id": e["existing"]["_id"]}, {"$set": {"status": "cancelled", "updated_at": now}}) for e in entries], ordered=False
+    )
+    for e in entries:
+        b_id = e["existing"].get("booking_id")
+        if b_id:
+            cal.release(b_id)
+        results[e["index"]].update(status="cancelled", booking_id=str(b_id) if b_id else None)
+
+
+async def _apply_updates(db, cal, entries, results):
+    entries = [e for e in entries if e["existing"].get("booking_id")]
+    if not entries:
+        return
+    # move each reserved range: new nights are claimed before old ones are let go, so a
+    # conflicting move leaves the booking's reservation untouched
+    failed = await move_many(db, [(e["index"], [e["mapped"]["accommodation_id"]], e["existing"]["booking_id"], e["ci"], e["co"]) for e in entries])
+    for e in entries:
+        if e["index"] in failed:
+            results[e["index"]].update(status=failed[e["index"]], detail="Accommodation already booked for the selected dates")
+    ok = [e for e in entries if e["index"] not in failed]
+    if not ok:
+        return
+    now = datetime.utcnow()
+    await db["bookings"].bulk_write([
+        UpdateOne({"_id": e["existing"]["booking_id"]}, {"$set": {
+            "accommodation_id": e["mapped"]["accommodation_id"], "check_in": e["ci"], "check_out": e["co"],
+            "total_price": e["mapped"].get("total_price", 0), "guest_name": e["mapped"].get("guest_name"),
+            "guest_email": e["mapped"].get("guest_email"), "status": "confirmed",
+        }}) for e in ok
+    ], ordered=False)
+    await db["ota_bookings"].bulk_write(
+        [UpdateOne({"_id": e["existing"]["_id"]}, {"$set": {"updated_at": now, "status": e["mapped"]["status"]}}) for e in ok], ordered=False
+    )
+    for e in ok:
+        b_id = e["existing"]["booking_id"]
+        cal.release(b_id)
+        cal.reserve(b_id, [e["mapped"]["accommodation_id"]], e["ci"], e["co"])
+        results[e["index"]].update(status="updated", booking_id=str(b_id))
+
+
+async def _legacy_overlaps(db, entries) -> set:
+    """Indexes of `entries` overlapping a stored booking, in one query.
+
+    Bookings made before range reservations existed are not in room_nights, so
+    `reserve_many` alone does not see them (the single /webhook path runs the
+    same check per event).
+    """
+    if not entries:
+        return set()
+    q = {"status": {"$ne": "cancelled"}, "$or": [
+        {"accommodation_id": e["mapped"]["accommodation_id"], "check_in": {"$lt": e["co"]}, "check_out": {"$gt": e["ci"]}}
+        for e in entries
+    ]}
+    stored = await db["bookings"].find(q, {"accommodation_id": 1, "check_in": 1, "check_out": 1}).to_list(length=None)
+    return {
+        e["index"] for e in entries
+        if any(_holds_unit(b.get("accommodation_id"), e["mapped"]["accommodation_id"]) and b["check_in"] < e["co"] and b["check_out"] > e["ci"]
+               for b in stored)
+    }
+
+
+def _holds_unit(stored, unit) -> bool:
+    # /api/bookings stores accommodation_id as a list, which the $or above matches element-wise
+    return unit in stored if isinstance(stored, list) else stored == unit
+
+
+async def _apply_creates(db, cal, entries, results):
+    overlaps = await _legacy_overlaps(db, entries)
+    claims = []
+    for e in entries:
+        if e["index"] in overlaps:
+            results[e["index"]].update(status="conflict", detail="Accommodation already booked for the selected dates")
+            continue
+        e["booking_id"] = ObjectId()
+        claims.append(e)
+    failed = await reserve_many(db, [(e["index"], [e["mapped"]["accommodation_id"]], e["booking_id"], e["ci"], e["co"]) for e in claims])
+    for e in claims:
+        if e["index"] in failed:
+            results[e["index"]].update(status=failed[e["index"]], detail="Accommodation already booked for the selected dates")
+    ok = [e for e in claims if e["index"] not in failed]
+    if not ok:
+        return
+    now = datetime.utcnow()
+    try:
+        await db["bookings"].insert_many([{"_id": e["booking_id"], **_booking_doc(e["mapped"], e["ci"], e["co"])} for e in ok], ordered=False)
+    except BaseException:
+        # like the single path: give the nights back and drop whatever was inserted
+        try:
+            await release_many(db, [e["booking_id"] for e in ok])
+            await db["bookings"].delete_many({"_id": {"$in": [e["booking_id"] for e in ok]}})
+        except Exception:
+            pass
+        raise
+    rejected = set()
+    try:
+        await db["ota_bookings"].bulk_write([
+            InsertOne({"source": e["source"], "external_id": e["mapped"]["external_id"], "booking_id": e["booking_id"], "status": "confirmed", "created_at": now})
+            for e in ok
+        ], ordered=False)
+    except pymongo.errors.BulkWriteError as err:
+        # mapped concurrently by another delivery: undo this batch's copy
+        rejected = {err_item["index"] for err_item in err.details.get("writeErrors", [])}
+    if rejected:
+        dup = [ok[i] for i in rejected]
+        await release_many(db, [e["booking_id"] for e in dup])
+        await db["bookings"].delete_many({"_id": {"$in": [e["booking_id"] for e in dup]}})
+        for e in dup:
+            results[e["index"]].update(status="duplicate", detail="external_id already mapped")
+    for i, e in enumerate(ok):
+        if i in rejected:
+            continue
+        cal.reserve(e["booking_id"], [e["mapped"]["accommodation_id"]], e["ci"], e["co"])
+        results[e["index"]].update(status="created", booking_id=str(e["booking_id"]))
+
+
+@router.post("/webhook/batch")
+async def ota_webhook_batch(request: Request, source: str):
+    """Batch OTA ingestion for channel-manager resyncs.
+
+    Body: a JSON array of events, or NDJSON, in the same shape as `/webhook`
+    (events may omit `source`; it defaults to the `source` query parameter).
+    The signature header of the provider is checked once over the whole body.
+    Events are mapped through the provider's adapter, the latest event per
+    external_id wins, and all changes are applied with grouped bulk writes on
+    `room_nights`, `bookings` and `ota_bookings`.
+
+    Returns one result per input event, in order:
+    created | updated | cancelled | unchanged | superseded | conflict | duplicate | error.
+    """
+    db = get_db_or_503(request)
+    adapter = ota_adapters.resolve(source)
+    body_bytes = await request.body()
+    secret = adapter.secret
+    if secret and not verify_hmac_sha256(request.headers.get(adapter.signature_header), body_bytes, secret):
+        raise HTTPException(status_code=403, detail="Invalid webhook signature")
+    try:
+        items = _parse_batch(body_bytes)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    if len(items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_ITEMS} events per batch")
+
+    results = [{"index": i, "status": "error"} for i in range(len(items))]
+    latest: dict = {}
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i]["detail"] = "event must be a JSON object"
+            continue
+        item_source = item.get("source") or source
+        if ota_adapters.resolve(item_source) is not adapter:
+            results[i]["detail"] = "event source does not match the batch source"
+            continue
+        mapped = adapter.map(item, item_source)
+        external_id = mapped.get("external_id")
+        results[i]["external_id"] = external_id
+        if not external_id:
+            results[i]["detail"] = "external_id required"
+            continue
+        try:
+            ci = datetime.fromisoformat(mapped.get("check_in"))
+            co = datetime.fromisoformat(mapped.get("check_out"))
+        except Exception:
+            if mapped["status"] != "cancelled":
+                results[i]["detail"] = "Invalid check_in/check_out format"
+                continue
+            ci = co = None
+        key = (item_source, external_id)
+        if key in latest:
+            results[latest[key]["index"]]["status"] = "superseded"
+        latest[key] = {"index": i, "source": item_source, "mapped": mapped, "ci": ci, "co": co}
+
+    existing = {}
+    by_source: dict = {}
+    for src, ext in latest:
+        by_source.setdefault(src, []).append(ext)
+    if by_source:
+        q = {"$or": [{"source": src, "external_id": {"$in": exts}} for src, exts in by_source.items()]}
+        async for d in db["ota_bookings"].find(q):
+            existing[(d.get("source"), d.get("external_id"))] = d
+
+    creates, updates, cancels = [], [], []
+    for key, e in latest.items():
+        e["existing"] = existing.get(key)
+        if e["mapped"]["status"] == "cancelled":
+            if e["existing"] and e["existing"].get("status") != "cancelled":
+                cancels.append(e)
+            else:
+                results[e["index"]]["status"] = "unchanged"
+        elif e["existing"] is None:
+            creates.append(e)
+        elif e["existing"].get("booking_id"):
+            updates.append(e)
+        else:
+            results[e["index"]]["detail"] = "Mapped booking not found"
+
+    cal = await get_calendar(db)
+    await _apply_cancels(db, cal, cancels, results)
+    await _apply_updates(db, cal, updates, results)
+    await _apply_creates(db, cal, creates, results)
+    return {"source": source, "received": len(items), "summary": dict(Counter(r["status"] for r in results)), "results": results}
+
+
 @router.get("/locks", dependencies=[Depends(admin_key_dep)])
 async def get_locks_and_mappings(request: Request, limit: int = 100):
     """Admin endpoint: inspect current locks and OTA mappings."""
@@ -197,3 +423,15 @@ async def get_locks_and_mappings(request: Request, limit: int = 100):
     locks = await db["locks"].find().sort("created_at", -1).to_list(length=limit)
     mappings = await db["ota_bookings"].find().sort("created_at", -1).limit(limit).to_list(length=limit)
     return {"locks": [serialize_doc(l) for l in locks], "mappings": [serialize_doc(m) for m in mappings]}
+
+
+@router.get("/ari", dependencies=[Depends(admin_key_dep)])
+async def ari_changes(request: Request, since: int = 0, limit: int = 1000):
+    """ARI rows (room type, date, availability, rate) changed after feed version `since`.
+
+    Poll with the returned `version` as the next `since`; `more` means another page is ready.
+    """
+    get_db_or_503(request)
+    if ari_feed.db is None:
+        raise HTTPException(status_code=503, detail="ARI feed not running")
+    return await ari_feed.changes_since(since, max(1, min(limit, 5000)))
@@ -3,6 +3,7 @@ from resort_backend.models import Package
 from bson import ObjectId
 from datetime import datetime
 from resort_backend.utils import get_db_or_503, serialize_doc
+from resort_backend.lib.catalog_cache import catalog_cache, cached_json_response
 
 router = APIRouter(tags=["packages"])
 
@@ -10,8 +11,12 @@ router = APIRouter(tags=["packages"])
 async def get_all_packages(request: Request):
     """Get all packages"""
     db = get_db_or_503(request)
-    packages = await db["packages"].find().to_list(None)
-    return [serialize_doc(pkg) for pkg in packages]
+
+    async def load():
+        packages = await db["packages"].find().to_list(None)
+        return [serialize_doc(pkg) for pkg in packages]
+
+    return await cached_json_response("packages", "all", load)
 
 @router.get("/{package_id}")
 async def get_package(request: Request, package_id: str):
@@ -32,6 +37,7 @@ async def create_package(request: Request, package: Package):
     pkg_dict = package.dict()
     pkg_dict["created_at"] = datetime.utcnow()
     result = await db["packages"].insert_one(pkg_dict)
+    catalog_cache.invalidate("packages")
     created = await db["packages"].find_one({"_id": result.inserted_id})
     return serialize_doc(created)
 
@@ -48,6 +54,7 @@ async def update_package(request: Request, package_id: str, package: Package):
         raise HTTPException(status_code=400, detail="Invalid package id")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Package not found")
+    catalog_cache.invalidate("packages")
     updated = await db["packages"].find_one({"_id": ObjectId(package_id)})
     return serialize_doc(updated)
 
@@ -61,4 +68,5 @@ async def delete_package(request: Request, package_id: str):
         raise HTTPException(status_code=400, detail="Invalid package id")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Package not found")
+    catalog_cache.invalidate("packages")
     return {"message": "Package deleted successfully"}
@@ -0,0 +1,59 @@
+from fastapi import APIRouter, Request, HTTPException, Depends, Body
+from bson import ObjectId
+from datetime import datetime
+from typing import Optional
+from resort_backend.utils import get_db_or_503, serialize_doc
+from resort_backend.lib.availability import _to_date
+from resort_backend.lib.pricing import RULES_COLLECTION, rate_table
+from resort_backend.routes.gallery import admin_key_dep
+
+router = APIRouter(tags=["pricing"], dependencies=[Depends(admin_key_dep)])
+
+RULE_KINDS = {"season", "length_of_stay", "occupancy", "tax"}
+
+
+def _validate_rule(rule: dict):
+    kind = rule.get("kind")
+    if kind not in RULE_KINDS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {sorted(RULE_KINDS)}")
+    if kind == "season":
+        start, end = _to_date(rule.get("start")), _to_date(rule.get("end"))
+        if start is None or end is None or end <= start:
+            raise HTTPException(status_code=400, detail="season needs start < end (YYYY-MM-DD)")
+        if rule.get("price_per_night") is None and rule.get("multiplier") is None:
+            raise HTTPException(status_code=400, detail="season needs price_per_night or multiplier")
+
+
+@router.get("/rules")
+async def list_rules(request: Request, kind: Optional[str] = None):
+    db = get_db_or_503(request)
+    q = {"kind": kind} if kind else {}
+    docs = await db[RULES_COLLECTION].find(q).to_list(length=None)
+    return [serialize_doc(d) for d in docs]
+
+
+@router.post("/rules", status_code=201)
+async def create_rule(request: Request, rule: dict = Body(...)):
+    """Add a pricing rule (see lib/pricing.py for the shapes per `kind`)."""
+    db = get_db_or_503(request)
+    rule.pop("_id", None)
+    rule.pop("id", None)
+    _validate_rule(rule)
+    rule["created_at"] = datetime.utcnow()
+    res = await db[RULES_COLLECTION].insert_one(rule)
+    rate_table.invalidate()
+    created = await db[RULES_COLLECTION].find_one({"_id": res.inserted_id})
+    return serialize_doc(created)
+
+
+@router.delete("/rules/{rule_id}")
+async def delete_rule(request: Request, rule_id: str):
+    db = get_db_or_503(request)
+    try:
+        res = await db[RULES_COLLECTION].delete_one({"_id": ObjectId(rule_id)})
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid rule id")
+    if res.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Rule not found")
+    rate_table.invalidate()
+    return {"message": "Rule deleted"}
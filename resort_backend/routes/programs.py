@@ -3,10 +3,9 @@ from bson import ObjectId
 from datetime import datetime
 from typing import List, Dict, Any
 from resort_backend.utils import get_db_or_503, serialize_doc
-import os
-import logging
-
-logger = logging.getLogger("resort_backend.programs")
+from resort_backend.lib.catalog_cache import catalog_cache, cached_json_response
+from resort_backend.lib.pricing import rate_table
+from resort_backend.lib.programs_view import programs_view
 from resort_backend.models import Program
 
 router = APIRouter(tags=["programs"])
@@ -15,86 +14,31 @@ router = APIRouter(tags=["programs"])
 async def list_programs(request: Request, tag: str | None = None):
     """List programs. Optional query param `tag` filters programs by tag (e.g. ?tag=wellness).
 
-    This endpoint is resilient to different collection names used in databases.
-    - If `tag=wellness` will attempt `wellnessPrograms` then `programs`.
-    - If `tag=activities` will attempt `activities` then `programs`.
-    - Without tag, will return from `programs` if present else combine known program collections.
+    Reads `programs_view` (lib/programs_view.py), which combines `programs`,
+    `wellnessPrograms` and `activities`: without a tag every program of every
+    collection is listed, programs first; `tag=wellness` and `tag=activities`
+    also match everything from the collection of that name. Documents are
+    returned as stored in their source collection.
     """
     db = get_db_or_503(request)
-    # Helper to fetch from a collection name if it exists
-    async def fetch_from_collection(name: str, q: dict | None = None):
-        try:
-            # check if collection exists (fast list_collection_names)
-            names = await db.list_collection_names()
-            if name in names:
-                q = q or {}
-                docs = await db[name].find(q).to_list(None)
-                return [serialize_doc(d) for d in docs]
-        except Exception:
-            # ignore and return empty
-            return []
-        return []
-
-    if tag:
-        t = tag.lower()
-        if t == 'wellness':
-            # Prefer explicit wellnessPrograms collection for compatibility
-            res = await fetch_from_collection('wellnessPrograms', None)
-            if res:
-                if os.getenv('DEV_VERBOSE_LOGGING', '').lower() in ('1','true'):
-                    logger.info("programs: returning %d docs from wellnessPrograms for tag=%s", len(res), tag)
-                return res
-            # fallback to programs collection with tag filter
-            res2 = await fetch_from_collection('programs', {'tags': {'$in': [tag]}})
-            if res2 and os.getenv('DEV_VERBOSE_LOGGING', '').lower() in ('1','true'):
-                logger.info("programs: returning %d docs from programs filtered by tag=%s", len(res2), tag)
-            return res2
-        if t in ('activities', 'resort-activities'):
-            res = await fetch_from_collection('activities', None)
-            if res:
-                if os.getenv('DEV_VERBOSE_LOGGING', '').lower() in ('1','true'):
-                    logger.info("programs: returning %d docs from activities for tag=%s", len(res), tag)
-                return res
-            res2 = await fetch_from_collection('programs', {'tags': {'$in': [tag]}})
-            if res2 and os.getenv('DEV_VERBOSE_LOGGING', '').lower() in ('1','true'):
-                logger.info("programs: returning %d docs from programs filtered by tag=%s", len(res2), tag)
-            return res2
-
-    # No tag: try programs, then wellnessPrograms + activities combined
-    res = await fetch_from_collection('programs', None)
-    if res:
-        if os.getenv('DEV_VERBOSE_LOGGING', '').lower() in ('1','true'):
-            logger.info("programs: returning %d docs from programs (no tag)", len(res))
-        return res
-    # combine known collections
-    combined = []
-    w = await fetch_from_collection('wellnessPrograms', None)
-    a = await fetch_from_collection('activities', None)
-    combined += w
-    combined += a
-    if os.getenv('DEV_VERBOSE_LOGGING', '').lower() in ('1','true'):
-        logger.info("programs: combined returned %d docs (wellnessPrograms=%d, activities=%d)", len(combined), len(w), len(a))
-    return combined
+
+    async def load():
+        return [serialize_doc(d) for d in await programs_view.raw(db, tag)]
+
+    return await cached_json_response("programs", f"tag={tag or ''}", load)
+
 
 @router.get("/{program_id}")
 async def get_program(request: Request, program_id: str):
     db = get_db_or_503(request)
-    # Try to resolve the id across known program-like collections for compatibility
-    coll_names = ['programs', 'wellnessPrograms', 'activities']
-    oid = None
     try:
         oid = ObjectId(program_id)
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid program id")
-
-    for cname in coll_names:
-        try:
-            doc = await db[cname].find_one({"_id": oid})
-        except Exception:
-            doc = None
-        if doc:
-            return serialize_doc(doc)
-    raise HTTPException(status_code=404, detail="Program not found")
+    doc = await programs_view.get(db, oid)
+    if doc is None:
+        raise HTTPException(status_code=404, detail="Program not found")
+    return serialize_doc(doc)
 
 
 @router.get("/debug/collections")
@@ -134,6 +78,9 @@ async def create_program(request: Request, program: Program):
     doc = program.dict()
     doc["created_at"] = datetime.utcnow()
     res = await db["programs"].insert_one(doc)
+    await programs_view.refresh(db, "programs", res.inserted_id)
+    catalog_cache.invalidate("programs")
+    rate_table.invalidate()
     created = await db["programs"].find_one({"_id": res.inserted_id})
     return serialize_doc(created)
 
@@ -146,6 +93,9 @@ async def update_program(request: Request, program_id: str, program: Program):
         raise HTTPException(status_code=400, detail="Invalid program id")
     if res.matched_count == 0:
         raise HTTPException(status_code=404, detail="Program not found")
+    await programs_view.refresh(db, "programs", ObjectId(program_id))
+    catalog_cache.invalidate("programs")
+    rate_table.invalidate()
     updated = await db["programs"].find_one({"_id": ObjectId(program_id)})
     return serialize_doc(updated)
 
@@ -158,6 +108,9 @@ async def delete_program(request: Request, program_id: str):
         raise HTTPException(status_code=400, detail="Invalid program id")
     if res.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Program not found")
+    await programs_view.refresh(db, "programs", ObjectId(program_id))
+    catalog_cache.invalidate("programs")
+    rate_table.invalidate()
     return {"message": "Program deleted"}
 
 
@@ -172,7 +125,8 @@ async def recommend_programs(request: Request, payload: Dict[str, Any] = Body(..
     stay_days = int(payload.get("stayDays") or 0)
 
     # simple scoring: +2 if tag matches preference, +1 if duration <= stay_days
-    programs = await db["programs"].find().to_list(None)
+    # scoring reads duration_days/capacity, which only `programs` documents carry
+    programs = await programs_view.raw(db, source="programs")
     scored = []
     for p in programs:
         score = 0
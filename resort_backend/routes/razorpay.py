@@ -1,16 +1,18 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Header
 from fastapi import Request
 from fastapi.responses import JSONResponse
 from typing import Any, List, Union
 from datetime import datetime
-import hmac
-import hashlib
 import json
 import logging
+import pymongo
 from resort_backend.database import get_db
+from resort_backend.lib.payments import get_gateway, GatewayTimeout
+from resort_backend.lib.webhooks import verify_hmac_sha256, enqueue, inbox_worker
+from resort_backend.lib.reconciliation import AWAITING_CLAIM, NOTHING_TO_CLAIM, booking_from_transaction, claim_new_bookings, reconcile
+from resort_backend.utils import get_db_or_503
 from pydantic import BaseModel, Field
 import os
-import razorpay
 import random
 import string
 
@@ -32,26 +34,9 @@ class VerifyPaymentRequest(BaseModel):
 
 
 def _get_client():
-    key_id = os.getenv("RAZORPAY_KEY_ID") or os.getenv("RAZORPAY_KEY")
-    key_secret = os.getenv("RAZORPAY_KEY_SECRET")
-    # also support older env names from application.properties style
-    if not key_id:
-        key_id = os.getenv("razorpay.key_id")
-    if not key_secret:
-        key_secret = os.getenv("razorpay.key_secret")
-    # If keys are missing, allow an explicit, opt-in test fallback for local development.
-    if not key_id or not key_secret:
-        allow_fallback = (os.getenv("ALLOW_RAZORPAY_TEST_FALLBACK") == "1") or (os.getenv("DEBUG") in ("1", "true", "True"))
-        if allow_fallback:
-            logging.getLogger("resort_backend").warning("Razorpay keys not configured — using test fallback because ALLOW_RAZORPAY_TEST_FALLBACK is enabled. Do NOT use this in production.")
-            key_id = key_id or "rzp_test_RpZR4dDpG2dPnv"
-            key_secret = key_secret or "CcN59mt21z556BN4ryhiI7Ks"
-        else:
-            logging.getLogger("resort_backend").error("Razorpay keys not configured. Set RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET in environment.")
-            raise RuntimeError("Razorpay keys not configured. Set RAZORPAY_KEY_ID and RAZORPAY_KEY_SECRET.")
-    # Log which key id is being used (do not log secrets)
-    logging.getLogger("resort_backend").info(f"Razorpay client using key_id={key_id}")
-    return razorpay.Client(auth=(key_id, key_secret)), key_id
+    """Process-wide payment gateway (see lib/payments.py) and its public key id."""
+    gateway = get_gateway()
+    return gateway, gateway.key_id
 
 
 @router.post("/order")
@@ -73,7 +58,7 @@ async def create_order(req: CreateOrderRequest):
     if req.notes:
         payload["notes"] = req.notes
     try:
-        order = client.order.create(data=payload)
+        order = await client.create_order(payload)
         # persist a transaction record linking to this razorpay order (helpful for reconciliation)
         try:
             db = get_db()
@@ -105,6 +90,8 @@ async def create_order(req: CreateOrderRequest):
         }
         # Optionally add more fields if needed, but avoid non-serializable ones
         return order_response
+    except GatewayTimeout as e:
+        raise HTTPException(status_code=504, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -120,7 +107,7 @@ async def verify_payment(body: VerifyPaymentRequest):
     # Log incoming verify attempt
     logging.getLogger("resort_backend").info(f"verify_payment called: order_id={data['razorpay_order_id']} payment_id={data['razorpay_payment_id']}")
     try:
-        client.utility.verify_payment_signature(data)
+        client.verify_payment_signature(data)
         logging.getLogger("resort_backend").info(f"verify_payment: signature verified for payment_id={data['razorpay_payment_id']}")
         # persist verification to transactions table (mark paid)
         try:
@@ -149,37 +136,47 @@ async def verify_payment(body: VerifyPaymentRequest):
 
 @router.post("/webhook")
 async def razorpay_webhook(request: Request):
-    """Endpoint to receive Razorpay webhooks. Verifies signature and updates bookings/transactions.
+    """Endpoint to receive Razorpay webhooks. Verifies the signature, stores the event and acks.
 
-    Expected header: X-Razorpay-Signature
+    Expected headers: X-Razorpay-Signature, X-Razorpay-Event-Id
+    The event is processed asynchronously from the webhook inbox (lib/webhooks.py);
+    redeliveries of an event id already received are acknowledged without new work.
     """
     body_bytes = await request.body()
-    body_text = body_bytes.decode("utf-8")
-    signature = request.headers.get("X-Razorpay-Signature") or request.headers.get("x-razorpay-signature")
+    signature = request.headers.get("X-Razorpay-Signature")
     secret = os.getenv("RAZORPAY_WEBHOOK_SECRET") or os.getenv("RAZORPAY_KEY_SECRET") or os.getenv("razorpay.key_secret")
     logger = logging.getLogger("resort_backend")
     if not signature or not secret:
         logger.warning("Webhook received without signature or secret not configured")
-        logger.debug(f"headers={dict(request.headers)} body={body_text[:1000]}")
         return JSONResponse({"ok": False, "detail": "Missing signature or secret"}, status_code=400)
 
-    # verify signature
-    computed = hmac.new(secret.encode("utf-8"), body_bytes, hashlib.sha256).hexdigest()
-    # log a masked comparison for debugging (show first 8 chars only)
-    logger.info(f"webhook: received sig={(signature or '')[:8]} computed={(computed or '')[:8]} body_len={len(body_bytes)}")
-    if not hmac.compare_digest(computed, signature):
-        logger.warning("Webhook signature verification failed")
-        logger.debug(f"computed={computed} signature={signature} body={body_text[:1000]}")
+    if not verify_hmac_sha256(signature, body_bytes, secret):
+        logger.warning(f"Webhook signature verification failed sig={signature[:8]} body_len={len(body_bytes)}")
         return JSONResponse({"ok": False, "detail": "Invalid signature"}, status_code=400)
 
+    event_id = request.headers.get("X-Razorpay-Event-Id")
     try:
-        payload = json.loads(body_text)
+        event = json.loads(body_bytes).get("event")
+    except Exception:
+        event = None
+    db = get_db_or_503(request)
+    if not await enqueue(db, "razorpay", event_id, body_bytes, event=event):
+        logger.info(f"webhook: duplicate delivery event_id={event_id} ignored")
+        return JSONResponse({"ok": True, "duplicate": True})
+    inbox_worker.notify()
+    return JSONResponse({"ok": True})
+
+
+async def process_webhook_event(db, doc: dict):
+    """Apply one stored Razorpay webhook. Safe to retry: updates are $set and inserts check first."""
+    logger = logging.getLogger("resort_backend")
+    try:
+        payload = json.loads(doc.get("body") or "{}")
     except Exception:
         payload = {}
 
     ev = payload.get("event")
     data = payload.get("payload", {})
-    db = get_db()
 
     # Example handling: payment.captured, payment.failed, order.paid
     try:
@@ -204,8 +201,10 @@ async def razorpay_webhook(request: Request):
                         logger.info(f"Inserted fallback transaction for order_id={order_id}")
                     except Exception:
                         logger.exception("Failed to insert fallback transaction in webhook payment.captured")
+                        raise
             except Exception:
                 logger.exception("Failed to update transactions for payment.captured")
+                raise
 
             # Attempt reconciliation: if payment captured but no booking exists, try to create one
             try:
@@ -215,41 +214,34 @@ async def razorpay_webhook(request: Request):
                     # fetch transaction to see if booking payload was stored at order creation
                     tx = await db.transactions.find_one({"razorpay_order_id": order_id})
                     if tx and tx.get("booking_payload"):
-                        bp = tx.get("booking_payload")
                         # ensure idempotency: double-check no booking exists for this payment
                         exists2 = await db.bookings.find_one({"$or": [{"payment.order_id": order_id}, {"payment.payment_id": payment_id}]})
                         if not exists2:
-                            # build booking doc from payload with status 'confirmed'
+                            # same booking and room claim as the reconciliation job: confirmed only once
+                            # its rooms are held in room_nights, otherwise left pending for review
                             try:
-                                doc = {
-                                    "reference": "RB-WEB-" + datetime.utcnow().strftime("%Y%m%d%H%M%S") + "-" + ''.join(random.choices(string.digits, k=4)),
-                                    "guest_name": bp.get("guest_name") or bp.get("guest_email") or "Auto-created",
-                                    "guest_email": bp.get("guest_email"),
-                                    "guest_phone": bp.get("guest_phone"),
-                                    "guests": bp.get("guests") or 1,
-                                    "selected_cottages": bp.get("selected_cottages") or [],
-                                    "allocated_cottages": bp.get("allocated_cottages") or [],
-                                    "payment": {"provider": "razorpay", "order_id": order_id, "payment_id": payment_id},
-                                    "check_in": bp.get("check_in"),
-                                    "check_out": bp.get("check_out"),
-                                    "nights": bp.get("nights") or 0,
-                                    "price_breakdown": bp.get("price_breakdown") or {},
-                                    "status": "confirmed",
-                                    "created_at": datetime.utcnow(),
-                                    "updated_at": datetime.utcnow(),
-                                    "auto_created_by_webhook": True,
-                                }
+                                doc = booking_from_transaction({**tx, "razorpay_order_id": order_id, "razorpay_payment_id": payment_id})
+                                doc.pop("auto_created_by_reconciliation", None)
+                                doc["auto_created_by_webhook"] = True
                                 await db.bookings.insert_one(doc)
-                                logger.info(f"Webhook reconciliation: created booking for order_id={order_id}")
+                                claims = [(doc["_id"], doc["allocated_cottages"], doc["check_in"], doc["check_out"])] if doc.get("review") == AWAITING_CLAIM else []
+                                if await claim_new_bookings(db, claims, {doc["_id"]}) or doc.get("review") == NOTHING_TO_CLAIM:
+                                    logger.warning(f"Webhook reconciliation: booking for order_id={order_id} needs review")
+                                else:
+                                    logger.info(f"Webhook reconciliation: created booking for order_id={order_id}")
+                            except pymongo.errors.DuplicateKeyError:
+                                # a reconciliation run created it meanwhile (unique payment.order_id)
+                                logger.info(f"Webhook reconciliation: booking for order_id={order_id} already exists")
                             except Exception:
                                 logger.exception("Failed to create booking from transaction booking_payload")
+                                raise
                     else:
                         # No booking payload available — create a minimal placeholder booking to record payment
                         try:
                             # create placeholder booking to record payment; admin must enrich later
                             placeholder = {
                                 "reference": "RB-WEB-" + datetime.utcnow().strftime("%Y%m%d%H%M%S") + "-" + ''.join(random.choices(string.digits, k=4)),
-                                "guest_name": tx.get("receipt") or "Unknown",
+                                "guest_name": (tx or {}).get("receipt") or "Unknown",
                                 "guest_email": tx.get("receipt") if tx and tx.get("receipt") else None,
                                 "guest_phone": None,
                                 "guests": 1,
@@ -268,10 +260,14 @@ async def razorpay_webhook(request: Request):
                             }
                             resph = await db.bookings.insert_one(placeholder)
                             logger.info(f"Webhook reconciliation: created placeholder booking id={getattr(resph, 'inserted_id', None)} for order_id={order_id}")
+                        except pymongo.errors.DuplicateKeyError:
+                            logger.info(f"Webhook reconciliation: booking for order_id={order_id} already exists")
                         except Exception:
                             logger.exception("Failed to insert placeholder booking on webhook reconciliation")
+                            raise
             except Exception:
                 logger.exception("Error during webhook reconciliation step")
+                raise
 
         elif ev == "payment.failed":
             payment_obj = data.get("payment", {}).get("entity", {})
@@ -282,6 +278,7 @@ async def razorpay_webhook(request: Request):
                 logger.debug(f"transactions.update_one matched={getattr(res, 'matched_count', None)} modified={getattr(res, 'modified_count', None)}")
             except Exception:
                 logger.exception("Failed to update transactions for payment.failed")
+                raise
 
         elif ev == "order.paid":
             order_obj = data.get("order", {}).get("entity", {})
@@ -291,8 +288,32 @@ async def razorpay_webhook(request: Request):
                 logger.debug(f"orders.update_one matched={getattr(res, 'matched_count', None)} modified={getattr(res, 'modified_count', None)}")
             except Exception:
                 logger.exception("Failed to update orders for order.paid")
+                raise
         # Add other event handlers as needed
     except Exception:
         logger.exception("Error processing webhook event")
+        raise
 
-    return JSONResponse({"ok": True})
+
+inbox_worker.register("razorpay", process_webhook_event)
+
+
+@router.post("/reconcile")
+async def reconcile_payments(
+    request: Request,
+    max_batches: int = 20,
+    dry_run: bool = False,
+    restart: bool = False,
+    x_internal_key: str | None = Header(None),
+):
+    """Run (or continue) the batched transactions/bookings reconciliation.
+
+    Requires X-Internal-Key matching INTERNAL_API_KEY. Each call processes at most
+    `max_batches` batches and returns `complete: false` when more remain; call again
+    to resume. For full nightly runs use scripts/reconcile_payments.py.
+    """
+    internal_key = os.getenv("INTERNAL_API_KEY")
+    if not internal_key or x_internal_key != internal_key:
+        raise HTTPException(status_code=403, detail="forbidden")
+    db = get_db_or_503(request)
+    return await reconcile(db, max_batches=max(1, max_batches), dry_run=dry_run, restart=restart)
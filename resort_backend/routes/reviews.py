@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Request, HTTPException
 from resort_backend.utils import get_db_or_503, serialize_doc
+from resort_backend.lib.catalog_cache import cached_json_response
 
 router = APIRouter(tags=["reviews"])
 
@@ -10,8 +11,12 @@ async def get_reviews(request: Request):
     Uses get_db_or_503 to ensure db is available, else returns 503.
     """
     db = get_db_or_503(request)
-    try:
-        reviews = await db["reviews"].find().to_list(100)
-    except Exception:
-        raise HTTPException(status_code=500, detail="Failed to fetch reviews")
-    return [serialize_doc(r) for r in reviews]
+
+    async def load():
+        try:
+            reviews = await db["reviews"].find().to_list(100)
+        except Exception:
+            raise HTTPException(status_code=500, detail="Failed to fetch reviews")
+        return [serialize_doc(r) for r in reviews]
+
+    return await cached_json_response("reviews", "all", load)
@@ -1,17 +1,27 @@
 from fastapi import APIRouter, HTTPException, Request
+from typing import Optional
 from resort_backend.models import Wellness
 from bson import ObjectId
 from datetime import datetime
 from resort_backend.utils import get_db_or_503, serialize_doc
+from resort_backend.lib.pagination import paged_response
+from resort_backend.lib.catalog_cache import catalog_cache, cached_json_response
 
 router = APIRouter(tags=["wellness"])
 
 @router.get("/")
-async def get_all_wellness(request: Request):
+async def get_all_wellness(request: Request, after: Optional[str] = None, limit: Optional[int] = None, format: Optional[str] = None):
     """Get all wellness services"""
     db = get_db_or_503(request)
-    services = await db["wellness"].find().to_list(None)
-    return [serialize_doc(s) for s in services]
+    paged = await paged_response(request, db["wellness"], after=after, limit=limit, format=format)
+    if paged is not None:
+        return paged
+
+    async def load():
+        services = await db["wellness"].find().to_list(None)
+        return [serialize_doc(s) for s in services]
+
+    return await cached_json_response("wellness", "all", load)
 
 @router.get("/{wellness_id}")
 async def get_wellness(request: Request, wellness_id: str):
@@ -32,6 +42,7 @@ async def create_wellness(request: Request, wellness: Wellness):
     wellness_dict = wellness.dict()
     wellness_dict["created_at"] = datetime.utcnow()
     result = await db["wellness"].insert_one(wellness_dict)
+    catalog_cache.invalidate("wellness")
     created = await db["wellness"].find_one({"_id": result.inserted_id})
     return serialize_doc(created)
 
@@ -48,6 +59,7 @@ async def update_wellness(request: Request, wellness_id: str, wellness: Wellness
         raise HTTPException(status_code=400, detail="Invalid wellness id")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Wellness service not found")
+    catalog_cache.invalidate("wellness")
     updated = await db["wellness"].find_one({"_id": ObjectId(wellness_id)})
     return serialize_doc(updated)
 
@@ -61,4 +73,5 @@ async def delete_wellness(request: Request, wellness_id: str):
         raise HTTPException(status_code=400, detail="Invalid wellness id")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Wellness service not found")
+    catalog_cache.invalidate("wellness")
     return {"message": "Wellness service deleted successfully"}
@@ -0,0 +1,69 @@
+"""Generate resized WebP/JPEG variants for existing gallery items (lib/media.py).
+
+Items are processed concurrently; resizing runs in a process pool of
+--workers processes. By default only items without variants (or whose image
+changed since their variants were made) are processed.
+
+Run from the backend root:
+  MONGODB_URL=... python scripts/backfill_gallery_variants.py
+  MONGODB_URL=... python scripts/backfill_gallery_variants.py --all --workers 8
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(ROOT))
+
+from lib.media import MediaPipeline, WORKERS, source_url  # noqa: E402
+
+
+async def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--workers", type=int, default=WORKERS, help="resize processes")
+    p.add_argument("--concurrency", type=int, default=None, help="items in flight (default: 2 x workers)")
+    p.add_argument("--all", action="store_true", help="regenerate variants for every item")
+    args = p.parse_args()
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+    if not os.getenv("MONGODB_URL"):
+        raise SystemExit("MONGODB_URL environment variable required")
+    client = AsyncIOMotorClient(os.environ["MONGODB_URL"])
+    db = client[os.getenv("DATABASE_NAME", "resort_db")]
+
+    pipeline = MediaPipeline(workers=args.workers)
+    if not pipeline.available:
+        raise SystemExit("Pillow is required: pip install Pillow")
+    sem = asyncio.Semaphore(args.concurrency or 2 * args.workers)
+    counts = {"processed": 0, "skipped": 0, "failed": 0}
+
+    async def one(doc):
+        async with sem:
+            try:
+                if await pipeline.process(db, doc) is None:
+                    counts["skipped"] += 1
+                else:
+                    counts["processed"] += 1
+            except Exception as exc:
+                counts["failed"] += 1
+                print(f"  {doc['_id']}: {exc}")
+
+    t0 = time.perf_counter()
+    tasks = []
+    async for doc in db["gallery"].find({}):
+        url = source_url(doc)
+        if url is None or (not args.all and doc.get("variants") and doc.get("variants_source") == url):
+            counts["skipped"] += 1
+            continue
+        tasks.append(asyncio.create_task(one(doc)))
+    await asyncio.gather(*tasks)
+    await pipeline.close()
+    client.close()
+    print(f"processed {counts['processed']}, skipped {counts['skipped']}, failed {counts['failed']} in {time.perf_counter() - t0:.2f}s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
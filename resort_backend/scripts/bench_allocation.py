@@ -0,0 +1,126 @@
+"""Benchmark the knapsack allocator in routes.api_compat against the previous
+itertools.combinations search (kept here as `legacy_allocate_rooms`).
+
+Run from the backend root:
+  python scripts/bench_allocation.py
+  python scripts/bench_allocation.py --sizes 10 100 1000 --guests 9
+
+Rooms are built with `make_room` from tests/test_allocation.py. Guest counts
+are chosen above the largest room capacity so the search cannot short-cut on a
+single room. Legacy runs are stopped after --legacy-timeout seconds; a capped
+run is reported as ">timeout" with the share of the search it covered and the
+full time extrapolated from its rate.
+"""
+import argparse
+import itertools
+import math
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, os.path.join(ROOT, "tests"))
+
+from routes.api_compat import allocate_rooms, _room_capacity  # noqa: E402
+from test_allocation import make_room  # noqa: E402
+
+
+class Capped(Exception):
+    """The legacy search ran past its deadline after `walked` combinations."""
+
+    def __init__(self, walked):
+        super().__init__(walked)
+        self.walked = walked
+
+
+def legacy_allocate_rooms(candidates, guests, allow_extra_beds=False, max_k=4, deadline=None):
+    """The pre-knapsack allocator: try every combination of 2..max_k rooms.
+
+    With `deadline` (a time.perf_counter() value) raises Capped once it passes.
+    """
+    annotated = []
+    for r in candidates:
+        cap = _room_capacity(r, allow_extra_beds)
+        price = r.get("price_per_night") or r.get("pricePerNight") or r.get("price") or 0
+        annotated.append({"room": r, "cap": cap, "price": price})
+    singles = [a for a in annotated if a["cap"] >= guests]
+    if singles:
+        return [min(singles, key=lambda a: a["price"])["room"]["_id"]]
+    best_combo = best_k = best_price = None
+    walked = 0
+    for k in range(2, min(max_k, len(annotated)) + 1):
+        for combo in itertools.combinations(annotated, k):
+            walked += 1
+            if deadline is not None and not walked % 4096 and time.perf_counter() > deadline:
+                raise Capped(walked)
+            if sum(c["cap"] for c in combo) >= guests:
+                price = sum(c["price"] for c in combo)
+                if best_combo is None or k < best_k or (k == best_k and price < best_price):
+                    best_combo, best_k, best_price = combo, k, price
+        if best_combo is not None:
+            break
+    return [c["room"]["_id"] for c in best_combo] if best_combo else []
+
+
+def build_inventory(n, seed=7):
+    rnd = random.Random(seed)
+    return [make_room("%024x" % (i + 1), rnd.choice([2, 2, 3, 4]), rnd.choice([50, 80, 120, 200])) for i in range(n)]
+
+
+def timed(fn, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best, result
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--sizes", nargs="*", type=int, default=[10, 100, 1000])
+    p.add_argument("--guests", type=int, default=9, help="guests to place (above max room capacity 4)")
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--legacy-timeout", type=float, default=10.0, help="seconds before a legacy run is stopped")
+    args = p.parse_args()
+
+    print(f"{'rooms':>6} {'guests':>6} {'knapsack ms':>12} {'legacy ms':>12} {'rooms new/old':>14}")
+    for n in args.sizes:
+        rooms = build_inventory(n)
+        new_t, new_res = timed(lambda: allocate_rooms(rooms, args.guests), args.repeat)
+        # combinations the legacy search walks before finding the minimal k
+        min_k = len(legacy_needed_rooms(rooms, args.guests))
+        work = sum(math.comb(n, k) for k in range(2, min(min_k, 4) + 1))
+        note = ""
+        t0 = time.perf_counter()
+        try:
+            old_res = legacy_allocate_rooms(rooms, args.guests, deadline=t0 + args.legacy_timeout)
+            old_ms = f"{(time.perf_counter() - t0) * 1000:.2f}"
+            old_len = str(len(old_res))
+        except Capped as capped:
+            spent = time.perf_counter() - t0
+            old_ms = f">{spent * 1000:.0f}"
+            old_len = "-"
+            note = (f"  legacy capped at {args.legacy_timeout:g}s after {capped.walked:,} of {work:,} combinations"
+                    f" ({capped.walked / work:.1%}); full run ~{spent * work / capped.walked:,.0f}s")
+        print(f"{n:>6} {args.guests:>6} {new_t * 1000:>12.2f} {old_ms:>12} {str(len(new_res)) + '/' + old_len:>14}{note}")
+
+
+def legacy_needed_rooms(rooms, guests):
+    """Largest-first rooms needed to reach `guests` (equals the minimal room count)."""
+    caps = sorted((_room_capacity(r, False) for r in rooms), reverse=True)
+    out = []
+    for c in caps:
+        if sum(out) >= guests:
+            break
+        out.append(c)
+    return out
+
+
+if __name__ == "__main__":
+    main()
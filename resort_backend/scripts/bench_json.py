@@ -0,0 +1,80 @@
+"""Per-document cost of the JSON response paths for list endpoints.
+
+  before: serialize_doc -> jsonable_encoder -> JSONResponse.render (FastAPI default)
+  after:  utils.encode_docs (single pass; orjson when installed, else stdlib json)
+
+Run from the backend root:
+  python scripts/bench_json.py
+  python scripts/bench_json.py --docs 100 1000 10000 --repeat 5
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+from bson import ObjectId  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from resort_backend import utils  # noqa: E402
+from resort_backend.utils import serialize_doc, encode_docs  # noqa: E402
+
+
+def make_booking(i):
+    ci = datetime(2026, 1, 1) + timedelta(days=i % 300)
+    return {
+        "_id": ObjectId(),
+        "guest_name": f"Guest {i}",
+        "guest_email": f"guest{i}@example.com",
+        "accommodation_id": ObjectId(),
+        "check_in": ci,
+        "check_out": ci + timedelta(days=3),
+        "guests": 2 + i % 3,
+        "allocated_cottages": [ObjectId() for _ in range(1 + i % 2)],
+        "status": "confirmed",
+        "total_price": 12000 + i,
+        "extraBeds": 0,
+        "cottage": "",
+        "created_at": ci - timedelta(days=10),
+        "payment": {"order_id": f"order_{i}", "paid_at": ci - timedelta(days=9), "amount": 12000 + i},
+    }
+
+
+def before(docs):
+    return JSONResponse(jsonable_encoder([serialize_doc(d) for d in docs])).body
+
+
+def after(docs):
+    return encode_docs(docs)
+
+
+def best_of(fn, docs, repeat):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(docs)
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return best
+
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--docs", nargs="*", type=int, default=[100, 1000, 10000])
+    p.add_argument("--repeat", type=int, default=5)
+    args = p.parse_args()
+
+    print(f"encoder: {'orjson' if utils.orjson is not None else 'stdlib json'}")
+    print(f"{'docs':>7} {'before us/doc':>14} {'after us/doc':>13} {'speedup':>8}")
+    for n in args.docs:
+        docs = [make_booking(i) for i in range(n)]
+        b = best_of(before, docs, args.repeat)
+        a = best_of(after, docs, args.repeat)
+        print(f"{n:>7} {b / n * 1e6:>14.2f} {a / n * 1e6:>13.2f} {b / a:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Contention benchmark for lib/locks.py.
+
+Many workers repeatedly take the same few lock keys. Three strategies are
+compared on store round-trips (lock-collection operations) and throughput:
+
+  poll      fixed 10 ms polling, no in-process coalescing
+  backoff   exponential backoff with jitter, no coalescing
+  coalesce  backoff + local waiter queue (the default LockManager)
+
+By default the lock store is the in-memory model from tests/test_locks.py with
+a simulated round-trip latency. Pass --mongo to run against MONGODB_URL.
+
+Run from the backend root:
+  python scripts/bench_locks.py
+  python scripts/bench_locks.py --workers 50 --keys 2 --iterations 5 --latency-ms 2
+  MONGODB_URL=... python scripts/bench_locks.py --mongo
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(ROOT))
+sys.path.insert(0, os.path.join(ROOT, "tests"))
+
+from lib.locks import LockManager  # noqa: E402
+from test_locks import MemoryLockManager  # noqa: E402
+
+
+class FixedPoll:
+    def backoff_delay(self, attempt):
+        return 0.01
+
+
+class MemoryPoll(FixedPoll, MemoryLockManager):
+    pass
+
+
+class CountingMongo(LockManager):
+    remote_calls = 0
+
+    async def _try_acquire(self, *a):
+        self.remote_calls += 1
+        return await super()._try_acquire(*a)
+
+    async def _renew_remote(self, *a):
+        self.remote_calls += 1
+        return await super()._renew_remote(*a)
+
+    async def _release_remote(self, *a):
+        self.remote_calls += 1
+        return await super()._release_remote(*a)
+
+
+class MongoPoll(FixedPoll, CountingMongo):
+    pass
+
+
+def build(strategy, mongo, latency):
+    if mongo:
+        cls = {"poll": MongoPoll, "backoff": CountingMongo, "coalesce": CountingMongo}[strategy]
+        return cls(coalesce=strategy == "coalesce")
+    cls = {"poll": MemoryPoll, "backoff": MemoryLockManager, "coalesce": MemoryLockManager}[strategy]
+    return cls(latency=latency, coalesce=strategy == "coalesce")
+
+
+async def run(mgr, db, workers, keys, iterations, hold):
+    failures = 0
+
+    async def worker(i):
+        nonlocal failures
+        key = f"bench:{i % keys}"
+        for _ in range(iterations):
+            lease = await mgr.acquire(db, key, ttl_seconds=30, timeout=30)
+            if lease is None:
+                failures += 1
+                continue
+            await asyncio.sleep(hold)
+            await lease.release()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[worker(i) for i in range(workers)])
+    return time.perf_counter() - t0, failures
+
+
+async def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--workers", type=int, default=50)
+    p.add_argument("--keys", type=int, default=2)
+    p.add_argument("--iterations", type=int, default=5)
+    p.add_argument("--hold-ms", type=float, default=2.0, help="time spent inside the critical section")
+    p.add_argument("--latency-ms", type=float, default=1.0, help="simulated store round-trip (in-memory mode)")
+    p.add_argument("--mongo", action="store_true", help="use MONGODB_URL instead of the in-memory store")
+    args = p.parse_args()
+
+    db = client = None
+    if args.mongo:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        if not os.getenv("MONGODB_URL"):
+            raise SystemExit("MONGODB_URL environment variable required for --mongo")
+        client = AsyncIOMotorClient(os.environ["MONGODB_URL"])
+        db = client[os.getenv("DATABASE_NAME", "resort_db")]
+
+    total = args.workers * args.iterations
+    print(f"{args.workers} workers x {args.iterations} acquisitions on {args.keys} key(s), hold {args.hold_ms} ms")
+    print(f"{'strategy':>9} {'seconds':>8} {'acq/s':>8} {'store ops':>10} {'ops/acq':>8} {'timeouts':>9}")
+    for strategy in ("poll", "backoff", "coalesce"):
+        mgr = build(strategy, args.mongo, args.latency_ms / 1000)
+        if db is not None:
+            await db["locks"].delete_many({"key": {"$regex": "^bench:"}})
+        secs, failures = await run(mgr, db, args.workers, args.keys, args.iterations, args.hold_ms / 1000)
+        ops = mgr.remote_calls
+        print(f"{strategy:>9} {secs:>8.2f} {total / secs:>8.0f} {ops:>10} {ops / total:>8.1f} {failures:>9}")
+    if client is not None:
+        await db["locks"].delete_many({"key": {"$regex": "^bench:"}})
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
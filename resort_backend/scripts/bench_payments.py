@@ -0,0 +1,74 @@
+"""Event-loop latency while payment orders are being created.
+
+A probe task sleeps 5 ms in a loop and records how late it wakes up. While
+it runs, N concurrent order creations go through the stub gateway with a
+simulated blocking SDK round-trip, either called inline in the coroutine
+(what routes/razorpay.py used to do) or through the gateway's bounded
+executor (lib/payments.py).
+
+Run from the backend root:
+  python scripts/bench_payments.py
+  python scripts/bench_payments.py --orders 200 --latency-ms 80 --workers 16
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(ROOT))
+
+from lib.payments import StubGateway  # noqa: E402
+
+PROBE_INTERVAL = 0.005
+
+
+async def probe(lags, stop):
+    while not stop.is_set():
+        t0 = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - t0 - PROBE_INTERVAL)
+
+
+async def run(mode, gateway, orders):
+    lags, stop = [], asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+    await asyncio.sleep(0.02)
+
+    async def one(i):
+        payload = {"amount": 100 * (i + 1), "currency": "INR", "receipt": f"bench_{i}"}
+        if mode == "inline":
+            return gateway._create_order_blocking(payload)
+        return await gateway.create_order(payload)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*[one(i) for i in range(orders)])
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    await probe_task
+    lags_ms = sorted(x * 1000 for x in lags) or [0.0]
+    p99 = lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))]
+    return elapsed, statistics.median(lags_ms), p99, lags_ms[-1]
+
+
+async def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--orders", type=int, default=64)
+    p.add_argument("--latency-ms", type=float, default=50.0, help="simulated SDK round-trip")
+    p.add_argument("--workers", type=int, default=8, help="gateway executor threads")
+    args = p.parse_args()
+
+    gateway = StubGateway(latency=args.latency_ms / 1000, max_workers=args.workers, timeout=60)
+    print(f"{args.orders} orders, {args.latency_ms} ms blocking SDK call, {args.workers} executor threads")
+    print(f"{'mode':>9} {'seconds':>8} {'orders/s':>9} {'lag p50 ms':>11} {'lag p99 ms':>11} {'lag max ms':>11}")
+    for mode in ("inline", "executor"):
+        secs, p50, p99, worst = await run(mode, gateway, args.orders)
+        print(f"{mode:>9} {secs:>8.2f} {args.orders / secs:>9.0f} {p50:>11.1f} {p99:>11.1f} {worst:>11.1f}")
+    gateway.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
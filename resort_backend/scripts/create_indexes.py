@@ -1,50 +1,52 @@
-"""Create recommended MongoDB indexes for accommodations and bookings.
-Run: python scripts/create_indexes.py
+"""Create the MongoDB indexes declared in lib/indexes.py and report drift.
+
+The API applies the same registry at startup (AUTO_CREATE_INDEXES=0 disables
+that); this script is for deploy pipelines and for checking a database.
+
+Run from the backend root:
+  MONGODB_URL=... python scripts/create_indexes.py            # create missing indexes; exit 1 if a collection failed
+  MONGODB_URL=... python scripts/create_indexes.py --check    # report only; exit 1 on drift
+  MONGODB_URL=... python scripts/create_indexes.py --fix      # also rebuild indexes whose definition changed
 Requires `MONGODB_URL` and optional `DATABASE_NAME` env vars.
-This creates a compound index to speed conflict checks for bookings.
 """
+import argparse
 import os
-import pymongo
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(ROOT))
+
+import pymongo  # noqa: E402
+from lib.indexes import ensure_indexes_sync  # noqa: E402
 
 MONGODB_URL = os.getenv("MONGODB_URL")
 DATABASE_NAME = os.getenv("DATABASE_NAME", "resort_db")
 
-if not MONGODB_URL:
-	print("MONGODB_URL not set. Export it and re-run.")
-	raise SystemExit(1)
-
-client = pymongo.MongoClient(MONGODB_URL)
-db = client[DATABASE_NAME]
-
-print(f"Creating indexes on database '{DATABASE_NAME}'...")
-
-# Compound index to speed overlap queries by accommodation and dates
-db["bookings"].create_index([
-	("accommodation_id", pymongo.ASCENDING),
-	("check_in", pymongo.ASCENDING),
-	("check_out", pymongo.ASCENDING),
-], name="accom_checkin_checkout_idx")
-
-# Per-night occupancy index to prevent double-booking at the granularity of a room-night
-db["occupancies"].create_index([
-	("accommodation_id", pymongo.ASCENDING),
-	("date", pymongo.ASCENDING),
-], name="accom_date_unique_idx", unique=True)
-
-# Locks: ensure unique key and automatic expiry via TTL index on `expire_at`.
-db["locks"].create_index([("key", pymongo.ASCENDING)], name="locks_key_unique", unique=True)
-db["locks"].create_index([("expire_at", pymongo.ASCENDING)], name="locks_expire_ttl", expireAfterSeconds=0)
-
-	# Ensure users and guests have indexes on email for fast lookup and uniqueness where appropriate
-	try:
-		db["users"].create_index([("email", pymongo.ASCENDING)], name="users_email_idx", unique=True)
-	except Exception:
-		# ignore if index exists or collection missing
-		pass
-
-	try:
-		db["guests"].create_index([("email", pymongo.ASCENDING)], name="guests_email_idx")
-	except Exception:
-		pass
-
-print("Indexes created.")
+
+def main():
+	p = argparse.ArgumentParser()
+	p.add_argument("--check", action="store_true", help="report missing indexes and drift without writing")
+	p.add_argument("--fix", action="store_true", help="drop and recreate indexes whose keys/options changed")
+	args = p.parse_args()
+
+	if not MONGODB_URL:
+		print("MONGODB_URL not set. Export it and re-run.")
+		raise SystemExit(1)
+
+	client = pymongo.MongoClient(MONGODB_URL)
+	db = client[DATABASE_NAME]
+
+	print(f"{'Checking' if args.check else 'Creating'} indexes on database '{DATABASE_NAME}'...")
+	summary = ensure_indexes_sync(db, apply=not args.check, fix=args.fix)
+	for kind in ("created", "missing", "changed", "renamed", "unmanaged", "failed"):
+		for name in summary[kind]:
+			print(f"  {kind}: {name}")
+	client.close()
+	if summary["failed"] or (args.check and (summary["missing"] or summary["changed"])):
+		raise SystemExit(1)
+	print("Indexes checked." if args.check else "Indexes created.")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,78 @@
+"""Migration script: carry per-night `occupancies` over to `room_nights` range reservations
+
+Bookings now claim their nights in one bitmask document per unit and month
+(lib/reservations.py) instead of one `occupancies` document per night. This
+folds existing occupancies into those documents so the new conflict check
+sees them. Occupancies whose night is already held by another booking are
+reported and skipped. The `occupancies` collection is left in place.
+
+Run with environment variables set:
+  MONGODB_URL and DATABASE_NAME
+
+Example:
+  MONGODB_URL="..." DATABASE_NAME=resort_db python scripts/migrate_occupancies.py --dry-run
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from pymongo import MongoClient, UpdateOne
+from pymongo.errors import BulkWriteError
+import argparse
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.dirname(ROOT))
+
+from resort_backend.lib.reservations import COLLECTION, doc_id, month_masks  # noqa: E402
+from resort_backend.lib.availability import unit_key  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    parser.add_argument("--since", help="Only migrate nights on or after this date (YYYY-MM-DD); default today")
+    args = parser.parse_args()
+
+    mongo_url = os.environ.get("MONGODB_URL")
+    if not mongo_url:
+        raise SystemExit("MONGODB_URL environment variable required")
+    client = MongoClient(mongo_url)
+    db = client[os.environ.get("DATABASE_NAME", "resort_db")]
+    since = datetime.fromisoformat(args.since) if args.since else datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    # (unit, month, booking) -> bits
+    holds = defaultdict(int)
+    count = 0
+    for o in db["occupancies"].find({"date": {"$gte": since}}, {"accommodation_id": 1, "date": 1, "booking_id": 1}):
+        acc = o.get("accommodation_id")
+        night = o.get("date")
+        holder = str(o.get("booking_id") or o["_id"])
+        for unit in acc if isinstance(acc, list) else [acc]:
+            if unit is None or night is None:
+                continue
+            for month, bits in month_masks(night, night + timedelta(days=1)):
+                holds[(unit_key(unit), month, holder)] |= bits
+        count += 1
+
+    ops = []
+    for (unit, month, holder), bits in holds.items():
+        ops.append(UpdateOne(
+            {"_id": doc_id(unit, month), "mask": {"$bitsAllClear": bits}, "holds.booking_id": {"$ne": holder}},
+            {"$bit": {"mask": {"or": bits}}, "$push": {"holds": {"booking_id": holder, "bits": bits}},
+             "$setOnInsert": {"unit": unit, "month": month}, "$currentDate": {"updated_at": True}},
+            upsert=True,
+        ))
+
+    print(f"{count} occupancy document(s) -> {len(ops)} unit/month hold(s) since {since.date()}.")
+    if ops and not args.dry_run:
+        try:
+            res = db[COLLECTION].bulk_write(ops, ordered=False).bulk_api_result
+        except BulkWriteError as e:
+            res = e.details
+            print(f"{len(res.get('writeErrors', []))} hold(s) skipped: already migrated or overlapping another booking's nights.")
+        print(f"Upserted {res.get('nUpserted', 0)}, updated {res.get('nModified', 0)}.")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
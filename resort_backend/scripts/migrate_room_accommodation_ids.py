@@ -0,0 +1,52 @@
+"""Migration script: store rooms.accommodation_id as the accommodation's native _id
+
+Older rooms reference their accommodation either by ObjectId or by its string
+form, which forced every reader into `{"$or": [{"accommodation_id": oid},
+{"accommodation_id": str(oid)}]}`. After this migration the shared
+accommodation/rooms `$lookup` (lib/accommodations.py) matches on a single type.
+
+Run with environment variables set:
+  MONGODB_URL and DATABASE_NAME
+
+Example:
+  MONGODB_URL="..." DATABASE_NAME=resort_db python scripts/migrate_room_accommodation_ids.py --dry-run
+"""
+from pymongo import MongoClient, UpdateOne
+import argparse
+import os
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    mongo_url = os.environ.get("MONGODB_URL")
+    if not mongo_url:
+        raise SystemExit("MONGODB_URL environment variable required")
+    client = MongoClient(mongo_url)
+    db = client[os.environ.get("DATABASE_NAME", "resort_db")]
+
+    # string form of every accommodation _id -> native _id
+    native = {str(a["_id"]): a["_id"] for a in db["accommodations"].find({}, {"_id": 1})}
+
+    ops = []
+    orphans = 0
+    for room in db["rooms"].find({"accommodation_id": {"$exists": True}}, {"accommodation_id": 1}):
+        current = room.get("accommodation_id")
+        target = native.get(str(current))
+        if target is None:
+            orphans += 1
+            continue
+        if type(current) is not type(target) or current != target:
+            ops.append(UpdateOne({"_id": room["_id"]}, {"$set": {"accommodation_id": target}}))
+
+    print(f"{len(ops)} room(s) to normalise, {orphans} room(s) reference an unknown accommodation (left unchanged).")
+    if ops and not args.dry_run:
+        res = db["rooms"].bulk_write(ops, ordered=False)
+        print(f"Updated {res.modified_count} room(s).")
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""Reconcile Razorpay transactions against bookings in batches (lib/reconciliation.py).
+
+Resumable: progress is checkpointed after every batch, so an interrupted run
+continues where it stopped when started again. Once a run completes, the
+next invocation starts a new scan.
+
+Run from the backend root (after scripts/create_indexes.py):
+  MONGODB_URL=... python scripts/reconcile_payments.py
+  MONGODB_URL=... python scripts/reconcile_payments.py --since-days 30 --dry-run
+  MONGODB_URL=... python scripts/reconcile_payments.py --restart --no-placeholders
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(ROOT))
+
+from lib.reconciliation import reconcile, BATCH_SIZE  # noqa: E402
+
+
+async def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    p.add_argument("--max-batches", type=int, default=None, help="stop after this many batches (resume later)")
+    p.add_argument("--since-days", type=int, default=None, help="new runs only look at transactions this recent")
+    p.add_argument("--checkpoint", default="payments", help="checkpoint name; use distinct names for independent runs")
+    p.add_argument("--restart", action="store_true", help="abandon an unfinished run and start over")
+    p.add_argument("--no-placeholders", action="store_true", help="skip paid transactions without a booking payload")
+    p.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    args = p.parse_args()
+
+    from motor.motor_asyncio import AsyncIOMotorClient
+    if not os.getenv("MONGODB_URL"):
+        raise SystemExit("MONGODB_URL environment variable required")
+    client = AsyncIOMotorClient(os.environ["MONGODB_URL"])
+    db = client[os.getenv("DATABASE_NAME", "resort_db")]
+
+    since = datetime.utcnow() - timedelta(days=args.since_days) if args.since_days else None
+    t0 = time.perf_counter()
+    totals = await reconcile(
+        db,
+        checkpoint=args.checkpoint,
+        batch_size=args.batch_size,
+        max_batches=args.max_batches,
+        placeholders=not args.no_placeholders,
+        dry_run=args.dry_run,
+        restart=args.restart,
+        since=since,
+    )
+    secs = time.perf_counter() - t0
+    print(f"{'DRY RUN: ' if args.dry_run else ''}scanned {totals['scanned']} transactions in {totals['batches']} batches, {secs:.2f}s")
+    for k in ("bookings_created", "placeholders_created", "bookings_confirmed", "transactions_marked_paid", "bookings_for_review"):
+        print(f"  {k}: {totals[k]}")
+    print("complete" if totals["complete"] else f"stopped at {totals['checkpoint']}; run again to resume")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
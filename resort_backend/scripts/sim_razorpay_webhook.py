@@ -44,6 +44,7 @@ def main():
     p.add_argument("--order_id", default="ord_test_" + str(int(time.time())))
     p.add_argument("--payment_id", default="pay_test_" + str(int(time.time())))
     p.add_argument("--amount", type=int, default=10000)
+    p.add_argument("--event_id", default="evt_test_" + str(int(time.time())), help="X-Razorpay-Event-Id; reuse it to simulate a redelivery")
     args = p.parse_args()
 
     if args.event == "payment.captured":
@@ -55,7 +56,7 @@ def main():
     body = json.dumps(payload).encode("utf-8")
     sig = compute_sig(args.secret, body)
 
-    headers = {"Content-Type": "application/json", "X-Razorpay-Signature": sig}
+    headers = {"Content-Type": "application/json", "X-Razorpay-Signature": sig, "X-Razorpay-Event-Id": args.event_id}
 
     print("POSTing webhook to", args.url)
     print("Payload:\n", json.dumps(payload, indent=2))
@@ -1,6 +1,9 @@
+from datetime import datetime
 import pytest
-from routes.api_compat import allocate_rooms
+from fastapi import HTTPException
+from routes.api_compat import allocate_rooms, find_conflicting_rooms, resolve_selected_cottages
 from bson import ObjectId
+from lib.availability import AvailabilityCalendar
 
 
 def make_room(_id, cap, price=100, slug=None, extra_beds=None):
@@ -35,3 +38,157 @@ def test_preferred_room_types():
     alloc = allocate_rooms(rooms, 4, preferred_room_types=["large"])
     assert len(alloc) == 1
     assert str(alloc[0]) == "000000000000000000000002"
+
+
+def test_group_booking_more_than_four_rooms():
+    rooms = [make_room("%024x" % (i + 1), 2, 50 + i) for i in range(8)]
+    alloc = allocate_rooms(rooms, 12)
+    assert len(alloc) == 6
+    # cheapest six rooms are picked
+    assert [str(a) for a in alloc] == ["%024x" % (i + 1) for i in range(6)]
+    assert allocate_rooms(rooms, 12, max_k=4) == []
+    assert allocate_rooms(rooms, 17) == []
+
+
+ACC = ObjectId("0000000000000000000000a1")
+R1, R2, R3 = (ObjectId(f"00000000000000000000000{i}") for i in (1, 2, 3))
+
+
+def _matches(doc, q):
+    """Equality/$in (array-aware), $or, $lt/$gt: the filters the resolver and conflict check send."""
+    for k, v in q.items():
+        if k == "$or":
+            if not any(_matches(doc, sub) for sub in v):
+                return False
+            continue
+        val = doc.get(k)
+        vals = val if isinstance(val, list) else [val]
+        if isinstance(v, dict):
+            for op, arg in v.items():
+                if op == "$in" and not any(x in arg for x in vals):
+                    return False
+                if op == "$lt" and not (val is not None and val < arg):
+                    return False
+                if op == "$gt" and not (val is not None and val > arg):
+                    return False
+        elif v not in vals:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, keys):
+        for key, direction in reversed(keys):
+            self.docs.sort(key=lambda d: str(d.get(key)), reverse=direction < 0)
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs
+
+    def __aiter__(self):
+        return self._gen()
+
+    async def _gen(self):
+        for d in self.docs:
+            yield d
+
+
+class FakeColl:
+    def __init__(self, docs):
+        self.docs = docs
+        self.queries = 0
+
+    def find(self, q, projection=None):
+        self.queries += 1
+        return FakeCursor([d for d in self.docs if _matches(d, q)])
+
+    def aggregate(self, pipeline):
+        docs = self.docs
+        for stage in pipeline:
+            (op, arg), = stage.items()
+            if op == "$match":
+                docs = [d for d in docs if _matches(d, arg)]
+            elif op == "$project":
+                docs = [{"_id": d["_id"], **{k: d[k] for k in arg if k in d}} for d in docs]
+            elif op == "$unwind":
+                field = arg.lstrip("$")
+                docs = [{**d, field: v} for d in docs for v in d.get(field) or []]
+            elif op == "$group":
+                field = arg["_id"].lstrip("$")
+                docs = [{"_id": v} for v in dict.fromkeys(d[field] for d in docs)]
+        return FakeCursor(docs)
+
+
+class FakeDb(dict):
+    def __getitem__(self, name):
+        return self.setdefault(name, FakeColl([]))
+
+
+def resort_db(bookings=()):
+    db = FakeDb()
+    db["rooms"] = FakeColl([
+        {"_id": R1, "id": "garden-1", "accommodation_id": ACC, "capacity": 2},
+        {"_id": R2, "accommodation_id": ACC, "capacity": 2},
+        {"_id": R3, "accommodation_id": "villa", "capacity": 4},
+    ])
+    db["accommodations"] = FakeColl([{"_id": ACC, "slug": "garden"}])
+    db["bookings"] = FakeColl(list(bookings))
+    return db
+
+
+STAY = (datetime(2026, 5, 10), datetime(2026, 5, 12))
+
+
+@pytest.mark.asyncio
+async def test_resolve_mixes_room_ids_custom_ids_accommodations_and_slugs():
+    db = resort_db()
+    # ObjectId string of a room, a room's custom id, an accommodation_id stored as str on rooms
+    got = await resolve_selected_cottages(db, [str(R1), "villa"], *STAY, AvailabilityCalendar())
+    assert got == {str(R1): [db["rooms"].docs[0]], "villa": [db["rooms"].docs[2]]}
+    got = await resolve_selected_cottages(db, ["garden-1"], *STAY, AvailabilityCalendar())
+    assert got["garden-1"][0]["_id"] == R1
+    # an accommodation by slug expands to its rooms, in _id order
+    got = await resolve_selected_cottages(db, ["garden", "garden"], *STAY, AvailabilityCalendar())
+    assert [r["_id"] for r in got["garden"]] == [R1, R2]
+    # a fixed number of queries: rooms, accommodations, then the slug's pool
+    assert db["rooms"].queries + db["accommodations"].queries == 5
+
+
+@pytest.mark.asyncio
+async def test_resolve_rejects_unknown_ids_and_busy_rooms():
+    db = resort_db()
+    with pytest.raises(HTTPException) as e:
+        await resolve_selected_cottages(db, ["nowhere"], *STAY, AvailabilityCalendar())
+    assert e.value.status_code == 400 and "not found" in e.value.detail
+    cal = AvailabilityCalendar()
+    cal.reserve("b1", [R1], "2026-05-11", "2026-05-13")
+    with pytest.raises(HTTPException):
+        await resolve_selected_cottages(db, [str(R1)], *STAY, cal)
+    with pytest.raises(HTTPException):
+        await resolve_selected_cottages(db, [str(R1), str(R1)], *STAY, AvailabilityCalendar())
+
+
+@pytest.mark.asyncio
+async def test_resolve_falls_back_to_a_free_room_of_the_accommodation():
+    db = resort_db()
+    cal = AvailabilityCalendar()
+    cal.reserve("b1", [R1], *STAY)
+    got = await resolve_selected_cottages(db, [str(ACC)], *STAY, cal)
+    assert [r["_id"] for r in got[str(ACC)]] == [R2]
+    # a room picked explicitly is not handed out again from its accommodation's pool
+    with pytest.raises(HTTPException):
+        await resolve_selected_cottages(db, [str(R2), str(ACC)], *STAY, cal)
+
+
+@pytest.mark.asyncio
+async def test_conflicts_come_from_allocated_cottages_of_active_overlapping_bookings():
+    db = resort_db([
+        {"_id": 1, "allocated_cottages": [R1, R3], "status": "confirmed", "check_in": datetime(2026, 5, 11), "check_out": datetime(2026, 5, 14)},
+        {"_id": 2, "allocated_cottages": [R2], "status": "cancelled", "check_in": datetime(2026, 5, 10), "check_out": datetime(2026, 5, 12)},
+        {"_id": 3, "allocated_cottages": [R2], "status": "pending", "check_in": datetime(2026, 5, 12), "check_out": datetime(2026, 5, 13)},
+    ])
+    assert await find_conflicting_rooms(db, [R1, R2], *STAY) == {str(R1)}
+    assert await find_conflicting_rooms(db, [], *STAY) == set()
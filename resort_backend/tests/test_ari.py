@@ -0,0 +1,110 @@
+import asyncio
+from datetime import date, datetime, timedelta
+import pytest
+from lib.availability import AvailabilityCalendar, stay_mask
+from lib.ari import AriFeed, mask_dates, load_busy, watermark
+from lib.reservations import month_masks
+
+
+def feed_with_types():
+    cal = AvailabilityCalendar()
+    feed = AriFeed(cal=cal, debounce=0.01)
+    feed.types = {"deluxe": {"units": ["r1", "r2"], "rate": 5000}, "cottage": {"units": ["cottage"], "rate": 8000}}
+    feed.unit_type = {"r1": "deluxe", "r2": "deluxe", "cottage": "cottage"}
+    feed.types_loaded_at = 0.0
+    cal.add_listener(feed.on_calendar_change)
+    return cal, feed
+
+
+def test_mask_dates_lists_only_nights_inside_window():
+    mask = stay_mask("2026-05-10", "2026-05-13")
+    assert mask_dates(mask, date(2026, 5, 11), 30) == [date(2026, 5, 11), date(2026, 5, 12)]
+    assert mask_dates(mask, date(2026, 5, 1), 9) == []
+
+
+def test_booking_marks_only_its_own_nights_and_release_reports_them_again():
+    cal, feed = feed_with_types()
+    cal.reserve("b1", ["r1"], "2026-05-10", "2026-05-12")
+    assert feed._dirty == {"deluxe": stay_mask("2026-05-10", "2026-05-12")}
+    # a second holder on the same nights changes nothing
+    cal.reserve("b2", ["r1"], "2026-05-10", "2026-05-12")
+    cal.reserve("b3", ["stranger"], "2026-05-10", "2026-05-12")
+    assert feed._dirty == {"deluxe": stay_mask("2026-05-10", "2026-05-12")}
+    assert feed.row("deluxe", date(2026, 5, 10), cal._busy)["available"] == 1
+    assert feed.row("deluxe", date(2026, 5, 12), cal._busy)["available"] == 2
+
+    feed._dirty.clear()
+    cal.release("b1")
+    assert feed._dirty == {}
+    cal.release("b2")
+    assert feed._dirty == {"deluxe": stay_mask("2026-05-10", "2026-05-12")}
+
+
+@pytest.mark.asyncio
+async def test_changes_within_debounce_window_flush_once(monkeypatch):
+    cal, feed = feed_with_types()
+    feed.db = object()
+    flushed = []
+
+    async def fake_flush():
+        feed._flush_handle = None
+        flushed.append(dict(feed._dirty))
+        feed._dirty.clear()
+
+    monkeypatch.setattr(feed, "flush", fake_flush)
+    cal.reserve("b1", ["r1"], "2026-05-10", "2026-05-11")
+    cal.reserve("b2", ["cottage"], "2026-05-10", "2026-05-11")
+    cal.reserve("b3", ["r2"], "2026-05-11", "2026-05-12")
+    await asyncio.sleep(0.05)
+    assert flushed == [{"deluxe": stay_mask("2026-05-10", "2026-05-12"), "cottage": stay_mask("2026-05-10", "2026-05-11")}]
+
+    feed.mark_type("cottage")
+    await asyncio.sleep(0.05)
+    assert flushed[-1] == {"cottage": -1}
+
+
+class FakeColl:
+    def __init__(self, docs):
+        self.docs = docs
+
+    async def find(self, q, projection=None):
+        for d in self.docs:
+            if "_id" not in q or d["_id"] in q["_id"]["$in"]:
+                yield d
+
+
+def test_rows_are_computed_from_mongo_not_the_worker_calendar():
+    cal, feed = feed_with_types()  # this worker's calendar has seen nothing
+    (month, bits), = month_masks("2026-05-10", "2026-05-12")
+    db = {"room_nights": FakeColl([{"_id": f"r1:{month}", "unit": "r1", "month": month, "mask": bits}]),
+          "bookings": FakeColl([{"_id": "b9", "allocated_cottages": ["r2", "elsewhere"],
+                                 "check_in": datetime(2026, 5, 11), "check_out": datetime(2026, 5, 13)}])}
+    busy = asyncio.run(load_busy(db, ["r1", "r2", "deluxe"], date(2026, 5, 1), 30))
+    assert "elsewhere" not in busy
+    assert [feed.row("deluxe", date(2026, 5, d), busy)["available"] for d in (10, 11, 12, 13)] == [1, 0, 1, 2]
+
+
+def test_readers_stop_below_the_oldest_block_in_flight():
+    now = datetime(2026, 5, 1, 12)
+    assert watermark(None, now) == 0
+    assert watermark({"seq": 30}, now) == 30
+    doc = {"seq": 30, "inflight": [{"first": 21, "at": now}, {"first": 11, "at": now - timedelta(seconds=5)}]}
+    assert watermark(doc, now) == 10
+    # a block left behind by a worker that died stops holding readers back
+    doc["inflight"][1]["at"] = now - timedelta(hours=1)
+    assert watermark(doc, now) == 20
+
+
+@pytest.mark.asyncio
+async def test_only_the_lease_holder_pushes():
+    class NoLease:
+        async def acquire(self, db, key, **kw):
+            return None
+
+    cal, feed = feed_with_types()
+    feed.locks, feed.db = NoLease(), object()
+    pushed = []
+    feed.push = lambda: pushed.append(1)
+    assert await feed.push_if_leader() is False
+    assert pushed == [] and feed._flush_handle is not None
+    feed._flush_handle.cancel()
@@ -0,0 +1,113 @@
+from datetime import datetime
+from bson import ObjectId
+import pytest
+from lib.availability import AvailabilityCalendar, stay_mask, booked_units_pipeline, booked_unit_ids, unit_id_variants
+
+
+ROOM_A = ObjectId("000000000000000000000001")
+ROOM_B = ObjectId("000000000000000000000002")
+
+
+def test_reserved_range_is_busy_and_touching_ranges_are_free():
+    cal = AvailabilityCalendar()
+    cal.reserve("b1", [ROOM_A], datetime(2026, 5, 10), datetime(2026, 5, 13))
+    assert not cal.is_free(ROOM_A, datetime(2026, 5, 12), datetime(2026, 5, 14))
+    assert not cal.is_free(str(ROOM_A), "2026-05-09", "2026-05-11")
+    # check-out day is free for the next check-in
+    assert cal.is_free(ROOM_A, datetime(2026, 5, 13), datetime(2026, 5, 15))
+    assert cal.is_free(ROOM_A, datetime(2026, 5, 8), datetime(2026, 5, 10))
+    assert cal.is_free(ROOM_B, datetime(2026, 5, 10), datetime(2026, 5, 13))
+
+
+def test_busy_units_and_free_units():
+    cal = AvailabilityCalendar()
+    cal.reserve("b1", [ROOM_A], datetime(2026, 5, 10), datetime(2026, 5, 13))
+    assert cal.busy_units(datetime(2026, 5, 11), datetime(2026, 5, 12)) == {str(ROOM_A)}
+    rooms = [{"_id": ROOM_A}, {"_id": ROOM_B}]
+    assert cal.free_units(rooms, datetime(2026, 5, 11), datetime(2026, 5, 12)) == [{"_id": ROOM_B}]
+
+
+def test_release_keeps_other_holders():
+    cal = AvailabilityCalendar()
+    cal.reserve("b1", [ROOM_A], datetime(2026, 5, 10), datetime(2026, 5, 12))
+    cal.reserve("b2", [ROOM_A], datetime(2026, 5, 20), datetime(2026, 5, 22))
+    cal.release("b1")
+    assert cal.is_free(ROOM_A, datetime(2026, 5, 10), datetime(2026, 5, 12))
+    assert not cal.is_free(ROOM_A, datetime(2026, 5, 21), datetime(2026, 5, 22))
+    cal.release("b2")
+    assert cal.busy_units(datetime(2026, 1, 1), datetime(2027, 1, 1)) == set()
+
+
+def test_per_night_occupancy():
+    cal = AvailabilityCalendar()
+    cal.reserve_night("b1", "acc-1", datetime(2026, 6, 1))
+    assert not cal.is_free("acc-1", datetime(2026, 5, 31), datetime(2026, 6, 2))
+    assert cal.is_free("acc-1", datetime(2026, 6, 2), datetime(2026, 6, 3))
+
+
+def test_empty_or_invalid_range_has_no_nights():
+    assert stay_mask(datetime(2026, 5, 10), datetime(2026, 5, 10)) == 0
+    assert stay_mask(None, datetime(2026, 5, 10)) == 0
+
+
+def test_free_counts_per_night():
+    cal = AvailabilityCalendar()
+    cal.reserve("b1", [ROOM_A], "2026-05-10", "2026-05-12")
+    cal.reserve("b2", [ROOM_B], "2026-05-11", "2026-05-13")
+    rooms = [ROOM_A, ROOM_B, "spare"]
+    assert cal.free_counts(rooms, "2026-05-09", 5) == [3, 2, 1, 2, 3]
+    assert cal.free_counts([], "2026-05-09", 2) == [0, 0]
+
+    # a booking on the accommodation itself takes one of its rooms, never below zero
+    cal.reserve("b3", ["acc"], "2026-05-10", "2026-05-12")
+    assert cal.free_counts(rooms, "2026-05-09", 5, shared="acc") == [3, 1, 0, 2, 3]
+
+
+def test_booked_units_pipeline_uses_typed_bounds():
+    match = booked_units_pipeline(datetime(2026, 5, 10), datetime(2026, 5, 12))[0]["$match"]
+    assert match["check_in"] == {"$lt": datetime(2026, 5, 12)}
+    assert match["check_out"] == {"$gt": datetime(2026, 5, 10)}
+    with pytest.raises(TypeError):
+        booked_units_pipeline("2026-05-10", "2026-05-12")
+    assert set(unit_id_variants([str(ROOM_A), "c1"])) == {str(ROOM_A), ROOM_A, "c1"}
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __aiter__(self):
+        return self._gen()
+
+    async def _gen(self):
+        for d in self.docs:
+            yield d
+
+    async def to_list(self, length=None):
+        return self.docs
+
+
+class FakeListingDb:
+    """`bookings` holds one string-dated booking (invisible to the typed $match); room_nights holds its nights."""
+
+    def __init__(self, nights):
+        self.nights = nights
+
+    def __getitem__(self, name):
+        return self
+
+    def aggregate(self, pipeline):
+        return FakeCursor([])
+
+    def find(self, q, projection=None):
+        return FakeCursor([d for d in self.nights if d["month"] in q["month"]["$in"]])
+
+
+@pytest.mark.asyncio
+async def test_booked_unit_ids_sees_string_dated_bookings_through_room_nights():
+    # booking {"accommodation_id": [ROOM_A], "check_in": "2026-05-10", "check_out": "2026-05-12"}
+    nights = [{"_id": f"{ROOM_A}:2026-05", "unit": str(ROOM_A), "month": "2026-05", "mask": 0b11 << 9},
+              {"_id": f"{ROOM_B}:2026-05", "unit": str(ROOM_B), "month": "2026-05", "mask": 0b1 << 20}]
+    booked = await booked_unit_ids(FakeListingDb(nights), datetime(2026, 5, 11), datetime(2026, 5, 13))
+    assert set(booked) == {str(ROOM_A), ROOM_A}
+    assert await booked_unit_ids(FakeListingDb(nights), datetime(2026, 5, 12), datetime(2026, 5, 14)) == []
@@ -0,0 +1,42 @@
+import json
+from datetime import datetime, date
+import pytest
+from bson import ObjectId
+from bson.decimal128 import Decimal128
+import utils
+from utils import serialize_doc, encode_docs, dumps_bson, BSONResponse
+
+
+DOCS = [
+    {
+        "_id": ObjectId("000000000000000000000001"),
+        "guest_name": "Asha",
+        "check_in": datetime(2026, 5, 10, 14, 30),
+        "stay_date": date(2026, 5, 10),
+        "allocated_cottages": [ObjectId("000000000000000000000002")],
+        "payment": {"paid_at": datetime(2026, 5, 1, 9, 0, 0, 123000), "amount": 1200.5, "ref": None},
+    },
+    {"guest_name": "no id", "tags": ["a", "b"]},
+]
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_encode_docs_matches_serialize_doc(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(utils, "orjson", None)
+    elif utils.orjson is None:
+        pytest.skip("orjson not installed")
+    expected = [serialize_doc(d) for d in DOCS]
+    assert json.loads(encode_docs(DOCS)) == expected
+
+
+def test_dumps_bson_handles_decimal128_and_rejects_unknown_types():
+    assert json.loads(dumps_bson({"price": Decimal128("12.50")})) == {"price": "12.50"}
+    with pytest.raises(TypeError):
+        dumps_bson({"x": object()})
+
+
+def test_bson_response_renders_bytes():
+    resp = BSONResponse({"id": ObjectId("000000000000000000000003")})
+    assert resp.media_type == "application/json"
+    assert json.loads(resp.body) == {"id": "000000000000000000000003"}
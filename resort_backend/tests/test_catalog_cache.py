@@ -0,0 +1,100 @@
+import asyncio
+import json
+import pytest
+from lib.catalog_cache import CatalogCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def counting_loader(payload):
+    calls = {"n": 0}
+
+    async def load():
+        calls["n"] += 1
+        await asyncio.sleep(0)
+        return payload
+    return load, calls
+
+
+@pytest.mark.asyncio
+async def test_hit_skips_loader_until_ttl_expires():
+    clock = FakeClock()
+    cache = CatalogCache(clock=clock)
+    load, calls = counting_loader([{"id": "1", "name": "Thali"}])
+    body = await cache.get_or_load("menu", "all", load)
+    assert json.loads(body) == [{"id": "1", "name": "Thali"}]
+    assert await cache.get_or_load("menu", "all", load) is body
+    assert calls["n"] == 1
+    clock.now += cache.ttl_for("menu") + 1
+    await cache.get_or_load("menu", "all", load)
+    assert calls["n"] == 2
+
+
+@pytest.mark.asyncio
+async def test_invalidate_only_drops_that_namespace():
+    cache = CatalogCache()
+    menu, menu_calls = counting_loader([1])
+    nav, nav_calls = counting_loader([2])
+    await cache.get_or_load("menu", "all", menu)
+    await cache.get_or_load("navigation", "public=True", nav)
+    cache.invalidate("menu")
+    await cache.get_or_load("menu", "all", menu)
+    await cache.get_or_load("navigation", "public=True", nav)
+    assert menu_calls["n"] == 2
+    assert nav_calls["n"] == 1
+
+
+@pytest.mark.asyncio
+async def test_lru_eviction_by_entries_and_bytes():
+    cache = CatalogCache(max_entries=2)
+    for key in ("a", "b"):
+        await cache.get_or_load("gallery", key, counting_loader([key])[0])
+    cache.get("gallery", "a")  # touch a so b is least recently used
+    await cache.get_or_load("gallery", "c", counting_loader(["c"])[0])
+    assert cache.get("gallery", "b") is None
+    assert cache.get("gallery", "a") is not None
+
+    small = CatalogCache(max_bytes=20)
+    await small.get_or_load("reviews", "x", counting_loader(["x" * 8])[0])
+    await small.get_or_load("reviews", "y", counting_loader(["y" * 8])[0])
+    assert small.get("reviews", "x") is None
+    assert small.stats()["bytes"] <= 20
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load_and_errors_are_not_cached():
+    cache = CatalogCache()
+    load, calls = counting_loader({"site": "Maud & Meadows"})
+    bodies = await asyncio.gather(*[cache.get_or_load("site", "latest", load) for _ in range(5)])
+    assert calls["n"] == 1
+    assert len(set(bodies)) == 1
+
+    async def failing():
+        raise RuntimeError("db down")
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load("wellness", "all", failing)
+    assert cache.get("wellness", "all") is None
+
+
+@pytest.mark.asyncio
+async def test_load_racing_an_invalidate_is_not_stored():
+    cache = CatalogCache()
+    started = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow():
+        started.set()
+        await release.wait()
+        return ["stale"]
+    task = asyncio.create_task(cache.get_or_load("packages", "all", slow))
+    await started.wait()
+    cache.invalidate("packages")
+    release.set()
+    assert json.loads(await task) == ["stale"]
+    assert cache.get("packages", "all") is None
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import pytest
+from bson import ObjectId
+from lib.event_bus import EventBus, LocalBackend, MongoBackend, DISCONNECT, topic_matcher
+
+
+@pytest.mark.asyncio
+async def test_publish_fans_out_to_every_subscriber():
+    bus = EventBus()
+    await bus.start(LocalBackend())
+    a, b = bus.subscribe(), bus.subscribe()
+    bus.publish({"event": "rooms.updated", "room_id": "r1"})
+    for sub in (a, b):
+        evt = json.loads((await asyncio.wait_for(sub.get(), 1)).payload)
+        assert evt["event"] == "rooms.updated" and "ts" in evt
+    bus.unsubscribe(a)
+    bus.publish({"event": "bookings.created"})
+    assert a.queue.empty()
+    assert json.loads((await b.get()).payload)["event"] == "bookings.created"
+    await bus.stop()
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_keeps_newest_events():
+    bus = EventBus()
+    sub = bus.subscribe(maxsize=3)
+    for i in range(10):
+        bus.publish({"event": "tick", "n": i})
+    assert sub.dropped == 7
+    assert [json.loads((await sub.get()).payload)["n"] for _ in range(3)] == [7, 8, 9]
+
+
+@pytest.mark.asyncio
+async def test_disconnect_policy_closes_stalled_subscriber():
+    bus = EventBus()
+    slow = bus.subscribe(maxsize=2, policy=DISCONNECT)
+    fast = bus.subscribe(maxsize=100)
+    for i in range(5):
+        bus.publish({"event": "tick", "n": i})
+    assert slow.closed and slow not in bus.subscribers
+    assert await slow.get() is None
+    assert fast.queue.qsize() == 5
+
+
+def test_topic_matcher_accepts_names_and_patterns():
+    match = topic_matcher("bookings.*, rooms.updated")
+    assert match("bookings.created") and match("rooms.updated")
+    assert not match("rooms.deleted") and not match("extra_bed.requested")
+    assert topic_matcher(None) is None and topic_matcher("*") is None
+
+
+@pytest.mark.asyncio
+async def test_last_event_id_replays_missed_events_for_subscribed_topics():
+    bus = EventBus(log_size=5)
+    ids = [bus.publish({"event": "bookings.created" if i % 2 else "rooms.updated", "n": i}) for i in range(8)]
+    assert ids == sorted(ids)
+    sub = bus.subscribe(topics="bookings.*", last_event_id=ids[4])
+    bus.publish({"event": "bookings.created", "n": 8})
+    bus.publish({"event": "rooms.updated", "n": 9})
+    got = [(await sub.get()).payload for _ in range(2)]
+    assert [json.loads(p)["n"] for p in got] == [5, 7]
+    assert json.loads((await sub.get()).payload)["n"] == 8
+    assert sub.queue.empty()
+    # an id older than the buffer replays everything still held
+    assert len(bus.subscribe(last_event_id="000000000000000000000000").backlog) == 5
+
+
+class FakeLog:
+    """Capped collection stand-in: every find() returns the whole log in append order."""
+
+    def __init__(self, docs):
+        self.docs = docs
+        self.finds = []
+
+    def find(self, q, cursor_type=None):
+        self.finds.append(q)
+        return FakeTail(list(self.docs))
+
+
+class FakeTail:
+    def __init__(self, docs):
+        self.docs = docs
+        self.alive = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.docs:
+            self.alive = False
+            raise StopAsyncIteration
+        return self.docs.pop(0)
+
+
+@pytest.mark.asyncio
+async def test_mongo_tail_follows_append_order_not_id_order():
+    first, newer, older = ObjectId(), ObjectId(), ObjectId()
+    newer, older = max(newer, older), min(newer, older)
+    bus = EventBus()
+    log = FakeLog([{"_id": i, "topic": "t"} for i in (first, newer, older)])
+    backend = MongoBackend({"events": log})
+    backend.bus, backend._last_id = bus, first
+    task = asyncio.create_task(backend._tail())
+    await asyncio.sleep(0.01)
+    # an event from a worker whose ObjectId sorts lower is still delivered
+    assert [e.id for e in bus.log] == [str(newer), str(older)]
+    assert log.finds == [{}]
+    # the last delivered event was overwritten: everything left is new
+    log.docs = [{"_id": ObjectId(), "topic": "t"}]
+    backend._last_id = ObjectId()
+    await asyncio.sleep(0.6)
+    task.cancel()
+    assert bus.log[-1].id == str(log.docs[0]["_id"]) and len(bus.log) == 3
+
+
+@pytest.mark.asyncio
+async def test_stream_sends_ids_and_heartbeats():
+    from resort_backend.routes.events import _event_generator
+    bus = EventBus()
+    sub = bus.subscribe()
+    gen = _event_generator(sub, heartbeat=0.01)
+    assert (await gen.__anext__()).startswith("retry:")
+    assert await gen.__anext__() == ": keepalive\n\n"
+    eid = bus.publish({"event": "rooms.updated"})
+    frame = await gen.__anext__()
+    assert frame.startswith(f"id: {eid}\ndata: ")
+    await gen.aclose()
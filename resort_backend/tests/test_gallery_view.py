@@ -0,0 +1,53 @@
+from datetime import datetime
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+import lib.gallery_view as gallery_view
+from lib.gallery_view import canonical_fields, encode_cursor, decode_cursor, gallery_pipeline
+
+OID = ObjectId("6a0000000000000000000001")
+
+
+def test_canonical_fields_unify_legacy_spellings():
+    fields = canonical_fields({"_id": OID, "images": ["/uploads/a.jpg"], "title": "Pool", "visible": False,
+                               "categoryName": "spa", "created_at": datetime(2026, 3, 1)})
+    assert fields["isVisible"] is False and fields["category"] == "spa" and fields["createdAt"] == datetime(2026, 3, 1)
+    pub = fields["public"]
+    assert pub["id"] == str(OID) and pub["caption"] == "Pool"
+    assert pub["url"] == pub["imageUrl"] == pub["image_url"] == "/uploads/a.jpg"
+
+    video = canonical_fields({"_id": OID, "url": "/uploads/clip.MP4", "isVisible": True, "visible": False})
+    assert video["isVisible"] is True and video["public"]["type"] == "video"
+    # no timestamp field: the ObjectId's creation time keeps the sort key total
+    assert video["createdAt"] == OID.generation_time.replace(tzinfo=None)
+
+
+def test_projection_is_rebuilt_when_the_media_base_url_changes(monkeypatch):
+    monkeypatch.setattr(gallery_view, "MEDIA_BASE_URL", "https://cdn.example.com")
+    fields = canonical_fields({"_id": OID, "url": "/uploads/a.jpg"})
+    assert fields["public"]["url"] == "https://cdn.example.com/uploads/a.jpg"
+    assert fields["public_base"] == "https://cdn.example.com"
+    assert {"public_base": {"$ne": "https://cdn.example.com"}} in gallery_view.stale_query()["$or"]
+
+
+def test_cursor_round_trip_and_rejects_garbage():
+    cursor = encode_cursor({"createdAt": datetime(2026, 3, 1, 12, 0, 0, 123000), "id": str(OID)})
+    cond = decode_cursor(cursor)
+    assert cond == {"$or": [{"createdAt": {"$lt": datetime(2026, 3, 1, 12, 0, 0, 123000)}},
+                            {"createdAt": datetime(2026, 3, 1, 12, 0, 0, 123000), "_id": {"$lt": OID}}]}
+    with pytest.raises(HTTPException):
+        decode_cursor("nope")
+
+
+def test_pipeline_keeps_filter_and_cursor_on_the_index():
+    cursor = encode_cursor({"createdAt": datetime(2026, 3, 1), "id": str(OID)})
+    plain = gallery_pipeline("rooms", True, cursor, 10)
+    assert plain[0] == {"$match": {"$and": [{"category": "rooms", "isVisible": True}, decode_cursor(cursor)]}}
+    assert plain[1:] == [{"$sort": {"createdAt": -1, "_id": -1}}, {"$limit": 11}, {"$replaceRoot": {"newRoot": "$public"}}]
+
+    faceted = gallery_pipeline(None, True, cursor, 10, facets=True)
+    assert faceted[0] == {"$match": {"isVisible": True}}
+    facet = faceted[2]["$facet"]
+    # counts ignore the page position; only the items branch applies the cursor
+    assert facet["items"][0] == {"$match": decode_cursor(cursor)}
+    assert facet["categories"][0] == {"$group": {"_id": "$category", "count": {"$sum": 1}}}
@@ -0,0 +1,77 @@
+import os
+from pymongo import MongoClient
+from pymongo.errors import OperationFailure
+from lib.indexes import INDEXES, HOT_QUERIES, IndexSpec, plan, plan_stages, ensure_indexes_sync
+
+
+def test_plan_reports_missing_changed_renamed_and_unmanaged():
+    specs = [
+        IndexSpec("rooms", [("slug", 1)], "rooms_slug_idx"),
+        IndexSpec("rooms", [("accommodation_id", 1)], "rooms_accommodation_idx"),
+        IndexSpec("rooms", [("code", 1)], "rooms_code_unique", {"unique": True}),
+        IndexSpec("rooms", [("name", 1)], "rooms_name_idx"),
+    ]
+    existing = {
+        "_id_": {"key": [("_id", 1)]},
+        "rooms_slug_idx": {"key": [("slug", 1)], "v": 2},
+        "accommodation_id_1": {"key": [("accommodation_id", 1)], "v": 2},
+        "rooms_code_unique": {"key": [("code", 1)], "v": 2},
+        "legacy_idx": {"key": [("legacy", 1)], "v": 2},
+    }
+    p = plan(specs, existing)
+    assert [s.name for s in p["create"]] == ["rooms_name_idx"]
+    assert [s.name for s in p["changed"]] == ["rooms_code_unique"]
+    assert [(s.name, n) for s, n in p["renamed"]] == [("rooms_accommodation_idx", "accommodation_id_1")]
+    assert p["unmanaged"] == ["legacy_idx"]
+
+
+def test_registry_names_are_unique_and_plan_stages_walks_nested_plans():
+    names = [(s.collection, s.name) for s in INDEXES]
+    assert len(names) == len(set(names))
+    winning = {"stage": "FETCH", "inputStage": {"stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "IXSCAN"}]}}
+    assert plan_stages(winning) == ["FETCH", "OR", "IXSCAN", "IXSCAN"]
+    # one booking per paid order, bookings without an order id are not indexed
+    order = next(s for s in INDEXES if s.collection == "bookings" and s.keys == [("payment.order_id", 1)])
+    assert order.options == {"unique": True, "partialFilterExpression": {"payment.order_id": {"$type": "string"}}}
+
+
+class FakeIndexColl:
+    def __init__(self, error=None):
+        self.error = error
+        self.created = []
+
+    def index_information(self):
+        if self.error:
+            raise self.error
+        return {"_id_": {"key": [("_id", 1)]}}
+
+    def create_indexes(self, models):
+        self.created += [m.document["name"] for m in models]
+
+
+def test_a_failing_collection_is_reported_and_the_rest_still_applied():
+    db = {"rooms": FakeIndexColl(OperationFailure("not authorized on rooms")), "guests": FakeIndexColl()}
+    specs = [IndexSpec("rooms", [("slug", 1)], "rooms_slug_idx"), IndexSpec("guests", [("email", 1)], "guests_email_idx")]
+    summary = ensure_indexes_sync(db, specs=specs)
+    assert summary["created"] == ["guests.guests_email_idx"]
+    assert summary["failed"] == ["rooms: not authorized on rooms"]
+    assert db["guests"].created == ["guests_email_idx"]
+
+
+def test_hot_queries_are_index_backed():
+    mongo_url = os.getenv("MONGODB_URL")
+    assert mongo_url is not None, "MONGODB_URL must be set to run this test"
+    client = MongoClient(mongo_url)
+    db = client["test_indexes_db"]
+    try:
+        ensure_indexes_sync(db)
+        assert ensure_indexes_sync(db)["created"] == []
+        for desc, coll, flt, sort in HOT_QUERIES:
+            cursor = db[coll].find(flt)
+            if sort:
+                cursor = cursor.sort(sort)
+            stages = plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+            assert "COLLSCAN" not in stages, f"{desc}: {stages}"
+    finally:
+        client.drop_database("test_indexes_db")
+        client.close()
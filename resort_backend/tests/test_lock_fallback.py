@@ -10,7 +10,11 @@ from main import app
 
 @pytest.mark.asyncio
 async def test_fallback_lock_path(monkeypatch):
-    """Force the fallback path by removing app.state.db_client and ensure bookings still serialize to single success."""
+    """Force the non-transactional path by removing app.state.db_client; concurrent bookings still serialize to one success.
+
+    Without a session the route claims the range in room_nights before inserting
+    (this replaced the lib/locks.py fallback lock).
+    """
     mongo_url = os.getenv("MONGODB_URL")
     assert mongo_url is not None, "MONGODB_URL must be set to run this test"
     db_name = os.getenv("DATABASE_NAME", "resort_db")
@@ -19,20 +23,23 @@ async def test_fallback_lock_path(monkeypatch):
 
     # Clean test artifacts
     db.bookings.delete_many({"accommodation_id": "test-fallback-room"})
-    db.occupancies.delete_many({"accommodation_id": "test-fallback-room"})
-    db.locks.delete_many({"key": {"$regex": "^accom:test-fallback-room:"}})
+    db.room_nights.delete_many({"unit": "test-fallback-room"})
 
     # Force fallback by removing db_client so transaction path is not taken
     monkeypatch.setattr(app.state, "db_client", None, raising=False)
 
     transport = ASGITransport(app=app)
     async with AsyncClient(transport=transport, base_url="http://test") as ac:
-        check_in = (datetime.utcnow() + timedelta(days=4)).replace(hour=14, minute=0, second=0, microsecond=0)
+        check_in = (datetime.utcnow() + timedelta(days=4)).date()
         check_out = check_in + timedelta(days=2)
         payload = {
             "guest_name": "Fallback Tester",
             "guest_email": "fallback@example.com",
             "guest_phone": "000",
+            "address": "1 Test Lane",
+            "city": "Test",
+            "postal_code": "000000",
+            "country": "IN",
             "accommodation_id": "test-fallback-room",
             "check_in": check_in.isoformat(),
             "check_out": check_out.isoformat(),
@@ -40,7 +47,7 @@ async def test_fallback_lock_path(monkeypatch):
         }
 
         async def try_book():
-            r = await ac.post("/bookings/", json=payload)
+            r = await ac.post("/api/bookings/", json=payload)
             return r.status_code
 
         tasks = [asyncio.create_task(try_book()) for _ in range(4)]
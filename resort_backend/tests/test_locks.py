@@ -0,0 +1,113 @@
+import asyncio
+import time
+import pytest
+from lib.locks import LockManager, LockLost
+
+
+class MemoryLockManager(LockManager):
+    """LockManager with the Mongo operations replaced by a dict (same matching rules)."""
+    def __init__(self, latency: float = 0.0, **kw):
+        super().__init__(**kw)
+        self.latency = latency
+        self.docs = {}
+        self.remote_calls = 0
+
+    async def _io(self):
+        self.remote_calls += 1
+        await asyncio.sleep(self.latency)
+
+    async def _ensure_index(self, db):
+        pass
+
+    async def _try_acquire(self, db, key, owner, ttl_seconds):
+        await self._io()
+        now = time.monotonic()
+        doc = self.docs.get(key)
+        if doc is not None and doc["owner"] is not None and doc["lease_until"] > now:
+            return None
+        token = (doc["token"] if doc else 0) + 1
+        self.docs[key] = {"owner": owner, "lease_until": now + ttl_seconds, "token": token}
+        return token
+
+    async def _renew_remote(self, db, key, owner, token, ttl_seconds):
+        await self._io()
+        doc = self.docs.get(key)
+        if not doc or doc["owner"] != owner or doc["token"] != token:
+            return False
+        doc["lease_until"] = time.monotonic() + ttl_seconds
+        return True
+
+    async def _release_remote(self, db, key, owner, token):
+        await self._io()
+        doc = self.docs.get(key)
+        if doc and doc["owner"] == owner and (token is None or doc["token"] == token):
+            doc["owner"] = None
+
+
+@pytest.mark.asyncio
+async def test_mutual_exclusion_and_increasing_fencing_tokens():
+    mgr = MemoryLockManager(latency=0.001)
+    inside, max_inside, tokens = 0, 0, []
+
+    async def worker():
+        nonlocal inside, max_inside
+        lease = await mgr.acquire(None, "accom:a", ttl_seconds=5, timeout=5)
+        assert lease is not None
+        inside += 1
+        max_inside = max(max_inside, inside)
+        tokens.append(lease.token)
+        await asyncio.sleep(0.002)
+        inside -= 1
+        await lease.release()
+
+    await asyncio.gather(*[worker() for _ in range(20)])
+    assert max_inside == 1
+    assert tokens == sorted(tokens) and len(set(tokens)) == 20
+    assert mgr._local == {}
+
+
+@pytest.mark.asyncio
+async def test_local_waiters_coalesce_before_touching_the_store():
+    mgr = MemoryLockManager(latency=0.001)
+    held = await mgr.acquire(None, "k", ttl_seconds=5, timeout=1)
+    calls_before = mgr.remote_calls
+    waiters = [asyncio.create_task(mgr.acquire(None, "k", ttl_seconds=5, timeout=1)) for _ in range(10)]
+    await asyncio.sleep(0.05)
+    # all ten are parked on the local lock, none is polling the store
+    assert mgr.remote_calls == calls_before
+    await held.release()
+    leases = []
+    for w in waiters:
+        lease = await w
+        leases.append(lease)
+        await lease.release()
+    assert all(leases)
+
+
+@pytest.mark.asyncio
+async def test_timeout_returns_none_and_held_lease_from_other_process_backs_off():
+    mgr = MemoryLockManager()
+    mgr.docs["k"] = {"owner": "other-process", "lease_until": time.monotonic() + 60, "token": 7}
+    t0 = time.monotonic()
+    assert await mgr.acquire(None, "k", timeout=0.2) is None
+    assert time.monotonic() - t0 < 1
+    # jittered exponential backoff, not a tight poll loop
+    assert mgr.remote_calls < 30
+    mgr.docs["k"]["lease_until"] = time.monotonic() - 1
+    lease = await mgr.acquire(None, "k", timeout=0.2)
+    assert lease.token == 8
+
+
+@pytest.mark.asyncio
+async def test_renew_and_lock_lost():
+    mgr = MemoryLockManager()
+    async with mgr.lease(None, "k", ttl_seconds=0.06) as lease:
+        await asyncio.sleep(0.15)
+        # auto-renew kept the short lease alive
+        assert mgr.docs["k"]["owner"] == lease.owner
+    assert mgr.docs["k"]["owner"] is None
+
+    lease = await mgr.acquire(None, "k2", ttl_seconds=5)
+    mgr.docs["k2"].update(owner="someone-else", token=lease.token + 1)
+    with pytest.raises(LockLost):
+        await lease.renew()
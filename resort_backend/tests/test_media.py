@@ -0,0 +1,51 @@
+import io
+import os
+import pytest
+import lib.media
+from lib.media import plan_sizes, build_srcset, render_variants, source_url, read_source, variant_key, Image
+
+
+def test_plan_sizes_keeps_aspect_and_never_upscales():
+    assert plan_sizes(4000, 3000) == [("thumbnail", 320, 240), ("medium", 800, 600), ("large", 1600, 1200)]
+    assert plan_sizes(1000, 500) == [("thumbnail", 320, 160), ("medium", 800, 400)]
+    assert plan_sizes(200, 100) == [("thumbnail", 200, 100)]
+
+
+def test_source_url_skips_videos_and_srcset_orders_by_width():
+    assert source_url({"url": "/uploads/a.jpg"}) == "/uploads/a.jpg"
+    assert source_url({"imageUrl": "https://x/clip.mp4"}) is None
+    assert source_url({"url": "/uploads/a.jpg", "type": "video"}) is None
+    variants = {"medium": {"width": 800, "webp": "/m.webp", "jpeg": "/m.jpg"}, "thumbnail": {"width": 320, "webp": "/t.webp", "jpeg": "/t.jpg"}}
+    assert build_srcset(variants) == {"webp": "/t.webp 320w, /m.webp 800w", "jpeg": "/t.jpg 320w, /m.jpg 800w"}
+
+
+
+def test_variant_key_follows_the_image_content():
+    # an image replaced under the same URL gets a new key, so cached variants are not reused
+    assert variant_key(b"first") != variant_key(b"second")
+    assert variant_key(b"first") == variant_key(b"first") and len(variant_key(b"first")) == 16
+
+
+@pytest.mark.asyncio
+async def test_remote_sources_need_an_allow_listed_host(monkeypatch):
+    monkeypatch.setattr(lib.media, "SOURCE_HOSTS", {"cdn.example.com"})
+    assert source_url({"url": "https://cdn.example.com/a.jpg"}) == "https://cdn.example.com/a.jpg"
+    assert source_url({"url": "http://169.254.169.254/latest/meta-data"}) is None
+    assert source_url({"url": "https://cdn.example.com.evil.test/a.jpg"}) is None
+    assert source_url({"url": "file:///etc/passwd"}) is None
+    with pytest.raises(ValueError):
+        await read_source("http://localhost:27017/")
+
+
+def test_render_variants_writes_webp_and_jpeg(tmp_path):
+    if Image is None:
+        pytest.skip("Pillow not installed")
+    buf = io.BytesIO()
+    Image.new("RGBA", (1000, 600), (10, 120, 200, 128)).save(buf, "PNG")
+    variants = render_variants(buf.getvalue(), str(tmp_path), "/uploads/derived/x")
+    assert sorted(variants) == ["medium", "thumbnail"]
+    assert variants["medium"] == {"width": 800, "height": 480, "webp": "/uploads/derived/x/medium.webp", "jpeg": "/uploads/derived/x/medium.jpg"}
+    with Image.open(os.path.join(tmp_path, "thumbnail.jpg")) as im:
+        assert im.size == (320, 192) and im.mode == "RGB"
+    with Image.open(os.path.join(tmp_path, "medium.webp")) as im:
+        assert im.format == "WEBP"
@@ -0,0 +1,78 @@
+import hashlib
+import gzip
+from starlette.applications import Starlette
+from starlette.routing import Mount
+from starlette.testclient import TestClient
+from lib.media_files import MediaFiles, parse_ranges, accepted_encodings
+
+DATA = bytes(range(256)) * 4  # 1024 bytes
+SHA = hashlib.sha256(DATA).hexdigest()
+
+
+def client(tmp_path):
+    (tmp_path / "cas" / SHA[:2]).mkdir(parents=True)
+    (tmp_path / "cas" / SHA[:2] / f"{SHA}.mp4").write_bytes(DATA)
+    (tmp_path / "menu.json").write_bytes(b'{"a": 1}' * 50)
+    (tmp_path / "menu.json.gz").write_bytes(gzip.compress(b'{"a": 1}' * 50))
+    app = Starlette(routes=[Mount("/uploads", MediaFiles(directory=str(tmp_path)))])
+    return TestClient(app)
+
+
+def test_parse_ranges():
+    assert parse_ranges("bytes=0-9", 100) == [(0, 9)]
+    assert parse_ranges("bytes=-10, 95-", 100) == [(90, 99)]
+    assert parse_ranges("bytes=50-, 0-4, 3-7", 100) == [(0, 7), (50, 99)]
+    assert parse_ranges("bytes=200-300", 100) == []
+    assert parse_ranges("bytes=9-2", 100) is None and parse_ranges("items=0-1", 100) is None
+    # malformed bounds send the whole file instead of failing the request
+    assert parse_ranges("bytes=0-abc", 100) is None and parse_ranges("bytes=0-1x", 100) is None
+    assert parse_ranges("bytes=x1-5", 100) is None and parse_ranges("bytes=-", 100) is None
+    assert parse_ranges("bytes=" + ",".join(f"{i * 4}-{i * 4 + 1}" for i in range(20)), 100) is None
+    assert accepted_encodings("gzip;q=0.5, br;q=0, identity") == {"gzip", "identity"}
+
+
+def test_hashed_upload_etag_immutable_and_conditional(tmp_path):
+    c = client(tmp_path)
+    url = f"/uploads/cas/{SHA[:2]}/{SHA}.mp4"
+    r = c.get(url)
+    assert r.status_code == 200 and r.content == DATA
+    assert r.headers["etag"] == f'"{SHA}"' and "immutable" in r.headers["cache-control"]
+    assert r.headers["accept-ranges"] == "bytes" and r.headers["content-type"] == "video/mp4"
+    assert c.get(url, headers={"If-None-Match": f'W/"x", "{SHA}"'}).status_code == 304
+    assert c.head(url).headers["content-length"] == "1024"
+
+    r = c.get("/uploads/menu.json")
+    assert "immutable" not in r.headers["cache-control"]
+    assert c.get("/uploads/menu.json", headers={"If-None-Match": r.headers["etag"]}).status_code == 304
+
+
+def test_single_multi_and_unsatisfiable_ranges(tmp_path):
+    c = client(tmp_path)
+    url = f"/uploads/cas/{SHA[:2]}/{SHA}.mp4"
+    r = c.get(url, headers={"Range": "bytes=100-199"})
+    assert r.status_code == 206 and r.content == DATA[100:200]
+    assert r.headers["content-range"] == "bytes 100-199/1024"
+
+    r = c.get(url, headers={"Range": "bytes=0-1, -2"})
+    assert r.status_code == 206
+    boundary = r.headers["content-type"].split("boundary=")[1]
+    assert int(r.headers["content-length"]) == len(r.content)
+    parts = r.content.split(f"--{boundary}".encode())
+    assert parts[1].endswith(b"Content-Range: bytes 0-1/1024\r\n\r\n" + DATA[:2] + b"\r\n")
+    assert parts[2].endswith(b"Content-Range: bytes 1022-1023/1024\r\n\r\n" + DATA[-2:] + b"\r\n")
+    assert parts[3] == b"--\r\n"
+
+    r = c.get(url, headers={"Range": "bytes=5000-"})
+    assert r.status_code == 416 and r.headers["content-range"] == "bytes */1024"
+    # a stale If-Range gets the whole, current file
+    assert c.get(url, headers={"Range": "bytes=0-1", "If-Range": '"old"'}).status_code == 200
+
+
+def test_precompressed_sibling(tmp_path):
+    c = client(tmp_path)
+    r = c.get("/uploads/menu.json", headers={"Accept-Encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip" and r.headers["vary"] == "Accept-Encoding"
+    assert r.content == b'{"a": 1}' * 50  # decoded by the client
+    plain = c.get("/uploads/menu.json", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers and plain.headers["etag"] != r.headers["etag"]
+    assert c.get("/uploads/missing.jpg").status_code == 404
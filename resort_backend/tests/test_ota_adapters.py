@@ -0,0 +1,61 @@
+import pytest
+from lib import ota_adapters
+from datetime import datetime
+from resort_backend.routes.ota import _legacy_overlaps, _parse_batch
+
+
+def test_resolve_uses_registered_names_and_aliases():
+    assert ota_adapters.resolve("yatra").name == "yatra"
+    assert ota_adapters.resolve("Booking_Yatra").name == "yatra"
+    assert ota_adapters.resolve("makemytrip").name == "mmt"
+    assert ota_adapters.resolve("some-channel").name == ota_adapters.GENERIC
+    assert ota_adapters.get_provider_config("yatra")["signature_header"] == "X-Yatra-Signature"
+
+
+def test_mappers_read_provider_fields_and_fall_back_to_generic():
+    y = ota_adapters.resolve("yatra").map(
+        {"booking_id": "Y1", "guest": {"name": "Asha"}, "room_code": "r1", "checkin": "2026-05-01", "checkout": "2026-05-03", "booking_status": "CANCELLED"},
+        "yatra",
+    )
+    assert (y["external_id"], y["guest_name"], y["accommodation_id"], y["status"]) == ("Y1", "Asha", "r1", "cancelled")
+    m = ota_adapters.resolve("mmt").map({"external_id": "M1", "check_in": "2026-05-01", "status": "modified"}, "mmt")
+    assert (m["external_id"], m["check_in"], m["status"]) == ("M1", "2026-05-01", "modified")
+
+
+def test_parse_batch_accepts_array_and_ndjson():
+    assert _parse_batch(b'[{"a": 1}, {"a": 2}]') == [{"a": 1}, {"a": 2}]
+    assert _parse_batch(b'{"a": 1}\n\n{"a": 2}\n') == [{"a": 1}, {"a": 2}]
+    assert _parse_batch(b"  ") == []
+    with pytest.raises(ValueError):
+        _parse_batch(b'{"a": 1}\nnot json')
+
+
+class FakeBookings:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def __getitem__(self, name):
+        return self
+
+    def find(self, q, projection=None):
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs
+
+
+@pytest.mark.asyncio
+async def test_batch_overlap_check_matches_list_shaped_bookings():
+    # /api/bookings stores accommodation_id as a list; OTA bookings store a scalar
+    db = FakeBookings([
+        {"accommodation_id": ["a1", "a2"], "check_in": datetime(2026, 5, 10), "check_out": datetime(2026, 5, 12)},
+        {"accommodation_id": "b1", "check_in": datetime(2026, 5, 10), "check_out": datetime(2026, 5, 12)},
+    ])
+    stay = {"ci": datetime(2026, 5, 11), "co": datetime(2026, 5, 13)}
+    entries = [
+        {"index": 0, "mapped": {"accommodation_id": "a2"}, **stay},
+        {"index": 1, "mapped": {"accommodation_id": "b1"}, **stay},
+        {"index": 2, "mapped": {"accommodation_id": "a3"}, **stay},
+        {"index": 3, "mapped": {"accommodation_id": "a1"}, "ci": datetime(2026, 5, 12), "co": datetime(2026, 5, 14)},
+    ]
+    assert await _legacy_overlaps(db, entries) == {0, 1}
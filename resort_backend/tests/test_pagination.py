@@ -0,0 +1,76 @@
+import json
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from starlette.requests import Request
+from lib.pagination import clamp_limit, keyset_query, parse_after, fetch_page, page_response, MAX_LIMIT
+
+
+IDS = [ObjectId("%024x" % i) for i in range(1, 8)]
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs = sorted(self.docs, key=lambda d: d[key], reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    async def to_list(self, length=None):
+        return self.docs[:length]
+
+
+class FakeCollection:
+    """Only understands the `{"_id": {"$gt": x}}` filter keyset paging produces."""
+    def __init__(self, docs):
+        self.docs = docs
+
+    def find(self, query, projection=None):
+        after = query.get("_id", {}).get("$gt")
+        return FakeCursor([d for d in self.docs if after is None or d["_id"] > after])
+
+
+def make_request(query_string=b""):
+    return Request({"type": "http", "method": "GET", "path": "/api/bookings/", "query_string": query_string,
+                    "headers": [(b"host", b"testserver")], "scheme": "http", "server": ("testserver", 80)})
+
+
+def test_keyset_query_keeps_caller_filter():
+    after = IDS[2]
+    assert keyset_query({}, after) == {"_id": {"$gt": after}}
+    assert keyset_query({"guest_email": "a@b.c"}, after) == {"$and": [{"guest_email": "a@b.c"}, {"_id": {"$gt": after}}]}
+    assert keyset_query({"guest_email": "a@b.c"}, None) == {"guest_email": "a@b.c"}
+
+
+def test_invalid_cursor_and_limit_are_rejected():
+    with pytest.raises(HTTPException):
+        parse_after("not-an-id")
+    with pytest.raises(HTTPException):
+        clamp_limit(0)
+    assert clamp_limit(10_000) == MAX_LIMIT
+
+
+@pytest.mark.asyncio
+async def test_pages_walk_the_collection_once_in_id_order():
+    coll = FakeCollection([{"_id": i, "n": n} for n, i in enumerate(reversed(IDS))])
+    seen, after = [], None
+    while True:
+        docs, after = await fetch_page(coll, None, after, 3)
+        seen += [d["_id"] for d in docs]
+        if after is None:
+            break
+    assert seen == IDS
+
+
+def test_page_response_sets_next_link():
+    resp = page_response(make_request(b"limit=2"), [{"_id": IDS[0]}, {"_id": IDS[1]}], str(IDS[1]), 2)
+    assert json.loads(resp.body) == [{"id": str(IDS[0])}, {"id": str(IDS[1])}]
+    assert resp.headers["X-Next-Cursor"] == str(IDS[1])
+    assert f"after={IDS[1]}" in resp.headers["Link"] and 'rel="next"' in resp.headers["Link"]
+    last = page_response(make_request(), [], None, 2)
+    assert "Link" not in last.headers
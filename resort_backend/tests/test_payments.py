@@ -0,0 +1,53 @@
+import asyncio
+import time
+import pytest
+from lib.payments import PaymentGateway, StubGateway, GatewayTimeout, SignatureError
+
+
+@pytest.mark.asyncio
+async def test_blocking_gateway_calls_do_not_stall_the_event_loop():
+    gateway = StubGateway(latency=0.05, max_workers=4)
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.005)
+            ticks += 1
+
+    t = asyncio.create_task(ticker())
+    t0 = time.perf_counter()
+    orders = await asyncio.gather(*[gateway.create_order({"amount": 100, "currency": "INR"}) for _ in range(8)])
+    elapsed = time.perf_counter() - t0
+    t.cancel()
+    assert len({o["id"] for o in orders}) == 8
+    # two waves of four threads, and the loop kept ticking meanwhile
+    assert elapsed < 0.3
+    assert ticks >= 5
+    gateway.close()
+
+
+@pytest.mark.asyncio
+async def test_call_timeout_raises_gateway_timeout():
+    gateway = StubGateway(latency=0.2, timeout=0.02)
+    with pytest.raises(GatewayTimeout):
+        await gateway.create_order({"amount": 100})
+    gateway.close()
+
+
+def test_stub_signature_verification():
+    gateway = StubGateway()
+    data = {"razorpay_order_id": "order_1", "razorpay_payment_id": "pay_1"}
+    gateway.verify_payment_signature(dict(data, razorpay_signature=gateway.sign("order_1", "pay_1")))
+    with pytest.raises(SignatureError):
+        gateway.verify_payment_signature(dict(data, razorpay_signature="bad"))
+    gateway.close()
+
+
+def test_gateways_must_implement_orders_and_signatures():
+    class Partial(PaymentGateway):
+        async def create_order(self, payload):
+            return {}
+
+    with pytest.raises(TypeError):
+        Partial("key")
@@ -0,0 +1,52 @@
+from datetime import date
+from lib.pricing import RateTable, Season, flatten_seasons
+
+
+def table(rules=()):
+    t = RateTable()
+    rooms = {
+        "r1": {"base": 5000.0, "accommodation_id": "deluxe", "extra_bed_price": 1000.0},
+        "r2": {"base": 9000.0, "accommodation_id": "villa", "extra_bed_price": 0.0},
+    }
+    programs = {"p1": {"program_id": "p1", "title": "Yoga", "price": 2000}}
+    t.compile(rooms, programs, list(rules))
+    return t
+
+
+def test_without_rules_matches_flat_breakdown():
+    q = table().quote(["r1"], "2026-05-10", "2026-05-12", guests=2, programs=["p1", "missing"])
+    assert q["rooms_subtotal"] == 10000 and q["programs_subtotal"] == 2000
+    assert q["tax"] == round(12000 * 0.18, 2) and q["total"] == round(12000 * 1.18, 2)
+    assert [p["program_id"] for p in q["programs"]] == ["p1"]
+
+
+def test_later_and_scoped_seasons_override():
+    starts, segs = flatten_seasons([
+        Season(date(2026, 12, 1).toordinal(), date(2027, 1, 10).toordinal(), multiplier=1.5),
+        Season(date(2026, 12, 24).toordinal(), date(2026, 12, 26).toordinal(), price=12000),
+    ])
+    assert [s.price if s else None for s in segs] == [None, 12000, None, None]
+    t = table([
+        {"kind": "season", "start": "2026-12-01", "end": "2027-01-10", "multiplier": 1.5},
+        {"kind": "season", "start": "2026-12-24", "end": "2026-12-26", "price_per_night": 12000},
+        {"kind": "season", "start": "2026-12-01", "end": "2027-01-10", "accommodation_id": "villa", "price_per_night": 10000},
+    ])
+    assert [t.nightly_rate("r1", date(2026, 12, d)) for d in (23, 24, 25, 26)] == [7500, 12000, 12000, 7500]
+    assert t.nightly_rate("r1", date(2027, 1, 10)) == 5000
+    assert t.nightly_rate("r2", date(2026, 12, 24)) == 10000
+
+
+def test_length_of_stay_occupancy_extra_beds_and_tax_slabs():
+    t = table([
+        {"kind": "length_of_stay", "min_nights": 3, "discount_pct": 10},
+        {"kind": "length_of_stay", "min_nights": 7, "discount_pct": 20},
+        {"kind": "occupancy", "base_guests": 2, "extra_guest_price": 500},
+        {"kind": "tax", "min_rate": 0, "rate": 0.12},
+        {"kind": "tax", "min_rate": 7501, "rate": 0.18},
+    ])
+    q = t.quote(["r1", "r2"], "2026-05-01", "2026-05-04", guests=5, extra_beds=1)
+    assert q["per_room"][0]["discount_pct"] == 10
+    assert q["rooms_subtotal"] == (5000 + 9000) * 3 * 0.9
+    assert q["occupancy_subtotal"] == 1 * 500 * 3
+    assert q["extra_beds_subtotal"] == 1000 * 3
+    assert q["tax"] == round(5000 * 3 * 0.9 * 0.12 + 9000 * 3 * 0.9 * 0.18 + (1500 + 3000) * 0.18, 2)
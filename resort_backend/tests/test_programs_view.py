@@ -0,0 +1,38 @@
+from lib.programs_view import VIEW, MERGE, kind_filter, normalize_stages, orphans_pipeline, rebuild_pipeline
+
+
+def test_rebuild_unions_every_source_into_the_view():
+    pipeline = rebuild_pipeline()
+    unions = [s["$unionWith"]["coll"] for s in pipeline if "$unionWith" in s]
+    assert unions == ["wellnessPrograms", "activities"]
+    assert pipeline[-1]["$merge"]["into"] == VIEW and pipeline[-1]["$merge"]["on"] == "_id"
+    # each source is mapped by its own stages, tagged with its rank
+    wellness = next(s for s in pipeline if s.get("$unionWith", {}).get("coll") == "wellnessPrograms")
+    assert wellness["$unionWith"]["pipeline"][0]["$project"]["rank"] == {"$literal": 1}
+
+
+def test_concurrent_writers_keep_the_newest_copy_and_orphans_are_anti_joined():
+    # built_at comes from the server clock, so stamps of different workers compare
+    assert normalize_stages("activities")[0]["$project"]["built_at"] == "$$NOW"
+    keep_newer = MERGE["$merge"]["whenMatched"][0]["$replaceWith"]["$cond"]
+    assert keep_newer == [{"$gt": ["$built_at", "$$new.built_at"]}, "$$ROOT", "$$new"]
+    lookup = orphans_pipeline("activities")
+    assert lookup[0] == {"$match": {"rank": 2}}
+    assert lookup[1]["$lookup"]["from"] == "activities" and lookup[1]["$lookup"]["foreignField"] == "_id"
+    assert lookup[2] == {"$match": {"src": {"$size": 0}}}
+
+
+def test_source_collection_implies_its_kind():
+    project = normalize_stages("wellnessPrograms")[0]["$project"]
+    kinds = project["kinds"]["$setUnion"][0]["$concatArrays"]
+    assert ["wellness"] in kinds
+    assert project["_id"] == {"$concat": ["wellnessPrograms:", {"$toString": "$_id"}]}
+    # programs only get a kind from their type or tags
+    programs = normalize_stages("programs")[0]["$project"]["kinds"]["$setUnion"][0]["$concatArrays"]
+    assert ["wellness"] not in programs and ["activities"] not in programs
+
+
+def test_kind_filter_lowercases_and_resolves_aliases():
+    assert kind_filter(None) == {}
+    assert kind_filter("Wellness") == {"kinds": "wellness"}
+    assert kind_filter("Resort-Activities") == {"kinds": "activities"}
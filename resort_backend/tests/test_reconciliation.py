@@ -0,0 +1,90 @@
+from datetime import datetime
+from bson import ObjectId
+import pytest
+import lib.reconciliation as reconciliation
+from lib.reconciliation import AWAITING_CLAIM, NOTHING_TO_CLAIM, batch_specs, batch_pipeline, claim_new_bookings
+
+
+def tx(status, order_id, payment_id=None, payload=None, by_order=None, by_payment=None):
+    return {
+        "_id": ObjectId(), "status": status, "created_at": datetime(2026, 5, 1),
+        "razorpay_order_id": order_id, "razorpay_payment_id": payment_id, "amount": 50000,
+        "booking_payload": payload, "by_order": by_order or [], "by_payment": by_payment or [],
+    }
+
+
+def test_batch_specs_cover_each_mismatch_once():
+    pending = {"_id": ObjectId(), "status": "pending", "payment": {"order_id": "o3"}}
+    paid_elsewhere = {"_id": ObjectId(), "status": "confirmed", "payment": {"order_id": "o5", "payment_id": "p5"}}
+    held = {"_id": ObjectId(), "status": "pending", "review": AWAITING_CLAIM}
+    stay = {"guest_email": "a@b.c", "allocated_cottages": ["r1"], "check_in": "2026-05-10", "check_out": "2026-05-12T00:00:00"}
+    txs = [
+        tx("paid", "o1", "p1", payload=stay),
+        tx("paid", "o1", "p1", payload={"guest_email": "a@b.c"}),  # duplicate row for the same order
+        tx("paid", "o2", "p2"),
+        tx("paid", "o3", "p3", by_order=[pending]),
+        tx("paid", "o4", "p4", by_order=[{"_id": ObjectId(), "status": "confirmed"}]),
+        tx("created", "o5", by_order=[paid_elsewhere]),
+        tx("created", "o6"),
+        tx("paid", "o7", "p7", by_order=[held]),  # auto-created, waiting for its rooms: not confirmed blindly
+        tx("paid", "o8", "p8", payload={"guest_email": "d@e.f", "check_in": "soon"}),
+    ]
+    booking_specs, tx_specs, counts, claims = batch_specs(txs)
+    assert counts == {"scanned": 9, "bookings_created": 2, "placeholders_created": 1, "bookings_confirmed": 1,
+                      "transactions_marked_paid": 1, "bookings_for_review": 1}
+    flt, update, upsert = booking_specs[0]
+    created = update["$setOnInsert"]
+    assert flt == {"payment.order_id": "o1"} and upsert
+    assert created["status"] == "pending" and created["review"] == AWAITING_CLAIM and created["guest_email"] == "a@b.c"
+    # dates are stored typed and the rooms are claimed for exactly that stay
+    assert created["check_in"] == datetime(2026, 5, 10) and created["check_out"] == datetime(2026, 5, 12)
+    assert claims == [(created["_id"], ["r1"], datetime(2026, 5, 10), datetime(2026, 5, 12))]
+    assert booking_specs[1][1]["$setOnInsert"]["status"] == "paid"
+    flt, update, upsert = booking_specs[2]
+    assert flt == {"_id": pending["_id"], "status": {"$in": ["pending"]}, "review": {"$exists": False}} and not upsert
+    assert update["$set"]["payment.payment_id"] == "p3"
+    assert booking_specs[3][1]["$setOnInsert"]["review"] == NOTHING_TO_CLAIM
+    assert len(booking_specs) == 4
+    assert tx_specs[0][1]["$set"]["razorpay_payment_id"] == "p5"
+
+    booking_specs, _, counts, _ = batch_specs(txs, placeholders=False)
+    assert counts["placeholders_created"] == 0 and len(booking_specs) == 3
+
+
+class FakeBookings:
+    def __init__(self):
+        self.writes = []
+
+    async def bulk_write(self, ops, ordered=True):
+        self.writes.append(ops)
+
+
+class FakeDb:
+    def __init__(self):
+        self.bookings = FakeBookings()
+
+
+@pytest.mark.asyncio
+async def test_new_bookings_are_confirmed_only_when_their_rooms_are_claimed(monkeypatch):
+    ok, taken, existing = ObjectId(), ObjectId(), ObjectId()
+    stays = []
+
+    async def reserve_many(db, batch):
+        stays.extend(batch)
+        return {taken: "conflict"}
+
+    monkeypatch.setattr(reconciliation, "reserve_many", reserve_many)
+    ci, co = datetime(2026, 5, 10), datetime(2026, 5, 12)
+    claims = [(ok, ["r1"], ci, co), (taken, ["r2"], ci, co), (existing, ["r3"], ci, co)]
+    db = FakeDb()
+    # `existing` lost the upsert to a booking already stored for its order: nothing to claim
+    assert await claim_new_bookings(db, claims, {ok, taken}) == 1
+    assert stays == [(ok, ["r1"], ok, ci, co), (taken, ["r2"], taken, ci, co)]
+    assert len(db.bookings.writes) == 1 and len(db.bookings.writes[0]) == 2
+
+
+def test_batch_pipeline_resumes_after_checkpoint():
+    after = {"created_at": datetime(2026, 5, 1), "_id": ObjectId()}
+    match = batch_pipeline(after, 500, until=datetime(2026, 6, 1))[0]["$match"]
+    assert match["created_at"] == {"$lte": datetime(2026, 6, 1)}
+    assert match["$or"][1] == {"created_at": after["created_at"], "_id": {"$gt": after["_id"]}}
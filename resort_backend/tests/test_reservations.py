@@ -0,0 +1,111 @@
+from datetime import datetime
+from types import SimpleNamespace
+import asyncio
+import pytest
+from pymongo.errors import DuplicateKeyError
+from lib.availability import stay_mask
+from lib.reservations import COLLECTION, month_masks, epoch_mask, doc_id, move_plan, reserve_units, FULL_MONTH
+
+
+def test_stay_inside_one_month_is_one_document():
+    assert month_masks(datetime(2026, 5, 10), datetime(2026, 5, 24)) == [("2026-05", ((1 << 14) - 1) << 9)]
+
+
+def test_stay_across_month_and_year_boundaries():
+    spans = month_masks(datetime(2026, 12, 30), datetime(2027, 1, 3))
+    assert spans == [("2026-12", 0b11 << 29), ("2027-01", 0b11)]
+    assert all(bits <= FULL_MONTH for _, bits in spans)
+    assert month_masks(datetime(2026, 5, 10), datetime(2026, 5, 10)) == []
+
+
+def test_overlapping_ranges_with_different_boundaries_share_bits():
+    (_, a), = month_masks("2026-05-10", "2026-05-13")
+    (_, b), = month_masks("2026-05-12", "2026-05-20")
+    (_, c), = month_masks("2026-05-13", "2026-05-15")
+    assert a & b
+    assert not a & c  # check-out day is free for the next check-in
+
+
+def test_epoch_mask_matches_availability_calendar():
+    ci, co = datetime(2026, 2, 25), datetime(2026, 3, 4)
+    combined = 0
+    for month, bits in month_masks(ci, co):
+        combined |= epoch_mask(month, bits)
+    assert combined == stay_mask(ci, co)
+    assert doc_id("abc", "2026-02") == "abc:2026-02"
+
+
+class FakeNights:
+    """The room_nights update_one semantics `reserve_units` relies on.
+
+    A missing document is inserted after yielding to the loop, so two first
+    claims started together race to insert the same _id like they do on Mongo.
+    """
+
+    def __init__(self):
+        self.docs = {}
+
+    async def update_one(self, q, update, upsert=False, session=None):
+        doc = self.docs.get(q["_id"])
+        if doc is None and upsert:
+            await asyncio.sleep(0)
+            if q["_id"] in self.docs:
+                raise DuplicateKeyError("E11000 duplicate key")
+            doc = self.docs[q["_id"]] = {"_id": q["_id"], "mask": 0, "holds": []}
+        bits = q.get("mask", {}).get("$bitsAllClear", 0)
+        if doc is None or doc["mask"] & bits or ("holds.booking_id" in q and not any(
+                h["booking_id"] == q["holds.booking_id"] for h in doc["holds"])):
+            if upsert:
+                raise DuplicateKeyError("E11000 duplicate key")
+            return SimpleNamespace(matched_count=0, modified_count=0)
+        ops = update["$bit"]["mask"]
+        doc["mask"] = doc["mask"] | ops["or"] if "or" in ops else doc["mask"] & ops["and"]
+        if "$push" in update:
+            doc["holds"].append(update["$push"]["holds"])
+        else:
+            doc["holds"] = [h for h in doc["holds"] if h["booking_id"] != update["$pull"]["holds"]["booking_id"]]
+        return SimpleNamespace(matched_count=1, modified_count=1)
+
+
+@pytest.mark.asyncio
+async def test_adjacent_stays_share_a_unit_and_overlapping_ones_conflict():
+    db = {COLLECTION: FakeNights()}
+    assert await reserve_units(db, ["r1"], "a", "2026-05-10", "2026-05-13")
+    assert await reserve_units(db, ["r1"], "b", "2026-05-13", "2026-05-15")
+    assert not await reserve_units(db, ["r1"], "c", "2026-05-12", "2026-05-14")
+    # a conflict on the second month rolls back the first one
+    assert not await reserve_units(db, ["r1"], "d", "2026-04-28", "2026-05-11")
+    assert "d" not in [h["booking_id"] for h in db[COLLECTION].docs["r1:2026-04"]["holds"]]
+
+
+@pytest.mark.asyncio
+async def test_concurrent_first_claims_on_a_month_both_succeed_when_disjoint():
+    db = {COLLECTION: FakeNights()}
+    ok = await asyncio.gather(reserve_units(db, ["r1"], "a", "2026-06-01", "2026-06-03"),
+                              reserve_units(db, ["r1"], "b", "2026-06-10", "2026-06-12"))
+    assert ok == [True, True]
+    assert [h["booking_id"] for h in db[COLLECTION].docs["r1:2026-06"]["holds"]] == ["a", "b"]
+    ok = await asyncio.gather(reserve_units(db, ["r2"], "c", "2026-06-01", "2026-06-03"),
+                              reserve_units(db, ["r2"], "d", "2026-06-02", "2026-06-04"))
+    assert sorted(ok) == [False, True]
+
+    # in a transaction the race aborts it: the error reaches the caller, which retries without one
+    session = object()
+    results = await asyncio.gather(reserve_units(db, ["r3"], "e", "2026-06-01", "2026-06-03", session=session),
+                                   reserve_units(db, ["r3"], "f", "2026-06-10", "2026-06-12", session=session),
+                                   return_exceptions=True)
+    assert results[0] is True and isinstance(results[1], DuplicateKeyError)
+
+
+def test_move_claims_only_new_nights_and_trims_the_ones_given_up():
+    (month, old), = month_masks("2026-05-10", "2026-05-13")
+    (_, new), = month_masks("2026-05-11", "2026-05-14")
+    _id = doc_id("r1", month)
+    # one night longer and one later: only the 13th is claimed, only the 10th released
+    claims, trims = move_plan({_id: old}, {_id: ("r1", month, new)})
+    assert claims == [("r1", month, new & ~old)] and trims == [(_id, old, old & new)]
+    # same nights: nothing to do
+    assert move_plan({_id: old}, {_id: ("r1", month, old)}) == ([], [])
+    # another unit: everything claimed there, everything released here
+    claims, trims = move_plan({_id: old}, {doc_id("r2", month): ("r2", month, old)})
+    assert claims == [("r2", month, old)] and trims == [(_id, old, 0)]
@@ -0,0 +1,120 @@
+import hashlib
+import os
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+from lib.uploads import receive_upload, release, sync_refs, blob_id, sniff_type, image_urls
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 200
+BOUNDARY = "xBOUNDARYx"
+
+
+class FakeBlobs:
+    """Just the media_blobs operations lib/uploads.py uses."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def _match(self, doc, q):
+        refs = q.get("refs", {})
+        return doc is not None and all(
+            (op == "$gt" and doc["refs"] > v) or (op == "$lte" and doc["refs"] <= v) for op, v in refs.items())
+
+    async def find_one_and_update(self, q, update, upsert=False, return_document=False):
+        doc = self.docs.get(q["_id"])
+        if doc is None and upsert:
+            doc = self.docs[q["_id"]] = {"_id": q["_id"], "refs": 0, **update.get("$setOnInsert", {})}
+        doc["refs"] += update["$inc"]["refs"]
+        return dict(doc)
+
+    async def update_one(self, q, update):
+        doc = self.docs.get(q["_id"])
+        if self._match(doc, q):
+            doc["refs"] += update["$inc"]["refs"]
+
+    async def find_one_and_delete(self, q):
+        doc = self.docs.get(q["_id"])
+        return self.docs.pop(q["_id"]) if self._match(doc, q) else None
+
+    async def find_one(self, q):
+        return self.docs.get(q["_id"])
+
+
+def multipart(fields, data, filename="a.png"):
+    body = b""
+    for name, value in fields.items():
+        body += f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+    body += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+             f'Content-Type: application/octet-stream\r\n\r\n').encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+    return body
+
+
+def request(body, chunk=37, content_length=True):
+    chunks = [body[i:i + chunk] for i in range(0, len(body), chunk)]
+
+    async def receive():
+        return {"type": "http.request", "body": chunks.pop(0) if chunks else b"", "more_body": bool(chunks)}
+    headers = [(b"content-type", f"multipart/form-data; boundary={BOUNDARY}".encode())]
+    if content_length:
+        headers.append((b"content-length", str(len(body)).encode()))
+    return Request({"type": "http", "method": "POST", "headers": headers}, receive)
+
+
+@pytest.mark.asyncio
+async def test_same_content_is_stored_once_and_deleted_with_last_reference(tmp_path):
+    db = {"media_blobs": FakeBlobs()}
+    blob, fields = await receive_upload(request(multipart({"caption": "Pool"}, PNG)), db, media_root=str(tmp_path))
+    again, _ = await receive_upload(request(multipart({}, PNG, "copy.png")), db, media_root=str(tmp_path))
+    sha = hashlib.sha256(PNG).hexdigest()
+    assert fields == {"caption": "Pool"}
+    assert blob["url"] == again["url"] == f"/uploads/cas/{sha[:2]}/{sha}.png" and blob_id(blob["url"]) == sha
+    path = tmp_path / "cas" / sha[:2] / f"{sha}.png"
+    assert path.read_bytes() == PNG and os.listdir(tmp_path / "cas" / "tmp") == []
+    assert db["media_blobs"].docs[sha]["refs"] == 2
+
+    await sync_refs(db, [blob["url"], "https://cdn/x.jpg"], ["https://cdn/x.jpg"], media_root=str(tmp_path))
+    assert path.exists() and db["media_blobs"].docs[sha]["refs"] == 1
+    await release(db, ["http://api" + blob["url"]], media_root=str(tmp_path))
+    assert not path.exists() and sha not in db["media_blobs"].docs
+
+
+@pytest.mark.asyncio
+async def test_upload_racing_the_last_release_keeps_its_file(tmp_path):
+    class Racing(FakeBlobs):
+        async def find_one(self, q):
+            # the same image is uploaded again between the delete and the check
+            self.docs[q["_id"]] = {"_id": q["_id"], "refs": 1, "content_type": "image/png"}
+            return self.docs[q["_id"]]
+
+    db = {"media_blobs": Racing()}
+    blob, _ = await receive_upload(request(multipart({}, PNG)), db, media_root=str(tmp_path))
+    sha = hashlib.sha256(PNG).hexdigest()
+    path = tmp_path / "cas" / sha[:2] / f"{sha}.png"
+    await release(db, [blob["url"]], media_root=str(tmp_path))
+    assert path.read_bytes() == PNG and os.listdir(path.parent) == [path.name]
+    # an upload of bytes already on disk still writes its file
+    again, _ = await receive_upload(request(multipart({}, PNG)), db, media_root=str(tmp_path))
+    assert path.read_bytes() == PNG and os.listdir(tmp_path / "cas" / "tmp") == []
+
+
+@pytest.mark.asyncio
+async def test_oversized_and_non_image_uploads_are_rejected_early(tmp_path):
+    db = {"media_blobs": FakeBlobs()}
+    big = multipart({}, PNG + b"\x00" * 70000)
+    # refused from Content-Length, and while streaming when there is none
+    for req in (request(big), request(big, content_length=False)):
+        with pytest.raises(HTTPException) as exc:
+            await receive_upload(req, db, max_bytes=500, media_root=str(tmp_path))
+        assert exc.value.status_code == 413
+    with pytest.raises(HTTPException) as exc:
+        await receive_upload(request(multipart({}, b"<svg onload=alert(1)>" * 10)), db, media_root=str(tmp_path))
+    assert exc.value.status_code == 415
+    assert db["media_blobs"].docs == {} and os.listdir(tmp_path / "cas" / "tmp") == []
+
+
+def test_sniff_type_and_image_urls():
+    assert sniff_type(b"\xff\xd8\xff\xe0" + b"\x00" * 12) == "image/jpeg"
+    assert sniff_type(b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert sniff_type(b"GIF89a") == "image/gif" and sniff_type(b"%PDF-1.7") is None
+    assert image_urls({"image": "/a.jpg", "images": ["/a.jpg", None, "/b.jpg"]}, ("image", "images")) == ["/a.jpg", "/a.jpg", "/b.jpg"]
+    assert blob_id("/uploads/gallery/a.jpg") is None
@@ -0,0 +1,218 @@
+import hashlib
+import hmac
+import json
+from types import SimpleNamespace
+import pytest
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+import lib.webhooks as webhooks
+from lib.webhooks import (verify_hmac_sha256, retry_delay, enqueue, InboxWorker, RETRY_CAP_SECONDS, CLAIM_SECONDS,
+                          MAX_ATTEMPTS, PENDING, PROCESSING, DONE, FAILED)
+
+
+def test_verify_hmac_sha256_accepts_plain_and_prefixed_hex():
+    body = b'{"event":"payment.captured"}'
+    sig = hmac.new(b"s3cret", body, hashlib.sha256).hexdigest()
+    assert verify_hmac_sha256(sig, body, "s3cret")
+    assert verify_hmac_sha256("sha256=" + sig, body, "s3cret")
+    assert not verify_hmac_sha256(sig, body + b" ", "s3cret")
+    assert not verify_hmac_sha256(None, body, "s3cret")
+    assert not verify_hmac_sha256(sig, body, "")
+
+
+def test_retry_delay_grows_and_is_capped():
+    assert 2.5 <= retry_delay(1) <= 5
+    assert 20 <= retry_delay(4) <= 40
+    assert retry_delay(30) <= RETRY_CAP_SECONDS
+
+
+NOW = datetime(2026, 5, 1, 12, 0, 0)
+
+
+def matches(doc, q):
+    """The query subset the inbox uses: equality, $or, $in, $lt, $lte."""
+    for k, v in q.items():
+        if k == "$or":
+            if not any(matches(doc, sub) for sub in v):
+                return False
+            continue
+        val = doc.get(k)
+        if isinstance(v, dict):
+            for op, arg in v.items():
+                ok = (val in arg if op == "$in" else
+                      val is not None and (val <= arg if op == "$lte" else val < arg))
+                if not ok:
+                    return False
+        elif val != v:
+            return False
+    return True
+
+
+class FakeCursor:
+    def __init__(self, docs):
+        self.docs = docs
+
+    def sort(self, key, direction):
+        self.docs.sort(key=lambda d: d[key], reverse=direction < 0)
+        return self
+
+    def limit(self, n):
+        self.docs = self.docs[:n]
+        return self
+
+    def __aiter__(self):
+        return self._gen()
+
+    async def _gen(self):
+        for d in self.docs:
+            yield d
+
+    async def to_list(self, length=None):
+        return [dict(d) for d in self.docs[:length]]
+
+
+class FakeInbox:
+    """In-memory `webhook_inbox`: unique _id, the inbox queries, and bulk_write calls recorded."""
+
+    def __init__(self, docs=()):
+        self.docs = {d["_id"]: d for d in docs}
+        self.bulk_writes = []
+
+    def __getitem__(self, name):
+        return self
+
+    async def insert_one(self, doc):
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError("E11000 duplicate key")
+        self.docs[doc["_id"]] = dict(doc)
+
+    def find(self, q, projection=None):
+        return FakeCursor([d for d in self.docs.values() if matches(d, q)])
+
+    async def update_many(self, q, update):
+        for d in self.docs.values():
+            if matches(d, q):
+                d.update(update["$set"])
+
+    async def bulk_write(self, ops, ordered=True):
+        self.bulk_writes.append(ops)
+
+
+class FrozenDatetime(datetime):
+    @classmethod
+    def utcnow(cls):
+        return NOW
+
+
+def inbox_doc(_id, status=PENDING, provider="razorpay", attempts=0, due=NOW, **extra):
+    return {"_id": _id, "provider": provider, "status": status, "attempts": attempts, "next_attempt_at": due, **extra}
+
+
+@pytest.mark.asyncio
+async def test_enqueue_dedups_on_event_id_and_falls_back_to_the_body_hash():
+    db = FakeInbox()
+    assert await enqueue(db, "razorpay", "evt_1", b"{}", "payment.captured")
+    assert not await enqueue(db, "razorpay", "evt_1", b'{"other": 1}')
+    assert db.docs["razorpay:evt_1"]["status"] == PENDING and db.docs["razorpay:evt_1"]["attempts"] == 0
+    # without an event id, byte-identical redeliveries collapse and other bodies do not
+    assert await enqueue(db, "razorpay", None, b'{"a": 1}')
+    assert not await enqueue(db, "razorpay", None, b'{"a": 1}')
+    assert await enqueue(db, "razorpay", None, b'{"a": 2}')
+    assert "razorpay:" + hashlib.sha256(b'{"a": 1}').hexdigest() in db.docs
+    assert len(db.docs) == 3
+
+
+@pytest.mark.asyncio
+async def test_worker_claims_due_events_and_expired_leases_only(monkeypatch):
+    monkeypatch.setattr(webhooks, "datetime", FrozenDatetime)
+    db = FakeInbox([
+        inbox_doc("due"),
+        inbox_doc("later", due=NOW + timedelta(minutes=1)),
+        inbox_doc("stale", status=PROCESSING, claim="dead", claimed_until=NOW - timedelta(seconds=1)),
+        inbox_doc("leased", status=PROCESSING, claim="alive", claimed_until=NOW + timedelta(seconds=30)),
+        inbox_doc("other", provider="stripe"),
+        inbox_doc("done", status=DONE),
+    ])
+    seen = []
+
+    async def handler(_db, doc):
+        seen.append(doc["_id"])
+        # the event is leased to this worker while its handler runs
+        assert doc["status"] == PROCESSING and doc["claimed_until"] == NOW + timedelta(seconds=CLAIM_SECONDS)
+
+    worker = InboxWorker(batch_size=10)
+    worker.register("razorpay", handler)
+    worker.db = db
+    assert await worker.run_once() == 2
+    assert sorted(seen) == ["due", "stale"]
+    # outcomes were not applied by the fake, so both are still leased: a second worker claims nothing
+    other = InboxWorker()
+    other.register("razorpay", handler)
+    other.db = db
+    assert await other.run_once() == 0
+
+
+@pytest.mark.asyncio
+async def test_outcomes_are_written_back_in_one_bulk_write(monkeypatch):
+    monkeypatch.setattr(webhooks, "datetime", FrozenDatetime)
+    monkeypatch.setattr(webhooks, "retry_delay", lambda attempts: 10.0 * attempts)
+    db = FakeInbox([inbox_doc("ok"), inbox_doc("flaky", attempts=2), inbox_doc("hopeless", attempts=MAX_ATTEMPTS - 1)])
+
+    async def handler(_db, doc):
+        if doc["_id"] != "ok":
+            raise RuntimeError("boom")
+
+    worker = InboxWorker()
+    worker.register("razorpay", handler)
+    worker.db = db
+    assert await worker.run_once() == 3
+    assert len(db.bulk_writes) == 1
+    unset = {"claim": "", "claimed_until": ""}
+    claim = db.docs["ok"]["claim"]
+    expected = [
+        UpdateOne({"_id": "ok", "claim": claim}, {"$set": {"status": DONE, "attempts": 1, "processed_at": NOW}, "$unset": unset}),
+        # retried with backoff until MAX_ATTEMPTS, then left failed
+        UpdateOne({"_id": "flaky", "claim": claim}, {"$set": {"status": PENDING, "attempts": 3, "last_error": "boom",
+                                                             "next_attempt_at": NOW + timedelta(seconds=30)}, "$unset": unset}),
+        UpdateOne({"_id": "hopeless", "claim": claim}, {"$set": {"status": FAILED, "attempts": MAX_ATTEMPTS, "last_error": "boom",
+                                                                "next_attempt_at": NOW + timedelta(seconds=10.0 * MAX_ATTEMPTS)},
+                                                       "$unset": unset}),
+    ]
+    assert sorted(db.bulk_writes[0], key=repr) == sorted(expected, key=repr)
+
+
+class FakeCollection:
+    def __init__(self, docs=None):
+        self.docs = list(docs or [])
+
+    async def find_one(self, q):
+        return self.docs[0] if self.docs and "razorpay_order_id" in q else None
+
+    async def update_one(self, q, update, upsert=False):
+        return SimpleNamespace(matched_count=len(self.docs))
+
+    async def insert_one(self, doc):
+        self.docs.append(doc)
+
+
+@pytest.mark.asyncio
+async def test_captured_payment_books_through_the_reconciliation_claim(monkeypatch):
+    import resort_backend.routes.razorpay as razorpay
+    claimed = []
+
+    async def claim_new_bookings(db, claims, inserted):
+        claimed.extend(claims)
+        return 1  # rooms already taken
+
+    monkeypatch.setattr(razorpay, "claim_new_bookings", claim_new_bookings)
+    payload = {"guest_email": "a@b.c", "allocated_cottages": ["r1"], "check_in": "2026-05-10", "check_out": "2026-05-12"}
+    db = SimpleNamespace(transactions=FakeCollection([{"razorpay_order_id": "o1", "booking_payload": payload}]),
+                         bookings=FakeCollection())
+    body = {"event": "payment.captured", "payload": {"payment": {"entity": {"order_id": "o1", "id": "p1"}}}}
+    await razorpay.process_webhook_event(db, {"body": json.dumps(body)})
+    booking = db.bookings.docs[0]
+    # written pending for review; confirmed only by a successful claim
+    assert booking["status"] == "pending" and booking["payment"] == {"provider": "razorpay", "order_id": "o1", "payment_id": "p1"}
+    assert booking["auto_created_by_webhook"] and "auto_created_by_reconciliation" not in booking
+    assert claimed == [(booking["_id"], ["r1"], booking["check_in"], booking["check_out"])]
@@ -1,9 +1,17 @@
 from fastapi import Request, HTTPException
-from typing import Any, Dict
+from fastapi.responses import Response
+from typing import Any, Dict, Iterable
+import json
 import logging
 from bson import ObjectId
+from bson.decimal128 import Decimal128
 from datetime import datetime, date
 
+try:
+    import orjson
+except ImportError:  # stdlib fallback produces the same JSON, only slower
+    orjson = None
+
 logger = logging.getLogger("resort_backend.utils")
 
 
@@ -50,6 +58,53 @@ def serialize_doc(doc: Dict[str, Any]) -> Dict[str, Any]:
     return out
 
 
+def _bson_default(v: Any):
+    """Encoder hook for values JSON has no native type for."""
+    if isinstance(v, ObjectId):
+        return str(v)
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, Decimal128):
+        return str(v.to_decimal())
+    raise TypeError(f"Type is not JSON serializable: {type(v).__name__}")
+
+
+def dumps_bson(data: Any) -> bytes:
+    """Encode `data` to JSON bytes in one pass, converting ObjectId/datetime on the fly.
+
+    Produces the same values as `serialize_doc` + json encoding, without the
+    intermediate copies.
+    """
+    if orjson is not None:
+        return orjson.dumps(data, default=_bson_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, default=_bson_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def with_id(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Shallow `_id` -> `id` rename; nested values are left for `dumps_bson`."""
+    out = {k: v for k, v in doc.items() if k != "_id"}
+    if doc.get("_id") is not None:
+        out["id"] = str(doc["_id"])
+    return out
+
+
+def encode_docs(docs: Iterable[Dict[str, Any]]) -> bytes:
+    return dumps_bson([with_id(d) for d in docs])
+
+
+class BSONResponse(Response):
+    """JSON response that encodes BSON types directly; return it from an endpoint to opt in."""
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps_bson(content)
+
+
+def docs_response(docs: Iterable[Dict[str, Any]], status_code: int = 200) -> Response:
+    """Raw JSON array response for Mongo documents, equivalent to `[serialize_doc(d) for d in docs]`."""
+    return Response(content=encode_docs(docs), status_code=status_code, media_type="application/json")
+
+
 def hash_password(password: str) -> str:
     # lightweight PBKDF2 password hashing to avoid extra deps
     import hashlib, os, binascii